@@ -0,0 +1,171 @@
+##  Copyright (C), 2010, Monash University
+##  Copyright (C), 2010, Victorian Partnership for Advanced Computing (VPAC)
+##  Copyright (C), 2016, University of Auckland
+##
+##  This file is part of the CREDO library.
+##  Developed as part of the Simulation, Analysis, Modelling program of
+##  AuScope Limited, and funded by the Australian Federal Government's
+##  National Collaborative Research Infrastructure Strategy (NCRIS) program.
+##
+##  This library is free software; you can redistribute it and/or
+##  modify it under the terms of the GNU Lesser General Public
+##  License as published by the Free Software Foundation; either
+##  version 2.1 of the License, or (at your option) any later version.
+##
+##  This library is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##  Lesser General Public License for more details.
+##
+##  You should have received a copy of the GNU Lesser General Public
+##  License along with this library; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+##  MA  02110-1301  USA
+
+
+
+"""A cache of the histories of the fields of Waiwera h5 outputs, for fast
+reading of the history at cells.
+
+Waiwera writes each field of the cells (e.g. cell_fields/fluid_pressure) as
+an array with a row for each output time, chunked (and so stored) a time at
+a time. So reading the history at one cell has to read every chunk of the
+field - for large models with many output times this can take seconds per
+cell.
+
+A :class:`HistoryCache` is a separate ("sidecar") h5 file holding copies of
+the fields, as arrays of the same shape, but chunked (and compressed) by
+blocks of cells, each chunk holding the whole histories of its cells. Each
+field is copied into it the first time its history is needed. The cache
+records the size, modification time and (sha256) hash of the output it was
+built from, and is rebuilt if the output has changed.
+
+It's normally used via the history_cache argument of
+:class:`credo.waiwera.WaiweraModelResult`.
+"""
+from builtins import object
+
+import os
+
+#: Default suffix of history cache filenames, replacing the extension of the
+#: h5 output's filename.
+DEFAULT_SUFFIX = '_history.h5'
+#: Approximate size (in bytes, uncompressed) of each chunk of the cached
+#: fields.
+CHUNK_SIZE = 1024 * 1024
+#: Approximate maximum size (in bytes) of each block of a field read from the
+#: output while copying it into the cache.
+BUILD_BLOCK_SIZE = 256 * 1024 * 1024
+
+def defaultCacheFilename(h5_filename):
+    """Returns the default filename of the history cache of the h5 output
+    h5_filename, e.g. 'model_history.h5' for 'model.h5'."""
+    return os.path.splitext(h5_filename)[0] + DEFAULT_SUFFIX
+
+class HistoryCache(object):
+    """History cache of the fields of a group (by default 'cell_fields') of
+    an h5 output.
+
+    .. attribute:: source
+
+       The h5 output (an open h5py File).
+
+    .. attribute:: filename
+
+       Filename of the cache.
+    """
+    def __init__(self, source, filename=None, group='cell_fields'):
+        self.source = source
+        if filename is None:
+            filename = defaultCacheFilename(source.filename)
+        self.filename = filename
+        self.group = group
+        self._cache = None
+
+    def close(self):
+        """Closes the cache file (it's reopened if needed)."""
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+
+    def getField(self, field):
+        """Returns the cached copy of field (an h5py Dataset, with the same
+        shape as in the output, chunked by cells), copying it from the output
+        first if it isn't already in the cache."""
+        cache = self._open()
+        name = '%s/%s' % (self.group, field)
+        if name in cache:
+            dset = cache[name]
+            if dset.attrs.get('complete', False):
+                return dset
+            # copying was interrupted
+            del cache[name]
+        return self._build(cache, name, self.source[self.group][field])
+
+    def _sourceStat(self):
+        st = os.stat(self.source.filename)
+        return st.st_size, st.st_mtime
+
+    def _open(self):
+        """Returns the open cache file, (re)creating it if it doesn't exist
+        or the output has changed since it was built."""
+        import h5py
+        if self._cache is not None:
+            return self._cache
+        size, mtime = self._sourceStat()
+        if os.path.exists(self.filename):
+            try:
+                cache = h5py.File(self.filename, 'a')
+            except (IOError, OSError):
+                # corrupt, so replace it
+                cache = None
+            if cache is not None:
+                if self._matches(cache, size, mtime):
+                    self._cache = cache
+                    return cache
+                cache.close()
+        from credo.jobrunner.runcache import fileHash
+        cache = h5py.File(self.filename, 'w')
+        cache.attrs['source_size'] = size
+        cache.attrs['source_mtime'] = mtime
+        cache.attrs['source_hash'] = fileHash(self.source.filename)
+        self._cache = cache
+        return cache
+
+    def _matches(self, cache, size, mtime):
+        """Returns whether the cache was built from the output as it is
+        now."""
+        if cache.attrs.get('source_size') != size:
+            return False
+        if cache.attrs.get('source_mtime') == mtime:
+            return True
+        # e.g. copied or touched, which doesn't matter if the contents are
+        # the same
+        from credo.jobrunner.runcache import fileHash
+        if cache.attrs.get('source_hash') == fileHash(self.source.filename):
+            cache.attrs['source_mtime'] = mtime
+            return True
+        return False
+
+    def _build(self, cache, name, src):
+        """Copies the dataset src of the output into the cache as name."""
+        nrows, ncols = src.shape
+        if nrows == 0 or ncols == 0:
+            # no output times or no cells: chunks can't be bigger than the
+            #  dataset, and there's nothing to copy
+            dset = cache.create_dataset(name, shape=src.shape,
+                dtype=src.dtype)
+            dset.attrs['complete'] = True
+            cache.flush()
+            return dset
+        col_size = nrows * src.dtype.itemsize
+        chunk_cols = max(1, min(ncols, CHUNK_SIZE // col_size))
+        dset = cache.create_dataset(name, shape=src.shape, dtype=src.dtype,
+            chunks=(nrows, chunk_cols), compression='gzip', shuffle=True)
+        # blocks of whole chunks of the cache, so each is written once
+        width = max(1, BUILD_BLOCK_SIZE // col_size // chunk_cols) * chunk_cols
+        for lo in range(0, ncols, width):
+            dset[:, lo:lo + width] = src[:, lo:lo + width]
+        dset.attrs['complete'] = True
+        cache.flush()
+        return dset
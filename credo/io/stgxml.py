@@ -33,9 +33,11 @@ from builtins import map
 
 import os
 import shlex
+import tempfile
 import subprocess as subp
 from xml.etree import ElementTree as etree
 import credo
+from credo.utils import replaceFile
 
 STG_ROOT_TAG = 'StGermainData'
 STG_NS = 'http://www.vpac.org/StGermain/XML_IO_Handler/Jun2003'
@@ -572,6 +574,28 @@ def writeXMLDoc(xmlDoc, outFile, prettyPrint=True):
         indentForPrettyPrint(xmlDoc.getroot())
     xmlDoc.write(outFile)
 
+def writeXMLDocAtomic(xmlDoc, filename, prettyPrint=True):
+    """Write xmlDoc to the file given by filename, atomically: the doc is
+    first written to a temporary file in the same directory, which then
+    replaces filename. So readers never see a partly-written file, and
+    several processes or threads writing the same record can't corrupt it.
+
+    :returns: the filename written to."""
+    dirName = os.path.dirname(os.path.abspath(filename))
+    fd, tmpFilename = tempfile.mkstemp(dir=dirName,
+        prefix=".%s." % os.path.basename(filename), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as outFile:
+            writeXMLDoc(xmlDoc, outFile, prettyPrint)
+        # mkstemp() creates files only readable by the owner.
+        os.chmod(tmpFilename, 0o644)
+        replaceFile(tmpFilename, filename)
+    except:
+        if os.path.exists(tmpFilename):
+            os.remove(tmpFilename)
+        raise
+    return filename
+
 def writeStgDataDocToFile(xmlDoc, filename):
     """Write a given StGermain xmlDoc to the file given by filename"""
     outFile = open(filename, 'wb')
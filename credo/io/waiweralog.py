@@ -0,0 +1,175 @@
+##  Copyright (C), 2010, Monash University
+##  Copyright (C), 2010, Victorian Partnership for Advanced Computing (VPAC)
+##  Copyright (C), 2016, University of Auckland
+##
+##  This file is part of the CREDO library.
+##  Developed as part of the Simulation, Analysis, Modelling program of
+##  AuScope Limited, and funded by the Australian Federal Government's
+##  National Collaborative Research Infrastructure Strategy (NCRIS) program.
+##
+##  This library is free software; you can redistribute it and/or
+##  modify it under the terms of the GNU Lesser General Public
+##  License as published by the Free Software Foundation; either
+##  version 2.1 of the License, or (at your option) any later version.
+##
+##  This library is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##  Lesser General Public License for more details.
+##
+##  You should have received a copy of the GNU Lesser General Public
+##  License along with this library; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+##  MA  02110-1301  USA
+
+
+"""A module for fast reading of the solver statistics in Waiwera's YAML log
+files.
+
+Waiwera logs can be hundreds of MB, so rather than loading the whole log as
+YAML, it's read a line at a time, and only the time step and nonlinear
+solver messages are parsed, e.g.::
+
+  - [info, timestep, start, {"count": 1, "size": 0.157700E+07}]
+  - [info, nonlinear_solver, iteration, {"count": 1, "linear_solver_iterations": 5, ...}]
+  - [info, nonlinear_solver, end, {"iterations": 2, "converged": T, ...}]
+  - [info, timestep, end, {"tries": 1, "size": 0.157700E+07, "time": 0.157700E+07, ...}]
+
+(This relies on Waiwera writing each message on a single line.)
+
+Primary interface is :func:`readSolverStats`, which returns numpy arrays of
+statistics for each completed time step, and :func:`summariseSolverStats`.
+:class:`WaiweraLogParser` can be used to follow a log as it's written.
+"""
+from __future__ import division
+from __future__ import print_function
+from builtins import object
+
+import re
+
+import numpy
+
+#: Names of the solver statistics arrays returned by :func:`readSolverStats`.
+SOLVER_STATS_NAMES = [
+    'count',                # time step number
+    'time',                 # simulation time at the end of the step
+    'size',                 # (final) time step size
+    'tries',                # number of tries needed to complete the step
+    'nonlinear_iterations', # over all tries
+    'linear_iterations',    # over all tries
+    'failed_tries',         # tries the nonlinear solver didn't converge
+    'reductions',           # times the step size was reduced
+    ]
+
+_VALUE_RE = re.compile(r'"(\w+)":\s*([^,}\]]+)')
+
+def _parseValues(text):
+    """Return a dictionary of the scalar values of a log message (as strings)."""
+    return dict(_VALUE_RE.findall(text))
+
+class WaiweraLogParser(object):
+    """Parser of the time step and nonlinear solver messages of a Waiwera
+    log, one line at a time, so it can be used both for reading whole logs
+    and for following the log of a model as it runs (see
+    :mod:`credo.jobrunner.runmonitor`).
+
+    :meth:`parseLine` returns an event for each line that is of interest,
+    as a tuple (eventType, values), where eventType is one of:
+
+    * 'step': a time step was completed. values is a dictionary of each of
+      the statistics in :data:`SOLVER_STATS_NAMES` for the step.
+    * 'failure': a try of the current time step failed (i.e. the nonlinear
+      solver didn't converge). values has the 'count' of the step.
+    * 'reduction': the time step size was reduced, to values['size'].
+    """
+    def __init__(self):
+        self.count = 0
+        self._resetStep()
+
+    def _resetStep(self):
+        self.nonlinear, self.linear = 0, 0
+        self.failed, self.reductions = 0, 0
+
+    def parseLine(self, line):
+        if not line.startswith('- ['):
+            return None
+        parts = line[3:].split(', ', 3)
+        if len(parts) < 4:
+            return None
+        source, event = parts[1], parts[2]
+        if source == 'nonlinear_solver':
+            if event == 'iteration':
+                vals = _parseValues(parts[3])
+                self.linear += int(vals.get('linear_solver_iterations', 0))
+            elif event == 'end':
+                vals = _parseValues(parts[3])
+                self.nonlinear += int(vals.get('iterations', 0))
+                if vals.get('converged', 'T').strip() != 'T':
+                    self.failed += 1
+                    return ('failure', {'count': self.count})
+        elif source == 'timestep':
+            if event == 'start':
+                vals = _parseValues(parts[3])
+                self.count = int(vals.get('count', self.count + 1))
+                self._resetStep()
+            elif event == 'reduction':
+                vals = _parseValues(parts[3])
+                self.reductions += 1
+                return ('reduction', {'size': float(vals['new_size'])})
+            elif event == 'end':
+                vals = _parseValues(parts[3])
+                return ('step', {
+                    'count': self.count,
+                    'time': float(vals['time']),
+                    'size': float(vals['size']),
+                    'tries': int(vals.get('tries', 1)),
+                    'nonlinear_iterations': self.nonlinear,
+                    'linear_iterations': self.linear,
+                    'failed_tries': self.failed,
+                    'reductions': self.reductions,
+                    })
+        return None
+
+def readSolverStats(filename):
+    """Read the solver statistics of each completed time step from the
+    Waiwera YAML log file filename.
+
+    :returns: a dictionary of numpy arrays, with one entry per time step, of
+      each of the statistics in :data:`SOLVER_STATS_NAMES`.
+    """
+    stats = dict((name, []) for name in SOLVER_STATS_NAMES)
+    parser = WaiweraLogParser()
+    with open(filename, 'r') as f:
+        for line in f:
+            event = parser.parseLine(line)
+            if event is not None and event[0] == 'step':
+                for name in SOLVER_STATS_NAMES:
+                    stats[name].append(event[1][name])
+    for name in SOLVER_STATS_NAMES:
+        if name in ['time', 'size']:
+            stats[name] = numpy.array(stats[name], dtype=float)
+        else:
+            stats[name] = numpy.array(stats[name], dtype=int)
+    return stats
+
+def summariseSolverStats(stats):
+    """Return a dictionary of summary values (floats) of the solver
+    statistics stats, as returned by :func:`readSolverStats`, e.g. for
+    recording as performance info of a run."""
+    numSteps = len(stats['count'])
+    summary = {'num_steps': float(numSteps)}
+    for name in ['tries', 'nonlinear_iterations', 'linear_iterations',
+            'failed_tries', 'reductions']:
+        summary['total_' + name] = float(numpy.sum(stats[name]))
+    if numSteps > 0:
+        summary['final_time'] = float(stats['time'][-1])
+        summary['min_step_size'] = float(numpy.min(stats['size']))
+        summary['max_step_size'] = float(numpy.max(stats['size']))
+        summary['mean_step_size'] = float(numpy.mean(stats['size']))
+        summary['mean_nonlinear_iterations'] = \
+            summary['total_nonlinear_iterations'] / numSteps
+    if summary['total_nonlinear_iterations'] > 0:
+        summary['mean_linear_iterations'] = \
+            summary['total_linear_iterations'] / \
+            summary['total_nonlinear_iterations']
+    return summary
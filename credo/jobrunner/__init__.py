@@ -22,14 +22,23 @@
 ##  MA  02110-1301  USA
 
 """This module allows running CREDO jobs using various approaches - e.g. via
-MPI locally, via PBS scripts in a queueing system, or via grid submission."""
+MPI locally, via PBS or Slurm scripts in a queueing system, or via grid
+submission."""
 
 from credo.jobrunner.simplejobrunner import SimpleJobRunner, SimpleJobMetaInfo
+from credo.jobrunner.pooledjobrunner import PooledJobRunner
+from credo.jobrunner.runcache import RunCache
+from credo.jobrunner.walltimehistory import WalltimeHistory
+from credo.jobrunner.runhistory import RunHistory
+from credo.jobrunner.runmonitor import RunMonitor
+from credo.jobrunner.progress import ProgressReporter
 from credo.jobrunner.pbsjobrunner import PBSJobMetaInfo
+from credo.jobrunner.slurmjobrunner import SlurmJobMetaInfo
 
 jobMetaInfoMapping = {
     "Simple": SimpleJobMetaInfo,
-    "PBS": PBSJobMetaInfo}
+    "PBS": PBSJobMetaInfo,
+    "Slurm": SlurmJobMetaInfo}
 
 def jobMetaInfoFactoryCreate(runTypeStr):
     jmiClass = jobMetaInfoMapping[runTypeStr]
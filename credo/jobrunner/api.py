@@ -24,8 +24,11 @@ from builtins import object
 ##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 ##  MA  02110-1301  USA
 
+import time
 import platform
 import operator
+import threading
+from future.moves.queue import Queue, Empty
 from datetime import timedelta, datetime
 from xml.etree import ElementTree as etree
 import credo.modelrun
@@ -42,6 +45,11 @@ class PerformanceProfiler(object):
 
     .startTimer() and .stopTimer() are optional for most profilers, it s really
     only designed for a dumb profiler implemented using pure Python.
+
+    Since a single profiler may be used to profile several jobs that run at
+    the same time, any state relating to a particular job should be saved in
+    that job's JobMetaInfo (e.g. in its profilerHandles dictionary), rather
+    than on the profiler itself.
     """
     def __init__(self, typeStr):
         self.typeStr = typeStr
@@ -53,10 +61,10 @@ class PerformanceProfiler(object):
     def modifyRun(self, modelRun, modelRunCommand, jobMetaInfo):
         raise NotImplementedError("Error, virtual func on base class")
 
-    def startTimer(self):
+    def startTimer(self, jobMetaInfo=None):
         pass
 
-    def stopTimer(self):
+    def stopTimer(self, jobMetaInfo=None):
         pass
 
     def attachPerformanceInfo(self, jobMetaInfo, modelResult):
@@ -116,22 +124,121 @@ class JobMetaInfo(object):
                 'release')])
 
     def readFromXMLNode(self, xmlNode):
-        self.simtime = float(xmlNode.find('simtime').text)
-        #TODO: how to convert ...
-        #self.submitTime = xmlNode.find('submitTime').text
-        #TODO: platformInfo
-        #TODO: profiler info
+        simtimeStr = xmlNode.find('simtime').text
+        try:
+            self.simtime = float(simtimeStr)
+        except (TypeError, ValueError):
+            self.simtime = "unknown"
+        self.submitTime = None
+        submitNode = xmlNode.find('submitTime')
+        if submitNode is not None:
+            self.submitTime = parseSubmitTime(submitNode.text)
+        self.platform = {}
+        platformNode = xmlNode.find('platformInfo')
+        if platformNode is not None:
+            for platNode in platformNode:
+                self.platform[platNode.tag] = platNode.text
         profilersNode = xmlNode.find('performanceInfo')
         for profNode in profilersNode.findall('profilerInfo'):
             profType = profNode.attrib['profType']
             self.performance[profType] = {}
             perfDict = self.performance[profType]
             for profStatNode in profNode:
-                # TODO: hack assuming as floats, ideally should read and
-                #  handle properly based on some sort of saved unit.
-                perfDict[profStatNode.tag] = float(profStatNode.text)
+                # TODO: ideally should read and handle properly based on
+                #  some sort of saved unit.
+                try:
+                    perfDict[profStatNode.tag] = float(profStatNode.text)
+                except (TypeError, ValueError):
+                    perfDict[profStatNode.tag] = profStatNode.text
         return
 
+def parseSubmitTime(timeStr):
+    """Returns the datetime a job was submitted, from the string it is
+    saved as in XML records (see :meth:`JobMetaInfo.writeInfoXML`), or None
+    if it wasn't recorded."""
+    if timeStr is None or timeStr == "None":
+        return None
+    for fmt in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(timeStr, fmt)
+        except ValueError:
+            pass
+    return None
+
+class RunFutureTimeoutError(Exception):
+    """An Exception for when the result of a :class:`RunFuture` isn't
+    available within the time given."""
+
+
+class RunFuture(object):
+    """The eventual ModelResult of a submitted run (see
+    :meth:`JobRunner.submitRunAsync`), or the :class:`ModelRunError` raised
+    if the run fails. Provides the commonly used part of the interface of
+    :class:`concurrent.futures.Future` (which isn't available in Python 2).
+
+    .. attribute:: modelRun
+
+       The ModelRun submitted.
+
+    .. attribute:: jobMetaInfo
+
+       The JobMetaInfo of the submitted job.
+    """
+    def __init__(self, modelRun, jobMetaInfo):
+        self.modelRun = modelRun
+        self.jobMetaInfo = jobMetaInfo
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def done(self):
+        """Returns whether the run has completed (or failed)."""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Returns the run's ModelResult, waiting up to timeout seconds (or
+        indefinitely, if None) for it to complete. If the run failed, the
+        error is raised instead."""
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """Returns the error raised by the run, or None if it completed
+        successfully, waiting as for :meth:`.result`."""
+        if not self._done.wait(timeout):
+            raise RunFutureTimeoutError("Run '%s' not completed within %s"\
+                " seconds." % (self.modelRun.name, timeout))
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """Arrange for fn(future) to be called once the run has completed
+        (straight away, if it already has)."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exception):
+        self._finish(None, exception)
+
+    def _finish(self, result, exception):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
 class JobRunner(object):
     """Class used for running ModelRun instances. This is an abstract base
     class, user code will need to choose a concrete implementation.
@@ -157,6 +264,10 @@ class JobRunner(object):
         self.runSuiteNonBlockingDefault = False
         self.profilers = []
         self.defaultProfiler = None
+        # Runs to be blocked on asynchronously are put on this queue, for
+        #  the waiter thread (see blockResultAsync).
+        self._asyncQueue = None
+        self._asyncLock = threading.Lock()
 
     def setup(self):
         """Does any necessary setup checks to run models.
@@ -177,6 +288,133 @@ class JobRunner(object):
         requires appropriate info to be passed in the jobMetaInfo object."""
         raise NotImplementedError("Error, virtual func on base class")
 
+    def killJob(self, jobMetaInfo):
+        """Stop a submitted job, if it's still running, including all the
+        processes it started, and wait for it to end."""
+        raise NotImplementedError("Error, virtual func on base class")
+
+    def submitRunAsync(self, modelRun, prefixStr=None, extraCmdLineOpts=None,
+            maxRunTime=None):
+        """Submit the job to be run, as for :meth:`.submitRun`, but rather
+        than a jobMetaInfo return a :class:`RunFuture` that will resolve to
+        the run's ModelResult once it completes (or to the
+        :class:`ModelRunError` raised, if the run fails).
+
+        The future's `modelRun` and `jobMetaInfo` attributes are also set,
+        to make it easier to keep track of which run a completed future
+        is for (see :meth:`.as_completed`)."""
+        jobMetaInfo = self.submitRun(modelRun, prefixStr, extraCmdLineOpts,
+            False, maxRunTime)
+        return self.blockResultAsync(modelRun, jobMetaInfo)
+
+    def blockResultAsync(self, modelRun, jobMetaInfo):
+        """Returns a :class:`RunFuture` that will resolve to the ModelResult
+        of an already submitted job, as returned by :meth:`.blockResult`.
+
+        The blocking is done by a single waiter thread (of this job runner),
+        for all the runs blocked on this way. Runs are only blocked on once
+        they're ready to complete (see :meth:`._asyncWaitTime`), so for job
+        runners that can tell when jobs finish, runs complete in the order
+        they finish."""
+        future = RunFuture(modelRun, jobMetaInfo)
+        with self._asyncLock:
+            if self._asyncQueue is None:
+                self._asyncQueue = Queue()
+                waiter = threading.Thread(target=self._asyncWaiterLoop,
+                    args=(self._asyncQueue,), name="credo-async-waiter")
+                waiter.daemon = True
+                waiter.start()
+            asyncQueue = self._asyncQueue
+            asyncQueue.put(future)
+        self._notifyWhenFinished(modelRun, jobMetaInfo,
+            lambda: asyncQueue.put(None))
+        return future
+
+    def _notifyWhenFinished(self, modelRun, jobMetaInfo, callback):
+        """Arrange for callback() to be called once the job of modelRun has
+        finished (or straight away, if it already has), if this job runner
+        can. By default it can't, so does nothing."""
+        pass
+
+    def _asyncWaitTime(self, modelRun, jobMetaInfo):
+        """Returns how long (in seconds) the waiter thread of
+        :meth:`.blockResultAsync` should wait before blocking on the job of
+        modelRun: 0 if it's ready to complete now, or None to wait until
+        woken as the job finishes (see :meth:`._notifyWhenFinished`).
+
+        By default 0, so jobs are blocked on in the order they are
+        submitted."""
+        return 0
+
+    def _asyncWaiterLoop(self, asyncQueue):
+        """Loop of the waiter thread of :meth:`.blockResultAsync`: resolve
+        the futures put on asyncQueue as their runs become ready to complete
+        (None is put on the queue just to wake it up). The thread stops once
+        there are none left to resolve."""
+        pending = []
+        while True:
+            if len(pending) == 0:
+                with self._asyncLock:
+                    if asyncQueue.empty():
+                        self._asyncQueue = None
+                        return
+            wait = None
+            for future in pending:
+                futureWait = self._asyncWaitTime(future.modelRun,
+                    future.jobMetaInfo)
+                if futureWait is not None:
+                    futureWait = max(futureWait, 0)
+                    wait = futureWait if wait is None \
+                        else min(wait, futureWait)
+            try:
+                item = asyncQueue.get(timeout=wait)
+                while True:
+                    if item is not None:
+                        pending.append(item)
+                    item = asyncQueue.get_nowait()
+            except Empty:
+                pass
+            for future in list(pending):
+                modelRun, jobMetaInfo = future.modelRun, future.jobMetaInfo
+                futureWait = self._asyncWaitTime(modelRun, jobMetaInfo)
+                if futureWait is None or futureWait > 0:
+                    continue
+                pending.remove(future)
+                try:
+                    result = self.blockResult(modelRun, jobMetaInfo)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+
+    def as_completed(self, futures, timeout=None):
+        """Returns an iterator over the given futures (e.g. from
+        :meth:`.submitRunAsync`), that yields them as they complete, in the
+        same manner as :func:`concurrent.futures.as_completed`. Raises a
+        :class:`RunFutureTimeoutError` if they haven't all completed within
+        timeout seconds (if given)."""
+        futures = set(futures)
+        completed = Queue()
+        for future in futures:
+            future.add_done_callback(completed.put)
+        deadline = None if timeout is None else time.time() + timeout
+        for i in range(len(futures)):
+            while True:
+                # (waiting in short intervals, as a wait without a timeout
+                #  can't be interrupted by Ctrl-C in Python 2)
+                wait = 1.0
+                if deadline is not None:
+                    wait = min(wait, deadline - time.time())
+                    if wait <= 0:
+                        raise RunFutureTimeoutError("%d of %d runs not"\
+                            " completed within %s seconds." % (len(futures)
+                            - i, len(futures), timeout))
+                try:
+                    yield completed.get(timeout=wait)
+                    break
+                except Empty:
+                    pass
+
     # TODO: should the args be passed through as unnamed kwArgs,
         # then interpreted by submitRun?
     def runModel(self, modelRun, prefixStr=None, extraCmdLineOpts=None,
@@ -220,23 +458,42 @@ class JobRunner(object):
                 jobMetaInfos.append(jobMetaInfo)
         return jobMetaInfos
 
-    def blockSuite(self, modelSuite, jobMetaInfos):
+    def blockSuite(self, modelSuite, jobMetaInfos, resultCallback=None):
         """Blocks on each ModelRun in a Suite, given a list of
-        JobMetaInfos for each run."""
-        modelSuite.resultsList = []
-        for modelRun, jobMetaInfo in zip(modelSuite.runs, jobMetaInfos):
-            # TODO: ideally if we implemented a "testResult" func, could
-            #  loop through and poll/report as they complete,
-            #  rather than just in sequential order ...
-            result = self.blockResult(modelRun, jobMetaInfo)
-            print("ModelRun '%s' complete." % modelRun.name)
-            assert isinstance(result, credo.modelresult.ModelResult)
-            modelSuite.resultsList.append(result)
+        JobMetaInfos for each run. Results are processed (and reported) in
+        the order the runs complete, but the :attr:`.resultsList` of the
+        suite is in the same order as its runs.
+
+        :keyword resultCallback: if given, is called as
+           `resultCallback(runI, modelResult)` as each run completes."""
+        futures = {}
+        for runI, (modelRun, jobMetaInfo) in enumerate(zip(modelSuite.runs,
+                jobMetaInfos)):
+            futures[self.blockResultAsync(modelRun, jobMetaInfo)] = runI
+        results = [None] * len(futures)
+        try:
+            for future in self.as_completed(futures):
+                result = future.result()
+                print("ModelRun '%s' complete." % future.modelRun.name)
+                assert isinstance(result, credo.modelresult.ModelResult)
+                results[futures[future]] = result
+                if resultCallback is not None:
+                    resultCallback(futures[future], result)
+        except KeyboardInterrupt:
+            # Don't leave jobs running after being interrupted (by Ctrl-C).
+            print("Interrupted: stopping all runs of the suite.")
+            try:
+                for jobMetaInfo in jobMetaInfos:
+                    self.killJob(jobMetaInfo)
+            except NotImplementedError:
+                pass
+            raise
+        modelSuite.resultsList = results
         return modelSuite.resultsList
 
     def runSuite(self, modelSuite, prefixStr=None, extraCmdLineOpts=None,
             dryRun=False, maxRunTime=None, runSuiteNonBlocking=None,
-            writeRecords=True):
+            writeRecords=True, resultCallback=None):
         """Run each ModelRun in the suite - with optional extra cmd line opts.
         Will also write XML records of each ModelRun and ModelResult in the
         suite.
@@ -252,6 +509,12 @@ class JobRunner(object):
            suite, and each ModelResult generated, to automatically write
            an XML record of itself in default location as it is run/produced.
 
+        :keyword resultCallback: if given, is called as
+           `resultCallback(runI, modelResult)` as soon as the result of each
+           run (with index runI in the suite) is available, so it can be
+           processed while other runs are still going. Note this may be
+           called in any order of runs.
+
         :returns: a reference to the :attr:`.resultsList` containing all
            the ModelResults generated."""
 
@@ -264,7 +527,8 @@ class JobRunner(object):
         if runSuiteNonBlocking:
             jobMetaInfos = self.submitSuite(modelSuite, prefixStr,
                 extraCmdLineOpts, dryRun, maxRunTime, writeRecords)
-            resultsList = self.blockSuite(modelSuite, jobMetaInfos)
+            resultsList = self.blockSuite(modelSuite, jobMetaInfos,
+                resultCallback)
             if writeRecords == True:
                 modelSuite.writeAllModelResultXMLs()
             return resultsList
@@ -272,8 +536,8 @@ class JobRunner(object):
             modelSuite.resultsList = []
             for runI, modelRun in enumerate(modelSuite.runs):
                 if not isinstance(modelRun, credo.modelrun.ModelRun):
-                    raise TypeError("Error, stored run %d not an instance of a"\
-                        " ModelRun" % runI)
+                    raise TypeError("Error, stored run %d not an instance"\
+                        " of a ModelRun" % runI)
                 print("Doing run %d/%d (index %d), of name '%s':"\
                     % (runI+1, len(modelSuite.runs), runI, modelRun.name))
                 print("ModelRun description: \"%s\"" % \
@@ -292,6 +556,8 @@ class JobRunner(object):
                 modelSuite.resultsList.append(result)
                 if writeRecords == True:
                     result.writeRecordXML()
+                if resultCallback is not None:
+                    resultCallback(runI, result)
 
         return modelSuite.resultsList
 
@@ -372,6 +638,35 @@ class ModelRunTimeoutError(ModelRunRegularError):
                 self.stdErrMsg, self.tailLen,
                 "".join(self.stdOutFileTail))
 
+class ModelRunAbortedError(ModelRunRegularError):
+    """An Exception for when Models are aborted while running by a
+    :class:`~credo.jobrunner.runmonitor.RunMonitor`, e.g. because the time
+    step size became too small.
+
+    .. attribute:: reason
+
+       description of the condition that caused the run to be aborted.
+
+    .. attribute:: evidence
+
+       list of the lines of the log being monitored up to the point the run
+       was aborted.
+    """
+    def __init__(self, modelName, retCode, stdOutFilename, stdErrFilename,
+            reason, evidence=None):
+        ModelRunRegularError.__init__(self, modelName, retCode,
+            stdOutFilename, stdErrFilename)
+        self.reason = reason
+        self.evidence = evidence if evidence is not None else []
+
+    def __str__(self):
+        return "Model '%s' was aborted while running: %s\n"\
+            "Last %d lines of the log monitored were:\n%s\n"\
+            "Std out and error logs saved to files %s and %s"\
+            % (self.modelName, self.reason, len(self.evidence),
+                "\n".join(self.evidence), self.stdOutFilename,
+                self.stdErrFilename)
+
 class ModelRunLaunchError(ModelRunError):
     """An Exception for when Models fail to run due to being unable to launch
     the run process in some way.
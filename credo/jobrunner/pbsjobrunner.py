@@ -23,39 +23,326 @@ from builtins import range
 ##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 ##  MA  02110-1301  USA
 
+"""A JobRunner that submits ModelRuns to a PBS queueing system.
+
+Each run is submitted as a PBS job script, written to the model's base
+directory, via `qsub`. The suites of runs can be submitted as a single PBS
+job array (see :attr:`PBSJobRunner.useJobArrays`). Jobs are waited on by a
+:class:`PBSJobPoller`, which checks on all jobs being waited on with a
+single `qstat` call each poll interval.
+"""
+
 import os
-import signal
+import re
 import subprocess
+import threading
 import time
 import shlex
 from datetime import timedelta, datetime
 from credo.jobrunner.api import *
+from credo.modelrun import DEF_POLL_INTERVAL
 from credo.modelresult import ModelResult
 from credo.modelresult import getSimInfoFromFreqOutput
+from credo.utils import monotonicTime
 
 MPI_RUN_COMMAND = "MPI_RUN_COMMAND"
 # For PBS, default to use mpiexec
 DEFAULT_MPI_RUN_COMMAND = "mpiexec"
 
 PBS_SUB_COMMAND = "qsub"
+PBS_STAT_COMMAND = "qstat"
 PBS_FIRSTLINE = "#!/bin/bash"
 PBS_PREFIX = "#PBS"
+# Job array options, for PBS Professional. (For Torque, use "-t" and
+#  "PBS_ARRAYID".)
+PBS_ARRAY_FLAG = "-J"
+PBS_ARRAY_INDEX_VAR = "PBS_ARRAY_INDEX"
+# Job states (as reported by qstat) of jobs that have finished:
+#  F = finished (PBS Pro), X = finished sub-job (PBS Pro),
+#  C = completed (Torque).
+PBS_FINISHED_STATES = ['F', 'X', 'C']
 
 class PBSJobMetaInfo(JobMetaInfo):
+    """JobMetaInfo of a job submitted to PBS.
+
+    .. attribute:: jobId
+
+       The PBS job ID (for a run in a job array, the ID of its sub-job).
+
+    .. attribute:: arrayJobId
+
+       If the run was submitted as part of a job array, the ID of the array
+       job, otherwise None.
+    """
     def __init__(self):
-        JobMetaInfo.__init__(self)
+        JobMetaInfo.__init__(self, 0)
         self.runType = "PBS"
         self.jobId = None
+        self.arrayJobId = None
 
     def writeInfoXML(self, xmlNode):
         JobMetaInfo.writeInfoXML(self, xmlNode)
         jmNode = xmlNode.find(self.XML_INFO_TAG)
         etree.SubElement(jmNode, 'jobId').text = str(self.jobId)
+        if self.arrayJobId is not None:
+            etree.SubElement(jmNode, 'arrayJobId').text = str(self.arrayJobId)
+
+def getExitStatusFilename(modelRun):
+    """Name of the file the PBS job script of a run saves the exit status of
+    the model to."""
+    return os.path.join(modelRun.basePath, modelRun.outputPath,
+        "%s.exitstatus" % modelRun.name)
+
+def parseQStatFull(qstatOut):
+    """Parse the output of `qstat -f` (of PBS Professional or Torque) into a
+    dictionary, keyed by job ID, of tuples of the job's state, and its exit
+    status (or None if not given)."""
+    jobs = {}
+    jobId = None
+    for line in qstatOut.splitlines():
+        match = re.match(r'^Job Id:\s*(\S+)', line)
+        if match:
+            jobId = match.group(1)
+            jobs[jobId] = [None, None]
+            continue
+        if jobId is None or '=' not in line:
+            continue
+        key, value = [s.strip() for s in line.split('=', 1)]
+        if key == 'job_state':
+            jobs[jobId][0] = value
+        elif key.lower() == 'exit_status':
+            # (PBS Professional uses Exit_status, Torque exit_status)
+            try:
+                jobs[jobId][1] = int(value)
+            except ValueError:
+                pass
+    return dict([(jobId, tuple(info)) for jobId, info in jobs.items()])
+
+class PBSJobPoller(object):
+    """Waits on PBS jobs to finish, by polling their status with `qstat`.
+    However many jobs are being waited on (e.g. in separate threads), there
+    is one `qstat -f` call for all of them each poll interval, made from
+    a single polling thread.
+
+    Plain `qstat -f` only reports on jobs still in the queue (for Torque,
+    including completed jobs, in state C, until `keep_completed` has
+    passed), so a job that `qstat` has reported on, but then doesn't know
+    about, is taken to have finished. A job it has never reported on is
+    taken to not have started yet - unless the exit status file its job
+    script writes (see :func:`getExitStatusFilename`) exists, in which case
+    it has finished. (So a job that is submitted and removed from the queue
+    within a poll interval is still seen to finish. On Torque, setting
+    `keep_completed` to more than the poll interval, or on PBS Professional
+    with job history enabled, using a :class:`.PBSProJobPoller`, also gives
+    its exit status.) A job that is never reported on, and leaves no exit
+    status file, is given up on after :attr:`.unreportedTimeout`.
+
+    Sub-classes for other queueing systems should override
+    :meth:`.queryJobs`, and set :attr:`.finishedStates` and
+    :attr:`.unknownJobsFinished` as appropriate.
+
+    .. attribute:: statCommand
+
+       Command used to get the status of jobs.
+
+    .. attribute:: statArgs
+
+       Arguments the status command is run with (before the job IDs).
+
+    .. attribute:: finishedStates
+
+       Job states (as returned by :meth:`.queryJobs`) of finished jobs.
+
+    .. attribute:: unknownJobsFinished
+
+       Whether jobs the status command doesn't report on should be taken
+       to have finished, even if it hasn't reported on them before
+       (otherwise, they're taken to not have started).
+
+    .. attribute:: unreportedTimeout
+
+       Time, in seconds, to wait for a job the status command has never
+       reported on, and that hasn't left an exit status file, before giving
+       up on it with a :class:`~credo.jobrunner.api.ModelRunLaunchError`.
+    """
+    statArgs = ['-f']
+    finishedStates = PBS_FINISHED_STATES
+    unknownJobsFinished = False
+    unreportedTimeout = 600.0
+
+    def __init__(self, statCommand=PBS_STAT_COMMAND):
+        self.statCommand = statCommand
+        self._lock = threading.Lock()
+        # jobId -> [pollInterval, event set when finished, status,
+        #  whether the job has been reported on, exit status filename,
+        #  time to give up on the job if it hasn't been reported on,
+        #  callbacks to call when finished]
+        # (finished jobs stay until their status is collected, see
+        #  waitForJob)
+        self._waiting = {}
+        self._pollThread = None
+
+    def queryJobs(self, jobIds):
+        """Get the status of all of the given jobs, with a single call of
+        `qstat`.
+
+        :returns: a dictionary of (job state, info) tuples, for the jobs
+          `qstat` knows about - where the info is the exit status (or None
+          if not given)."""
+        args = shlex.split(self.statCommand) + self.statArgs + list(jobIds)
+        # qstat returns an error code if any of the jobs are unknown, so
+        #  just use what it reports.
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True)
+        qstatOut, qstatErr = proc.communicate()
+        return parseQStatFull(qstatOut)
+
+    def watchJob(self, jobId, pollInterval=DEF_POLL_INTERVAL,
+            exitStatusFilename=None, callback=None):
+        """Start polling the status of the job with the given ID, if it isn't
+        already being (see :meth:`.waitForJob` for the arguments). If
+        given, callback() is called once the job has finished (straight
+        away, if it already has)."""
+        with self._lock:
+            entry = self._waiting.get(jobId)
+            if entry is None:
+                entry = [pollInterval, threading.Event(), None, False,
+                    exitStatusFilename,
+                    monotonicTime() + self.unreportedTimeout, []]
+                self._waiting[jobId] = entry
+                if self._pollThread is None:
+                    self._pollThread = threading.Thread(
+                        target=self._pollLoop, name="credo-pbs-poller")
+                    self._pollThread.daemon = True
+                    self._pollThread.start()
+            if callback is not None and not entry[1].is_set():
+                entry[6].append(callback)
+                callback = None
+        if callback is not None:
+            callback()
+
+    def jobFinished(self, jobId):
+        """Returns whether the job with the given ID, being polled (see
+        :meth:`.watchJob`), has been seen to finish."""
+        with self._lock:
+            entry = self._waiting.get(jobId)
+        return entry is not None and entry[1].is_set()
+
+    def waitForJob(self, jobId, pollInterval=DEF_POLL_INTERVAL,
+            exitStatusFilename=None):
+        """Block until the job with the given ID has finished.
+
+        :param exitStatusFilename: if given, the file the job's script
+          writes its exit status to, so that the job is known to have
+          finished if the file exists, even if the status command never
+          reports on it.
+        :returns: the info about the finished job (see :meth:`.queryJobs`),
+          or None if there isn't any."""
+        self.watchJob(jobId, pollInterval, exitStatusFilename)
+        with self._lock:
+            entry = self._waiting[jobId]
+        entry[1].wait()
+        with self._lock:
+            self._waiting.pop(jobId, None)
+        if isinstance(entry[2], Exception):
+            raise entry[2]
+        return entry[2]
+
+    def _pollLoop(self):
+        while True:
+            with self._lock:
+                polled = [(jobId, entry) for jobId, entry
+                    in self._waiting.items() if not entry[1].is_set()]
+                if len(polled) == 0:
+                    self._pollThread = None
+                    return
+                pollInterval = min([entry[0] for jobId, entry in polled])
+            time.sleep(pollInterval)
+            with self._lock:
+                jobIds = sorted([jobId for jobId, entry in
+                    self._waiting.items() if not entry[1].is_set()])
+            finished = self.finishedStates[0]
+            try:
+                jobs = self.queryJobs(jobIds)
+            except OSError as ose:
+                error = ModelRunLaunchError("(batch job)", self.statCommand,
+                    "Check %s working properly, OSError was %s" \
+                    % (self.statCommand, ose))
+                jobs = dict([(jobId, (finished, error)) for jobId in jobIds])
+            callbacks = []
+            with self._lock:
+                for jobId in jobIds:
+                    entry = self._waiting.get(jobId)
+                    if entry is None or entry[1].is_set():
+                        continue
+                    if jobId in jobs:
+                        state, info = jobs[jobId]
+                        entry[3] = True
+                    elif entry[3] or self.unknownJobsFinished or (
+                            entry[4] is not None and os.path.exists(entry[4])):
+                        state, info = finished, None
+                    elif monotonicTime() > entry[5]:
+                        state = finished
+                        info = ModelRunLaunchError("(batch job)",
+                            self.statCommand, "%s hasn't reported on job %s"\
+                            " in %s seconds, and it left no exit status file"\
+                            % (self.statCommand, jobId,
+                                self.unreportedTimeout))
+                    else:
+                        continue
+                    if state in self.finishedStates:
+                        entry[2] = info
+                        entry[1].set()
+                        callbacks.extend(entry[6])
+                        entry[6] = []
+            for callback in callbacks:
+                callback()
+
+class PBSProJobPoller(PBSJobPoller):
+    """Waits on PBS jobs as for :class:`.PBSJobPoller`, for PBS Professional
+    servers with job history enabled (`job_history_enable`): `qstat -x -f`
+    then also reports on finished jobs (in state F, or X for sub-jobs), so a
+    job it doesn't know about at all is taken to have finished (and had its
+    history removed).
+
+    .. note:: don't use this with Torque, whose `qstat -x` gives XML
+       output instead."""
+    statArgs = ['-x', '-f']
+    unknownJobsFinished = True
 
 class PBSJobRunner(JobRunner):
     """A JobRunner to submit CREDO jobs via creating PBS script files,
     and submitting these via command-line utils like qsub.
 
+    The job script of each run saves the model's stdout and stderr to the
+    run's usual files (see
+    :meth:`credo.modelrun.ModelRun.getStdOutFilename`), and its exit status
+    to a file in the run's output path, used to check whether it succeeded.
+
+    .. attribute:: useJobArrays
+
+       If True (the default), suites of runs that all request the same PBS
+       resources (processors, walltime and PBS job parameters) - such as
+       those generated by :meth:`credo.modelsuite.ModelSuite.generateRuns` -
+       are submitted as a single PBS job array, rather than one job per run.
+
+    .. attribute:: arrayFlag
+
+       The qsub option used to submit a job array, with the range of array
+       indices. Defaults to the PBS Professional "-J" (Torque uses "-t").
+
+    .. attribute:: arrayIndexVar
+
+       The environment variable giving the index of a sub-job in a job
+       array. Defaults to the PBS Professional "PBS_ARRAY_INDEX" (Torque
+       uses "PBS_ARRAYID").
+
+    .. attribute:: poller
+
+       The :class:`.PBSJobPoller` used to wait on jobs. (For a PBS
+       Professional server with job history enabled, a
+       :class:`.PBSProJobPoller` can be used instead.)
+
     .. note:: this module is currently still in development, and needs
        tuning for different HPC machines."""
     def __init__(self):
@@ -66,6 +353,10 @@ class PBSJobRunner(JobRunner):
             self.mpiRunCommand = os.environ[MPI_RUN_COMMAND]
         else:
             self.mpiRunCommand = DEFAULT_MPI_RUN_COMMAND
+        self.useJobArrays = True
+        self.arrayFlag = PBS_ARRAY_FLAG
+        self.arrayIndexVar = PBS_ARRAY_INDEX_VAR
+        self.poller = PBSJobPoller()
 
     def setup(self):
         # TODO: check pbs available and running, if necessary
@@ -74,23 +365,119 @@ class PBSJobRunner(JobRunner):
     def submitRun(self, modelRun, prefixStr=None, extraCmdLineOpts=None,
             dryRun=False, maxRunTime=None):
         """See :meth:`credo.jobrunner.api.JobRunner.submit`."""
+        runCommand = self._prepareRun(modelRun, prefixStr, extraCmdLineOpts)
+        pbsFilename = os.path.join(modelRun.basePath,
+            "%s_proc_%d.pbs" % (modelRun.name, modelRun.jobParams['nproc']))
+        try:
+            jobNameLine = modelRun.jobParams['PBS']['jobNameLine']
+        except KeyError:
+            jobNameLine = "%s -N %s" % (PBS_PREFIX, modelRun.name)
+        with open(pbsFilename, 'w') as f:
+            self._writePBSHeader(f, modelRun.jobParams, jobNameLine)
+            self._writeRunLines(f, modelRun, runCommand)
 
-        # Navigate to the model's base directory
-        startDir = os.getcwd()
-        if modelRun.basePath != startDir:
-            print("Changing to ModelRun's specified base path '%s'" % \
-                (modelRun.basePath))
-            os.chdir(modelRun.basePath)
+        # Run the run command, sending stdout and stderr to defined log paths
+        print("Running model '%s' via PBS, submitted filename %s"\
+            " with command '%s', with underlying MPI command '%s' ..."\
+            % (modelRun.name, pbsFilename, PBS_SUB_COMMAND, runCommand))
+
+        # If we're only doing a dry run, return here.
+        if dryRun == True:
+            return None
+
+        jobMetaInfo = PBSJobMetaInfo()
+        jobMetaInfo.submitTime = datetime.now()
+        jobMetaInfo.jobId = self._submitPBSFile(modelRun.name, pbsFilename,
+            modelRun.jobParams, modelRun.basePath)
+        self.attachPlatformInfo(jobMetaInfo)
+        return jobMetaInfo
 
+    def submitSuite(self, modelSuite, prefixStr=None, extraCmdLineOpts=None,
+            dryRun=False, maxRunTime=None, writeRecords=True):
+        """Submits each modelRun in a suite to be run, as for
+        :meth:`credo.jobrunner.api.JobRunner.submitSuite`. If
+        :attr:`.useJobArrays` is set, and the runs can share a job array (see
+        :meth:`.canUseJobArray`), they are submitted as a single PBS job
+        array."""
+        if not (self.useJobArrays and self.canUseJobArray(modelSuite)):
+            return JobRunner.submitSuite(self, modelSuite, prefixStr,
+                extraCmdLineOpts, dryRun, maxRunTime, writeRecords)
+        if writeRecords == True:
+            modelSuite.writeAllModelRunXMLs()
+        runCommands = []
+        for runI, modelRun in enumerate(modelSuite.runs):
+            customOpts = modelSuite.getCustomOpts(runI, extraCmdLineOpts)
+            runCommands.append(self._prepareRun(modelRun, prefixStr,
+                customOpts))
+        firstRun = modelSuite.runs[0]
+        arrayName = os.path.basename(os.path.normpath(
+            modelSuite.outputPathBase)) or firstRun.name
+        pbsFilename = os.path.join(firstRun.basePath, "%s_array_%d.pbs"
+            % (arrayName, len(modelSuite.runs)))
+        with open(pbsFilename, 'w') as f:
+            self._writePBSHeader(f, firstRun.jobParams,
+                "%s -N %s" % (PBS_PREFIX, arrayName),
+                ["%s %s 0-%d" % (PBS_PREFIX, self.arrayFlag,
+                    len(modelSuite.runs)-1)])
+            f.write("case $%s in\n" % self.arrayIndexVar)
+            for runI, (modelRun, runCommand) in enumerate(zip(
+                    modelSuite.runs, runCommands)):
+                f.write("%d)\n" % runI)
+                self._writeRunLines(f, modelRun, runCommand)
+                f.write(";;\n")
+            f.write("esac\n")
+
+        print("Running the %d models of the suite via PBS as a job array,"\
+            " submitted filename %s with command '%s' ..."\
+            % (len(modelSuite.runs), pbsFilename, PBS_SUB_COMMAND))
+        if dryRun == True:
+            return []
+
+        submitTime = datetime.now()
+        arrayJobId = self._submitPBSFile(arrayName, pbsFilename,
+            firstRun.jobParams, firstRun.basePath)
+        jobMetaInfos = []
+        for runI in range(len(modelSuite.runs)):
+            jobMetaInfo = PBSJobMetaInfo()
+            jobMetaInfo.submitTime = submitTime
+            jobMetaInfo.arrayJobId = arrayJobId
+            jobMetaInfo.jobId = arrayJobId.replace("[]", "[%d]" % runI, 1)
+            self.attachPlatformInfo(jobMetaInfo)
+            jobMetaInfos.append(jobMetaInfo)
+        return jobMetaInfos
+
+    def canUseJobArray(self, modelSuite):
+        """Returns whether the runs of modelSuite can be submitted as a
+        single job array: i.e. there's more than one, and they all request
+        the same resources from PBS."""
+        if len(modelSuite.runs) < 2:
+            return False
+        def resources(modelRun):
+            jobParams = modelRun.jobParams
+            pbsParams = dict(jobParams.get('PBS', {}))
+            # Each sub-job is named after the array anyway.
+            pbsParams.pop('jobNameLine', None)
+            return (jobParams['nproc'], jobParams['maxRunTime'],
+                sorted(pbsParams.items()))
+        firstResources = resources(modelSuite.runs[0])
+        return all([resources(modelRun) == firstResources
+            for modelRun in modelSuite.runs[1:]])
+
+    def _prepareRun(self, modelRun, prefixStr, extraCmdLineOpts):
+        """Prepare a run for submission, and return the command to run it."""
         # For PBS runs, want to ensure the output path is an abs path:-
         #  given file system complexities etc.
         #  thus update here.
-        modelRun.outputPath = os.path.abspath(modelRun.outputPath)
+        modelRun.outputPath = os.path.join(modelRun.basePath,
+            modelRun.outputPath)
         # Now generate the XML etc
         modelRun.checkValidRunConfig()
         modelRun.preRunPreparation()
-        modelRunCommand = modelRun.getModelRunCommand(extraCmdLineOpts,
-            absXMLPaths=True)
+        if isinstance(modelRun, credo.modelrun.UnderworldModelRun):
+            modelRunCommand = modelRun.getModelRunCommand(extraCmdLineOpts,
+                absXMLPaths=True)
+        else:
+            modelRunCommand = modelRun.getModelRunCommand(extraCmdLineOpts)
         # Construct full run line
         mpiPart = "%s" % (self.mpiRunCommand)
         runCommand = " ".join([mpiPart, modelRunCommand])
@@ -98,72 +485,57 @@ class PBSJobRunner(JobRunner):
             # NB: in the case of MPI runs, we prefix the prefixStr before MPI
             # command and args ... appropriate for things like timing stuff.
             runCommand = " ".join([prefixStr, runCommand])
+        # Remove any exit status left from a previous run
+        exitStatusFilename = getExitStatusFilename(modelRun)
+        if os.path.exists(exitStatusFilename):
+            os.remove(exitStatusFilename)
+        return runCommand
 
-        pbsFilename = self._writePBSFile(modelRun, runCommand)
+    def _submitPBSFile(self, jobName, pbsFilename, jobParams, basePath):
+        """Submit a PBS job script with qsub, and return its job ID."""
         try:
-            pbsQueueStr = "-q %s" % (modelRun.jobParams['PBS']['queue'])
+            pbsQueueStr = "-q %s" % (jobParams['PBS']['queue'])
         except KeyError:
             pbsQueueStr = ""
         pbsSubCmd = "%s %s %s" % (PBS_SUB_COMMAND, pbsQueueStr, pbsFilename)
-
-        # Run the run command, sending stdout and stderr to defined log paths
-        print("Running model '%s' via PBS, submitted filename %s"\
-            " with command '%s', with underlying MPI command '%s' ..."\
-            % (modelRun.name, pbsFilename, PBS_SUB_COMMAND, runCommand))
-
-        # If we're only doing a dry run, return here.
-        if dryRun == True:
-            os.chdir(startDir)
-            return None
-
-        # Submit the command to PBS
         pbsSubArgs = shlex.split(pbsSubCmd)
-        jobMetaInfo = PBSJobMetaInfo()
-        jobMetaInfo.submitTime = datetime.now()
         try:
             qsubStdOut = open("%s.stdout" % pbsFilename, "w+")
             qsubStdErr = open("%s.stderr" % pbsFilename, "w+")
             retCode = subprocess.call(pbsSubArgs, shell=False,
-                stdout=qsubStdOut, stderr=qsubStdErr)
+                stdout=qsubStdOut, stderr=qsubStdErr, cwd=basePath)
         except OSError as ose:
-            raise ModelRunLaunchError(modelRun.name, pbsSubCmd,
+            raise ModelRunLaunchError(jobName, pbsSubCmd,
                 "Check qsub working properly, OSError was %s" % (ose))
-
         # Parse the result, get the job number
         qsubStdOut.seek(0)
         qsubStdErr.seek(0)
-        jobId = self._parseQSubOutput(qsubStdOut.read(), qsubStdErr.read())
-        jobMetaInfo.jobId = jobId
-        # TODO: create further job meta info
-        # TODO: record where the stdout and stderr were set, and archive?
+        qsubOut, qsubErr = qsubStdOut.read(), qsubStdErr.read()
         qsubStdOut.close()
         qsubStdErr.close()
-        # TODO: delete the qsub files if successful?
-        if modelRun.basePath != startDir:
-            print("Restoring initial path '%s'" % (startDir))
-            os.chdir(startDir)
-        return jobMetaInfo
+        if retCode != 0:
+            raise ModelRunLaunchError(jobName, pbsSubCmd,
+                "qsub failed with return code %d, stderr was '%s'" \
+                % (retCode, qsubErr.strip()))
+        return self._parseQSubOutput(qsubOut, qsubErr)
 
     def _parseQSubOutput(self, qsubStdOut, qsubStdErr):
-        #TODO
-        print("Going to parse qsub output '%s', stderr '%s'" % \
-            (qsubStdOut, qsubStdErr))
-        jobId = qsubStdOut
-        return jobId
-
-    def _writePBSFile(self, modelRun, runCommand):
-        jobParams = modelRun.jobParams
-        #make the pbs file name
-        pbsFileName = "%s_proc_%d.pbs" % (modelRun.name, jobParams['nproc'])
-        #add all necessary lines for a basic pbs- might need to modify
-        # this slightly depending on what needs to go in
-        f = open(pbsFileName, 'w')
+        """Get the job ID from the output of qsub: the last line it
+        prints."""
+        lines = qsubStdOut.strip().splitlines()
+        if len(lines) == 0:
+            raise ValueError("No job ID in qsub output, stderr was '%s'" \
+                % (qsubStdErr.strip()))
+        return lines[-1].strip()
+
+    def _writePBSHeader(self, f, jobParams, jobNameLine,
+            extraDirectives=None):
+        """Write the start of a PBS job script, with the PBS options for
+        the job (and any extraDirectives lines, e.g. the job array flag),
+        then the lines setting up its environment. All the directives come
+        before any commands, as qsub ignores those after the first
+        command."""
         f.write(PBS_FIRSTLINE+"\n")
-        #name line:
-        try:
-            jobNameLine = jobParams['PBS']['jobNameLine']
-        except KeyError:
-            jobNameLine = "%s -N %s" % (PBS_PREFIX, modelRun.name)
         f.write(jobNameLine+"\n")
         # All the following can be rearranged to suit whatever cluster
         # this is running on
@@ -190,6 +562,8 @@ class PBSJobRunner(JobRunner):
         f.write(wallTimeLine+"\n")
         #export bash script vars:
         f.write("%s -V\n" % PBS_PREFIX)
+        for directive in (extraDirectives or []):
+            f.write(directive+"\n")
         #Optional PBS script entries
         try:
             for srcFile in jobParams['PBS']['sourcefiles']:
@@ -201,114 +575,90 @@ class PBSJobRunner(JobRunner):
                 f.write("module load %s\n" % modName)
         except KeyError:
             pass
-        #cmd line:
-        f.write(runCommand+"\n")
-        f.close()
-        return pbsFileName
+
+    def _writeRunLines(self, f, modelRun, runCommand):
+        """Write the lines of a PBS job script that run a model, from its
+        base directory, saving its stdout, stderr and exit status."""
+        absOutPath = os.path.join(modelRun.basePath, modelRun.outputPath)
+        redirects = "> %s 2> %s" % (
+            os.path.join(modelRun.basePath, modelRun.getStdOutFilename()),
+            os.path.join(modelRun.basePath, modelRun.getStdErrFilename()))
+        if os.path.exists(modelRun.getStdInFilename()):
+            redirects += " < %s" % modelRun.getStdInFilename()
+        f.write("cd %s\n" % modelRun.basePath)
+        f.write("mkdir -p %s\n" % absOutPath)
+        f.write("%s %s\n" % (runCommand, redirects))
+        f.write("echo $? > %s\n" % getExitStatusFilename(modelRun))
+
+    def _notifyWhenFinished(self, modelRun, jobMetaInfo, callback):
+        """Overrides
+        :meth:`credo.jobrunner.api.JobRunner._notifyWhenFinished`, starting
+        to poll the status of the job."""
+        self.poller.watchJob(jobMetaInfo.jobId,
+            modelRun.jobParams['pollInterval'],
+            getExitStatusFilename(modelRun), callback)
+
+    def _asyncWaitTime(self, modelRun, jobMetaInfo):
+        """Overrides :meth:`credo.jobrunner.api.JobRunner._asyncWaitTime`:
+        a job is ready to complete once the :attr:`.poller` has seen it
+        finish."""
+        return 0 if self.poller.jobFinished(jobMetaInfo.jobId) else None
+
+    def _waitForJob(self, modelRun, jobMetaInfo):
+        """Wait for a job to finish, and return its exit status as reported
+        by the queueing system (or None if not known)."""
+        return self.poller.waitForJob(jobMetaInfo.jobId,
+            modelRun.jobParams['pollInterval'],
+            getExitStatusFilename(modelRun))
 
     def blockResult(self, modelRun, jobMetaInfo):
-        # Check jobMetaInfo is of type PBS
-        # via self.runType = "PBS"
-        startDir = os.getcwd()
-        if modelRun.basePath != startDir:
-            print("Changing to ModelRun's specified base path '%s'" % \
-                (modelRun.basePath))
-            os.chdir(modelRun.basePath)
-        jobID = jobMetaInfo.jobId
-        pollInterval = modelRun.jobParams['pollInterval']
-        checkOutput = 0
-        # NB: unlike with the MPI Job Runner, we don't check the "maxJobTime" here:- since that was encoded
-        #  in the PBS Walltime used. Wait as long as necessary for job to be queued, run, and completed
-        #  in PBS system.
-        pbsWaitTime = 0
-        gotResult = False
-        pbsError = False
-        while gotResult == False:
-            time.sleep(pollInterval)
-            pbsWaitTime += pollInterval
-            # check PBS job output ... (eg using qstat on jobID)
-            qstat = os.popen("qstat "+jobID).readlines()
-            qstatus = "%s" % (qstat)
-            # when the job has been submitted and we query the job ID we should get something like:
-            # if the job has ended:
-            #qstat: Unknown Job Id 3506.tweedle
-            # OR
-            #3505.tweedle              cratonic30t2c3d2 WendySharples   00:15:16 E batch
-            # if the job has not commenced running or is still running:
-            #3505.tweedle              cratonic30t2c3d2 WendySharples   00:15:16 Q batch
-            #3505.tweedle              cratonic30t2c3d2 WendySharples   00:15:16 R batch
-            #3505.tweedle              cratonic30t2c3d2 WendySharples   00:15:16 S batch
-            # if the job has not been able to be run:
-            #3505.tweedle              cratonic30t2c3d2 WendySharples   00:15:16 C batch
-            # So if we break the command line up into an array of words separated by spaces:
-            qstatus = qstatus.split(" ")
-            #jobName and modelName MUST be THE SAME
-            for ii in range(len(qstatus)):
-                if qstatus[ii] == "Unknown":
-                    print("job has already run\n")
-                    gotResult = True
-                elif qstatus[ii] == "R":
-                    print("job is still running\n")
-                elif qstatus[ii] == "Q":
-                    print("job is queued\n")
-                elif qstatus[ii] == "C":
-                    print("job is cancelled\n")
-                    gotResult = True
-                    pbsError = True
-                elif qstatus[ii] == "E":
-                    print("job has ended\n")
-                    gotResult = True
+        # NB: unlike with the MPI Job Runner, we don't check the "maxJobTime"
+        #  here:- since that was encoded in the PBS Walltime used. Wait as
+        #  long as necessary for job to be queued, run, and completed in PBS
+        #  system.
+        pbsExitStatus = self._waitForJob(modelRun, jobMetaInfo)
 
         # Check status of run (eg error status)
-        # TODO: archive PBS file in modelRun output directory.
-        # TODO: connect/copy PBS stdout/error files to standard expected names.
-        stdOutFilename = modelRun.getStdOutFilename()
-        stdErrFilename = modelRun.getStdErrFilename()
-
-        #qdel = os.popen("qdel "+jobID).readlines()
-        if pbsError:
-            raise ModelRunRegularError(modelRun.name, -1, stdOutFilename,
-                stdErrFilename)
-        else:
-            absOutPath = os.path.join(modelRun.basePath, modelRun.outputPath)
-            absLogPath = os.path.join(modelRun.basePath, modelRun.logPath)
-            # TODO: Move and rename output and error files created by PBS,
-            #  ... to stdOutFilename, stdErrFilename
-            # check PBS output file and make sure there's something in it
-            jobName = "%s" % (modelRun.name)
-            jobid = jobID.split(".")
-            jobNo = jobid[0]
-            fileName = jobName+".o"+jobNo
-            f = open(fileName, 'r')
-            lines = f.read()
-            if lines == "":
-                print("error in file no output obtained\n")
-                raise ModelRunRegularError(modelRun.name, retCode,
-                    stdOutFilename, stdErrFilename)
-            else:
-                print("Model ran successfully (output saved to %s, std out"\
-                " & std error to %s." % (absOutPath, absLogPath))
+        stdOutFilename = os.path.join(modelRun.basePath,
+            modelRun.getStdOutFilename())
+        stdErrFilename = os.path.join(modelRun.basePath,
+            modelRun.getStdErrFilename())
+        absOutPath = os.path.join(modelRun.basePath, modelRun.outputPath)
+        try:
+            with open(getExitStatusFilename(modelRun)) as f:
+                retCode = int(f.read())
+        except (IOError, ValueError):
+            # The job script didn't get to finish the run - e.g. it was
+            #  deleted, or ran out of walltime.
+            print("PBS job %s of model '%s' finished without the model"\
+                " finishing (PBS exit status %s)." % (jobMetaInfo.jobId,
+                modelRun.name, pbsExitStatus))
+            for fname in [stdOutFilename, stdErrFilename]:
+                if not os.path.exists(fname):
+                    open(fname, 'w').close()
+            retCode = -1 if pbsExitStatus in [None, 0] else pbsExitStatus
+        if retCode != 0:
+            raise ModelRunRegularError(modelRun.name, retCode,
+                stdOutFilename, stdErrFilename)
+        print("Model ran successfully (output saved to path %s )." \
+            % (absOutPath))
         print("Doing post-run tidyup:")
         modelRun.postRunCleanup()
 
         # Construct a modelResult
-        # TODO: [Refactor] ModelResult to be generated by modelrun
-        mResult = ModelResult(modelRun.name, absOutPath)
+        try:
+            mResult = modelRun.createModelResult()
+            mResult.outputPath = os.path.join(modelRun.basePath,
+                mResult.outputPath)
+        except NotImplementedError:
+            mResult = ModelResult(modelRun.name, absOutPath)
 
         # Now attach appropriate Job meta info
         try:
-            tSteps, simTime = getSimInfoFromFreqOutput(modelRun.outputPath)
+            tSteps, simTime = getSimInfoFromFreqOutput(absOutPath)
+            jobMetaInfo.simtime = simTime
         except ValueError:
             # For now, allow runs that didn't create a freq output
             tSteps, simTime = None, None
-        # Perhaps functions on jobMetaInfo?
-        # get provenance info
-        # attach provenance info
-        # get performance info
-        # attach performance info
         mResult.jobMetaInfo = jobMetaInfo
-        # Navigate to the model's base directory
-        if modelRun.basePath != startDir:
-            print("Restoring initial path '%s'" % (startDir))
-            os.chdir(startDir)
         return mResult
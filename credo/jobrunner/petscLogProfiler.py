@@ -0,0 +1,216 @@
+from __future__ import print_function
+##  Copyright (C), 2010, Monash University
+##  Copyright (C), 2010, Victorian Partnership for Advanced Computing (VPAC)
+##
+##  This file is part of the CREDO library.
+##  Developed as part of the Simulation, Analysis, Modelling program of
+##  AuScope Limited, and funded by the Australian Federal Government's
+##  National Collaborative Research Infrastructure Strategy (NCRIS) program.
+##
+##  This library is free software; you can redistribute it and/or
+##  modify it under the terms of the GNU Lesser General Public
+##  License as published by the Free Software Foundation; either
+##  version 2.1 of the License, or (at your option) any later version.
+##
+##  This library is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##  Lesser General Public License for more details.
+##
+##  You should have received a copy of the GNU Lesser General Public
+##  License along with this library; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+##  MA  02110-1301  USA
+
+import os
+import re
+import ast
+from credo.jobrunner.api import PerformanceProfiler
+
+"""A module for profiling the performance of PETSc-based models (such as
+Waiwera) by the time, floating point operations and messages of each PETSc
+event (e.g. SNESSolve, KSPSolve, PCSetUp, MatAssemblyEnd) and logging stage,
+as reported by PETSc's `-log_view` option.
+
+The detailed ASCII format of `-log_view` (`ascii_info_detail`) is used,
+since it reports the values on each MPI rank separately (in the form of
+Python dictionary assignments), from which totals and max/min ratios across
+ranks are calculated."""
+
+#: Name of the PETSc log file saved, in the run's output directory.
+PETSC_LOG_FILENAME = "petscLogView.txt"
+#: PETSc log values recorded for each event and stage, as named in the log.
+PETSC_LOG_VALUES = ["time", "flop", "numMessages", "messageLength",
+    "numReductions"]
+
+_STAGE_LINE_RE = re.compile(
+    r'^Stages\["(?P<stage>[^"]*)"\]\["(?P<event>[^"]*)"\]'
+    r'\[(?P<rank>\d+)\]\s*=\s*(?P<values>\{.*\})\s*$')
+_LOCAL_LINE_RE = re.compile(
+    r'^Local(?P<name>\w+)\[(?P<rank>\d+)\]\s*=\s*(?P<value>\S+)\s*$')
+# Names of the whole run totals in the log (as LocalX[rank] = value).
+_LOCAL_NAMES = {
+    "Times": "time",
+    "Flop": "flop",
+    "Messages": "numMessages",
+    "MessageLens": "messageLength",
+    "Reductions": "numReductions",
+    }
+
+def readPETScLogView(filename):
+    """Read a PETSc log file written in the `ascii_info_detail` format.
+
+    :returns: a tuple (totals, stages), where totals is a dictionary of the
+      whole run values of each rank, e.g. totals['time'][rank], and stages
+      is a dictionary of the values of each event in each stage, on each
+      rank, e.g. stages['Main Stage']['KSPSolve'][rank]['time']. The overall
+      values of each stage are saved under the event name 'summary'."""
+    totals = {}
+    stages = {}
+    with open(filename) as f:
+        for line in f:
+            match = _STAGE_LINE_RE.match(line)
+            if match:
+                try:
+                    values = ast.literal_eval(match.group('values'))
+                except (ValueError, SyntaxError):
+                    # e.g. values that aren't numbers, such as nan.
+                    continue
+                stageDict = stages.setdefault(match.group('stage'), {})
+                eventDict = stageDict.setdefault(match.group('event'), {})
+                eventDict[int(match.group('rank'))] = values
+                continue
+            match = _LOCAL_LINE_RE.match(line)
+            if match and match.group('name') in _LOCAL_NAMES:
+                name = _LOCAL_NAMES[match.group('name')]
+                totals.setdefault(name, {})[int(match.group('rank'))] = \
+                    float(match.group('value'))
+    return totals, stages
+
+def xmlSafeName(name):
+    """Return a version of name (e.g. of a PETSc stage or event) that can be
+    used as an XML tag name."""
+    safeName = re.sub(r'[^A-Za-z0-9_]', '_', name.strip())
+    if not re.match(r'[A-Za-z_]', safeName):
+        safeName = "_" + safeName
+    return safeName
+
+def maxMinRatio(values):
+    """Return the ratio of the maximum to the minimum of values, or 0 if the
+    minimum is 0 (as PETSc does)."""
+    minVal = min(values)
+    return max(values) / float(minVal) if minVal > 0 else 0.0
+
+def _summariseRanks(rankValues, prefix, resDict):
+    """Add the totals over ranks of each of :data:`PETSC_LOG_VALUES` in
+    rankValues (a dictionary of the values on each rank) to resDict, with the
+    max/min ratio and maximum of the time."""
+    for name in PETSC_LOG_VALUES:
+        values = [float(v.get(name, 0)) for v in rankValues.values()]
+        if name == "time":
+            resDict[prefix + "time"] = max(values)
+            resDict[prefix + "timeRatio"] = maxMinRatio(values)
+        else:
+            resDict[prefix + name] = sum(values)
+            if name == "flop":
+                resDict[prefix + "flopRatio"] = maxMinRatio(values)
+    counts = [v["count"] for v in rankValues.values() if "count" in v]
+    if counts:
+        resDict[prefix + "count"] = max(counts)
+
+def getStagePerformanceDict(stageEvents):
+    """Return a dictionary of the performance of a PETSc stage, given the
+    values of its events on each rank (as returned in the stages dictionary
+    of :func:`readPETScLogView`).
+
+    The overall stage values are saved under their names (e.g. 'time',
+    'flop'), and each event that was called, with the event name as a
+    prefix (e.g. 'KSPSolve_time'). Times are the maximum over ranks, and
+    'timeRatio' the ratio of the maximum to minimum, while flops, messages
+    and reductions are totals over all ranks."""
+    resDict = {}
+    for event, rankValues in stageEvents.items():
+        if event == "summary":
+            _summariseRanks(rankValues, "", resDict)
+        elif any(v.get("count", 0) > 0 for v in rankValues.values()):
+            _summariseRanks(rankValues, xmlSafeName(event) + "_", resDict)
+    return resDict
+
+def _ranksToValues(totals):
+    """Convert whole run totals as returned by :func:`readPETScLogView` (by
+    value name, then rank) to a dictionary of the values on each rank."""
+    rankValues = {}
+    for name, ranks in totals.items():
+        for rank, val in ranks.items():
+            rankValues.setdefault(rank, {})[name] = val
+    return rankValues
+
+class PETScLogProfiler(PerformanceProfiler):
+    """Profiler for PETSc-based models, that adds the `-log_view` option to
+    the run command, and saves the parsed results in the job's performance
+    info (and thus the model result records).
+
+    The whole run totals are saved under the profiler type 'PETSc' (e.g. the
+    'time', 'timeRatio', 'flop', 'numMessages' of the run), along with the
+    values of each event summed over all stages (e.g. 'SNESSolve_time',
+    'KSPSolve_flop'). The values of each stage are saved separately, under
+    the profiler type 'PETSc stage <stage name>' (see
+    :func:`getStagePerformanceDict`).
+
+    This isn't one of the default profilers, since it's only for PETSc
+    models - add it to a job runner's profilers to use it, e.g.::
+
+        jobRunner.profilers.append(PETScLogProfiler())
+
+    .. attribute:: logFormat
+
+       PETSc viewer format of the log file. Only the default,
+       'ascii_info_detail', can be parsed.
+    """
+    def __init__(self):
+        PerformanceProfiler.__init__(self, "PETSc")
+        self.logFormat = "ascii_info_detail"
+
+    def logFilename(self, modelBasePath, modelOutputPath):
+        return os.path.join(modelBasePath, modelOutputPath,
+            PETSC_LOG_FILENAME)
+
+    def setup(self, modelName, modelBasePath, modelOutputPath, jobMetaInfo):
+        logFilename = self.logFilename(modelBasePath, modelOutputPath)
+        # Make sure a log of an earlier run isn't read.
+        if os.path.exists(logFilename):
+            os.remove(logFilename)
+        jobMetaInfo.profilerHandles[self.typeStr] = logFilename
+
+    def modifyRun(self, modelRun, oldModelRunCommand, jobMetaInfo):
+        logFilename = self.logFilename(modelRun.basePath, modelRun.outputPath)
+        return "%s -log_view :%s:%s" % (oldModelRunCommand, logFilename,
+            self.logFormat)
+
+    def attachPerformanceInfo(self, jobMetaInfo, modelResult):
+        logFilename = jobMetaInfo.profilerHandles.get(self.typeStr)
+        if logFilename is None:
+            return
+        if not os.path.exists(logFilename):
+            print("Warning: PETSc log file %s not found, so no PETSc"\
+                " performance info recorded." % logFilename)
+            return
+        totals, stages = readPETScLogView(logFilename)
+        resDict = {}
+        if totals:
+            _summariseRanks(_ranksToValues(totals), "", resDict)
+        eventTotals = {}
+        for stage, stageEvents in stages.items():
+            jobMetaInfo.performance["%s stage %s" % (self.typeStr, stage)] = \
+                getStagePerformanceDict(stageEvents)
+            for event, rankValues in stageEvents.items():
+                if event == "summary":
+                    continue
+                eventRanks = eventTotals.setdefault(event, {})
+                for rank, values in rankValues.items():
+                    rankTotals = eventRanks.setdefault(rank, {})
+                    for name, val in values.items():
+                        rankTotals[name] = rankTotals.get(name, 0) + val
+        eventDict = getStagePerformanceDict(eventTotals)
+        resDict.update(eventDict)
+        jobMetaInfo.performance[self.typeStr] = resDict
@@ -0,0 +1,387 @@
+from __future__ import print_function
+##  Copyright (C), 2010, Monash University
+##  Copyright (C), 2010, Victorian Partnership for Advanced Computing (VPAC)
+##
+##  This file is part of the CREDO library.
+##  Developed as part of the Simulation, Analysis, Modelling program of
+##  AuScope Limited, and funded by the Australian Federal Government's
+##  National Collaborative Research Infrastructure Strategy (NCRIS) program.
+##
+##  This library is free software; you can redistribute it and/or
+##  modify it under the terms of the GNU Lesser General Public
+##  License as published by the Free Software Foundation; either
+##  version 2.1 of the License, or (at your option) any later version.
+##
+##  This library is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##  Lesser General Public License for more details.
+##
+##  You should have received a copy of the GNU Lesser General Public
+##  License along with this library; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+##  MA  02110-1301  USA
+
+"""A module for running the ModelRuns of a
+:class:`~credo.modelsuite.ModelSuite` concurrently on the local machine,
+within a total budget of processors.
+
+.. seealso:: :class:`credo.jobrunner.simplejobrunner.SimpleJobRunner`, which
+   this runner extends, and which is used to launch each individual run."""
+
+from future.moves.queue import Queue, Empty
+import threading
+import multiprocessing
+from credo.jobrunner.api import *
+from credo.jobrunner.simplejobrunner import SimpleJobRunner
+from credo.jobrunner.runcache import suiteRunFingerprint
+
+#: Longest single wait (in seconds) on a queue or thread - waits without a
+#: timeout can't be interrupted by Ctrl-C in Python 2, so are done in slices.
+WAIT_SLICE = 1.0
+
+def _joinThread(thread):
+    """Wait until thread has finished, interruptibly (see WAIT_SLICE)."""
+    while thread.is_alive():
+        thread.join(WAIT_SLICE)
+
+class PooledJobRunner(SimpleJobRunner):
+    """A JobRunner that runs the ModelRuns of a suite concurrently on the
+    local machine. As many runs are launched at once as fit within a total
+    budget of processors, using each run's `jobParams['nproc']`. Whenever a
+    run finishes, the next pending runs that fit in the processors freed up
+    are launched.
+
+    Single runs (see :meth:`.runModel`) are run exactly as for the
+    :class:`~credo.jobrunner.simplejobrunner.SimpleJobRunner`, so the
+    :meth:`.submitRun` and :meth:`.blockResult` interface is unchanged.
+
+    .. attribute:: maxProcs
+
+       Total number of processors that concurrently running jobs may use.
+       Defaults to the number of CPUs on the machine. A run that needs more
+       processors than this on its own is only launched once all other
+       runs have finished.
+
+    .. attribute:: walltimeHistory
+
+       If set to a :class:`~credo.jobrunner.walltimehistory.WalltimeHistory`,
+       the walltime of each run is recorded in it, and the runs of a suite
+       are launched longest expected walltime first (runs not run before
+       are assumed to be the longest, and runs using more processors go
+       first among those expected to take the same time). This stops a long
+       run started near the end holding up the whole suite. If None, runs
+       are launched in the order they are in the suite.
+    """
+    def __init__(self, maxProcs=None, mpi=False, runCache=None,
+            walltimeHistory=None, runMonitor=None, progressReporter=None,
+            runHistory=None):
+        SimpleJobRunner.__init__(self, mpi=mpi, runCache=runCache,
+            runMonitor=runMonitor, progressReporter=progressReporter,
+            runHistory=runHistory)
+        if maxProcs is None:
+            maxProcs = multiprocessing.cpu_count()
+        if maxProcs < 1:
+            raise ValueError("The maxProcs of a PooledJobRunner must be at"\
+                " least 1, not %s." % maxProcs)
+        self.maxProcs = maxProcs
+        self.walltimeHistory = walltimeHistory
+        self.runSuiteNonBlockingDefault = True
+
+    def runSuite(self, modelSuite, prefixStr=None, extraCmdLineOpts=None,
+            dryRun=False, maxRunTime=None, runSuiteNonBlocking=None,
+            writeRecords=True, resultCallback=None):
+        """Run each ModelRun in the suite, as for
+        :meth:`credo.jobrunner.api.JobRunner.runSuite`, but running as many
+        ModelRuns at once as fit within :attr:`.maxProcs`.
+
+        If a run fails, no further runs are launched, but those already
+        running are allowed to finish before the error is raised.
+
+        :keyword runSuiteNonBlocking: if set to False, the runs will instead
+           be run one after another.
+
+        :returns: a reference to the :attr:`.resultsList` containing all
+           the ModelResults generated, in the same order as the suite's runs.
+        """
+        if runSuiteNonBlocking is None:
+            runSuiteNonBlocking = self.runSuiteNonBlockingDefault
+        if not runSuiteNonBlocking:
+            return SimpleJobRunner.runSuite(self, modelSuite, prefixStr,
+                extraCmdLineOpts, dryRun, maxRunTime, runSuiteNonBlocking,
+                writeRecords, resultCallback)
+
+        nRuns = len(modelSuite.runs)
+        print("Running the %d modelRuns specified in the suite, using up to"\
+            " %d processors at once" % (nRuns, self.maxProcs))
+        for runI, modelRun in enumerate(modelSuite.runs):
+            if not isinstance(modelRun, credo.modelrun.ModelRun):
+                raise TypeError("Error, stored run %d not an instance of a"\
+                    " ModelRun" % runI)
+
+        results = [None] * nRuns
+        fingerprints = [None] * nRuns
+        pending = list(range(nRuns))
+        if self.walltimeHistory is not None or self.runHistory is not None:
+            fingerprints = [suiteRunFingerprint(modelSuite, runI,
+                extraCmdLineOpts) for runI in range(nRuns)]
+        if self.walltimeHistory is not None:
+            pending = self._orderByExpectedWalltime(modelSuite, fingerprints)
+        if self.runHistory is not None:
+            self._setSuiteFingerprints(modelSuite, fingerprints)
+        running = {}
+        errors = []
+        # Indices of runs are put on this queue as their processes exit.
+        finishedQueue = Queue()
+        # Finished runs are put on this queue to be completed (see
+        #  _completeFinished), so that launching pending runs and timing out
+        #  running ones isn't held up by completing others.
+        completionQueue = Queue()
+        completer = threading.Thread(target=self._completeFinished,
+            args=(modelSuite, completionQueue, results, fingerprints, errors,
+                writeRecords, resultCallback),
+            name="credo-completion")
+        completer.daemon = True
+        completer.start()
+        reporter = self.progressReporter if not dryRun else None
+        if reporter is not None:
+            reporter.startSuite(modelSuite, extraCmdLineOpts,
+                maxProcs=self.maxProcs, walltimeHistory=self.walltimeHistory,
+                fingerprints=fingerprints if self.walltimeHistory else None)
+        try:
+            self._runPending(modelSuite, pending, running, errors,
+                finishedQueue, completionQueue, prefixStr, extraCmdLineOpts,
+                dryRun, maxRunTime, writeRecords)
+            completionQueue.put(None)
+            _joinThread(completer)
+        except BaseException as e:
+            # Don't leave jobs running after being interrupted (by Ctrl-C),
+            #  or an error launching or waiting on runs.
+            if isinstance(e, KeyboardInterrupt):
+                print("Interrupted: stopping all running runs of the suite.")
+            else:
+                print("Error: stopping all running runs of the suite.")
+            for jobMI, retCode, timeOut in list(running.values()):
+                self.killJob(jobMI)
+            # (the runs that had already finished are still completed, so
+            #  the completer stops once they have been)
+            completionQueue.put(None)
+            _joinThread(completer)
+            raise
+        finally:
+            self._suiteFingerprints = {}
+            if reporter is not None:
+                reporter.finishSuite()
+        if len(errors) > 0:
+            raise errors[0]
+
+        if dryRun == True:
+            modelSuite.resultsList = []
+        else:
+            modelSuite.resultsList = results
+        return modelSuite.resultsList
+
+    def _runPending(self, modelSuite, pending, running, errors,
+            finishedQueue, completionQueue, prefixStr, extraCmdLineOpts,
+            dryRun, maxRunTime, writeRecords):
+        """Launch pending runs, and hand them on to be completed (see
+        :meth:`._completeFinished`) as they finish, until there are none left
+        (or one fails, and those running have finished).
+
+        Only the bookkeeping of finished runs is done here, so their
+        processors are free for pending runs straight away."""
+        failed = False
+        while len(pending) > 0 or len(running) > 0:
+            if len(errors) == 0 and not failed:
+                self._launchPending(modelSuite, pending, running, errors,
+                    finishedQueue, prefixStr, extraCmdLineOpts, dryRun,
+                    maxRunTime, writeRecords)
+            else:
+                del pending[:]
+            if len(running) == 0:
+                continue
+            for runI in self._waitForFinished(modelSuite, running,
+                    finishedQueue):
+                jobMI, retCode, timeOut = running.pop(runI)
+                if timeOut or jobMI.abortReason is not None or \
+                        (not jobMI.cacheHit and retCode != 0):
+                    # Will fail when completed, so don't launch any more.
+                    failed = True
+                completionQueue.put((runI, jobMI, retCode, timeOut))
+
+    def _completeFinished(self, modelSuite, completionQueue, results,
+            fingerprints, errors, writeRecords, resultCallback):
+        """Complete the finished runs put on completionQueue (as tuples of
+        (runI, jobMI, retCode, timeOut)), in turn, until None is put on it:
+        post-run tidy up and profiling (see :meth:`._completeRun`), records,
+        and the resultCallback. Run in its own thread by :meth:`.runSuite`.
+        Errors are added to the errors list."""
+        while True:
+            item = completionQueue.get()
+            if item is None:
+                return
+            runI, jobMI, retCode, timeOut = item
+            modelRun = modelSuite.runs[runI]
+            try:
+                result = self._completeRun(modelRun, jobMI, retCode,
+                    timeOut)
+            except ModelRunError as mre:
+                print("ModelRun '%s' failed." % modelRun.name)
+                errors.append(mre)
+                continue
+            except Exception as e:
+                errors.append(e)
+                continue
+            print("ModelRun '%s' complete." % modelRun.name)
+            results[runI] = result
+            try:
+                self._recordWalltime(fingerprints[runI], modelRun, jobMI)
+                if writeRecords == True:
+                    result.writeRecordXML()
+                if resultCallback is not None:
+                    resultCallback(runI, result)
+            except Exception as e:
+                errors.append(e)
+
+    def _orderByExpectedWalltime(self, modelSuite, fingerprints):
+        """Returns the indices of the suite's runs, in the order they should
+        be launched: by expected walltime (from :attr:`.walltimeHistory`),
+        longest first, then by number of processors, most first. Runs with
+        no history go first, in suite order."""
+        def sortKey(runI):
+            walltime = self.walltimeHistory.predictWalltime(
+                fingerprints[runI], modelSuite.runs[runI])
+            if walltime is None:
+                walltime = float('inf')
+            return (-walltime, -self._runProcs(modelSuite.runs[runI]), runI)
+        order = sorted(range(len(modelSuite.runs)), key=sortKey)
+        if order != list(range(len(order))):
+            print("Launching runs longest expected walltime first, in order:"\
+                " %s" % ", ".join([modelSuite.runs[runI].name
+                    for runI in order]))
+        return order
+
+    def _recordWalltime(self, fingerprint, modelRun, jobMI):
+        """Record the walltime of a completed run, as measured by the
+        :class:`~credo.jobrunner.walltimeProfiler.WalltimeProfiler`, in the
+        :attr:`.walltimeHistory`."""
+        if self.walltimeHistory is None or jobMI.cacheHit:
+            return
+        try:
+            walltime = jobMI.performance['Walltime']['walltime']
+        except KeyError:
+            return
+        self.walltimeHistory.recordWalltime(fingerprint, modelRun, walltime)
+
+    def _runProcs(self, modelRun):
+        """Number of processors a run will use."""
+        return modelRun.jobParams['nproc']
+
+    def _launchPending(self, modelSuite, pending, running, errors,
+            finishedQueue, prefixStr, extraCmdLineOpts, dryRun, maxRunTime,
+            writeRecords):
+        """Launch, in the order they are in the pending list (see
+        :meth:`._orderByExpectedWalltime`), each pending run that fits
+        within the processors not used by running jobs. Launched runs are
+        removed from the pending list and added to the running dictionary,
+        and their index will be put on finishedQueue once they finish."""
+        usedProcs = sum([self._runProcs(modelSuite.runs[runI]) \
+            for runI in running])
+        for runI in list(pending):
+            modelRun = modelSuite.runs[runI]
+            nproc = self._runProcs(modelRun)
+            if usedProcs + nproc > self.maxProcs and \
+                    (len(running) > 0 or nproc <= self.maxProcs):
+                continue
+            if nproc > self.maxProcs:
+                print("Warning: run '%s' needs %d processors, more than the"\
+                    " %d allowed - running it on its own." \
+                    % (modelRun.name, nproc, self.maxProcs))
+            pending.remove(runI)
+            print("Doing run %d/%d (index %d), of name '%s':"\
+                % (runI+1, len(modelSuite.runs), runI, modelRun.name))
+            print("ModelRun description: \"%s\"" % \
+                (modelSuite.runDescrips[runI]))
+            print("Running the Model (saving results in %s):"\
+                % (modelRun.outputPath))
+            customOpts = modelSuite.getCustomOpts(runI, extraCmdLineOpts)
+            if writeRecords == True:
+                modelRun.writeInfoXML()
+            try:
+                jobMI = self.submitRun(modelRun, prefixStr, customOpts,
+                    dryRun, maxRunTime)
+            except ModelRunError as mre:
+                errors.append(mre)
+                return
+            if dryRun == True:
+                continue
+            running[runI] = (jobMI, None, False)
+            jobMI.addFinishCallback(
+                lambda jobMI, runI=runI: finishedQueue.put(runI))
+            usedProcs += nproc
+            if usedProcs >= self.maxProcs:
+                return
+
+    def _waitForFinished(self, modelSuite, running, finishedQueue):
+        """Wait until at least one running job has finished. Jobs that run
+        over their maximum run time are killed, in a separate thread so
+        others can still be launched and timed out meanwhile (see
+        :meth:`._startTimeOut`) - they count as finished once they've been
+        killed. Waits on jobs finishing, rather than polling them (though in
+        slices of at most WAIT_SLICE seconds, so the wait can be
+        interrupted).
+
+        :returns: a list of indices of the finished runs, whose entries in
+          the running dictionary are updated with their return code, and
+          whether they timed out."""
+        finished = []
+        while len(finished) == 0:
+            timeLeft = None
+            for runI, (jobMI, retCode, timeOut) in running.items():
+                if timeOut:
+                    # (being killed)
+                    continue
+                jobTimeLeft = self._timeLeft(jobMI,
+                    modelSuite.runs[runI].jobParams['maxRunTime'])
+                if jobTimeLeft is not None:
+                    timeLeft = jobTimeLeft if timeLeft is None \
+                        else min(timeLeft, jobTimeLeft)
+            wait = WAIT_SLICE
+            if timeLeft is not None:
+                wait = max(min(timeLeft, wait), 0)
+            runIs = []
+            try:
+                runIs.append(finishedQueue.get(timeout=wait))
+                while True:
+                    runIs.append(finishedQueue.get_nowait())
+            except Empty:
+                pass
+            for runI in runIs:
+                if runI not in running:
+                    continue
+                jobMI, retCode, timeOut = running[runI]
+                running[runI] = (jobMI, None if timeOut else jobMI.retCode,
+                    timeOut)
+                finished.append(runI)
+            for runI, (jobMI, retCode, timeOut) in list(running.items()):
+                maxRunTime = modelSuite.runs[runI].jobParams['maxRunTime']
+                jobTimeLeft = self._timeLeft(jobMI, maxRunTime)
+                if runI not in finished and not timeOut and \
+                        jobTimeLeft is not None and jobTimeLeft <= 0:
+                    running[runI] = (jobMI, None, True)
+                    self._startTimeOut(modelSuite.runs[runI], jobMI,
+                        maxRunTime)
+        return sorted(finished)
+
+    def _startTimeOut(self, modelRun, jobMI, maxRunTime):
+        """Start killing a job that has run too long (see
+        :meth:`._timeOutJob`), in a separate thread, as it can take up to
+        :attr:`.killGracePeriod`. The job finishes once it has been
+        killed."""
+        def timeOut():
+            print("Run '%s':" % modelRun.name, end=' ')
+            self._timeOutJob(jobMI, maxRunTime)
+        killer = threading.Thread(target=timeOut,
+            name="credo-timeout-%s" % modelRun.name)
+        killer.daemon = True
+        killer.start()
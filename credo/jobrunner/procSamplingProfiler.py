@@ -0,0 +1,333 @@
+from __future__ import print_function
+##  Copyright (C), 2010, Monash University
+##  Copyright (C), 2010, Victorian Partnership for Advanced Computing (VPAC)
+##
+##  This file is part of the CREDO library.
+##  Developed as part of the Simulation, Analysis, Modelling program of
+##  AuScope Limited, and funded by the Australian Federal Government's
+##  National Collaborative Research Infrastructure Strategy (NCRIS) program.
+##
+##  This library is free software; you can redistribute it and/or
+##  modify it under the terms of the GNU Lesser General Public
+##  License as published by the Free Software Foundation; either
+##  version 2.1 of the License, or (at your option) any later version.
+##
+##  This library is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##  Lesser General Public License for more details.
+##
+##  You should have received a copy of the GNU Lesser General Public
+##  License along with this library; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+##  MA  02110-1301  USA
+
+from builtins import object
+import os
+import csv
+import time
+import threading
+from credo.jobrunner.api import PerformanceProfiler
+
+"""A module for profiling how the resource use of ModelRuns evolves while
+they run, by sampling the Linux `/proc` filesystem.
+
+At a regular interval, the `stat`, `status` and `io` files of the job's
+launched process and all its descendants (e.g. mpiexec, and all the MPI
+ranks it starts) are read. The samples are saved as a time series in the
+run's output directory (see :data:`TIMELINE_FILENAME`), and a summary -
+peak resident set size (RSS), CPU utilisation and bytes read and written by
+each MPI rank, and totals for the whole process tree - is attached to the
+job's performance info.
+
+The rank of a process is taken from the rank environment variable set by
+the MPI launcher (see :data:`RANK_ENV_VARS`). If no process has one, the
+run is assumed to be serial, and the launched process is treated as rank 0.
+
+.. note:: only works on Linux (or other systems with a Linux-style `/proc`),
+   with a job runner that runs jobs locally and records their process
+   handles (i.e. :class:`~credo.jobrunner.simplejobrunner.SimpleJobRunner`
+   and its sub-classes).
+
+   Since processes are sampled, the peak RSS recorded may be less than the
+   true peak, and the resource use of processes that live for less than
+   one sampling interval may be missed. See
+   :class:`~credo.jobrunner.rusageProfiler.RusageProfiler` for exact totals.
+"""
+
+#: Default interval between samples, in seconds.
+DEFAULT_SAMPLE_INTERVAL = 0.5
+#: Name of the file the time series of samples is saved to, in the run's
+#: output directory.
+TIMELINE_FILENAME = "procTimeline.csv"
+#: Environment variables MPI launchers use to give each process its rank,
+#: in the order they're checked.
+RANK_ENV_VARS = ["OMPI_COMM_WORLD_RANK", "PMI_RANK", "PMIX_RANK",
+    "SLURM_PROCID"]
+#: Columns of the time series file. Times are in seconds since the job
+#: started, sizes in bytes. rank is -1 for processes that aren't MPI ranks.
+TIMELINE_COLUMNS = ["time", "pid", "rank", "cpuTime", "rss", "readBytes",
+    "writeBytes"]
+
+PROC_PATH = "/proc"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+def procAvailable():
+    """Return whether the `/proc` filesystem can be used for sampling."""
+    return os.path.exists(os.path.join(PROC_PATH, "self", "stat"))
+
+def _readProcFile(pid, name, mode="r"):
+    with open(os.path.join(PROC_PATH, str(pid), name), mode) as f:
+        return f.read()
+
+def readProcStat(pid):
+    """Return the parent pid, and user+system CPU time (in seconds), of
+    process pid, from its `/proc/<pid>/stat` file."""
+    stat = _readProcFile(pid, "stat")
+    # The command name (2nd field) may include spaces, so split after it.
+    fields = stat[stat.rindex(")") + 2:].split()
+    ppid = int(fields[1])
+    cpuTime = (int(fields[11]) + int(fields[12])) / float(CLOCK_TICKS)
+    return ppid, cpuTime
+
+def readProcRSS(pid):
+    """Return the resident set size of process pid in bytes, from its
+    `/proc/<pid>/status` file (0 if it isn't listed, e.g. for zombies)."""
+    for line in _readProcFile(pid, "status").splitlines():
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1]) * 1024
+    return 0
+
+def readProcIO(pid):
+    """Return the bytes read and written by process pid (through read and
+    write system calls, whether or not they reached storage), from its
+    `/proc/<pid>/io` file. Returns (0, 0) if these can't be read."""
+    try:
+        ioDict = {}
+        for line in _readProcFile(pid, "io").splitlines():
+            key, val = line.split(":")
+            ioDict[key] = int(val)
+        return ioDict.get("rchar", 0), ioDict.get("wchar", 0)
+    except (IOError, OSError, ValueError):
+        return 0, 0
+
+def readProcRank(pid):
+    """Return the MPI rank of process pid, from the rank environment
+    variables (see :data:`RANK_ENV_VARS`) it was started with, or None if
+    it doesn't have one."""
+    try:
+        environ = _readProcFile(pid, "environ", "rb")
+    except (IOError, OSError):
+        return None
+    envDict = {}
+    for entry in environ.split(b"\0"):
+        key, sep, val = entry.partition(b"=")
+        if sep:
+            envDict[key.decode("utf-8", "replace")] = val
+    for var in RANK_ENV_VARS:
+        if var in envDict:
+            try:
+                return int(envDict[var])
+            except ValueError:
+                pass
+    return None
+
+def findDescendants(rootPid):
+    """Return a list of rootPid and the pids of all its descendants (that are
+    currently running), found by scanning `/proc`."""
+    children = {}
+    for entry in os.listdir(PROC_PATH):
+        if not entry.isdigit():
+            continue
+        try:
+            ppid = readProcStat(entry)[0]
+        except (IOError, OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids = [rootPid]
+    i = 0
+    while i < len(pids):
+        pids.extend(children.get(pids[i], []))
+        i += 1
+    return pids
+
+class ProcSample(object):
+    """The latest state of one process seen while sampling a job."""
+    def __init__(self, pid, rank, startTime):
+        self.pid = pid
+        self.rank = rank
+        self.startTime = startTime
+        self.lastTime = startTime
+        self.firstCpuTime = None
+        self.cpuTime = 0.0
+        self.rss = 0
+        self.peakRSS = 0
+        self.readBytes = 0
+        self.writeBytes = 0
+
+class ProcSamplingHandle(object):
+    """Per-job state of the :class:`ProcSamplingProfiler`."""
+    def __init__(self, timelineFilename):
+        self.timelineFilename = timelineFilename
+        self.rows = []
+        self.procs = {}
+        self.peakTotalRSS = 0
+        self.startTime = None
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+class ProcSamplingProfiler(PerformanceProfiler):
+    """Profiler that samples the resource use of the whole process tree of a
+    job, in a background thread, while it runs. See the module documentation
+    for details.
+
+    This isn't one of the default profilers of any job runner, since it's
+    more expensive than them - add it to a job runner's profilers to use it,
+    e.g.::
+
+        jobRunner.profilers.append(ProcSamplingProfiler(interval=0.2))
+
+    The summary attached to each job's performance info includes, for each
+    rank N, `rankN_peakRSS` (bytes), `rankN_cpuUtilisation` (the fraction of
+    one processor used, on average, while the process was running),
+    `rankN_readBytes` and `rankN_writeBytes`, plus totals over all the
+    processes sampled: `peakRSS` (the largest total RSS of any sample),
+    `cpuTime`, `readBytes`, `writeBytes`, `nProcs` and `nSamples`.
+
+    .. attribute:: interval
+
+       Interval between samples, in seconds.
+    """
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        PerformanceProfiler.__init__(self, "ProcSampling")
+        self.interval = interval
+
+    def setup(self, modelName, modelBasePath, modelOutputPath, jobMetaInfo):
+        timelineFilename = os.path.join(modelBasePath, modelOutputPath,
+            TIMELINE_FILENAME)
+        jobMetaInfo.profilerHandles[self.typeStr] = ProcSamplingHandle(
+            timelineFilename)
+
+    def modifyRun(self, modelRun, oldModelRunCommand, jobMetaInfo):
+        return oldModelRunCommand
+
+    def startTimer(self, jobMetaInfo=None):
+        if jobMetaInfo is None or not procAvailable():
+            return
+        h = jobMetaInfo.profilerHandles.get(self.typeStr)
+        if h is None:
+            return
+        h.startTime = time.time()
+        h.thread = threading.Thread(target=self._sampleLoop,
+            args=(jobMetaInfo, h), name="credo-proc-sampler")
+        h.thread.daemon = True
+        h.thread.start()
+
+    def stopTimer(self, jobMetaInfo=None):
+        if jobMetaInfo is None:
+            return
+        h = jobMetaInfo.profilerHandles.get(self.typeStr)
+        if h is None or h.thread is None:
+            return
+        h.stopEvent.set()
+        h.thread.join()
+        h.thread = None
+        self._writeTimeline(h)
+
+    def _sampleLoop(self, jobMetaInfo, h):
+        # The job's process is started just after the timer, so wait for it.
+        while not h.stopEvent.is_set():
+            procHandle = getattr(jobMetaInfo, "procHandle", None)
+            if procHandle is not None:
+                self.sample(procHandle.pid, h)
+            h.stopEvent.wait(self.interval)
+
+    def sample(self, rootPid, h):
+        """Take one sample of the process tree of rootPid, adding it to the
+        handle h."""
+        now = time.time()
+        sampleTime = now - h.startTime
+        totalRSS = 0
+        for pid in findDescendants(rootPid):
+            try:
+                cpuTime = readProcStat(pid)[1]
+                rss = readProcRSS(pid)
+            except (IOError, OSError, ValueError, IndexError):
+                # The process exited while being sampled.
+                continue
+            readBytes, writeBytes = readProcIO(pid)
+            proc = h.procs.get(pid)
+            if proc is None:
+                proc = ProcSample(pid, readProcRank(pid), now)
+                h.procs[pid] = proc
+            if proc.firstCpuTime is None:
+                proc.firstCpuTime = cpuTime
+            proc.lastTime = now
+            proc.cpuTime = cpuTime
+            proc.rss = rss
+            proc.peakRSS = max(proc.peakRSS, rss)
+            proc.readBytes = readBytes
+            proc.writeBytes = writeBytes
+            totalRSS += rss
+            rank = -1 if proc.rank is None else proc.rank
+            h.rows.append(["%.3f" % sampleTime, pid, rank, "%.2f" % cpuTime,
+                rss, readBytes, writeBytes])
+        h.peakTotalRSS = max(h.peakTotalRSS, totalRSS)
+
+    def _writeTimeline(self, h):
+        outDir = os.path.dirname(h.timelineFilename)
+        if not os.path.exists(outDir):
+            os.makedirs(outDir)
+        with open(h.timelineFilename, "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(TIMELINE_COLUMNS)
+            writer.writerows(h.rows)
+
+    def _rankProcs(self, rootPid, h):
+        """Return a dictionary of the sampled processes of each rank."""
+        ranks = {}
+        for proc in h.procs.values():
+            if proc.rank is not None:
+                ranks.setdefault(proc.rank, []).append(proc)
+        if not ranks and rootPid in h.procs:
+            # Assume a serial run.
+            ranks[0] = [h.procs[rootPid]]
+        return ranks
+
+    def _cpuUtilisation(self, procs, h):
+        """Return the average fraction of a processor used by procs, over
+        the time they were sampled."""
+        cpuTime = sum(p.cpuTime - p.firstCpuTime for p in procs)
+        runTime = sum(p.lastTime - p.startTime for p in procs)
+        if runTime <= 0:
+            # Only sampled once: use the time since the job started.
+            cpuTime = sum(p.cpuTime for p in procs)
+            runTime = max(p.lastTime for p in procs) - h.startTime
+        return cpuTime / runTime if runTime > 0 else 0.0
+
+    def attachPerformanceInfo(self, jobMetaInfo, modelResult):
+        h = jobMetaInfo.profilerHandles.get(self.typeStr)
+        if h is None or h.startTime is None:
+            return
+        procs = list(h.procs.values())
+        resDict = {
+            'peakRSS': h.peakTotalRSS,
+            'cpuTime': sum(p.cpuTime for p in procs),
+            'readBytes': sum(p.readBytes for p in procs),
+            'writeBytes': sum(p.writeBytes for p in procs),
+            'nProcs': len(procs),
+            'nSamples': len(set(row[0] for row in h.rows)),
+            }
+        rootPid = jobMetaInfo.procHandle.pid
+        for rank, rankProcs in sorted(self._rankProcs(rootPid, h).items()):
+            # A rank may be several processes, e.g. if it's started through
+            #  a wrapper script.
+            prefix = "rank%d_" % rank
+            resDict[prefix + 'peakRSS'] = max(p.peakRSS for p in rankProcs)
+            resDict[prefix + 'cpuUtilisation'] = self._cpuUtilisation(
+                rankProcs, h)
+            resDict[prefix + 'readBytes'] = sum(p.readBytes
+                for p in rankProcs)
+            resDict[prefix + 'writeBytes'] = sum(p.writeBytes
+                for p in rankProcs)
+        jobMetaInfo.performance[self.typeStr] = resDict
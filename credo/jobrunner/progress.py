@@ -0,0 +1,479 @@
+from __future__ import print_function
+##  Copyright (C), 2010, Monash University
+##  Copyright (C), 2010, Victorian Partnership for Advanced Computing (VPAC)
+##
+##  This file is part of the CREDO library.
+##  Developed as part of the Simulation, Analysis, Modelling program of
+##  AuScope Limited, and funded by the Australian Federal Government's
+##  National Collaborative Research Infrastructure Strategy (NCRIS) program.
+##
+##  This library is free software; you can redistribute it and/or
+##  modify it under the terms of the GNU Lesser General Public
+##  License as published by the Free Software Foundation; either
+##  version 2.1 of the License, or (at your option) any later version.
+##
+##  This library is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##  Lesser General Public License for more details.
+##
+##  You should have received a copy of the GNU Lesser General Public
+##  License along with this library; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+##  MA  02110-1301  USA
+
+
+"""Reporting of the progress of model runs as they run, with estimates of
+how long each run, and the suite as a whole, has left to go.
+
+A :class:`ProgressReporter` is given to a job runner (see its
+progressReporter attribute). While a suite is running it regularly works
+out, for each running model:
+
+* the simulated time it has reached - from its progress log, as parsed by
+  its progress parser (see
+  :meth:`credo.modelrun.ModelRun.createProgressParser`, e.g. the time steps
+  in the Waiwera YAML log), or else from the outputs it has written so far
+  (see :meth:`credo.modelrun.ModelRun.readSimTime`, e.g. the h5 `time`
+  dataset for Waiwera, or the FrequentOutput.dat file for Underworld).
+* how far that is through the model's simulated time (see
+  :meth:`credo.modelrun.ModelRun.getSimTimeLimits`, e.g. the stop time in
+  the Waiwera input JSON).
+* the walltime it has left: extrapolated from its progress so far, and
+  from the walltimes of past runs of the same model, if a
+  :class:`~credo.jobrunner.walltimehistory.WalltimeHistory` is available
+  (see :meth:`RunProgress.remainingWalltime`).
+
+From these, and the past walltimes of runs yet to be launched, an
+estimate of the time until the whole suite finishes is made.
+
+The progress is printed to the console, and written to a JSON status file
+(replaced atomically each time, so it can be polled by e.g. a dashboard),
+of the form::
+
+    {"updated": "2026-01-01T12:00:00", "timestamp": 1767225600.0,
+     "suite": {"numRuns": 3, "numComplete": 1, "numFailed": 0,
+               "numRunning": 1, "numPending": 1, "elapsed": 120.0,
+               "eta": 310.5},
+     "runs": [{"index": 0, "name": "run1", "state": "complete", ...},
+              {"index": 1, "name": "run2", "state": "running",
+               "nproc": 1, "simTime": 1.0e7, "startTime": 0.0,
+               "stopTime": 2.0e7, "fraction": 0.5, "elapsed": 60.0,
+               "predictedWalltime": 130.0, "eta": 65.0}, ...]}
+
+Times are in seconds, and estimates that can't be made are null.
+
+.. note:: only job runners that run jobs locally (i.e.
+   :class:`~credo.jobrunner.simplejobrunner.SimpleJobRunner` and its
+   sub-classes) support progress reporting.
+"""
+from builtins import object
+
+import os
+import json
+import time
+import tempfile
+import threading
+from datetime import datetime
+
+from credo.jobrunner.runmonitor import LogTailer, jobStartTime
+from credo.jobrunner.runcache import suiteRunFingerprint
+from credo.utils import monotonicTime, replaceFile
+
+#: Default interval between progress reports, in seconds.
+DEFAULT_REPORT_INTERVAL = 10.0
+
+def formatDuration(seconds):
+    """Returns a duration in seconds as a short string, e.g. '1h02m05s', or
+    'unknown' if seconds is None."""
+    if seconds is None:
+        return "unknown"
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours > 0:
+        return "%dh%02dm%02ds" % (hours, minutes, secs)
+    elif minutes > 0:
+        return "%dm%02ds" % (minutes, secs)
+    return "%ds" % secs
+
+class RunProgress(object):
+    """The progress of a single run of a suite (see
+    :class:`ProgressReporter`).
+
+    .. attribute:: state
+
+       One of 'pending', 'running', 'complete' or 'failed'.
+
+    .. attribute:: simTime
+
+       Simulated time the run has reached, if known.
+
+    .. attribute:: predictedWalltime
+
+       Walltime (in seconds) the run is expected to take, from past runs,
+       if known.
+    """
+    def __init__(self, index, modelRun, predictedWalltime=None):
+        self.index = index
+        self.modelRun = modelRun
+        self.predictedWalltime = predictedWalltime
+        self.state = 'pending'
+        self.simTime = None
+        self.simTimeLimits = None
+        self.cacheHit = False
+        self.startClock = None
+        self.finishClock = None
+        self._tailer = None
+        self._parser = None
+        self._parsedTime = False
+
+    def start(self, jobMetaInfo):
+        """Record that the run has been launched, with the given job."""
+        modelRun = self.modelRun
+        self.state = 'running'
+        self.startClock = monotonicTime()
+        self.simTimeLimits = modelRun.getSimTimeLimits()
+        self._parser = modelRun.createProgressParser()
+        if self._parser is not None:
+            logFilename = modelRun.getProgressLogFilename()
+            if logFilename is None:
+                logFilename = modelRun.getStdOutFilename()
+            self._tailer = LogTailer(os.path.join(modelRun.basePath,
+                logFilename), jobStartTime(jobMetaInfo))
+
+    def finish(self, jobMetaInfo):
+        """Record that the job of the run has finished."""
+        self.finishClock = monotonicTime()
+        self.cacheHit = jobMetaInfo.cacheHit
+        if jobMetaInfo.retCode == 0 and not jobMetaInfo.killed:
+            self.state = 'complete'
+        else:
+            self.state = 'failed'
+
+    def update(self):
+        """Read the simulated time the run has reached, from the lines
+        logged since the last update (or else its outputs)."""
+        if self.state != 'running':
+            return
+        if self._tailer is not None:
+            for line in self._tailer.readLines():
+                event = self._parser.parseLine(line)
+                if event is not None and event[0] == 'step':
+                    self.simTime = event[1]['time']
+                    self._parsedTime = True
+        if not self._parsedTime:
+            simTime = self.modelRun.readSimTime()
+            if simTime is not None:
+                self.simTime = simTime
+
+    def fraction(self):
+        """Fraction (from 0 to 1) of the model's simulated time the run has
+        got through, or None if not known."""
+        if self.state == 'complete':
+            return 1.0
+        if self.simTime is None or self.simTimeLimits is None:
+            return None
+        start, stop = self.simTimeLimits
+        if stop <= start:
+            return None
+        return min(max((self.simTime - start) / (stop - start), 0.0), 1.0)
+
+    def elapsed(self, now):
+        """Walltime the run has been running for (in seconds)."""
+        if self.startClock is None:
+            return 0.0
+        if self.finishClock is not None:
+            now = self.finishClock
+        return now - self.startClock
+
+    def remainingWalltime(self, now):
+        """Estimate of the walltime (in seconds) the run has left, or None if
+        it can't be estimated.
+
+        For a running run, its progress so far is extrapolated (assuming the
+        simulated time keeps advancing at the same average rate), and the
+        predicted walltime from past runs less the time it has been running
+        is used. If both are available, they are combined weighting the
+        extrapolation by the fraction of the run done (so the past runs
+        count most at the start, when extrapolating is least reliable).
+        A pending run is expected to take its predicted walltime."""
+        if self.state in ('complete', 'failed'):
+            return 0.0
+        if self.state == 'pending':
+            return self.predictedWalltime
+        elapsed = self.elapsed(now)
+        fraction = self.fraction()
+        fromProgress = None
+        if fraction is not None and fraction > 0:
+            fromProgress = elapsed * (1.0 - fraction) / fraction
+        fromHistory = None
+        if self.predictedWalltime is not None:
+            fromHistory = max(self.predictedWalltime - elapsed, 0.0)
+        if fromProgress is None:
+            return fromHistory
+        if fromHistory is None:
+            return fromProgress
+        return fraction * fromProgress + (1.0 - fraction) * fromHistory
+
+    def statusDict(self, now):
+        """Returns the progress of the run as a dictionary (for the status
+        file)."""
+        limits = self.simTimeLimits or (None, None)
+        return {
+            'index': self.index,
+            'name': self.modelRun.name,
+            'state': self.state,
+            'cacheHit': self.cacheHit,
+            'nproc': self.modelRun.jobParams['nproc'],
+            'simTime': self.simTime,
+            'startTime': limits[0],
+            'stopTime': limits[1],
+            'fraction': self.fraction(),
+            'elapsed': self.elapsed(now),
+            'predictedWalltime': self.predictedWalltime,
+            'eta': self.remainingWalltime(now),
+            }
+
+class ProgressReporter(object):
+    """Reports the progress of the runs of a job runner, as they run. E.g.
+    to print the progress of a suite every 30 seconds, and keep a status
+    file up to date for a dashboard::
+
+        reporter = ProgressReporter(statusFilename="suiteStatus.json",
+            interval=30)
+        jobRunner = PooledJobRunner(progressReporter=reporter)
+
+    .. attribute:: statusFilename
+
+       JSON file the progress is written to (see
+       :mod:`credo.jobrunner.progress`), if not None.
+
+    .. attribute:: interval
+
+       Interval between reports, in seconds.
+
+    .. attribute:: console
+
+       Whether to print the progress to std out.
+
+    .. attribute:: walltimeHistory
+
+       A :class:`~credo.jobrunner.walltimehistory.WalltimeHistory` the
+       walltimes of runs are predicted from. If None, that of the job
+       runner (if it keeps one) is used. The reporter only reads the
+       history - recording walltimes in it is up to the job runner.
+    """
+    def __init__(self, statusFilename=None, interval=DEFAULT_REPORT_INTERVAL,
+            console=True, walltimeHistory=None):
+        self.statusFilename = statusFilename
+        self.interval = interval
+        self.console = console
+        self.walltimeHistory = walltimeHistory
+        self.runs = []
+        self.maxProcs = None
+        self._suite = None
+        self._suiteStart = None
+        self._lock = threading.RLock()
+        self._stopEvent = threading.Event()
+        self._thread = None
+
+    def startSuite(self, modelSuite, extraCmdLineOpts=None, maxProcs=None,
+            walltimeHistory=None, fingerprints=None):
+        """Start reporting on the runs of a suite, all pending to begin with.
+
+        :keyword maxProcs: the total number of processors runs are run on at
+          once, or None if they are run one after another.
+        :keyword walltimeHistory: the job runner's walltime history (used if
+          the reporter doesn't have its own).
+        :keyword fingerprints: the fingerprints of the suite's runs, if
+          already worked out (see
+          :func:`~credo.jobrunner.runcache.suiteRunFingerprint`)."""
+        history = self.walltimeHistory
+        if history is None:
+            history = walltimeHistory
+        runs = []
+        for runI, modelRun in enumerate(modelSuite.runs):
+            predicted = None
+            if history is not None:
+                if fingerprints is not None:
+                    fingerprint = fingerprints[runI]
+                else:
+                    fingerprint = suiteRunFingerprint(modelSuite, runI,
+                        extraCmdLineOpts)
+                predicted = history.predictWalltime(fingerprint, modelRun)
+            runs.append(RunProgress(runI, modelRun, predicted))
+        with self._lock:
+            self.runs = runs
+            self.maxProcs = maxProcs
+            self._suite = modelSuite
+            self._suiteStart = monotonicTime()
+        self._startThread()
+
+    def finishSuite(self):
+        """Stop reporting on the suite, after a final report."""
+        self._stopEvent.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.report()
+        with self._lock:
+            self._suite = None
+
+    def runStarted(self, modelRun, jobMetaInfo):
+        """Record that modelRun has been launched, as the given job (a
+        :class:`~credo.jobrunner.simplejobrunner.SimpleJobMetaInfo`)."""
+        with self._lock:
+            runProgress = None
+            for rp in self.runs:
+                if rp.modelRun is modelRun and rp.state == 'pending':
+                    runProgress = rp
+                    break
+            if runProgress is None:
+                # A single run, not part of the suite (if any).
+                if self._suite is None:
+                    self.runs = [rp for rp in self.runs
+                        if rp.state == 'running']
+                runProgress = RunProgress(len(self.runs), modelRun)
+                self.runs.append(runProgress)
+            runProgress.start(jobMetaInfo)
+        jobMetaInfo.addFinishCallback(
+            lambda jobMI: self._runFinished(runProgress, jobMI))
+        if self._suite is None:
+            self._startThread()
+
+    def _runFinished(self, runProgress, jobMetaInfo):
+        with self._lock:
+            runProgress.finish(jobMetaInfo)
+            # Keep the status file up to date with finished runs.
+            self.writeStatusFile()
+
+    def _startThread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopEvent.clear()
+        def reportLoop():
+            while not self._stopEvent.wait(self.interval):
+                self.report()
+                if self._suite is None and len(self.getRunning()) == 0:
+                    return
+        self._thread = threading.Thread(target=reportLoop,
+            name="credo-progress")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def getRunning(self):
+        """Returns the :class:`RunProgress` of each running run."""
+        with self._lock:
+            return [rp for rp in self.runs if rp.state == 'running']
+
+    def update(self):
+        """Update the simulated times of the running runs."""
+        for runProgress in self.getRunning():
+            runProgress.update()
+
+    def suiteRemainingWalltime(self, now=None):
+        """Estimate of the walltime (in seconds) until all the runs have
+        finished, or None if it can't be estimated (i.e. the walltime of a
+        running or pending run can't).
+
+        Runs run one after another take the sum of their remaining
+        walltimes. Runs run concurrently (within :attr:`.maxProcs`
+        processors) are assumed to keep all processors busy, so take their
+        total remaining processor time divided by the processors - but at
+        least as long as the longest running run has left."""
+        if now is None:
+            now = monotonicTime()
+        with self._lock:
+            remaining = []
+            for rp in self.runs:
+                if rp.state not in ('running', 'pending'):
+                    continue
+                walltime = rp.remainingWalltime(now)
+                if walltime is None:
+                    return None
+                remaining.append((rp, walltime))
+        if self.maxProcs is None:
+            return sum([walltime for rp, walltime in remaining])
+        procTime = sum([walltime * rp.modelRun.jobParams['nproc']
+            for rp, walltime in remaining])
+        longest = max([walltime for rp, walltime in remaining
+            if rp.state == 'running'] + [0.0])
+        return max(procTime / float(self.maxProcs), longest)
+
+    def statusDict(self, now=None):
+        """Returns the progress of the suite and each run as a dictionary
+        (as saved in the status file)."""
+        if now is None:
+            now = monotonicTime()
+        with self._lock:
+            states = [rp.state for rp in self.runs]
+            suiteElapsed = None
+            if self._suiteStart is not None:
+                suiteElapsed = now - self._suiteStart
+            return {
+                'updated': datetime.now().isoformat(),
+                'timestamp': time.time(),
+                'suite': {
+                    'numRuns': len(self.runs),
+                    'numComplete': states.count('complete'),
+                    'numFailed': states.count('failed'),
+                    'numRunning': states.count('running'),
+                    'numPending': states.count('pending'),
+                    'elapsed': suiteElapsed,
+                    'eta': self.suiteRemainingWalltime(now),
+                    },
+                'runs': [rp.statusDict(now) for rp in self.runs],
+                }
+
+    def writeStatusFile(self, status=None):
+        """Write the status (by default, the current one) to the
+        :attr:`.statusFilename`, replacing it atomically."""
+        if self.statusFilename is None:
+            return
+        if status is None:
+            status = self.statusDict()
+        dirName = os.path.dirname(os.path.abspath(self.statusFilename))
+        if not os.path.exists(dirName):
+            os.makedirs(dirName)
+        fd, tmpName = tempfile.mkstemp(dir=dirName, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(status, f, indent=1, sort_keys=True)
+            replaceFile(tmpName, self.statusFilename)
+        except:
+            if os.path.exists(tmpName):
+                os.remove(tmpName)
+            raise
+
+    def report(self):
+        """Update the progress of the running runs, and report it."""
+        self.update()
+        with self._lock:
+            status = self.statusDict()
+            self.writeStatusFile(status)
+        if self.console:
+            print(self.formatStatus(status))
+
+    def formatStatus(self, status):
+        """Returns a status dictionary (see :meth:`.statusDict`) as lines of
+        text, for the console."""
+        suite = status['suite']
+        lines = ["Progress: %d/%d runs complete (%d failed), %d running,"\
+            " suite ETA %s" % (suite['numComplete'] + suite['numFailed'],
+                suite['numRuns'], suite['numFailed'], suite['numRunning'],
+                formatDuration(suite['eta']))]
+        for run in status['runs']:
+            if run['state'] != 'running':
+                continue
+            if run['fraction'] is not None:
+                done = "%.1f%% (time %g of %g)" % (100.0 * run['fraction'],
+                    run['simTime'], run['stopTime'])
+            elif run['simTime'] is not None:
+                done = "time %g" % run['simTime']
+            else:
+                done = "starting"
+            lines.append("  '%s': %s, elapsed %s, ETA %s" % (run['name'],
+                done, formatDuration(run['elapsed']),
+                formatDuration(run['eta'])))
+        return "\n".join(lines)
@@ -0,0 +1,288 @@
+from __future__ import print_function
+##  Copyright (C), 2010, Monash University
+##  Copyright (C), 2010, Victorian Partnership for Advanced Computing (VPAC)
+##
+##  This file is part of the CREDO library.
+##  Developed as part of the Simulation, Analysis, Modelling program of
+##  AuScope Limited, and funded by the Australian Federal Government's
+##  National Collaborative Research Infrastructure Strategy (NCRIS) program.
+##
+##  This library is free software; you can redistribute it and/or
+##  modify it under the terms of the GNU Lesser General Public
+##  License as published by the Free Software Foundation; either
+##  version 2.1 of the License, or (at your option) any later version.
+##
+##  This library is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##  Lesser General Public License for more details.
+##
+##  You should have received a copy of the GNU Lesser General Public
+##  License along with this library; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+##  MA  02110-1301  USA
+
+"""A cache of the outputs of ModelRuns, so that runs whose inputs haven't
+changed since they were last run don't need to be run again.
+
+Runs are identified by a "fingerprint" (see :func:`runFingerprint`): a hash
+of the contents of all the model's input files (as given by
+:meth:`credo.modelrun.ModelRun.getInputFilenames`), the simulator
+executable, the number of processors and the full command line used to run
+it.
+
+To use, set the `runCache` attribute of a
+:class:`~credo.jobrunner.simplejobrunner.SimpleJobRunner` (or pass it to the
+constructor) to a :class:`RunCache`.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from credo.utils import findExecutable
+
+# Default maximum total size of a run cache: 10 GB
+DEFAULT_MAX_BYTES = 10 * 1024**3
+
+ENTRY_INFO_FILENAME = "entry.json"
+ENTRY_FILES_DIR = "files"
+
+_fileHashes = {}
+_fileHashesLock = threading.Lock()
+
+def fileHash(filename):
+    """Returns a (sha256) hash of the contents of a file, as a hex string.
+    Hashes are remembered while the file's size and modification time are
+    unchanged, so large files (e.g. simulator executables) are only read
+    once."""
+    absFilename = os.path.realpath(filename)
+    st = os.stat(absFilename)
+    key = (absFilename, st.st_size, st.st_mtime)
+    with _fileHashesLock:
+        if key in _fileHashes:
+            return _fileHashes[key]
+    h = hashlib.sha256()
+    with open(absFilename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _fileHashesLock:
+        _fileHashes[key] = digest
+    return digest
+
+def executableHash(command):
+    """Returns a hash of the executable that running command (a program name
+    or path) would use. If it can't be found, the command itself is
+    returned."""
+    if command is None:
+        return ""
+    exePath = findExecutable(command)
+    if exePath is None and os.path.isfile(command):
+        exePath = command
+    if exePath is None:
+        return command
+    return fileHash(exePath)
+
+def runFingerprint(modelRun, runCommand):
+    """Returns a fingerprint (a hex string) identifying all the inputs of a
+    ModelRun, if run with the given command line. Runs with the same
+    fingerprint should produce the same results.
+
+    :returns: the fingerprint, or None if the ModelRun can't say what its
+      inputs are (see :meth:`credo.modelrun.ModelRun.getInputFilenames`), or
+      some of these are missing."""
+    inputFilenames = modelRun.getInputFilenames()
+    if inputFilenames is None:
+        return None
+    h = hashlib.sha256()
+    def add(name, value):
+        h.update(("%s=%s\n" % (name, value)).encode('utf-8'))
+    add('modelRun', modelRun.__class__.__name__)
+    add('runCommand', runCommand)
+    add('nproc', modelRun.jobParams['nproc'])
+    add('simulator', executableHash(modelRun.getSimulatorExecutable()))
+    # Some models are given input via stdin (see
+    #  credo.modelrun.ModelRun.getStdInFilename())
+    stdInFilename = modelRun.getStdInFilename()
+    if os.path.isfile(stdInFilename):
+        add('stdin', fileHash(stdInFilename))
+    for fname in sorted(set(inputFilenames)):
+        try:
+            add('input:%s' % fname,
+                fileHash(os.path.join(modelRun.basePath, fname)))
+        except (IOError, OSError):
+            return None
+    return h.hexdigest()
+
+def suiteRunFingerprint(modelSuite, runI, extraCmdLineOpts=None):
+    """Returns a fingerprint (as for :func:`runFingerprint`) for run runI of
+    a :class:`~credo.modelsuite.ModelSuite`, that can be worked out before
+    the run is prepared: the command line options it will be given by the
+    suite are used instead of its full command line (which for some
+    ModelRuns is only known just before running)."""
+    customOpts = modelSuite.getCustomOpts(runI, extraCmdLineOpts)
+    return runFingerprint(modelSuite.runs[runI], "customOpts=%s" % customOpts)
+
+def runOutputFilenames(modelRun):
+    """Returns the absolute filenames of all the outputs of a completed
+    ModelRun that need to be kept for its results to be re-created: all
+    files in its output path, its log files, and any other output files it
+    specifies (see :meth:`credo.modelrun.ModelRun.getOutputFilenames`).
+    Input files are not included."""
+    basePath = modelRun.basePath
+    absOutputPath = os.path.join(basePath, modelRun.outputPath)
+    filenames = []
+    if os.path.isdir(absOutputPath):
+        # Sub-directories aren't included, as they may be other runs' outputs
+        filenames += [os.path.join(absOutputPath, f) for f in
+            sorted(os.listdir(absOutputPath))]
+    filenames += [os.path.join(basePath, f) for f in
+        [modelRun.getStdOutFilename(), modelRun.getStdErrFilename()] +
+        modelRun.getOutputFilenames()]
+    inputFilenames = [os.path.realpath(os.path.join(basePath, f)) for f in
+        modelRun.getInputFilenames() or []]
+    outFilenames = []
+    for fname in filenames:
+        fname = os.path.normpath(fname)
+        if os.path.isfile(fname) and fname not in outFilenames and \
+                os.path.realpath(fname) not in inputFilenames:
+            outFilenames.append(fname)
+    return outFilenames
+
+class RunCache(object):
+    """A cache of the outputs of ModelRuns, in a directory, keyed by the
+    fingerprint of the runs (see :func:`runFingerprint`).
+
+    Each entry is a sub-directory named by the fingerprint, holding copies
+    of the run's output files, and an info file recording where these belong
+    and the performance info of the original run. When the total size of
+    the cache goes over :attr:`.maxBytes`, the least recently used entries
+    are removed.
+
+    .. attribute:: cacheDir
+
+       Directory the cache is stored in.
+
+    .. attribute:: maxBytes
+
+       Maximum total size (in bytes) of the output files in the cache.
+    """
+    def __init__(self, cacheDir, maxBytes=DEFAULT_MAX_BYTES):
+        self.cacheDir = os.path.abspath(cacheDir)
+        self.maxBytes = maxBytes
+        self._lock = threading.Lock()
+        if not os.path.exists(self.cacheDir):
+            os.makedirs(self.cacheDir)
+
+    def _entryDir(self, fingerprint):
+        return os.path.join(self.cacheDir, fingerprint)
+
+    def _readEntryInfo(self, entryDir):
+        with open(os.path.join(entryDir, ENTRY_INFO_FILENAME)) as f:
+            return json.load(f)
+
+    def __contains__(self, fingerprint):
+        return os.path.isfile(os.path.join(self._entryDir(fingerprint),
+            ENTRY_INFO_FILENAME))
+
+    def restore(self, fingerprint, modelRun):
+        """If there's an entry for the fingerprint, copy its output files
+        back to where modelRun will expect them.
+
+        :returns: the performance info of the original run (a dictionary,
+          as for :attr:`credo.jobrunner.api.JobMetaInfo.performance`), or
+          None if the fingerprint isn't in the cache."""
+        entryDir = self._entryDir(fingerprint)
+        with self._lock:
+            try:
+                info = self._readEntryInfo(entryDir)
+            except (IOError, OSError, ValueError):
+                return None
+            # Mark as recently used
+            os.utime(entryDir, None)
+        for storedName, relName in info['files']:
+            dest = os.path.join(modelRun.basePath, relName)
+            destDir = os.path.dirname(dest)
+            if not os.path.exists(destDir):
+                os.makedirs(destDir)
+            shutil.copy2(os.path.join(entryDir, ENTRY_FILES_DIR, storedName),
+                dest)
+        return info['performance']
+
+    def store(self, fingerprint, modelRun, performance):
+        """Save copies of the output files of a completed modelRun in the
+        cache, along with its performance info. Then remove least recently
+        used entries if the cache is over its size limit."""
+        filenames = runOutputFilenames(modelRun)
+        size = sum([os.path.getsize(f) for f in filenames])
+        if size > self.maxBytes:
+            print("Not caching run '%s': its outputs (%d bytes) are bigger"\
+                " than the whole cache." % (modelRun.name, size))
+            return
+        # Build the entry in a temporary directory first, so a partly
+        #  written entry is never seen.
+        tmpDir = tempfile.mkdtemp(dir=self.cacheDir, prefix=".tmp-")
+        try:
+            os.mkdir(os.path.join(tmpDir, ENTRY_FILES_DIR))
+            files = []
+            for i, fname in enumerate(filenames):
+                storedName = "%d-%s" % (i, os.path.basename(fname))
+                shutil.copy2(fname, os.path.join(tmpDir, ENTRY_FILES_DIR,
+                    storedName))
+                files.append((storedName,
+                    os.path.relpath(fname, modelRun.basePath)))
+            info = {'name': modelRun.name, 'files': files, 'size': size,
+                'performance': performance}
+            with open(os.path.join(tmpDir, ENTRY_INFO_FILENAME), 'w') as f:
+                json.dump(info, f, indent=1)
+            with self._lock:
+                entryDir = self._entryDir(fingerprint)
+                if os.path.exists(entryDir):
+                    shutil.rmtree(entryDir)
+                os.rename(tmpDir, entryDir)
+        except:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+            raise
+        self.evict()
+
+    def entries(self):
+        """Returns a list of (fingerprint, size, lastUsed) for each entry in
+        the cache, least recently used first."""
+        entries = []
+        for fingerprint in os.listdir(self.cacheDir):
+            entryDir = self._entryDir(fingerprint)
+            if fingerprint.startswith('.'):
+                continue
+            try:
+                info = self._readEntryInfo(entryDir)
+                lastUsed = os.path.getmtime(entryDir)
+            except (IOError, OSError, ValueError):
+                continue
+            entries.append((fingerprint, info['size'], lastUsed))
+        entries.sort(key=lambda e: e[2])
+        return entries
+
+    def totalBytes(self):
+        """Returns the total size of the output files in the cache."""
+        return sum([size for fingerprint, size, lastUsed in self.entries()])
+
+    def evict(self):
+        """Remove least recently used entries until the cache is within its
+        size limit."""
+        with self._lock:
+            entries = self.entries()
+            total = sum([size for fingerprint, size, lastUsed in entries])
+            for fingerprint, size, lastUsed in entries:
+                if total <= self.maxBytes:
+                    break
+                shutil.rmtree(self._entryDir(fingerprint), ignore_errors=True)
+                total -= size
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            for fingerprint, size, lastUsed in self.entries():
+                shutil.rmtree(self._entryDir(fingerprint), ignore_errors=True)
@@ -0,0 +1,297 @@
+from __future__ import print_function
+##  Copyright (C), 2010, Monash University
+##  Copyright (C), 2010, Victorian Partnership for Advanced Computing (VPAC)
+##
+##  This file is part of the CREDO library.
+##  Developed as part of the Simulation, Analysis, Modelling program of
+##  AuScope Limited, and funded by the Australian Federal Government's
+##  National Collaborative Research Infrastructure Strategy (NCRIS) program.
+##
+##  This library is free software; you can redistribute it and/or
+##  modify it under the terms of the GNU Lesser General Public
+##  License as published by the Free Software Foundation; either
+##  version 2.1 of the License, or (at your option) any later version.
+##
+##  This library is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##  Lesser General Public License for more details.
+##
+##  You should have received a copy of the GNU Lesser General Public
+##  License along with this library; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+##  MA  02110-1301  USA
+
+"""A database of the runs done by a job runner, with their performance
+(walltime, CPU time, peak memory, solver statistics etc.), so it can be
+queried later, e.g. for trends in the walltime of a model over its last
+runs, without having to find and parse the XML records of each run.
+
+The history is kept in an SQLite database file, which can be shared by
+several job runners (and processes). Each run is a row of the `runs` table:
+
+* id, modelName, fingerprint (for runs of a suite, that used by the job
+  runner to identify them, see
+  :func:`credo.jobrunner.runcache.suiteRunFingerprint`; otherwise see
+  :func:`credo.jobrunner.runcache.runFingerprint`), recordTime (Unix time
+  the run was recorded), submitTime (ISO format)
+* runType, simulator, simulatorHash (hash of the simulator executable, see
+  :func:`credo.jobrunner.runcache.executableHash` - which changes with
+  each build of the simulator), nproc, host (and all the platform info, as
+  JSON, in platform)
+* walltime, cpuTime and peakRSS (in bytes), from the performance info of
+  whichever profilers recorded them (see :data:`SUMMARY_STATS`).
+
+and all the performance info recorded by the job runner's profilers is in
+the `performance` table (runId, profType, name, value) - including solver
+statistics, e.g. from the
+:class:`~credo.jobrunner.waiweraLogProfiler.WaiweraLogProfiler`.
+
+To use, set the `runHistory` attribute of a
+:class:`~credo.jobrunner.simplejobrunner.SimpleJobRunner` (or pass it to the
+constructor) to a :class:`RunHistory`, then query it, e.g.::
+
+    history = RunHistory("runHistory.sqlite")
+    for recordTime, walltime in history.walltimeTrend("myModel", 50):
+        ...
+"""
+from builtins import object
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import closing
+from xml.etree import ElementTree as etree
+
+from credo.jobrunner.runcache import runFingerprint, executableHash
+
+#: Summary columns of the runs table, and the (profType, name) of the
+#: performance info they are taken from, in order of preference.
+SUMMARY_STATS = [
+    ('walltime', [('Walltime', 'walltime')]),
+    ('cpuTime', [('Rusage', 'cpuTime'), ('ProcSampling', 'cpuTime')]),
+    ('peakRSS', [('ProcSampling', 'peakRSS'), ('Rusage', 'maxRSS')]),
+    ]
+
+#: Columns of the runs table (other than id).
+RUN_COLUMNS = ['modelName', 'fingerprint', 'recordTime', 'submitTime',
+    'runType', 'simulator', 'simulatorHash', 'nproc', 'host', 'platform'] + \
+    [name for name, sources in SUMMARY_STATS]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    modelName TEXT, fingerprint TEXT, recordTime REAL, submitTime TEXT,
+    runType TEXT, simulator TEXT, simulatorHash TEXT, nproc INTEGER,
+    host TEXT, platform TEXT, walltime REAL, cpuTime REAL, peakRSS REAL);
+CREATE INDEX IF NOT EXISTS runsModelName ON runs (modelName, recordTime);
+CREATE INDEX IF NOT EXISTS runsFingerprint ON runs (fingerprint);
+CREATE TABLE IF NOT EXISTS performance (
+    runId INTEGER REFERENCES runs(id), profType TEXT, name TEXT,
+    value REAL);
+CREATE INDEX IF NOT EXISTS performanceRunId ON performance (runId);
+"""
+
+def getSummaryStats(performance):
+    """Returns a dictionary of the summary values (see
+    :data:`SUMMARY_STATS`) found in performance info (a dictionary of
+    dictionaries, as in :attr:`credo.jobrunner.api.JobMetaInfo.performance`).
+    Values not found are None."""
+    summary = {}
+    for name, sources in SUMMARY_STATS:
+        summary[name] = None
+        for profType, statName in sources:
+            value = performance.get(profType, {}).get(statName)
+            if isinstance(value, (int, float)):
+                summary[name] = float(value)
+                break
+    return summary
+
+def getRunPerformance(jobMetaInfo, modelResult=None):
+    """Returns the performance info of a run's job (a dictionary of
+    dictionaries, as in :attr:`credo.jobrunner.api.JobMetaInfo.performance`),
+    plus a summary of the solver statistics of its modelResult (e.g. a
+    :class:`~credo.waiwera.WaiweraModelResult`), if it has them and they
+    weren't already recorded by a profiler."""
+    performance = dict(jobMetaInfo.performance)
+    if 'WaiweraSolver' in performance or modelResult is None or \
+            not hasattr(modelResult, 'getSolverStats'):
+        return performance
+    from credo.io.waiweralog import summariseSolverStats
+    try:
+        performance['WaiweraSolver'] = summariseSolverStats(
+            modelResult.getSolverStats())
+    except (IOError, OSError, KeyError, ValueError):
+        # E.g. no log was written.
+        pass
+    return performance
+
+class RunHistory(object):
+    """History of runs, and their performance, in an SQLite database (see
+    :mod:`credo.jobrunner.runhistory`).
+
+    .. attribute:: filename
+
+       The database file (created if it doesn't exist).
+    """
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self._lock = threading.Lock()
+        dirName = os.path.dirname(self.filename)
+        if not os.path.exists(dirName):
+            os.makedirs(dirName)
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # Allow for other processes using the database at the same time.
+        conn = sqlite3.connect(self.filename, timeout=30.0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def recordRun(self, modelRun, jobMetaInfo, modelResult=None,
+            fingerprint=None):
+        """Record a completed run, and the performance info of its job.
+
+        :keyword modelResult: the result of the run. If given and it has
+          solver statistics (e.g. a
+          :class:`~credo.waiwera.WaiweraModelResult`) not already in the
+          performance info, their summary is recorded too.
+        :keyword fingerprint: the fingerprint of the run, if already worked
+          out (e.g. by the job runner, for runs of a suite - see
+          :func:`~credo.jobrunner.runcache.suiteRunFingerprint`). Otherwise
+          it's that of the job (if a run cache is used), or else worked out
+          from the run's command line.
+        :returns: the id of the run in the database."""
+        if fingerprint is None:
+            fingerprint = getattr(jobMetaInfo, 'fingerprint', None)
+        runCommand = getattr(jobMetaInfo, 'runCommand', None)
+        if fingerprint is None and runCommand is not None:
+            fingerprint = runFingerprint(modelRun, runCommand)
+        performance = getRunPerformance(jobMetaInfo, modelResult)
+        simulator = modelRun.getSimulatorExecutable()
+        values = {
+            'modelName': modelRun.name,
+            'fingerprint': fingerprint,
+            'simulator': simulator,
+            'simulatorHash': executableHash(simulator) if simulator else None,
+            'nproc': modelRun.jobParams['nproc'],
+            }
+        return self._insertRun(values, jobMetaInfo, performance)
+
+    def importModelResultXML(self, filename):
+        """Record the run of an existing XML record of a ModelResult (see
+        :meth:`credo.modelresult.ModelResult.writeRecordXML`), e.g. to add
+        runs done before the history was kept. The fingerprint, simulator
+        and number of processors of such runs aren't known.
+
+        :returns: the id of the run in the database, or None if the record
+          has no job info."""
+        from credo.jobrunner import readJobMetaInfoFromXMLNode
+        root = etree.parse(filename).getroot()
+        jmiNode = root.find('jobMetaInfo')
+        if jmiNode is None:
+            return None
+        jobMetaInfo = readJobMetaInfoFromXMLNode(jmiNode)
+        values = {'modelName': root.find('modelName').text}
+        return self._insertRun(values, jobMetaInfo,
+            jobMetaInfo.performance, recordTime=os.path.getmtime(filename))
+
+    def _insertRun(self, values, jobMetaInfo, performance, recordTime=None):
+        values = dict(values)
+        values['recordTime'] = time.time() if recordTime is None \
+            else recordTime
+        if jobMetaInfo.submitTime is not None:
+            values['submitTime'] = jobMetaInfo.submitTime.isoformat()
+        values['runType'] = jobMetaInfo.runType
+        values['host'] = jobMetaInfo.platform.get('node')
+        values['platform'] = json.dumps(jobMetaInfo.platform,
+            sort_keys=True)
+        values.update(getSummaryStats(performance))
+        columns = [col for col in RUN_COLUMNS if col in values]
+        perfRows = []
+        for profType, perfDict in sorted(performance.items()):
+            for name, value in sorted(perfDict.items()):
+                if isinstance(value, (int, float)):
+                    perfRows.append((profType, name, float(value)))
+        with self._lock, closing(self._connect()) as conn:
+            with conn:
+                cursor = conn.execute("INSERT INTO runs (%s) VALUES (%s)" \
+                    % (", ".join(columns), ", ".join(["?"] * len(columns))),
+                    [values[col] for col in columns])
+                runId = cursor.lastrowid
+                conn.executemany("INSERT INTO performance (runId, profType,"\
+                    " name, value) VALUES (?, ?, ?, ?)",
+                    [(runId,) + row for row in perfRows])
+        return runId
+
+    def _query(self, sql, params=()):
+        with self._lock, closing(self._connect()) as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    def getRuns(self, modelName=None, fingerprint=None, lastN=None):
+        """Returns a list of dictionaries of the columns of the runs (see
+        :data:`RUN_COLUMNS`) recorded of the given model and/or fingerprint
+        (or all runs, if neither is given), oldest first.
+
+        :keyword lastN: if given, only the last lastN runs are returned."""
+        conditions, params = [], []
+        if modelName is not None:
+            conditions.append("modelName = ?")
+            params.append(modelName)
+        if fingerprint is not None:
+            conditions.append("fingerprint = ?")
+            params.append(fingerprint)
+        sql = "SELECT * FROM runs"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY recordTime DESC, id DESC"
+        if lastN is not None:
+            sql += " LIMIT %d" % int(lastN)
+        runs = self._query(sql, params)
+        runs.reverse()
+        return runs
+
+    def getPerformance(self, runId):
+        """Returns the performance info recorded for run runId, as a
+        dictionary of dictionaries (as in
+        :attr:`credo.jobrunner.api.JobMetaInfo.performance`)."""
+        performance = {}
+        for row in self._query("SELECT profType, name, value FROM"\
+                " performance WHERE runId = ?", (runId,)):
+            performance.setdefault(row['profType'], {})[row['name']] = \
+                row['value']
+        return performance
+
+    def getTrend(self, modelName, statName, lastN=50):
+        """Returns a list of (recordTime, value) of the statistic statName
+        over the last lastN runs of the model, oldest first, for runs it was
+        recorded for.
+
+        statName is either a column of the runs table (e.g. 'walltime',
+        'peakRSS'), or 'profType.name' of any performance info, e.g.
+        'WaiweraSolver.total_linear_iterations'."""
+        runs = self.getRuns(modelName, lastN=lastN)
+        if statName in RUN_COLUMNS:
+            trend = [(run['recordTime'], run[statName]) for run in runs]
+        else:
+            profType, name = statName.rsplit('.', 1)
+            values = {}
+            if runs:
+                ids = [run['id'] for run in runs]
+                for row in self._query("SELECT runId, value FROM performance"\
+                        " WHERE profType = ? AND name = ? AND runId IN (%s)" \
+                        % ", ".join(["?"] * len(ids)),
+                        [profType, name] + ids):
+                    values[row['runId']] = row['value']
+            trend = [(run['recordTime'], values.get(run['id']))
+                for run in runs]
+        return [(t, v) for t, v in trend if v is not None]
+
+    def walltimeTrend(self, modelName, lastN=50):
+        """Returns a list of (recordTime, walltime) over the last lastN runs
+        of the model, oldest first (see :meth:`.getTrend`)."""
+        return self.getTrend(modelName, 'walltime', lastN)
@@ -0,0 +1,308 @@
+from __future__ import print_function
+##  Copyright (C), 2010, Monash University
+##  Copyright (C), 2010, Victorian Partnership for Advanced Computing (VPAC)
+##
+##  This file is part of the CREDO library.
+##  Developed as part of the Simulation, Analysis, Modelling program of
+##  AuScope Limited, and funded by the Australian Federal Government's
+##  National Collaborative Research Infrastructure Strategy (NCRIS) program.
+##
+##  This library is free software; you can redistribute it and/or
+##  modify it under the terms of the GNU Lesser General Public
+##  License as published by the Free Software Foundation; either
+##  version 2.1 of the License, or (at your option) any later version.
+##
+##  This library is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##  Lesser General Public License for more details.
+##
+##  You should have received a copy of the GNU Lesser General Public
+##  License along with this library; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+##  MA  02110-1301  USA
+
+
+"""Monitoring of model runs while they run, so runs that have gone wrong
+(e.g. whose time steps keep being reduced, or that have stalled) can be
+aborted early, rather than using up processors until they reach their
+maximum run time.
+
+A :class:`RunMonitor` is given to a job runner (see its runMonitor
+attribute), and follows the progress log of each run the runner launches
+(see :meth:`credo.modelrun.ModelRun.getProgressLogFilename`), and its std
+out, as they're written. The lines are parsed into progress events by the
+model's progress parser (see
+:meth:`credo.modelrun.ModelRun.createProgressParser`), and if any of the
+conditions the monitor is configured with fires, the run's processes are
+killed, and a :class:`~credo.jobrunner.api.ModelRunAbortedError` is
+raised, with the reason and the last lines of the log as evidence.
+
+Runs can also have their own checks, of their outputs as they're written
+(see :attr:`credo.modelrun.ModelRun.liveChecks`), e.g. comparing them to
+reference results (see
+:class:`credo.systest.singleRunWithinTolTC.LiveWithinTolCheck`). These are
+done along with the monitor's checks - a job runner without a monitor uses
+a default :class:`RunMonitor` for runs with live checks.
+
+.. note:: only job runners that run jobs locally (i.e.
+   :class:`~credo.jobrunner.simplejobrunner.SimpleJobRunner` and its
+   sub-classes) support monitoring.
+"""
+from builtins import object
+
+import os
+import re
+import math
+import time
+import threading
+from collections import deque
+
+#: Default interval between checks of a run's logs, in seconds.
+DEFAULT_POLL_INTERVAL = 1.0
+#: Default number of lines of the log saved as evidence when aborting a run.
+DEFAULT_EVIDENCE_LINES = 20
+
+def jobStartTime(jobMetaInfo):
+    """Return the time (as from time.time()) the job of jobMetaInfo was
+    submitted, or the current time if that isn't known."""
+    submitTime = getattr(jobMetaInfo, 'submitTime', None)
+    if submitTime is None:
+        return time.time()
+    return time.mktime(submitTime.timetuple()) + \
+        submitTime.microsecond / 1.0e6
+
+def isStale(mtime, since):
+    """Return whether a file last modified at mtime was left over from
+    before since (a time as from time.time(), e.g. from
+    :func:`jobStartTime`), so wasn't written by a job started then. Times are
+    compared to the whole second, as some file systems don't record them any
+    more precisely."""
+    return since is not None and mtime < math.floor(since)
+
+class LogTailer(object):
+    """Reads the lines added to a (log) file since it was last read. The file
+    doesn't need to exist yet.
+
+    If notBefore (a time as from time.time()) is given, e.g. the start of the
+    job writing the file, a file last modified before then is a stale log
+    left over from a previous run, and is ignored until it is written to
+    again (see :func:`isStale`)."""
+    def __init__(self, filename, notBefore=None):
+        self.filename = filename
+        self.notBefore = notBefore
+        self._offset = 0
+        self._partial = b""
+
+    def readLines(self):
+        """Return a list of the complete lines added to the file since the
+        last call (without line endings)."""
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return []
+        size = st.st_size
+        if self._offset == 0 and isStale(st.st_mtime, self.notBefore):
+            return []
+        # Once it has been written to, the file is the current log.
+        self.notBefore = None
+        if size < self._offset:
+            # The file has been re-written, so start again.
+            self._offset = 0
+            self._partial = b""
+        if size == self._offset:
+            return []
+        with open(self.filename, "rb") as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        self._offset += len(data)
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        return [line.decode("utf-8", "replace").rstrip("\r")
+            for line in lines]
+
+class RunMonitor(object):
+    """Configuration of the conditions for aborting runs, which a job runner
+    checks for each of its runs as they run. All the conditions are off by
+    default, e.g. to abort runs whose time steps fall below 1 second, or that
+    fail 5 times in a row::
+
+        monitor = RunMonitor(minStepSize=1.0, maxConsecutiveFailures=5)
+        jobRunner = SimpleJobRunner(runMonitor=monitor)
+
+    .. attribute:: minStepSize
+
+       Abort if the time step size (of a completed step, or after being
+       reduced) falls below this.
+
+    .. attribute:: maxConsecutiveFailures
+
+       Abort if this many tries of time steps fail in a row (without a
+       step being completed).
+
+    .. attribute:: minProgressRate
+
+       Abort if the simulated time advances by less than this per second of
+       wall time, measured over the last :attr:`progressWindow` seconds.
+       Measurement starts once the first time step is completed, so the
+       time taken to set up the model isn't counted.
+
+    .. attribute:: progressWindow
+
+       Wall time (in seconds) the progress rate is measured over.
+
+    .. attribute:: abortPatterns
+
+       List of regular expressions - abort if any line of the progress log
+       or std out matches one of them.
+
+    .. attribute:: pollInterval
+
+       Interval between checks of the logs, in seconds.
+
+    .. attribute:: evidenceLines
+
+       Number of the last lines of the log saved as evidence on aborting.
+    """
+    def __init__(self, minStepSize=None, maxConsecutiveFailures=None,
+            minProgressRate=None, progressWindow=60.0, abortPatterns=None,
+            pollInterval=DEFAULT_POLL_INTERVAL,
+            evidenceLines=DEFAULT_EVIDENCE_LINES):
+        self.minStepSize = minStepSize
+        self.maxConsecutiveFailures = maxConsecutiveFailures
+        self.minProgressRate = minProgressRate
+        self.progressWindow = progressWindow
+        self.abortPatterns = abortPatterns if abortPatterns else []
+        self.pollInterval = pollInterval
+        self.evidenceLines = evidenceLines
+
+    def createJobMonitor(self, modelRun, startTime=None):
+        """Return a :class:`JobMonitor` to check the progress of modelRun
+        (whose job started at startTime, see :class:`JobMonitor`) against
+        this monitor's conditions."""
+        return JobMonitor(self, modelRun, startTime)
+
+    def startMonitoring(self, modelRun, jobMetaInfo, abortJob):
+        """Start a thread that checks the progress of the job of modelRun
+        (which has been launched) until it finishes. If it should be aborted,
+        abortJob(jobMetaInfo, reason, evidence) is called.
+
+        :returns: the :class:`JobMonitor` of the job."""
+        jobMonitor = self.createJobMonitor(modelRun,
+            jobStartTime(jobMetaInfo))
+        def monitorLoop():
+            while not jobMetaInfo.finished.wait(self.pollInterval):
+                reason = jobMonitor.check()
+                if reason is not None:
+                    abortJob(jobMetaInfo, reason, jobMonitor.evidence)
+                    return
+        thread = threading.Thread(target=monitorLoop,
+            name="credo-monitor-%s" % modelRun.name)
+        thread.daemon = True
+        thread.start()
+        return jobMonitor
+
+class JobMonitor(object):
+    """Checks the progress of a single run against the conditions of a
+    :class:`RunMonitor`. If startTime (a time as from time.time()) is given,
+    logs last modified before then, left over from a previous run, are
+    ignored until the run writes them (see :class:`LogTailer`).
+
+    .. attribute:: evidence
+
+       The last lines read from the log in which the condition that fired
+       was found (once :meth:`check` has returned a reason).
+    """
+    def __init__(self, runMonitor, modelRun, startTime=None):
+        self.monitor = runMonitor
+        self.parser = modelRun.createProgressParser()
+        self.evidence = []
+        self.consecutiveFailures = 0
+        self.simTime = None
+        # (wall time, sim time) of checks in the last progress window
+        self._progress = deque()
+        stdOutFilename = os.path.join(modelRun.basePath,
+            modelRun.getStdOutFilename())
+        logFilename = modelRun.getProgressLogFilename()
+        if logFilename is None:
+            logFilename = stdOutFilename
+        else:
+            logFilename = os.path.join(modelRun.basePath, logFilename)
+        self._logs = [(LogTailer(logFilename, startTime), True,
+            deque(maxlen=runMonitor.evidenceLines))]
+        if logFilename != stdOutFilename:
+            self._logs.append((LogTailer(stdOutFilename, startTime), False,
+                deque(maxlen=runMonitor.evidenceLines)))
+        self._patterns = [re.compile(p) for p in runMonitor.abortPatterns]
+        self.liveChecks = list(getattr(modelRun, 'liveChecks', []))
+
+    def check(self, now=None):
+        """Read the lines logged since the last check, and check the
+        monitor's conditions.
+
+        :returns: the reason the run should be aborted, or None if it
+          shouldn't."""
+        if now is None:
+            now = time.time()
+        for tailer, isProgressLog, recentLines in self._logs:
+            for line in tailer.readLines():
+                recentLines.append(line)
+                reason = self._checkLine(line, isProgressLog)
+                if reason is not None:
+                    self.evidence = list(recentLines)
+                    return reason
+        reason = self._checkProgressRate(now)
+        if reason is not None:
+            self.evidence = list(self._logs[0][2])
+            return reason
+        for liveCheck in self.liveChecks:
+            reason = liveCheck.check()
+            if reason is not None:
+                self.evidence = list(liveCheck.evidence)
+                return reason
+        return None
+
+    def _checkLine(self, line, isProgressLog):
+        m = self.monitor
+        for pattern in self._patterns:
+            if pattern.search(line):
+                return "log line matched abort pattern '%s'" % \
+                    pattern.pattern
+        if not isProgressLog or self.parser is None:
+            return None
+        event = self.parser.parseLine(line)
+        if event is None:
+            return None
+        eventType, values = event
+        if eventType == 'failure':
+            self.consecutiveFailures += 1
+            if m.maxConsecutiveFailures is not None and \
+                    self.consecutiveFailures >= m.maxConsecutiveFailures:
+                return "%d consecutive failed time step tries (at step %s)" \
+                    % (self.consecutiveFailures, values.get('count'))
+        elif eventType == 'reduction' or eventType == 'step':
+            if eventType == 'step':
+                self.consecutiveFailures = 0
+                self.simTime = values['time']
+            if m.minStepSize is not None and values['size'] < m.minStepSize:
+                return "time step size %g is below the minimum of %g" \
+                    % (values['size'], m.minStepSize)
+        return None
+
+    def _checkProgressRate(self, now):
+        m = self.monitor
+        if m.minProgressRate is None or self.simTime is None:
+            return None
+        self._progress.append((now, self.simTime))
+        while len(self._progress) > 1 and \
+                self._progress[1][0] <= now - m.progressWindow:
+            self._progress.popleft()
+        startWall, startSim = self._progress[0]
+        if now - startWall < m.progressWindow:
+            return None
+        rate = (self.simTime - startSim) / (now - startWall)
+        if rate < m.minProgressRate:
+            return "simulated time progressed at %g per second over the"\
+                " last %g seconds, below the minimum rate of %g" \
+                % (rate, now - startWall, m.minProgressRate)
+        return None
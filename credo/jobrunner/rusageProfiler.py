@@ -0,0 +1,68 @@
+from __future__ import print_function
+import sys
+from credo.jobrunner.api import PerformanceProfiler
+
+"""A module for saving profiling info about ModelRuns from the resource
+usage (rusage) the operating system reports for their processes.
+
+The usage is collected when the job's process is reaped, with `os.wait4()`
+(see :meth:`credo.jobrunner.simplejobrunner.SimpleJobRunner._startWaiter`),
+so no wrapper process (like the Unix time command) is needed, and the usage
+of each job is kept separate even when several jobs run at once (unlike
+`resource.getrusage(RUSAGE_CHILDREN)`, which totals all reaped children).
+
+The usage reported includes that of all descendants of the job's process
+that it waited for - so for an MPI run, all the ranks launched locally by
+mpiexec. CPU times, page faults and context switches are totals over all
+these processes, but the maximum resident set size is that of the largest
+single process.
+
+.. note:: only works on Unix systems, with a job runner that records
+   rusage (currently :class:`~credo.jobrunner.simplejobrunner.SimpleJobRunner`
+   and its sub-classes)."""
+
+# Fields of the rusage of a process recorded, and the names they're saved
+#  under in the performance info.
+RUSAGE_FIELDS = [
+    ("userTime", "ru_utime"),
+    ("sysTime", "ru_stime"),
+    ("maxRSS", "ru_maxrss"),
+    ("minorPageFaults", "ru_minflt"),
+    ("majorPageFaults", "ru_majflt"),
+    ("voluntaryContextSwitches", "ru_nvcsw"),
+    ("involuntaryContextSwitches", "ru_nivcsw"),
+    ]
+
+def getRusageDict(rusage):
+    """Return a dictionary of the resource usage info in rusage (as returned
+    by `os.wait4()`), as saved by the :class:`RusageProfiler`. Times are in
+    seconds, and maxRSS is in bytes."""
+    resDict = {}
+    for name, field in RUSAGE_FIELDS:
+        resDict[name] = getattr(rusage, field)
+    resDict['cpuTime'] = resDict['userTime'] + resDict['sysTime']
+    # Linux reports maxrss in kilobytes, Mac OS X in bytes.
+    if sys.platform != 'darwin':
+        resDict['maxRSS'] *= 1024
+    return resDict
+
+class RusageProfiler(PerformanceProfiler):
+    """A performance profiler that records the resource usage (user and
+    system CPU time, maximum resident set size, page faults and context
+    switches) of each job's processes, as reported by the operating system
+    when the job finished."""
+    def __init__(self):
+        PerformanceProfiler.__init__(self, "Rusage")
+
+    def setup(self, modelName, modelBasePath, modelOutputPath, jobMetaInfo):
+        pass
+
+    def modifyRun(self, modelRun, oldModelRunCommand, jobMetaInfo):
+        return oldModelRunCommand
+
+    def attachPerformanceInfo(self, jobMetaInfo, modelResult):
+        rusage = getattr(jobMetaInfo, 'rusage', None)
+        if rusage is None:
+            # E.g. the job runner couldn't collect it.
+            return
+        jobMetaInfo.performance[self.typeStr] = getRusageDict(rusage)
@@ -24,10 +24,12 @@ from __future__ import print_function
 
 import os
 import sys
+import errno
 import signal
 import subprocess
 import time
 import shlex
+import threading
 import operator
 from xml.etree import ElementTree as etree
 from datetime import timedelta, datetime
@@ -36,62 +38,236 @@ from credo.modelresult import ModelResult
 from credo.modelresult import getSimInfoFromFreqOutput
 from credo.jobrunner.unixTimeCmdProfiler import UnixTimeCmdProfiler
 from credo.jobrunner.walltimeProfiler import WalltimeProfiler
+from credo.jobrunner.rusageProfiler import RusageProfiler
+from credo.jobrunner.runcache import runFingerprint, suiteRunFingerprint
+from credo.jobrunner.runmonitor import RunMonitor
+from credo.utils import monotonicTime
 
 # Allow MPI command to be overriden by env var.
 MPI_RUN_COMMAND = "MPI_RUN_COMMAND"
 DEFAULT_MPI_RUN_COMMAND = "mpiexec"
 
+# Seconds the processes of a job are given to exit after being asked to
+#  (with SIGTERM), before they are killed (with SIGKILL).
+DEFAULT_KILL_GRACE_PERIOD = 5
+
+# Popen arguments to start a job in its own session. Python 2 has no
+#  start_new_session, so call setsid in the child instead.
+if sys.version_info >= (3, 2):
+    NEW_SESSION_POPEN_ARGS = {'start_new_session': True}
+else:
+    NEW_SESSION_POPEN_ARGS = {'preexec_fn': os.setsid}
+
+def processGroupExists(pgid):
+    """Returns whether any processes in the process group pgid still
+    exist (including ones that have exited but not been reaped)."""
+    try:
+        os.killpg(pgid, 0)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return False
+        elif e.errno != errno.EPERM:
+            raise
+    return True
+
+def killProcessGroup(pgid, gracePeriod=DEFAULT_KILL_GRACE_PERIOD,
+        checkInterval=0.05):
+    """Kill all processes in the process group pgid: first ask them to exit
+    with SIGTERM, then if any are left after gracePeriod seconds, kill them
+    with SIGKILL. Returns once all of them are gone.
+
+    .. note:: the group leader, if it's a child of this process, must be
+       reaped (e.g. by waiting on it in another thread) for this to return.
+    """
+    try:
+        os.killpg(pgid, signal.SIGTERM)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return
+        raise
+    deadline = monotonicTime() + gracePeriod
+    while processGroupExists(pgid):
+        if monotonicTime() >= deadline:
+            try:
+                os.killpg(pgid, signal.SIGKILL)
+            except OSError as e:
+                if e.errno == errno.ESRCH:
+                    return
+                raise
+            # Processes can't ignore SIGKILL, so just wait for them to go.
+            deadline = float('inf')
+        time.sleep(checkInterval)
+
 class SimpleJobMetaInfo(JobMetaInfo):
     def __init__(self):
         JobMetaInfo.__init__(self, 0)
         self.runType = "Simple"
         self.runCommand = None
         self.procHandle = None
+        # Set once the job's process has finished.
+        self.retCode = None
+        # Time (as from time.time()) the job's process was found to have
+        #  finished, i.e. when it was reaped, not when it was completed (which
+        #  may be later, e.g. for runs of a suite finishing together).
+        self.finishTime = None
+        self.finished = threading.Event()
+        self._finishLock = threading.Lock()
+        self._finishCallbacks = []
+        # Set once the finish callbacks have been taken to be called.
+        self._finishing = False
+        # See credo.jobrunner.runcache
+        self.fingerprint = None
+        self.cacheHit = False
+        # Set when the job is being killed (see SimpleJobRunner.killJob)
+        self.killed = False
+        # Resource usage of the job's process once finished, as returned by
+        #  os.wait4() (see credo.jobrunner.rusageProfiler)
+        self.rusage = None
+        # Set if the job is aborted by a run monitor (see
+        #  credo.jobrunner.runmonitor)
+        self.abortReason = None
+        self.abortEvidence = None
 
     def writeInfoXML(self, xmlNode):
         JobMetaInfo.writeInfoXML(self, xmlNode)
         jmNode = xmlNode.find(self.XML_INFO_TAG)
         etree.SubElement(jmNode, 'runCommand').text = str(self.runCommand)
+        etree.SubElement(jmNode, 'cacheHit').text = str(self.cacheHit)
+
+    def setFinished(self, retCode):
+        """Record that the job's process has finished with the given return
+        code, and notify anything waiting on it. The finish callbacks are
+        called before the finished event is set, so anything waiting on the
+        event (e.g. for the run's result) sees what they've done (e.g. the
+        run recorded as complete by a progress reporter)."""
+        with self._finishLock:
+            self.retCode = retCode
+            self.finishTime = time.time()
+            self._finishing = True
+            callbacks, self._finishCallbacks = self._finishCallbacks, []
+        try:
+            for callback in callbacks:
+                callback(self)
+        finally:
+            self.finished.set()
+
+    def addFinishCallback(self, callback):
+        """Add a function to be called (with this JobMetaInfo as argument)
+        when the job's process finishes. If it has already finished, the
+        function is called straight away."""
+        with self._finishLock:
+            if not self._finishing:
+                self._finishCallbacks.append(callback)
+                return
+        callback(self)
 
 
 class SimpleJobRunner(JobRunner):
-    def __init__(self, mpi=False):
+    """A JobRunner that runs ModelRuns as processes on the local machine
+    (via MPI, if required).
+
+    Each job is started in a new session (and so process group), so when a
+    job is killed (on passing its maximum run time, or being interrupted by
+    Ctrl-C) all processes it started - e.g. all the ranks of an MPI run -
+    are killed, not just the one launched directly.
+
+    .. attribute:: killGracePeriod
+
+       Seconds the processes of a job being killed are given to exit after
+       being sent SIGTERM, before they are sent SIGKILL.
+
+    .. attribute:: runCache
+
+       If set to a :class:`~credo.jobrunner.runcache.RunCache`, the outputs
+       of successful runs are saved in it, and the outputs of runs whose
+       inputs are the same as a cached run are restored from it, rather than
+       actually running the model again.
+
+    .. attribute:: runMonitor
+
+       If set to a :class:`~credo.jobrunner.runmonitor.RunMonitor`, the
+       progress of each run is checked as it runs, and runs that meet any of
+       the monitor's conditions are aborted (raising a
+       :class:`~credo.jobrunner.api.ModelRunAbortedError`).
+
+    .. attribute:: progressReporter
+
+       If set to a :class:`~credo.jobrunner.progress.ProgressReporter`, the
+       progress of the runs (and the time they, and the suite being run,
+       have left) is regularly reported as they run.
+
+    .. attribute:: runHistory
+
+       If set to a :class:`~credo.jobrunner.runhistory.RunHistory`, each
+       successful run (that wasn't restored from the :attr:`.runCache`) is
+       recorded in it, with its performance info. Runs of a suite are
+       recorded by the fingerprint used to identify them when run as part
+       of it (see :func:`~credo.jobrunner.runcache.suiteRunFingerprint`), as
+       for a :class:`~credo.jobrunner.walltimehistory.WalltimeHistory`.
+    """
+    def __init__(self, mpi=False, runCache=None, runMonitor=None,
+            progressReporter=None, runHistory=None):
         JobRunner.__init__(self)
         self.mpi = mpi
+        self.runCache = runCache
+        self.runMonitor = runMonitor
+        self.progressReporter = progressReporter
+        self.runHistory = runHistory
+        # Fingerprints of the runs of the suite being run, by run id (see
+        #  _setSuiteFingerprints)
+        self._suiteFingerprints = {}
+        self.killGracePeriod = DEFAULT_KILL_GRACE_PERIOD
         defProfiler = WalltimeProfiler()
         # TODO: perhaps a more declarative approach to choosing profiler
         #  to use better in future than what's below ... e.g. have a profiler
         #  factory that chooses based on platform info, job runner type,
         #  and installed software.
 
-        # temporarily disable UnixTimeCmdProfiler, does not work on Adrian's
-        # machine:
-        # if sys.platform[0:len("linux")] == "linux":
-        #     # TODO: UnixTimeCmdProfiler does not seem to work now that I use
-        #     # Popen(shell=False).  check this on Adrian's machine
-        #     # Add at least a UnixTimeCmdProfiler
-        #     defProfiler = UnixTimeCmdProfiler()
-        #     self.profilers.append(defProfiler)
-
         self.profilers.append(defProfiler)
         self.defaultProfiler = defProfiler
+        # Resource usage is collected as jobs are reaped, rather than via a
+        #  wrapper like the UnixTimeCmdProfiler (which doesn't work with
+        #  Popen(shell=False)).
+        if hasattr(os, 'wait4'):
+            self.profilers.append(RusageProfiler())
 
     def setup(self):
         # TODO: check mpd is running, if necessary
         pass
 
+    def runSuite(self, modelSuite, prefixStr=None, extraCmdLineOpts=None,
+            dryRun=False, maxRunTime=None, runSuiteNonBlocking=None,
+            writeRecords=True, resultCallback=None):
+        """See :meth:`credo.jobrunner.api.JobRunner.runSuite`. If there is
+        a :attr:`.progressReporter`, it reports on the suite while it runs."""
+        reporter = self.progressReporter if not dryRun else None
+        if self.runHistory is not None:
+            self._setSuiteFingerprints(modelSuite, [suiteRunFingerprint(
+                modelSuite, runI, extraCmdLineOpts)
+                for runI in range(len(modelSuite.runs))])
+        if reporter is not None:
+            reporter.startSuite(modelSuite, extraCmdLineOpts)
+        try:
+            return JobRunner.runSuite(self, modelSuite, prefixStr,
+                extraCmdLineOpts, dryRun, maxRunTime, runSuiteNonBlocking,
+                writeRecords, resultCallback)
+        finally:
+            self._suiteFingerprints = {}
+            if reporter is not None:
+                reporter.finishSuite()
+
+    def _setSuiteFingerprints(self, modelSuite, fingerprints):
+        """Set the fingerprints of the runs of the suite about to be run
+        (see :func:`~credo.jobrunner.runcache.suiteRunFingerprint`), which
+        they are recorded by in the :attr:`.runHistory`."""
+        self._suiteFingerprints = dict([(id(modelRun), fingerprint)
+            for modelRun, fingerprint in zip(modelSuite.runs, fingerprints)])
+
     def submitRun(self, modelRun, prefixStr=None, extraCmdLineOpts=None,
             dryRun=False, maxRunTime=None):
         """See :meth:`credo.jobrunner.api.JobRunner.submit`."""
         jobMI = SimpleJobMetaInfo()
 
-        # Navigate to the model's base directory
-        startDir = os.getcwd()
-        if modelRun.basePath != startDir:
-            print("Changing to ModelRun's specified base path '%s'" % \
-                (modelRun.basePath))
-            os.chdir(modelRun.basePath)
-
         modelRun.checkValidRunConfig()
         modelRun.preRunPreparation() #This includes finalising input files
         runCommand = self._getRunCommandLine(modelRun, prefixStr,
@@ -103,12 +279,17 @@ class SimpleJobRunner(JobRunner):
 
         # If we're only doing a dry run, return here.
         if dryRun == True:
-            os.chdir(startDir)
             return None
 
         #NB: currently archiving this without the detailed profiler info.
         jobMI.runCommand = runCommand
         self.archiveRunCommand(modelRun, runCommand)
+        if self.progressReporter is not None:
+            self.progressReporter.runStarted(modelRun, jobMI)
+
+        if self.runCache is not None and self._restoreFromCache(modelRun,
+                jobMI, runCommand):
+            return jobMI
 
         for profiler in self.profilers:
             profiler.setup(modelRun.name, modelRun.basePath,
@@ -125,21 +306,46 @@ class SimpleJobRunner(JobRunner):
             stdInFile = open(modelRun.getStdInFilename(), "rb", 0)
         except IOError:
             stdInFile = None
-        stdOutFile = open(modelRun.getStdOutFilename(), "w+")
-        stdErrFile = open(modelRun.getStdErrFilename(), "w+")
+        # Taking advantage of os.path.join functionality to automatically
+        #  over-ride later absolute paths.
+        stdOutFile = open(os.path.join(modelRun.basePath,
+            modelRun.getStdOutFilename()), "w+")
+        stdErrFile = open(os.path.join(modelRun.basePath,
+            modelRun.getStdErrFilename()), "w+")
         jobMI.stdOutFile = stdOutFile
         jobMI.stdErrFile = stdErrFile
         jobMI.submitTime = datetime.now()
+        jobMI.startClock = monotonicTime()
         try:
             for profiler in self.profilers:
-                profiler.startTimer()
+                profiler.startTimer(jobMI)
             # TODO: check side effect of shell=True:
             # http://stackoverflow.com/a/1254322/2368167
             # shell=True needed when using shell features: '<' redirection
-            procHandle = subprocess.Popen(runAsArgs, shell=False,
-                stdin=stdInFile, stdout=stdOutFile, stderr=stdErrFile)
+            # The job is run in the model's base directory, in its own
+            #  session, so all its processes can be killed together.
+            try:
+                procHandle = subprocess.Popen(runAsArgs, shell=False,
+                    stdin=stdInFile, stdout=stdOutFile, stderr=stdErrFile,
+                    cwd=modelRun.basePath, **NEW_SESSION_POPEN_ARGS)
+            finally:
+                # The process has its own copy of std in, if it was launched.
+                if stdInFile is not None:
+                    stdInFile.close()
             jobMI.procHandle = procHandle
+            self._startWaiter(jobMI)
+            runMonitor = self.runMonitor
+            if runMonitor is None and getattr(modelRun, 'liveChecks', None):
+                runMonitor = RunMonitor()
+            if runMonitor is not None:
+                runMonitor.startMonitoring(modelRun, jobMI, self._abortJob)
         except OSError:
+            # Don't leave the profilers (e.g. sampling threads) running, or
+            #  the log files open, for a job that wasn't launched.
+            for profiler in self.profilers:
+                profiler.stopTimer(jobMI)
+            stdOutFile.close()
+            stdErrFile.close()
             # TODO: [Refactor] this is not always correct? rewrite.
             raise ModelRunLaunchError(modelRun.name, runAsArgs[0],
                 "You can set the MPI_RUN_COMMAND env. variable to control"
@@ -147,13 +353,31 @@ class SimpleJobRunner(JobRunner):
 
         # TODO: record extra info in "provenance" dict of jobMI,
         #  eg hostname, run command used, prefix, etc...
-        if modelRun.basePath != startDir:
-            print("Restoring initial path '%s'" % \
-                (startDir))
-            os.chdir(startDir)
         self.attachPlatformInfo(jobMI)
         return jobMI
 
+    def _restoreFromCache(self, modelRun, jobMI, runCommand):
+        """Restore the outputs of the run from the :attr:`.runCache`, if an
+        identical run is in the cache. If so, the job is marked as finished
+        straight away.
+
+        :returns: whether the outputs were restored."""
+        jobMI.fingerprint = runFingerprint(modelRun, runCommand)
+        if jobMI.fingerprint is None:
+            return False
+        performance = self.runCache.restore(jobMI.fingerprint, modelRun)
+        if performance is None:
+            return False
+        print("Restored outputs of identical run from cache in %s" \
+            % (self.runCache.cacheDir))
+        jobMI.cacheHit = True
+        jobMI.performance = performance
+        jobMI.submitTime = datetime.now()
+        jobMI.startClock = monotonicTime()
+        self.attachPlatformInfo(jobMI)
+        jobMI.setFinished(0)
+        return True
+
     def _getRunCommandLine(self, modelRun, prefixStr, extraCmdLineOpts):
         """ Obtain run command from ModelRun object, if use MPI, related command
         will be added.
@@ -176,53 +400,171 @@ class SimpleJobRunner(JobRunner):
             runCommand = " ".join([prefixStr, runCommand])
         return runCommand
 
+    def _startWaiter(self, jobMI):
+        """Start a thread that blocks until the process of a submitted job
+        exits, then marks the job as finished (see
+        :meth:`SimpleJobMetaInfo.setFinished`). So waiting on jobs is driven
+        by their processes exiting, rather than by polling.
+
+        Any processes the job left behind (in its process group) are killed
+        before it's marked as finished, so they don't use processors needed
+        by later runs."""
+        def waitForExit():
+            retCode = self._reapProcess(jobMI)
+            pgid = jobMI.procHandle.pid
+            # (If the job is being killed, killJob() deals with the rest.)
+            if not jobMI.killed and processGroupExists(pgid):
+                print("Warning: processes of job %d still running after it"\
+                    " exited, killing them." % pgid)
+                killProcessGroup(pgid, self.killGracePeriod)
+            jobMI.setFinished(retCode)
+        waiter = threading.Thread(target=waitForExit,
+            name="credo-waiter-%d" % jobMI.procHandle.pid)
+        waiter.daemon = True
+        waiter.start()
+
+    def _reapProcess(self, jobMI):
+        """Wait for the process of a job to exit, recording its resource
+        usage (see :mod:`credo.jobrunner.rusageProfiler`) where possible.
+
+        :returns: the return code of the process."""
+        procHandle = jobMI.procHandle
+        if not hasattr(os, 'wait4'):
+            return procHandle.wait()
+        while True:
+            try:
+                pid, status, rusage = os.wait4(procHandle.pid, 0)
+                break
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                elif e.errno == errno.ECHILD:
+                    # Already reaped elsewhere, so no usage info.
+                    return procHandle.wait()
+                raise
+        if os.WIFSIGNALED(status):
+            retCode = -os.WTERMSIG(status)
+        else:
+            retCode = os.WEXITSTATUS(status)
+        # Let the Popen object know the process has gone.
+        procHandle.returncode = retCode
+        jobMI.rusage = rusage
+        return retCode
+
     def blockResult(self, modelRun, jobMI):
         # CHeck jobMI is of type MPI ...
         maxRunTime = modelRun.jobParams['maxRunTime']
-        pollInterval = modelRun.jobParams['pollInterval']
-        procHandle = jobMI.procHandle
+        try:
+            retCode, timeOut = self._waitForProcess(jobMI, maxRunTime)
+        except KeyboardInterrupt:
+            print("Interrupted: stopping run '%s'." % modelRun.name)
+            self.killJob(jobMI)
+            raise
+        return self._completeRun(modelRun, jobMI, retCode, timeOut)
 
-        # Navigate to the model's base directory
-        startDir = os.getcwd()
-        if modelRun.basePath != startDir:
-            print("Changing to ModelRun's specified base path '%s'" % \
-                (modelRun.basePath))
-            os.chdir(modelRun.basePath)
+    def _notifyWhenFinished(self, modelRun, jobMI, callback):
+        """Overrides
+        :meth:`credo.jobrunner.api.JobRunner._notifyWhenFinished`, using
+        the job's finish callbacks."""
+        jobMI.addFinishCallback(lambda jobMI: callback())
 
-        if maxRunTime == None or maxRunTime <= 0:
-            timeOut = False
-            retCode = procHandle.wait()
-        else:
-            if pollInterval > maxRunTime: pollInterval = maxRunTime
-            totalTime = 0
-            timeOut = True
-            while totalTime <= maxRunTime:
-                # Note: current strategy in this loop means 'totalTime'
-                #  recorded here will only be as accurate as size of
-                #  pollInterval.
-                #  Thus this is a fall-back for recording time taken.
-                time.sleep(pollInterval)
-                totalTime += pollInterval
-                retCode = procHandle.poll()
-                if retCode is not None:
-                    timeOut = False
-                    break
-            if timeOut:
-                # At this point, we know the process has run too long.
-                # From Python 2.6, change this to procHandle.kill()
-                print("Error: passed timeout of %s, sending quit signal." % \
-                    (str(timedelta(seconds=maxRunTime))))
-                os.kill(procHandle.pid, signal.SIGQUIT)
-        # TODO: set finishTime
+    def _asyncWaitTime(self, modelRun, jobMI):
+        """Overrides :meth:`credo.jobrunner.api.JobRunner._asyncWaitTime`:
+        a job is ready to complete once its process has finished, or it has
+        run out of time."""
+        if jobMI.finished.is_set():
+            return 0
+        return self._timeLeft(jobMI, modelRun.jobParams['maxRunTime'])
+
+    def _timeLeft(self, jobMI, maxRunTime):
+        """Returns the time (in seconds) a job has left to run before it
+        passes maxRunTime, or None if there is no time limit."""
+        if maxRunTime is None or maxRunTime <= 0:
+            return None
+        return maxRunTime - (monotonicTime() - jobMI.startClock)
+
+    def _waitForProcess(self, jobMI, maxRunTime):
+        """Wait for the process of a submitted job to finish, killing it if
+        it runs for longer than maxRunTime seconds (measured from when it was
+        launched).
+
+        :returns: a tuple of the process return code, and whether the job
+          timed out."""
+        timeLeft = self._timeLeft(jobMI, maxRunTime)
+        if timeLeft is None:
+            jobMI.finished.wait()
+        elif not jobMI.finished.wait(max(timeLeft, 0)):
+            # At this point, we know the process has run too long.
+            self._timeOutJob(jobMI, maxRunTime)
+            return None, True
+        return jobMI.retCode, False
+
+    def _timeOutJob(self, jobMI, maxRunTime):
+        """Kill a job that has run too long, and wait for it to exit."""
+        print("Error: passed timeout of %s, killing the job's processes." % \
+            (str(timedelta(seconds=maxRunTime))))
+        self.killJob(jobMI)
+
+    def _abortJob(self, jobMI, reason, evidence):
+        """Kill a job that a run monitor decided should be aborted, recording
+        why - unless its process has already finished by itself, in which
+        case it isn't recorded as aborted."""
+        # The reason is recorded before the job is killed, so it's seen once
+        #  the job is found to have finished, but not if it has finished
+        #  already (see SimpleJobMetaInfo.setFinished).
+        with jobMI._finishLock:
+            if jobMI.procHandle is None or jobMI._finishing:
+                return
+            jobMI.abortReason = reason
+            jobMI.abortEvidence = evidence
+        print("Error: aborting run (%s), killing the job's processes." % \
+            reason)
+        self.killJob(jobMI)
+
+    def killJob(self, jobMI):
+        """Kill all the processes of a submitted job (see
+        :func:`killProcessGroup`), wait for it to finish, and close its
+        output files."""
+        if jobMI.procHandle is None or jobMI.finished.is_set():
+            return
+        jobMI.killed = True
+        killProcessGroup(jobMI.procHandle.pid, self.killGracePeriod)
+        jobMI.finished.wait()
+        jobMI.stdOutFile.close()
+        jobMI.stdErrFile.close()
+
+    def _completeRun(self, modelRun, jobMI, retCode, timeOut):
+        """Do all the processing needed once the process of a job has
+        finished (or been killed after timing out): check its status, tidy
+        up, and construct the ModelResult, with profiling info attached.
+
+        For a run restored from the :attr:`.runCache` there's no process to
+        check or profile: the profiling info is that of the original run
+        (marked by :attr:`SimpleJobMetaInfo.cacheHit`), but the run is
+        tidied up as usual.
+
+        :returns: the :class:`~credo.modelresult.ModelResult` of the run."""
+        if jobMI.cacheHit:
+            print("Doing post-run tidyup:")
+            modelRun.postRunCleanup()
+            return self._createModelResult(modelRun, jobMI)
         for profiler in self.profilers:
-            profiler.stopTimer()
+            profiler.stopTimer(jobMI)
+        jobMI.stdOutFile.close()
+        jobMI.stdErrFile.close()
 
         # Check status of run (eg error status)
-        stdOutFilename = modelRun.getStdOutFilename()
-        stdErrFilename = modelRun.getStdErrFilename()
+        stdOutFilename = os.path.join(modelRun.basePath,
+            modelRun.getStdOutFilename())
+        stdErrFilename = os.path.join(modelRun.basePath,
+            modelRun.getStdErrFilename())
+        if jobMI.abortReason is not None:
+            raise ModelRunAbortedError(modelRun.name, retCode,
+                stdOutFilename, stdErrFilename, jobMI.abortReason,
+                jobMI.abortEvidence)
         if timeOut == True:
             raise ModelRunTimeoutError(modelRun.name, stdOutFilename,
-                stdErrFilename, maxRunTime)
+                stdErrFilename, modelRun.jobParams['maxRunTime'])
         if retCode != 0:
             raise ModelRunRegularError(modelRun.name, retCode, stdOutFilename,
                 stdErrFilename)
@@ -238,14 +580,10 @@ class SimpleJobRunner(JobRunner):
             print(").")
 
         # Now tidy things up after the run.
-        jobMI.stdOutFile.close()
-        jobMI.stdErrFile.close()
         print("Doing post-run tidyup:")
         modelRun.postRunCleanup()
 
-        # Construct a modelResult
-        mResult = modelRun.createModelResult()
-        mResult.jobMetaInfo = jobMI
+        mResult = self._createModelResult(modelRun, jobMI)
         try:
             #TODO: the below should be a standard method of ModelResult
             tSteps, simTime = getSimInfoFromFreqOutput(mResult.outputPath)
@@ -255,18 +593,29 @@ class SimpleJobRunner(JobRunner):
         #Now collect profiler performance info.
         for profiler in self.profilers:
             profiler.attachPerformanceInfo(jobMI, mResult)
+        if self.runCache is not None and jobMI.fingerprint is not None:
+            self.runCache.store(jobMI.fingerprint, modelRun,
+                jobMI.performance)
+        if self.runHistory is not None:
+            self.runHistory.recordRun(modelRun, jobMI, mResult,
+                self._suiteFingerprints.get(id(modelRun)))
+        return mResult
 
-        if modelRun.basePath != startDir:
-            print("Restoring initial path '%s'" % \
-                (startDir))
-            os.chdir(startDir)
+    def _createModelResult(self, modelRun, jobMI):
+        """Construct the ModelResult of a completed run."""
+        mResult = modelRun.createModelResult()
+        mResult.jobMetaInfo = jobMI
+        # Make sure records of the result don't depend on the current path.
+        mResult.outputPath = os.path.join(modelRun.basePath,
+            mResult.outputPath)
         return mResult
 
     def archiveRunCommand(self, modelRun, runCommand):
         """Save the given runCommand to a file in output directory."""
-        if not os.path.exists(modelRun.outputPath):
-            os.makedirs(modelRun.outputPath)
-        fName = os.path.join(modelRun.outputPath, "runCommand.sh")
+        absOutPath = os.path.join(modelRun.basePath, modelRun.outputPath)
+        if not os.path.exists(absOutPath):
+            os.makedirs(absOutPath)
+        fName = os.path.join(absOutPath, "runCommand.sh")
         f = open(fName, "w")
         f.write("#!/bin/sh\n")
         f.write("cd %s\n" % modelRun.basePath)
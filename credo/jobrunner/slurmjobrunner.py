@@ -0,0 +1,334 @@
+from __future__ import print_function
+##  Copyright (C), 2010, Monash University
+##  Copyright (C), 2010, Victorian Partnership for Advanced Computing (VPAC)
+##
+##  This file is part of the CREDO library.
+##  Developed as part of the Simulation, Analysis, Modelling program of
+##  AuScope Limited, and funded by the Australian Federal Government's
+##  National Collaborative Research Infrastructure Strategy (NCRIS) program.
+##
+##  This library is free software; you can redistribute it and/or
+##  modify it under the terms of the GNU Lesser General Public
+##  License as published by the Free Software Foundation; either
+##  version 2.1 of the License, or (at your option) any later version.
+##
+##  This library is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##  Lesser General Public License for more details.
+##
+##  You should have received a copy of the GNU Lesser General Public
+##  License along with this library; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+##  MA  02110-1301  USA
+
+"""A JobRunner that submits ModelRuns to a Slurm queueing system.
+
+Suites of runs are submitted as Slurm array jobs: runs requesting the same
+resources (processors, walltime and Slurm job parameters) share an array
+job, with one array task per run. All outstanding tasks are checked on with
+a single `sacct` call each poll interval (see :class:`SlurmJobPoller`), and
+the elapsed time, CPU time and maximum memory use reported by `sacct` are
+saved in each run's :attr:`~credo.jobrunner.api.JobMetaInfo.performance`.
+
+Runs can be configured with a 'Slurm' dictionary in their
+:attr:`~credo.modelrun.ModelRun.jobParams`, with the optional keys
+'partition', 'account', 'sbatchOptions' (a list of extra `#SBATCH` options),
+'sourcefiles' and 'modules'.
+"""
+
+import os
+import re
+import shlex
+import subprocess
+from datetime import timedelta, datetime
+from credo.jobrunner.api import *
+from credo.jobrunner.pbsjobrunner import PBSJobRunner, PBSJobPoller, \
+    PBSJobMetaInfo, MPI_RUN_COMMAND, getExitStatusFilename
+
+SLURM_SUB_COMMAND = "sbatch"
+SLURM_ACCT_COMMAND = "sacct"
+SLURM_PREFIX = "#SBATCH"
+SLURM_ARRAY_INDEX_VAR = "SLURM_ARRAY_TASK_ID"
+# Default MPI launcher within a Slurm job
+DEFAULT_SLURM_MPI_RUN_COMMAND = "srun"
+# Fields asked of sacct, in order.
+SACCT_FIELDS = ["JobID", "State", "ExitCode", "Elapsed", "MaxRSS",
+    "TotalCPU"]
+# Job states (as reported by sacct) of jobs that have finished.
+SLURM_FINISHED_STATES = ["COMPLETED", "FAILED", "CANCELLED", "TIMEOUT",
+    "NODE_FAIL", "OUT_OF_MEMORY", "PREEMPTED", "BOOT_FAIL", "DEADLINE"]
+# Name of the performance info from sacct (see JobMetaInfo.performance)
+SLURM_PERFORMANCE_TYPE = "Slurm"
+
+def parseSlurmTime(timeStr):
+    """Convert a time reported by Slurm (formatted as [D-][HH:]MM:SS[.mmm])
+    to seconds. Returns None for an empty string."""
+    timeStr = timeStr.strip()
+    if timeStr == "":
+        return None
+    days = 0
+    if '-' in timeStr:
+        dayStr, timeStr = timeStr.split('-', 1)
+        days = int(dayStr)
+    seconds = 0.0
+    for part in timeStr.split(':'):
+        seconds = seconds * 60 + float(part)
+    return days * 24 * 60 * 60 + seconds
+
+def formatSlurmTime(seconds):
+    """Format a time in seconds as Slurm expects for a time limit
+    (D-HH:MM:SS)."""
+    seconds = int(round(seconds))
+    days, seconds = divmod(seconds, 24 * 60 * 60)
+    return "%d-%s" % (days, timedelta(seconds=seconds))
+
+def parseSlurmMemory(memStr):
+    """Convert a memory size reported by Slurm (e.g. '1024K', '1.5G') to
+    bytes. Returns None for an empty string."""
+    memStr = memStr.strip()
+    if memStr == "":
+        return None
+    multipliers = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    if memStr[-1].upper() in multipliers:
+        return float(memStr[:-1]) * multipliers[memStr[-1].upper()]
+    return float(memStr)
+
+def parseSAcct(sacctOut):
+    """Parse the output of `sacct --parsable2 --noheader` for the fields
+    :data:`SACCT_FIELDS`.
+
+    :returns: a dictionary keyed by job ID (without step suffixes like
+      '.batch'), of tuples of the job's state (e.g. 'COMPLETED'), and a
+      dictionary of info about it: its 'exitCode', and its 'walltime' and
+      'cpuTime' (in seconds), and 'maxRSS' (in bytes, the maximum over
+      the job's steps) where known."""
+    jobs = {}
+    for line in sacctOut.splitlines():
+        values = line.split('|')
+        if len(values) < len(SACCT_FIELDS):
+            continue
+        fields = dict(zip(SACCT_FIELDS, values))
+        jobId, sep, step = fields['JobID'].partition('.')
+        state, info = jobs.setdefault(jobId, [None, {}])
+        maxRSS = parseSlurmMemory(fields['MaxRSS'])
+        if maxRSS is not None:
+            info['maxRSS'] = max(info.get('maxRSS', 0), maxRSS)
+        if step != "":
+            continue
+        # E.g. "CANCELLED by 1234"
+        jobs[jobId][0] = fields['State'].split()[0] \
+            if fields['State'].strip() else None
+        exitCode = fields['ExitCode'].split(':')[0]
+        info['exitCode'] = int(exitCode) if exitCode.isdigit() else None
+        for key, field in [('walltime', 'Elapsed'), ('cpuTime', 'TotalCPU')]:
+            value = parseSlurmTime(fields[field])
+            if value is not None:
+                info[key] = value
+    return dict([(jobId, tuple(job)) for jobId, job in jobs.items()])
+
+class SlurmJobPoller(PBSJobPoller):
+    """Waits on Slurm jobs to finish, as for :class:`.PBSJobPoller`, but with
+    one `sacct` call for all jobs each poll interval. Jobs `sacct` doesn't
+    yet know about are taken to not have started.
+
+    The info returned when a job has finished is the dictionary given by
+    :func:`parseSAcct`.
+    """
+    finishedStates = SLURM_FINISHED_STATES
+    unknownJobsFinished = False
+
+    def __init__(self, statCommand=SLURM_ACCT_COMMAND):
+        PBSJobPoller.__init__(self, statCommand)
+
+    def queryJobs(self, jobIds):
+        args = shlex.split(self.statCommand) + ['--noheader', '--parsable2',
+            '--format=%s' % ",".join(SACCT_FIELDS),
+            '--jobs=%s' % ",".join(jobIds)]
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True)
+        sacctOut, sacctErr = proc.communicate()
+        return parseSAcct(sacctOut)
+
+class SlurmJobMetaInfo(PBSJobMetaInfo):
+    """JobMetaInfo of a job submitted to Slurm. The :attr:`.jobId` of a run
+    in an array job is that of its task (e.g. '1234_5')."""
+    def __init__(self):
+        PBSJobMetaInfo.__init__(self)
+        self.runType = "Slurm"
+
+class SlurmJobRunner(PBSJobRunner):
+    """A JobRunner to submit CREDO jobs to Slurm, via creating job scripts,
+    and submitting these with `sbatch`. Works as for the
+    :class:`~credo.jobrunner.pbsjobrunner.PBSJobRunner`, except that all
+    suites are submitted as array jobs (grouping runs that need the same
+    resources, see :meth:`.groupRunsByResources`).
+
+    .. attribute:: mpiRunCommand
+
+       Command used to launch the model within the job. Defaults to the
+       MPI_RUN_COMMAND environment variable if set, otherwise `srun`.
+    """
+    def __init__(self):
+        PBSJobRunner.__init__(self)
+        if MPI_RUN_COMMAND not in os.environ:
+            self.mpiRunCommand = DEFAULT_SLURM_MPI_RUN_COMMAND
+        self.arrayIndexVar = SLURM_ARRAY_INDEX_VAR
+        self.poller = SlurmJobPoller()
+
+    def submitRun(self, modelRun, prefixStr=None, extraCmdLineOpts=None,
+            dryRun=False, maxRunTime=None):
+        """See :meth:`credo.jobrunner.api.JobRunner.submit`."""
+        runCommand = self._prepareRun(modelRun, prefixStr, extraCmdLineOpts)
+        scriptFilename = os.path.join(modelRun.basePath,
+            "%s_proc_%d.slurm" % (modelRun.name, modelRun.jobParams['nproc']))
+        with open(scriptFilename, 'w') as f:
+            self._writeSlurmHeader(f, modelRun.jobParams, modelRun.name)
+            self._writeRunLines(f, modelRun, runCommand)
+        print("Running model '%s' via Slurm, submitted filename %s"\
+            " with command '%s', with underlying MPI command '%s' ..."\
+            % (modelRun.name, scriptFilename, SLURM_SUB_COMMAND, runCommand))
+        if dryRun == True:
+            return None
+        jobMetaInfo = SlurmJobMetaInfo()
+        jobMetaInfo.submitTime = datetime.now()
+        jobMetaInfo.jobId = self._submitSlurmFile(modelRun.name,
+            scriptFilename, modelRun.basePath)
+        self.attachPlatformInfo(jobMetaInfo)
+        return jobMetaInfo
+
+    def submitSuite(self, modelSuite, prefixStr=None, extraCmdLineOpts=None,
+            dryRun=False, maxRunTime=None, writeRecords=True):
+        """Submits the modelRuns of a suite as array jobs, one for each
+        group of runs needing the same resources (see
+        :meth:`.groupRunsByResources`), and returns a list of all
+        jobMetaInfos for the submitted runs."""
+        if not self.useJobArrays:
+            return JobRunner.submitSuite(self, modelSuite, prefixStr,
+                extraCmdLineOpts, dryRun, maxRunTime, writeRecords)
+        if writeRecords == True:
+            modelSuite.writeAllModelRunXMLs()
+        runCommands = []
+        for runI, modelRun in enumerate(modelSuite.runs):
+            customOpts = modelSuite.getCustomOpts(runI, extraCmdLineOpts)
+            runCommands.append(self._prepareRun(modelRun, prefixStr,
+                customOpts))
+        suiteName = os.path.basename(os.path.normpath(
+            modelSuite.outputPathBase)) or modelSuite.runs[0].name
+        jobMetaInfos = [None] * len(modelSuite.runs)
+        for groupI, runIs in enumerate(self.groupRunsByResources(modelSuite)):
+            firstRun = modelSuite.runs[runIs[0]]
+            arrayName = "%s-%d" % (suiteName, groupI)
+            scriptFilename = os.path.join(firstRun.basePath,
+                "%s_array_%d.slurm" % (arrayName, len(runIs)))
+            with open(scriptFilename, 'w') as f:
+                self._writeSlurmHeader(f, firstRun.jobParams, arrayName,
+                    ["--array=0-%d" % (len(runIs)-1)])
+                f.write("case $%s in\n" % self.arrayIndexVar)
+                for taskI, runI in enumerate(runIs):
+                    f.write("%d)\n" % taskI)
+                    self._writeRunLines(f, modelSuite.runs[runI],
+                        runCommands[runI])
+                    f.write(";;\n")
+                f.write("esac\n")
+            print("Running %d models of the suite via Slurm as an array job,"\
+                " submitted filename %s with command '%s' ..."\
+                % (len(runIs), scriptFilename, SLURM_SUB_COMMAND))
+            if dryRun == True:
+                continue
+            submitTime = datetime.now()
+            arrayJobId = self._submitSlurmFile(arrayName, scriptFilename,
+                firstRun.basePath)
+            for taskI, runI in enumerate(runIs):
+                jobMetaInfo = SlurmJobMetaInfo()
+                jobMetaInfo.submitTime = submitTime
+                jobMetaInfo.arrayJobId = arrayJobId
+                jobMetaInfo.jobId = "%s_%d" % (arrayJobId, taskI)
+                self.attachPlatformInfo(jobMetaInfo)
+                jobMetaInfos[runI] = jobMetaInfo
+        if dryRun == True:
+            return []
+        return jobMetaInfos
+
+    def groupRunsByResources(self, modelSuite):
+        """Group the runs of a suite that need the same resources from Slurm
+        (number of processors, walltime, and Slurm job parameters), so each
+        group can be submitted as an array job.
+
+        :returns: a list of lists of run indices, in order of the first run
+          in each group."""
+        groups = []
+        groupResources = []
+        for runI, modelRun in enumerate(modelSuite.runs):
+            jobParams = modelRun.jobParams
+            resources = (jobParams['nproc'], jobParams['maxRunTime'],
+                sorted(jobParams.get('Slurm', {}).items()))
+            if resources in groupResources:
+                groups[groupResources.index(resources)].append(runI)
+            else:
+                groupResources.append(resources)
+                groups.append([runI])
+        return groups
+
+    def _submitSlurmFile(self, jobName, scriptFilename, basePath):
+        """Submit a job script with sbatch, and return its job ID."""
+        subArgs = [SLURM_SUB_COMMAND, "--parsable", scriptFilename]
+        try:
+            proc = subprocess.Popen(subArgs, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, cwd=basePath, universal_newlines=True)
+            subOut, subErr = proc.communicate()
+        except OSError as ose:
+            raise ModelRunLaunchError(jobName, " ".join(subArgs),
+                "Check sbatch working properly, OSError was %s" % (ose))
+        if proc.returncode != 0:
+            raise ModelRunLaunchError(jobName, " ".join(subArgs),
+                "sbatch failed with return code %d, stderr was '%s'" \
+                % (proc.returncode, subErr.strip()))
+        # With --parsable, sbatch prints "jobid[;cluster]"
+        return self._parseQSubOutput(subOut, subErr).split(';')[0]
+
+    def _writeSlurmHeader(self, f, jobParams, jobName, extraOptions=None):
+        """Write the start of a Slurm job script, with the sbatch options for
+        the job (and any extraOptions, e.g. the array option), then the lines
+        setting up its environment. All the options come before any
+        commands, as sbatch ignores those after the first command."""
+        slurmParams = jobParams.get('Slurm', {})
+        f.write("#!/bin/bash\n")
+        f.write("%s --job-name=%s\n" % (SLURM_PREFIX, jobName))
+        f.write("%s --ntasks=%d\n" % (SLURM_PREFIX, jobParams['nproc']))
+        if jobParams['maxRunTime'] is not None:
+            f.write("%s --time=%s\n" % (SLURM_PREFIX,
+                formatSlurmTime(jobParams['maxRunTime'])))
+        for param in ['partition', 'account']:
+            if param in slurmParams:
+                f.write("%s --%s=%s\n" % (SLURM_PREFIX, param,
+                    slurmParams[param]))
+        for option in slurmParams.get('sbatchOptions', []) + \
+                (extraOptions or []):
+            f.write("%s %s\n" % (SLURM_PREFIX, option))
+        for srcFile in slurmParams.get('sourcefiles', []):
+            f.write("source %s\n" % srcFile)
+        for modName in slurmParams.get('modules', []):
+            f.write("module load %s\n" % modName)
+
+    def _waitForJob(self, modelRun, jobMetaInfo):
+        """Wait for a job to finish, save the accounting info from sacct in
+        its performance info, and return its exit code (or None if not
+        known)."""
+        info = self.poller.waitForJob(jobMetaInfo.jobId,
+            modelRun.jobParams['pollInterval'],
+            getExitStatusFilename(modelRun))
+        if info is None:
+            # sacct stopped reporting on the job (e.g. its accounting
+            #  records were purged), or never did but it left its exit
+            #  status file.
+            print("Warning: Slurm job %s of model '%s' isn't reported"\
+                " by %s, so taking it as finished with unknown"\
+                " exit code." % (jobMetaInfo.jobId, modelRun.name,
+                self.poller.statCommand))
+            jobMetaInfo.performance[SLURM_PERFORMANCE_TYPE] = {}
+            return None
+        perfInfo = dict([(key, info[key]) for key in
+            ['walltime', 'cpuTime', 'maxRSS'] if key in info])
+        jobMetaInfo.performance[SLURM_PERFORMANCE_TYPE] = perfInfo
+        return info.get('exitCode')
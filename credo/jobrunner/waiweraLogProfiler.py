@@ -0,0 +1,66 @@
+from __future__ import print_function
+##  Copyright (C), 2010, Monash University
+##  Copyright (C), 2010, Victorian Partnership for Advanced Computing (VPAC)
+##
+##  This file is part of the CREDO library.
+##  Developed as part of the Simulation, Analysis, Modelling program of
+##  AuScope Limited, and funded by the Australian Federal Government's
+##  National Collaborative Research Infrastructure Strategy (NCRIS) program.
+##
+##  This library is free software; you can redistribute it and/or
+##  modify it under the terms of the GNU Lesser General Public
+##  License as published by the Free Software Foundation; either
+##  version 2.1 of the License, or (at your option) any later version.
+##
+##  This library is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##  Lesser General Public License for more details.
+##
+##  You should have received a copy of the GNU Lesser General Public
+##  License along with this library; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+##  MA  02110-1301  USA
+
+from credo.jobrunner.api import PerformanceProfiler
+from credo.io.waiweralog import summariseSolverStats
+
+"""A module for profiling the solver performance of Waiwera runs (numbers
+of time steps, nonlinear and linear iterations, failed tries, step sizes),
+from their YAML logs, so solver efficiency can be compared across simulator
+versions."""
+
+class WaiweraLogProfiler(PerformanceProfiler):
+    """Profiler that saves a summary of the solver statistics of a Waiwera
+    run (see :func:`credo.io.waiweralog.summariseSolverStats`) in the job's
+    performance info, under the profiler type 'WaiweraSolver'.
+
+    Only model results with a getSolverStats() method (i.e.
+    :class:`credo.waiwera.WaiweraModelResult`) are profiled, so this can be
+    used with job runners that also run other types of models. It isn't one
+    of the default profilers - add it to a job runner's profilers to use it,
+    e.g.::
+
+        jobRunner.profilers.append(WaiweraLogProfiler())
+    """
+    def __init__(self):
+        PerformanceProfiler.__init__(self, "WaiweraSolver")
+
+    def setup(self, modelName, modelBasePath, modelOutputPath, jobMetaInfo):
+        pass
+
+    def modifyRun(self, modelRun, oldModelRunCommand, jobMetaInfo):
+        return oldModelRunCommand
+
+    def attachPerformanceInfo(self, jobMetaInfo, modelResult):
+        getSolverStats = getattr(modelResult, 'getSolverStats', None)
+        if getSolverStats is None:
+            return
+        try:
+            stats = getSolverStats()
+        except (IOError, OSError) as e:
+            print("Warning: couldn't read the solver statistics of model"\
+                " %s (%s), so they're not recorded." % (modelResult.modelName,
+                    e))
+            return
+        jobMetaInfo.performance[self.typeStr] = summariseSolverStats(stats)
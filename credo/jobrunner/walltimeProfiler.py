@@ -1,3 +1,4 @@
+from builtins import object
 import time
 from credo.jobrunner.api import PerformanceProfiler
 
@@ -9,6 +10,12 @@ relevant CREDO declarative :class:`credo.jobrunner.api.PerformanceProfiler`
 class for using with :class:`credo.jobrunner.api.JobRunner` s.
 """
 
+class WalltimeHandle(object):
+    """Records the start and end times of a single job."""
+    def __init__(self):
+        self.ts = None
+        self.te = None
+
 class WalltimeProfiler(PerformanceProfiler):
     """
     """
@@ -16,23 +23,39 @@ class WalltimeProfiler(PerformanceProfiler):
         PerformanceProfiler.__init__(self, "Walltime")
 
     def setup(self, modelName, modelBasePath, modelOutputPath, jobMetaInfo):
-        pass
+        jobMetaInfo.profilerHandles[self.typeStr] = WalltimeHandle()
 
     def modifyRun(self, modelRun, oldModelRunCommand, jobMetaInfo):
         """ minimum implementation should at least return the original command
         """
         return oldModelRunCommand
 
-    def startTimer(self):
-        self._ts = time.time()
-
-    def stopTimer(self):
-        self._te = time.time()
+    def _getHandle(self, jobMetaInfo):
+        # Fall back to storing times on the profiler itself, if it's being
+        #  used without a JobMetaInfo (i.e. for one job at a time).
+        if jobMetaInfo is None:
+            if not hasattr(self, '_handle'):
+                self._handle = WalltimeHandle()
+            return self._handle
+        if self.typeStr not in jobMetaInfo.profilerHandles:
+            jobMetaInfo.profilerHandles[self.typeStr] = WalltimeHandle()
+        return jobMetaInfo.profilerHandles[self.typeStr]
+
+    def startTimer(self, jobMetaInfo=None):
+        self._getHandle(jobMetaInfo).ts = time.time()
+
+    def stopTimer(self, jobMetaInfo=None):
+        # Use the time the job's process finished, if the job runner recorded
+        #  it, so time spent waiting to be completed isn't counted.
+        finishTime = getattr(jobMetaInfo, 'finishTime', None)
+        if finishTime is None:
+            finishTime = time.time()
+        self._getHandle(jobMetaInfo).te = finishTime
 
     def attachPerformanceInfo(self, jobMetaInfo, modelResult):
-        self._elasped_time = self._te - self._ts
+        h = self._getHandle(jobMetaInfo)
         resDict = {
-            'walltime': self._elasped_time,
+            'walltime': h.te - h.ts,
             }
         jobMetaInfo.performance[self.typeStr] = dict(resDict)
 
@@ -0,0 +1,134 @@
+from __future__ import print_function
+##  Copyright (C), 2010, Monash University
+##  Copyright (C), 2010, Victorian Partnership for Advanced Computing (VPAC)
+##
+##  This file is part of the CREDO library.
+##  Developed as part of the Simulation, Analysis, Modelling program of
+##  AuScope Limited, and funded by the Australian Federal Government's
+##  National Collaborative Research Infrastructure Strategy (NCRIS) program.
+##
+##  This library is free software; you can redistribute it and/or
+##  modify it under the terms of the GNU Lesser General Public
+##  License as published by the Free Software Foundation; either
+##  version 2.1 of the License, or (at your option) any later version.
+##
+##  This library is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##  Lesser General Public License for more details.
+##
+##  You should have received a copy of the GNU Lesser General Public
+##  License along with this library; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+##  MA  02110-1301  USA
+
+
+"""A record of how long ModelRuns took in the past, used to predict how long
+they'll take next time, so the longest runs of a suite can be started first.
+
+Runs are identified by their fingerprint (see
+:func:`credo.jobrunner.runcache.suiteRunFingerprint`), which includes the
+number of processors they are run on, so a model run at different numbers
+of processors has separate entries. As the fingerprint also changes with
+each build of the simulator, and any change to a run's input files, the
+walltimes of each run are also kept by the class and name of the run and
+its number of processors (see :func:`runKey`), to predict from for runs
+with a fingerprint not in the history.
+
+To use, set the `walltimeHistory` attribute of a
+:class:`~credo.jobrunner.pooledjobrunner.PooledJobRunner` (or pass it to the
+constructor) to a :class:`WalltimeHistory`.
+"""
+
+import os
+import json
+import tempfile
+import threading
+from credo.utils import replaceFile
+
+# Number of most recent walltimes of each run kept to make predictions from.
+DEFAULT_KEEP_RUNS = 5
+
+def runKey(modelRun):
+    """Returns the key a ModelRun's walltimes are kept by in a
+    :class:`WalltimeHistory` regardless of its fingerprint: its class and
+    name, and number of processors."""
+    return "run:%s:%s:np%d" % (modelRun.__class__.__name__, modelRun.name,
+        modelRun.jobParams['nproc'])
+
+class WalltimeHistory(object):
+    """Walltimes of past runs, saved in a JSON file, keyed by run
+    fingerprint (and by :func:`runKey`).
+
+    .. attribute:: filename
+
+       File the history is saved to (and loaded from, if it exists).
+
+    .. attribute:: keepRuns
+
+       Number of most recent walltimes kept for each run. The predicted
+       walltime of a run is the mean of these.
+    """
+    def __init__(self, filename, keepRuns=DEFAULT_KEEP_RUNS):
+        self.filename = os.path.abspath(filename)
+        self.keepRuns = keepRuns
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.isfile(self.filename):
+            try:
+                with open(self.filename) as f:
+                    self._entries = json.load(f)
+            except ValueError:
+                print("Warning: walltime history file '%s' is corrupt,"\
+                    " ignoring it." % self.filename)
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self._entries
+
+    def predictWalltime(self, fingerprint, modelRun=None):
+        """Returns the expected walltime (in seconds) of the run with the
+        given fingerprint, or None if it hasn't been run before.
+
+        :keyword modelRun: if given, and no run with the fingerprint is in
+          the history, the walltime is predicted from past runs of the same
+          ModelRun (see :func:`runKey`), e.g. before the simulator was
+          rebuilt."""
+        keys = [fingerprint]
+        if modelRun is not None:
+            keys.append(runKey(modelRun))
+        with self._lock:
+            for key in keys:
+                if key is None:
+                    continue
+                entry = self._entries.get(key)
+                if entry is not None and len(entry['walltimes']) > 0:
+                    return sum(entry['walltimes']) / \
+                        float(len(entry['walltimes']))
+        return None
+
+    def recordWalltime(self, fingerprint, modelRun, walltime):
+        """Record the walltime (in seconds) of a completed run, and save the
+        history to file."""
+        if fingerprint is None:
+            return
+        with self._lock:
+            for key in [fingerprint, runKey(modelRun)]:
+                entry = self._entries.setdefault(key, {'walltimes': []})
+                entry['name'] = modelRun.name
+                entry['nproc'] = modelRun.jobParams['nproc']
+                entry['walltimes'] = (entry['walltimes'] +
+                    [walltime])[-self.keepRuns:]
+            self._save()
+
+    def _save(self):
+        dirName = os.path.dirname(self.filename)
+        if not os.path.exists(dirName):
+            os.makedirs(dirName)
+        fd, tmpName = tempfile.mkstemp(dir=dirName, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._entries, f, indent=1, sort_keys=True)
+            replaceFile(tmpName, self.filename)
+        except:
+            os.remove(tmpName)
+            raise
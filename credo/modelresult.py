@@ -30,14 +30,158 @@ The primary interface is via the :class:`~credo.modelrun.ModelRun` class.
 from builtins import object
 
 import os
+import sys
 import glob
+import threading
+from collections import OrderedDict
 from xml.etree import ElementTree as etree
 import numpy as np
 
 from credo.io import stgfreq
-from credo.io.stgxml import writeXMLDoc
+from credo.io.stgxml import writeXMLDocAtomic
 from credo.analysis import fields
 
+def _stackHistories(histories, getTimes):
+    """Combine a list of (times, values) histories, e.g. of several cells,
+    into times and an array of shape (ntimes, len(histories)). getTimes is
+    used for the times if there are no histories."""
+    if len(histories) == 0:
+        t = np.array(getTimes())
+        return t, np.empty((len(t), 0))
+    t = np.array(histories[0][0])
+    return t, np.column_stack([np.asarray(v) for tv, v in histories])
+
+def _positionsToArray(positions):
+    """Convert a list of positions (arrays or tuples of coordinates, or
+    single numbers) to a contiguous float array, with NaNs for any positions
+    that are None."""
+    if not isinstance(positions, np.ndarray) and \
+            any(p is None for p in positions):
+        known = [p for p in positions if p is not None]
+        nan = np.full(np.shape(known[0]) if known else (), np.nan)
+        positions = [nan if p is None else p for p in positions]
+    return np.ascontiguousarray(positions, dtype=float)
+
+#: Default maximum total size (in bytes) of the field values kept in a
+#: :class:`FieldCache`: 256 MB.
+DEFAULT_FIELD_CACHE_BYTES = 256 * 1024**2
+
+def _valueBytes(value):
+    """Approximate size in bytes of a field value (an array, or tuple of
+    arrays e.g. times and history values)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    elif isinstance(value, (tuple, list)):
+        return sum(_valueBytes(v) for v in value)
+    else:
+        return sys.getsizeof(value)
+
+def _readOnlyValue(value):
+    """Returns a field value to be shared from a cache: arrays (including
+    those in tuples, e.g. times and history values) are replaced by read-only
+    views of them, so they can't be modified by one user of the cache for
+    all.  (The arrays themselves, which may belong to the model result, are
+    left as they were.)"""
+    if isinstance(value, np.ndarray):
+        if not value.flags.writeable:
+            return value
+        view = value.view()
+        view.flags.writeable = False
+        return view
+    elif isinstance(value, tuple):
+        return tuple(_readOnlyValue(v) for v in value)
+    else:
+        return value
+
+class FieldCache(object):
+    """A least recently used (LRU) cache of the field values read by
+    :class:`ModelResult` objects, so e.g. several test components checking
+    the same field of a result only read it once.  The cached values are kept
+    while their total size is within maxBytes, the least recently used being
+    evicted first.  One cache can be shared by several results, so they
+    share the one budget.  Cached arrays are shared by all users of the
+    results, so they're returned as read-only views.  A cache can be used by
+    several threads at once (e.g. by the checks of running models, see
+    :mod:`credo.jobrunner.runmonitor`).
+
+    .. attribute:: maxBytes
+
+       Maximum total size of the cached values, in bytes.
+
+    .. attribute:: hits
+
+       Number of values found in the cache.
+
+    .. attribute:: misses
+
+       Number of values that weren't in the cache, so were read.
+
+    .. attribute:: evictions
+
+       Number of values evicted to keep within maxBytes.
+    """
+    def __init__(self, maxBytes=DEFAULT_FIELD_CACHE_BYTES):
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.totalBytes = 0
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key, compute):
+        """Returns the cached value of key, or else the value computed (read)
+        by compute(), which is cached if it's not bigger than maxBytes.  (The
+        cache isn't locked while compute() is called, so other values can be
+        read at the same time.)"""
+        with self._lock:
+            if key in self._values:
+                self.hits += 1
+                value, size = self._values.pop(key)
+                self._values[key] = (value, size)
+                return value
+            self.misses += 1
+        value = _readOnlyValue(compute())
+        size = _valueBytes(value)
+        with self._lock:
+            if key in self._values:
+                # read by another thread meanwhile
+                return self._values[key][0]
+            if size <= self.maxBytes:
+                self._values[key] = (value, size)
+                self.totalBytes += size
+                self._evict()
+        return value
+
+    def resize(self, maxBytes):
+        """Change maxBytes, evicting values if needed."""
+        with self._lock:
+            self.maxBytes = maxBytes
+            self._evict()
+
+    def clear(self):
+        """Remove all the cached values (the counters are kept)."""
+        with self._lock:
+            self._values.clear()
+            self.totalBytes = 0
+
+    def stats(self):
+        """Returns a dictionary of the cache's counters and size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'entries': len(self._values),
+                    'totalBytes': self.totalBytes, 'maxBytes': self.maxBytes}
+
+    def _evict(self):
+        # (called with the lock held)
+        while self.totalBytes > self.maxBytes:
+            key, (value, size) = self._values.popitem(last=False)
+            self.totalBytes -= size
+            self.evictions += 1
+
 class ModelResult(object):
     """ A (mostly abstract) base class that defines the common interface of
     various model results from different simulators.  The primary users of these
@@ -63,6 +207,19 @@ class ModelResult(object):
     be specified in the dictionary.  i.e. field name not in the keys will be
     left untouched.
 
+    Attribute .fieldCache is None by default, or can be set to a
+    :class:`FieldCache` to cache the values read by the sub-class (i.e. the
+    results of ._getFieldAtOutputIndex() and the history methods, before
+    .ordering_map is applied), so values requested more than once (e.g. by
+    several TCs) are only read once.  The same FieldCache can be set for
+    several results, to keep them all within one memory budget (a
+    :class:`~credo.systest.api.SysTest` gives one to the results it checks).
+    NOTE that arrays returned from the cache are read-only, so callers that
+    change the values in place must copy them first.  NOTE also that the
+    histories read at single cells (.getFieldHistoryAtCell()) and at several
+    cells at once (.getFieldHistoryAtCells()) are cached separately, so a
+    history read both ways is kept twice.
+
     TODO: .ordering_map and .fieldname_map are both handled by subclass at the
     moment, should it be part of the ModelRun superclass?
 
@@ -82,6 +239,30 @@ class ModelResult(object):
         self.fieldname_map = fieldname_map
         if self.fieldname_map is None:
             self.fieldname_map = {}
+        self.fieldCache = None
+        # distinguishes this result's values in a shared field cache
+        self._cacheToken = object()
+        self._positionsArray = None
+
+    def _cached(self, key, compute):
+        """ Returns the value of key from the field cache (if there is one),
+        calling compute() to read it if it's not in the cache.
+        """
+        if self.fieldCache is None:
+            return compute()
+        return self.fieldCache.get((self._cacheToken,) + key, compute)
+
+    def getDataFilenames(self):
+        """ Returns a list of the files the result's data is read from
+        (absolute, or relative to the current directory).  This is used to
+        decide whether reference results used by test components have
+        changed, e.g. to reuse the result of a previous run of a test (see
+        :meth:`credo.systest.api.SysTest.getInputFingerprint`).
+
+        Returns None if the files are not known, which is the default.  Tests
+        using such results as references are always re-run.
+        """
+        return None
 
     def getFieldAtOutputIndex(self, field, outputIndex):
         try:
@@ -103,10 +284,11 @@ class ModelResult(object):
         compatible (some with dummy element for boundary conditions to be mapped
         out).
         """
+        orig = self._cached(('field', field, outputIndex),
+            lambda: self._getFieldAtOutputIndex(field, outputIndex))
         if self.ordering_map is None:
-            return self._getFieldAtOutputIndex(field, outputIndex)
+            return orig
         else:
-            orig = self._getFieldAtOutputIndex(field, outputIndex)
             if type(orig) == np.ndarray:
                 return orig[self.ordering_map]
             else:
@@ -140,9 +322,12 @@ class ModelResult(object):
         out).
         """
         if self.ordering_map is None:
-            return self._getFieldHistoryAtCell(field, cellIndex)
+            return self._cached(('cell', field, cellIndex),
+                lambda: self._getFieldHistoryAtCell(field, cellIndex))
         else:
-            t, val = self._getFieldHistoryAtCell(field, self.ordering_map[cellIndex])
+            cellIndex = self.ordering_map[cellIndex]
+            t, val = self._cached(('cell', field, cellIndex),
+                lambda: self._getFieldHistoryAtCell(field, cellIndex))
             return np.array(t), np.array(val)
 
     def _getFieldHistoryAtCell(self, field, cellIndex):
@@ -160,7 +345,8 @@ class ModelResult(object):
         if callable(field):
             return field(self, sourceIndex)
         else:
-            return self._getFieldHistoryAtSource(field, sourceIndex)
+            return self._cached(('source', field, sourceIndex),
+                lambda: self._getFieldHistoryAtSource(field, sourceIndex))
 
     def _getFieldHistoryAtSource(self, field, sourceIndex):
         """ Returns history value of specified field at one of the model's
@@ -169,6 +355,74 @@ class ModelResult(object):
         """
         raise NotImplementedError("._getFieldHistoryAtSource()")
 
+    def getFieldHistoryAtCells(self, field, cellIndices):
+        """ Returns times and history values of specified field at several of
+        the model's elements/cells, as a NumPy array of shape (ntimes, ncells),
+        with a column for each of cellIndices (in the order given).  The
+        cellIndices are mapped if self.ordering_map is specified, as for
+        getFieldHistoryAtCell().
+        """
+        try:
+            field = self.fieldname_map[field]
+        except KeyError:
+            pass
+        if callable(field):
+            return _stackHistories([field(self, i) for i in cellIndices],
+                                   self.getTimes)
+        else:
+            return self._getFieldHistoryAtCells_(field, cellIndices)
+
+    def _getFieldHistoryAtCells_(self, field, cellIndices):
+        """ Returns times and history values of specified field at several of
+        the model's element/cells, with cellIndices mapped if
+        self.ordering_map is specified.
+
+        Sub-classes should implement _getFieldHistoryAtCells() instead of this.
+        """
+        if self.ordering_map is not None:
+            cellIndices = [self.ordering_map[i] for i in cellIndices]
+        t, vals = self._cached(('cells', field, tuple(cellIndices)),
+            lambda: self._getFieldHistoryAtCells(field, cellIndices))
+        return np.asarray(t), np.asarray(vals)
+
+    def _getFieldHistoryAtCells(self, field, cellIndices):
+        """ Returns times and history values of specified field at several of
+        the model's element/cells, as an array of shape (ntimes, ncells).  By
+        default this calls _getFieldHistoryAtCell() for each cell, sub-classes
+        can implement a more efficient way of reading them all at once.
+        """
+        return _stackHistories(
+            [self._getFieldHistoryAtCell(field, i) for i in cellIndices],
+            self.getTimes)
+
+    def getFieldHistoryAtSources(self, field, sourceIndices):
+        """ Returns times and history values of specified field at several of
+        the model's sources, as a NumPy array of shape (ntimes, nsources),
+        with a column for each of sourceIndices (in the order given).
+        """
+        try:
+            field = self.fieldname_map[field]
+        except KeyError:
+            pass
+        if callable(field):
+            return _stackHistories([field(self, i) for i in sourceIndices],
+                                   self.getTimes)
+        else:
+            t, vals = self._cached(('sources', field, tuple(sourceIndices)),
+                lambda: self._getFieldHistoryAtSources(field, sourceIndices))
+            return np.asarray(t), np.asarray(vals)
+
+    def _getFieldHistoryAtSources(self, field, sourceIndices):
+        """ Returns times and history values of specified field at several of
+        the model's sources, as an array of shape (ntimes, nsources).  By
+        default this calls _getFieldHistoryAtSource() for each source,
+        sub-classes can implement a more efficient way of reading them all at
+        once.
+        """
+        return _stackHistories(
+            [self._getFieldHistoryAtSource(field, i) for i in sourceIndices],
+            self.getTimes)
+
     def getPositions(self):
         """ Returns a list of positions of all model's elements in order.
 
@@ -187,6 +441,25 @@ class ModelResult(object):
             orig = self._getPositions()
             return [orig[i] for i in self.ordering_map]
 
+    def getPositionsArray(self):
+        """ Returns the positions of all model's elements in order, as a
+        contiguous NumPy float array of shape (ncells, 3) (or (ncells, ndim)
+        for positions with other numbers of coordinates, or (ncells,) if each
+        position is a single number).  Positions that aren't defined (e.g. of
+        atmosphere blocks) are NaN.
+
+        The array is only made once (and again if .ordering_map is replaced),
+        so it's much faster than getPositions() for large models, but it's
+        shared so shouldn't be modified.
+        """
+        if self._positionsArray is None or \
+                self._positionsArray[0] is not self.ordering_map:
+            positions = _positionsToArray(self._getPositions())
+            if self.ordering_map is not None:
+                positions = positions[np.asarray(self.ordering_map, dtype=int)]
+            self._positionsArray = (self.ordering_map, positions)
+        return self._positionsArray[1]
+
     def _getPositions(self):
         """ Returns a list of positions of all model's elements in order.
 
@@ -235,10 +508,7 @@ class ModelResult(object):
         # Write the files
         if not os.path.exists(outputDir): os.makedirs(outputDir)
         fullPath = os.path.join(outputDir, filename)
-        outFile = open(fullPath, 'wb')
-        writeXMLDoc(xmlDoc, outFile, prettyPrint)
-        outFile.close()
-        return fullPath
+        return writeXMLDocAtomic(xmlDoc, fullPath, prettyPrint)
 
 class HistoryDataResult(ModelResult):
     """History data results for specified fields and cell or source indices.
@@ -257,6 +527,10 @@ class HistoryDataResult(ModelResult):
                                             fieldname_map=fieldname_map)
         self._data = data
 
+    def getDataFilenames(self):
+        """ The data is given directly, not read from files. """
+        return []
+
     def _getFieldHistoryAtCell(self, field, cellIndex):
         t = self._data[field, cellIndex][:,0]
         val = self._data[field, cellIndex][:,1]
@@ -277,7 +551,10 @@ class DigitisedOneDFieldResult(ModelResult):
                                             fieldname_map=fieldname_map)
         self.field = field
         self.outputIndex = outputIndex
+        self.fileName = fileName
         self.data = np.loadtxt(fileName)
+    def getDataFilenames(self):
+        return [self.fileName]
     def getCoordinates(self):
         return self.data[:, 0]
     def _getFieldAtOutputIndex(self, field, outputIndex):
@@ -382,10 +659,7 @@ class UnderworldModelResult(ModelResult):
         # Write the files
         if not os.path.exists(outputDir): os.makedirs(outputDir)
         fullPath = os.path.join(outputDir, filename)
-        outFile = open(fullPath, 'wb')
-        writeXMLDoc(xmlDoc, outFile, prettyPrint)
-        outFile.close()
-        return fullPath
+        return writeXMLDocAtomic(xmlDoc, fullPath, prettyPrint)
 
     def readFromRecordXML(self, xmlFilename):
         # parse in doc
@@ -459,6 +733,4 @@ def updateModelResultsXMLFieldInfo(filename, newFieldResult, prettyPrint=True):
     newFieldResult.writeInfoXML(fieldResultsNode)
 
     # Write the file, default name if filename provided is empty
-    outFile = open(filename, 'wb')
-    writeXMLDoc(xmlDoc, outFile, prettyPrint)
-    outFile.close()
+    writeXMLDocAtomic(xmlDoc, filename, prettyPrint)
@@ -39,7 +39,7 @@ from datetime import timedelta
 import shutil
 import inspect
 from xml.etree import ElementTree as etree
-from credo.io.stgxml import writeXMLDoc
+from credo.io.stgxml import writeXMLDocAtomic
 import credo.modelresult
 from credo.io import stgxml
 from credo.io import stgpath
@@ -68,6 +68,13 @@ class ModelRun(object):
         .getModelRunCommand() .getStdOutFilename() .getStdErrFilename()
         .checkValidRunConfig() .preRunPreparation() .postRunCleanup()
         .createModelResult()
+    and, if caching run results:
+        .getInputFilenames() .getOutputFilenames() .getSimulatorExecutable()
+    and, if monitoring runs while they run:
+        .getProgressLogFilename() .createProgressParser() .liveChecks
+        .createPartialModelResult()
+    and, if reporting the progress of runs:
+        .getSimTimeLimits() .readSimTime()
 
 
     Key attributes:
@@ -96,6 +103,13 @@ class ModelRun(object):
        A :class:`.JobParams` class, to record options needed to define
        how the model should be actually run (eg number of procs to use).
 
+    .. attribute:: liveChecks
+
+       List of checks of the run's outputs to do while it runs (each with a
+       .check() method returning the reason the run should be aborted, or
+       None, and an .evidence attribute) - see
+       :mod:`credo.jobrunner.runmonitor`.
+
     """
     def __init__(self, name, basePath=None, outputPath=None, logPath=None):
         self.name = name
@@ -115,6 +129,7 @@ class ModelRun(object):
         else:
             self.logPath = logPath
         self.jobParams = JobParams()
+        self.liveChecks = []
 
     def getModelRunCommand(self, extraCmdLineOpts=None):
         """ Construct the command needed to run that model, and return as a
@@ -157,6 +172,61 @@ class ModelRun(object):
         saved to."""
         return os.path.join(self.outputPath, "%s.stderr" % self.name)
 
+    def getInputFilenames(self):
+        """ Returns a list of all the input files the model reads (relative to
+        .basePath, or absolute).  This is used to decide whether a model's
+        inputs have changed, e.g. to reuse cached results of a previous run
+        (see :mod:`credo.jobrunner.runcache`).
+
+        Returns None if the input files are not known, which is the default.
+        Such models are always re-run.
+        """
+        return None
+
+    def getOutputFilenames(self):
+        """ Returns a list of output files (relative to .basePath, or absolute)
+        that the model writes outside its .outputPath, and which are needed by
+        .createModelResult().  Default is an empty list.
+        """
+        return []
+
+    def getSimulatorExecutable(self):
+        """ Returns the name (or path) of the simulator program used to run
+        the model, if known, otherwise None.
+        """
+        return None
+
+    def getProgressLogFilename(self):
+        """ Returns the file (relative to .basePath, or absolute) the model
+        logs its progress (e.g. time steps) to as it runs, which can be
+        followed to monitor the run (see :mod:`credo.jobrunner.runmonitor`).
+        Default is None, meaning the progress is logged to std out.
+        """
+        return None
+
+    def createProgressParser(self):
+        """ Returns a parser of the progress log of the model (see
+        .getProgressLogFilename()), with a .parseLine() method, e.g.
+        :class:`credo.io.waiweralog.WaiweraLogParser`, or None (the default)
+        if its progress can't be parsed.
+        """
+        return None
+
+    def getSimTimeLimits(self):
+        """ Returns the (start, stop) simulated times of the model, used to
+        work out how far through it a run is (see
+        :mod:`credo.jobrunner.progress`), or None (the default) if not known.
+        """
+        return None
+
+    def readSimTime(self):
+        """ Returns the simulated time the run has reached, as read from the
+        outputs written so far, or None (the default) if it can't be read.
+        This is only used if the progress parser (see
+        .createProgressParser()) doesn't give the time.
+        """
+        return None
+
     def checkValidRunConfig(self):
         pass
 
@@ -172,6 +242,13 @@ class ModelRun(object):
         """
         raise NotImplementedError(".createModelResult()")
 
+    def createPartialModelResult(self):
+        """ Returns a ModelResult of the outputs the model has written so far,
+        while it is still running (e.g. for live checks, see .liveChecks).
+        Default is the same as .createModelResult().
+        """
+        return self.createModelResult()
+
     def writeInfoXML(self, writePath="", filename="", update=False,
             prettyPrint=True):
         """Writes an XML recording the key details of this ModelRun, in CREDO
@@ -227,10 +304,7 @@ class ModelRun(object):
         # Write the file
         if not os.path.exists(writePath):
             os.makedirs(writePath)
-        outFile = open(writePath+filename, 'wb')
-        writeXMLDoc(xmlDoc, outFile, prettyPrint)
-        outFile.close()
-        return writePath+filename
+        return writeXMLDocAtomic(xmlDoc, writePath+filename, prettyPrint)
 
 
 
@@ -392,6 +466,7 @@ class UnderworldModelRun(ModelRun):
         else:
             self.logPath = self.setPath(logPath)
         self.jobParams = JobParams(nproc=nproc)
+        self.liveChecks = []
         self.simParams = simParams
         self.paramOverrides = paramOverrides
         if self.paramOverrides == None:
@@ -491,7 +566,8 @@ class UnderworldModelRun(ModelRun):
         if self.solverOpts:
             soCopyPath = os.path.join(absOutputPath,
                 SOLVER_OPTS_RECORD_FILENAME)
-            shutil.copy(self.solverOpts, soCopyPath)
+            shutil.copy(os.path.join(self.basePath, self.solverOpts),
+                soCopyPath)
 
         # Allow all analysis operators to do any post-run cleanup
         for opName, analysisOp in self.analysisOps.items():
@@ -503,6 +579,26 @@ class UnderworldModelRun(ModelRun):
             # If this hook isn't implemented, keep going.
             pass
 
+    def getSimTimeLimits(self):
+        """Returns (0, stop time) if the run's :attr:`.simParams` set a stop
+        time, otherwise None (the number of steps doesn't say how far
+        through the model a run is)."""
+        if self.simParams is None or self.simParams.stoptime is None:
+            return None
+        return (0.0, self.simParams.stoptime)
+
+    def readSimTime(self):
+        """Returns the simulated time of the last record of the run's
+        FrequentOutput.dat file, or None if it hasn't been written yet."""
+        absOutputPath = os.path.join(self.basePath, self.outputPath)
+        try:
+            tSteps, simTime = credo.modelresult.getSimInfoFromFreqOutput(
+                absOutputPath)
+        except (IOError, ValueError, IndexError, KeyError):
+            # No file yet, or still being written.
+            return None
+        return simTime
+
     def defaultModelRunFilename(self):
         """Calculates and returns a default filename for the ModelRun's XML
         record filename."""
@@ -599,10 +695,7 @@ class UnderworldModelRun(ModelRun):
         # Write the file
         if not os.path.exists(writePath):
             os.makedirs(writePath)
-        outFile = open(writePath+filename, 'wb')
-        writeXMLDoc(xmlDoc, outFile, prettyPrint)
-        outFile.close()
-        return writePath+filename
+        return writeXMLDocAtomic(xmlDoc, writePath+filename, prettyPrint)
 
     def analysisXMLGen(self, filename=None):
         """Generates an XML file, in StGermainData XML format, to over-ride
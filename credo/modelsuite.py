@@ -420,26 +420,22 @@ class ModelSuite(object):
         '''Remove all files in each model's output path. Useful to get rid of
         results still there from previous jobs. Doesn't delete sub-directories,
         in case they are other model runs' results that should be ignored.'''
-        startDir = os.getcwd()
         for modelRun in self.runs:
-            os.chdir(modelRun.basePath)
-            for filePath in glob.glob(os.path.join(modelRun.outputPath,"*")):
+            absOutPath = os.path.join(modelRun.basePath, modelRun.outputPath)
+            for filePath in glob.glob(os.path.join(absOutPath, "*")):
                 if os.path.isfile(filePath):
                     os.unlink(filePath)
-            os.chdir(startDir)
 
     def cleanAllLogFiles(self):
         """Remove all stdout and stderr files from each ModelRun's designated
         output and log paths."""
-        startDir = os.getcwd()
         for modelRun in self.runs:
-            os.chdir(modelRun.basePath)
             logFiles = [modelRun.getStdOutFilename(),
                 modelRun.getStdErrFilename()]
             for fname in logFiles:
-                if os.path.isfile(fname):
-                    os.unlink(fname)
-            os.chdir(startDir)
+                absFname = os.path.join(modelRun.basePath, fname)
+                if os.path.isfile(absFname):
+                    os.unlink(absFname)
 
     def addVariant(self, name, modelVariant):
         """Add a :class:`.StgXMLVariant` to the list to be applied to a
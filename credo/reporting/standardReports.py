@@ -102,7 +102,17 @@ def defaultAnalysisImgEls(mSuite, rGen, level):
                 width=rGen.PAGE_WIDTH * .6))
     return elements
 
+def resolveReportPaths(basePath, rGen, outName):
+    """Resolve the report filename outName, and the base path of the report
+    generator rGen, against basePath (if they're relative), so reports
+    don't depend on the working directory. Returns the resolved outName."""
+    rGen.basePath = os.path.join(basePath, rGen.basePath)
+    return os.path.join(basePath, outName)
+
 def makeSuiteReport(mSuite, mResults, rGen, outName, imgPerRow=3):
+    """Make a report of a model suite. Relative paths are relative to the
+    base path of the suite's runs."""
+    outName = resolveReportPaths(mSuite.runs[0].basePath, rGen, outName)
     #content
     # TODO: would be good is suite had a name here .. use output path for now.
     title = "Suite Report: %s" % mSuite.outputPathBase
@@ -129,9 +139,12 @@ def makeSuiteReport(mSuite, mResults, rGen, outName, imgPerRow=3):
 def makeSciBenchReport(sciBTest, mResults, rGen, outName, imgPerRow=3):
     """Make a science benchmark report.
     :param sciBTest: a science benchmark test to create report of.
-    :param rGen: a report generator instatiation.
-    :param outName: name of file to save generated report as.
+    :param rGen: a report generator instatiation (with a base path that's
+      absolute, or relative to the test's base path).
+    :param outName: name of file to save generated report as (absolute, or
+      relative to the test's base path).
     :param imgPerRow: how many images to use per row."""
+    outName = resolveReportPaths(sciBTest.basePath, rGen, outName)
     #content
     title = "%s Report" % sciBTest.testName
     description = sciBTest.description
@@ -76,6 +76,7 @@ from .singleRunWithinTolTC import FieldWithinTolTC
 from .singleRunWithinTolTC import HistoryWithinTolTC
 from .singleRunWithinTolTC import OneDSolutionWithinTolTC
 from .outputWithinRangeTC import OutputWithinRangeTC
+from .performanceWithinTolTC import PerformanceWithinTolTC, addRepeatedRuns
 
 from .singleRunWithinTolTC import BaseWithinTolTC, calc_errors, calc_dist_errors
 
@@ -34,7 +34,11 @@ from builtins import object
 
 import os
 import copy
+import json
 import types
+import hashlib
+import threading
+from future.moves.queue import Queue
 from datetime import timedelta
 from xml.etree import ElementTree as etree
 import credo.modelrun as mrun
@@ -44,6 +48,9 @@ import credo.io.stgxml
 import credo.io.stgpath as stgpath
 import credo.utils
 import credo.jobrunner
+from credo.jobrunner.runcache import suiteRunFingerprint, executableHash, \
+    fileHash
+from credo.jobrunner.api import ModelRunAbortedError
 
 class SysTestSetupError(Exception):
     """An exception for when a System test fails to set up correctly."""
@@ -59,6 +66,12 @@ class SysTestResult(object):
 
        One-word status string summarising test result (eg 'Pass').
 
+    .. attribute:: cached
+
+       True if this result was not freshly generated, but is that of a
+       previous run of the test, whose inputs haven't changed since (see
+       the `incremental` option of :meth:`.SysTest.runTest`).
+
     .. attribute:: _absRecordFile
 
        The absolute path of where the system test was saved to.
@@ -66,6 +79,7 @@ class SysTestResult(object):
 
     detailMsg = None
     statusStr = None
+    cached = False
     _absRecordFile = None
 
     def __str__(self):
@@ -230,6 +244,22 @@ class SysTest(object):
 
        A list of the file-names of all generated reports created based on
        this benchmark.
+
+    .. attribute:: fieldCacheBytes
+
+       Maximum total size (in bytes) of the field values read from the
+       model results of the test that are kept in its :attr:`.fieldCache`,
+       so test components checking the same fields only read them once.
+       Defaults to :data:`credo.modelresult.DEFAULT_FIELD_CACHE_BYTES`. If
+       None (or 0), field values aren't cached.
+
+    .. attribute:: fieldCache
+
+       The :class:`~credo.modelresult.FieldCache` shared by the model
+       results of the test while they're checked (unless they already have
+       one), created each time the test is run (see :meth:`.runTest`), and
+       cleared once it's done. None if not running, or no values are to be
+       cached.
     """
     def __init__(self, testType, testName, basePath, outputPathBase,
             nproc=1, timeout=None):
@@ -252,6 +282,8 @@ class SysTest(object):
         self.testStatus = None
         self.customReporting = None
         self.generatedReports = []
+        self.fieldCacheBytes = mresult.DEFAULT_FIELD_CACHE_BYTES
+        self.fieldCache = None
 
     def regenerateFixture(self, jobRunner):
         '''Function to do any setup of tests for the first time they're run,
@@ -265,7 +297,8 @@ class SysTest(object):
         self.configureTestComps()
 
     def runTest(self, jobRunner, postProcFromExisting=False,
-                createReports=True, extraCmdLineOpts=None):
+                createReports=True, extraCmdLineOpts=None,
+                pipelineChecks=False, incremental=False):
         """Run this sysTest, and return the
         :class:`~credo.systest.api.SysTestResult` it produces.
         Will also write an XML record of the System test, and each ModelRun
@@ -275,16 +308,57 @@ class SysTest(object):
             but will read the result from existing modelResults.
         :keyword createReports: if True, will create external reports
             (additional to the XML record) this test specifies.
+        :keyword pipelineChecks: if True, the single-run test components of
+            each run are checked (in a separate thread) as soon as that run
+            completes, overlapping with any runs still going, rather than
+            after the whole suite has run. Multi-run test components are
+            checked once all the results are in.
+        :keyword incremental: if True, and the test has been run before
+            (with incremental set) and passed or failed, and none of its
+            inputs have changed since (see :meth:`.getInputFingerprint`),
+            the previous result is returned without running or checking
+            anything, marked as :attr:`~.SysTestResult.cached`. The
+            previous XML record of the test is kept.
         :returns: SysTestResult, and list of ModelResults
-           (since latter may be useful for further post-processing)"""
+           (since latter may be useful for further post-processing)
+
+        .. note:: the working directory isn't changed, so several tests can
+           be run at once from different threads. Relative paths used by the
+           model runs and test components (e.g. reference data paths) are
+           resolved against the test's :attr:`.basePath`, and custom setup
+           and reporting functions should do the same."""
 
         print("Running '%s' system test (%s):" % (self.testName, self.testType))
-        startDir = os.getcwd()
-        os.chdir(self.basePath)
         print("Attaching test component analysis ops to suite ModelRuns")
         self.attachAllTestCompOps()
+        fingerprint = None
+        if incremental and postProcFromExisting == False:
+            fingerprint = self.getInputFingerprint(extraCmdLineOpts)
+            sysTestResult = self._readCachedResult(fingerprint)
+            if sysTestResult is not None:
+                print("%s '%s' result: **%s** (cached: inputs unchanged"\
+                    " since last run)" % (self.testType, self.testName,
+                    sysTestResult))
+                return sysTestResult, None
         print("Writing pre-test info to XML")
         self.writePreRunXML()
+        if self.fieldCacheBytes:
+            self.fieldCache = mresult.FieldCache(self.fieldCacheBytes)
+        try:
+            return self._runAndCheck(jobRunner, postProcFromExisting,
+                createReports, extraCmdLineOpts, pipelineChecks,
+                incremental, fingerprint)
+        finally:
+            # Don't keep values read for this run of the test (e.g. while
+            #  other tests are run) - its results can still be read.
+            if self.fieldCache is not None:
+                self.fieldCache.clear()
+                self.fieldCache = None
+
+    def _runAndCheck(self, jobRunner, postProcFromExisting, createReports,
+            extraCmdLineOpts, pipelineChecks, incremental, fingerprint):
+        """Run the test's suite (or read its existing results) and check
+        them, for :meth:`.runTest`."""
         if postProcFromExisting == False:
             if len(self.mSuite.runs) < 1:
                 raise AttributeError("Error: test's ModelSuite has zero runs"\
@@ -294,16 +368,58 @@ class SysTest(object):
             for mRun in self.mSuite.runs:
                 assert mRun.outputPath != self.outputPathBase
             self.mSuite.preRunCleanup()
+            checks = {}
+            checkErrors = []
+            resultCallback = None
+            if pipelineChecks:
+                self.tcResults = [{} for mRun in self.mSuite.runs]
+                # A single checking thread, so checks don't compete with
+                #  each other (or need to be thread-safe).
+                checkQueue = Queue()
+                def checkRuns():
+                    while True:
+                        item = checkQueue.get()
+                        if item is None:
+                            return
+                        runI, modelResult = item
+                        try:
+                            checks[runI] = self.checkRunTestComps(runI,
+                                modelResult)
+                        except Exception as e:
+                            checkErrors.append(e)
+                checker = threading.Thread(target=checkRuns,
+                    name="credo-checker")
+                checker.daemon = True
+                checker.start()
+                def resultCallback(runI, modelResult):
+                    checkQueue.put((runI, modelResult))
             try:
                 suiteResults = jobRunner.runSuite(self.mSuite,
                     extraCmdLineOpts=extraCmdLineOpts,
-                    maxRunTime=self.timeout, writeRecords=True)
+                    maxRunTime=self.timeout, writeRecords=True,
+                    resultCallback=resultCallback)
+            except ModelRunAbortedError as mre:
+                suiteResults = None
+                sysTestResult = self.setAbortedStatus(mre)
             except Exception as mre:
                 suiteResults = None
                 sysTestResult = self.setErrorStatus(str(mre))
             else:
                 print("Processing sys test result:")
-                sysTestResult = self.getStatus(suiteResults)
+                if pipelineChecks:
+                    # Wait for checks still going, re-raising any errors.
+                    checkQueue.put(None)
+                    checker.join()
+                    if len(checkErrors) > 0:
+                        raise checkErrors[0]
+                    sysTestResult = self.getStatus(suiteResults,
+                        checkedRuns=list(checks.keys()))
+                else:
+                    sysTestResult = self.getStatus(suiteResults)
+            finally:
+                if pipelineChecks and checker.is_alive():
+                    checkQueue.put(None)
+                    checker.join()
         else:
             print("(Reading existing results from %s)" % \
                 (os.path.join(self.basePath, self.outputPathBase)))
@@ -330,9 +446,117 @@ class SysTest(object):
         if createReports and not isinstance(sysTestResult, CREDO_ERROR):
             self.createReports(suiteResults)
         sysTestResult.setRecordFile(outFilePath)
-        os.chdir(startDir)
+        if incremental and postProcFromExisting == False:
+            self._writeManifest(fingerprint, sysTestResult)
         return sysTestResult, suiteResults
 
+    def defaultManifestFilename(self):
+        """Return the default filename of the manifest used to decide
+        whether the test needs re-running in incremental mode (see
+        :meth:`.runTest`)."""
+        return 'SysTest-'+self.testName+'.manifest.json'
+
+    def getInputFingerprint(self, extraCmdLineOpts=None):
+        """Returns a dictionary describing everything the result of this
+        test depends on: a fingerprint of each run in the suite (see
+        :func:`credo.jobrunner.runcache.suiteRunFingerprint`), a hash of each
+        simulator executable, a hash of each reference data file of the test
+        components (see
+        :meth:`.TestComponent.getReferenceFilenames`), and a hash of the
+        test's specification and test components (as written to its pre-run
+        XML).
+        The 'fingerprint' key holds a hash of all of these together.
+
+        Should be called after test component ops have been attached to the
+        suite (see :meth:`.attachAllTestCompOps`).
+
+        :returns: the dictionary, or None if any of the runs, or reference
+          data of test components, can't be fingerprinted (in which case the
+          test must always be re-run)."""
+        runs = []
+        simulators = {}
+        for runI, mRun in enumerate(self.mSuite.runs):
+            runFP = suiteRunFingerprint(self.mSuite, runI, extraCmdLineOpts)
+            if runFP is None:
+                return None
+            runs.append([mRun.name, runFP])
+            simulator = mRun.getSimulatorExecutable()
+            if simulator is not None:
+                simulators[simulator] = executableHash(simulator)
+        references = {}
+        testComps = [tc for tcForRun in self.testComps
+            for tc in tcForRun.values()] + \
+            list(self.multiRunTestComps.values())
+        for tc in testComps:
+            refFilenames = tc.getReferenceFilenames()
+            if refFilenames is None:
+                return None
+            for refFilename in refFilenames:
+                refFilename = os.path.join(self.basePath, refFilename)
+                # (missing files are still part of the fingerprint)
+                references[refFilename] = fileHash(refFilename) \
+                    if os.path.isfile(refFilename) else None
+        baseNode = self._createXMLBaseNode()
+        self._writeXMLDescription(baseNode)
+        self._writeXMLSpecification(baseNode)
+        self._writeXMLTestComponentPreRuns(baseNode)
+        testConfig = hashlib.sha256(etree.tostring(baseNode)).hexdigest()
+        manifest = {'runs': runs, 'simulators': simulators,
+            'references': references, 'testConfig': testConfig}
+        manifest['fingerprint'] = hashlib.sha256(json.dumps(manifest,
+            sort_keys=True).encode('utf-8')).hexdigest()
+        return manifest
+
+    def _manifestFilePath(self):
+        outputPath, filename = self._resolveXMLOutputPathFilename(
+            filename=self.defaultManifestFilename())
+        return os.path.join(outputPath, filename)
+
+    def _readCachedResult(self, fingerprint):
+        """If the test's manifest shows it was last run with the same
+        fingerprint (see :meth:`.getInputFingerprint`), and the record of
+        that run still exists, returns the result of that run (and sets it
+        as the test's status). Otherwise returns None."""
+        if fingerprint is None:
+            return None
+        try:
+            with open(self._manifestFilePath()) as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if manifest.get('fingerprint') != fingerprint['fingerprint']:
+            return None
+        resultClasses = {'Pass': CREDO_PASS, 'Fail': CREDO_FAIL}
+        prevResult = manifest['result']
+        if prevResult['status'] not in resultClasses or \
+                not os.path.isfile(prevResult['recordFile']):
+            return None
+        sysTestResult = resultClasses[prevResult['status']](
+            str(prevResult['detailMsg']))
+        sysTestResult.cached = True
+        sysTestResult.setRecordFile(prevResult['recordFile'])
+        self.testStatus = sysTestResult
+        return sysTestResult
+
+    def _writeManifest(self, fingerprint, sysTestResult):
+        """Save the fingerprint the test was run with, and its result, to
+        the test's manifest. Errors are never re-used, so if there was an
+        error (or the test can't be fingerprinted) any manifest is removed
+        instead."""
+        manifestFile = self._manifestFilePath()
+        if fingerprint is None or isinstance(sysTestResult, CREDO_ERROR):
+            if os.path.exists(manifestFile):
+                os.remove(manifestFile)
+            return
+        manifest = dict(fingerprint)
+        manifest['result'] = {'status': sysTestResult.statusStr,
+            'detailMsg': sysTestResult.detailMsg,
+            'recordFile': sysTestResult.getRecordFile()}
+        tmpFile = manifestFile + '.tmp'
+        with open(tmpFile, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        credo.utils.replaceFile(tmpFile, manifestFile)
+
     def configureSuite(self):
         """Function for configuring the :class:`credo.modelsuite.ModelSuite`
         to be used for testing on. Must be saved to :attr:`.mSuite` by the
@@ -377,7 +601,7 @@ class SysTest(object):
         evaluate properly."""
         pass
 
-    def getStatus(self, resultsSet):
+    def getStatus(self, resultsSet, checkedRuns=None):
         """After a suite of runs created by :meth:".genSuite"
         has been run, when this method is passed the results of the suite
         (as a list of :class:`credo.modelresult.ModelResult`), it must decide
@@ -389,6 +613,11 @@ class SysTest(object):
         for the system test do check its status, all must pass for a total
         pass.
 
+        :keyword checkedRuns: indices of runs whose single-run test
+           components have already been checked, using
+           :meth:`.checkRunTestComps` (e.g. as each run completed), so
+           don't need checking again.
+
         .. note:: if using this default method, then sub-classes need to
            have defined `failMsg` and `passMsg` attributes to use.
         """
@@ -403,32 +632,17 @@ class SysTest(object):
                 " (lens are %d and %d, respectively)" %\
                 (len(resultsSet), len(self.testComps)))
         self.checkModelResultsValid(resultsSet)
+        for modelResult in resultsSet:
+            self._shareFieldCache(modelResult)
+        if checkedRuns is None:
+            checkedRuns = []
+            self.tcResults = [{} for res in resultsSet]
         runPassed = [None for res in resultsSet]
-        self.tcResults = [{} for res in resultsSet]
-        #TODO: cleanup in future when iterator/generator interface improved
-        if self.mSuite.iterGen is not None:
-            inIter = msuite.getVariantIndicesIter(self.mSuite.modelVariants,
-                self.mSuite.iterGen)
-            varDicts = msuite.getVariantNameDicts(self.mSuite.modelVariants,
-                inIter)
         for runI, modelResult in enumerate(resultsSet):
-            if len(self.testComps[runI]) > 0:
-                print("Testing single-run T.C.s for model result %d" % (runI))
-                if self.mSuite.iterGen is not None:
-                    print("(var-generated, with variants applied of:\n%s)"\
-                        % varDicts[runI])
-            for tcName, tComp in list(self.testComps[runI].items()):
-                tcResult = tComp.check(modelResult)
-                self.tcResults[runI][tcName] = tcResult
-            runPassed[runI] = all(self.tcResults[runI].values())
-            if len(self.testComps[runI]) > 0:
-                if runPassed[runI]:
-                    print("All single run test components for"\
-                        " run %d passed." % runI)
-                else:
-                    #Do not break - we want to do all checks for sys tests
-                    print("at least one single run test component for"\
-                       " run %d failed." % runI)
+            if runI in checkedRuns:
+                runPassed[runI] = all(self.tcResults[runI].values())
+            else:
+                runPassed[runI] = self.checkRunTestComps(runI, modelResult)
         self.allsrPassed = all(runPassed)
         #Now do the Multi-run test components
         if len(self.multiRunTestComps) > 0:
@@ -449,6 +663,46 @@ class SysTest(object):
             self.testStatus = CREDO_FAIL(self.failMsg)
         return self.testStatus
 
+    def _shareFieldCache(self, modelResult):
+        """Give a model result of the test the test's :attr:`.fieldCache`,
+        if there is one and the result doesn't already have its own."""
+        if self.fieldCache is not None and \
+                getattr(modelResult, 'fieldCache', None) is None:
+            modelResult.fieldCache = self.fieldCache
+
+    def checkRunTestComps(self, runI, modelResult):
+        """Check each of the single-run test components of the run with
+        index runI in the suite, given its
+        :class:`~credo.modelresult.ModelResult`. Results of each check are
+        saved in :attr:`.tcResults` (which must already be set up to hold
+        results for all runs).
+
+        :returns: whether all the run's test components passed."""
+        self._shareFieldCache(modelResult)
+        if len(self.testComps[runI]) > 0:
+            print("Testing single-run T.C.s for model result %d" % (runI))
+            #TODO: cleanup in future when iterator/generator interface improved
+            if self.mSuite.iterGen is not None:
+                inIter = msuite.getVariantIndicesIter(
+                    self.mSuite.modelVariants, self.mSuite.iterGen)
+                varDicts = msuite.getVariantNameDicts(
+                    self.mSuite.modelVariants, inIter)
+                print("(var-generated, with variants applied of:\n%s)"\
+                    % varDicts[runI])
+        for tcName, tComp in list(self.testComps[runI].items()):
+            tcResult = tComp.check(modelResult)
+            self.tcResults[runI][tcName] = tcResult
+        runPassed = all(self.tcResults[runI].values())
+        if len(self.testComps[runI]) > 0:
+            if runPassed:
+                print("All single run test components for"\
+                    " run %d passed." % runI)
+            else:
+                #Do not break - we want to do all checks for sys tests
+                print("at least one single run test component for"\
+                   " run %d failed." % runI)
+        return runPassed
+
     def getTCRes(self, tcName, allowMissing=True):
         """Utility function for single run test components to get lists of
         test components, and tc results, for each run of a given testComp
@@ -485,6 +739,26 @@ class SysTest(object):
         self.testStatus = testStatus
         return testStatus
 
+    def setAbortedStatus(self, abortedError):
+        """Utility function for if a model run is aborted while running
+        (see :class:`~credo.jobrunner.api.ModelRunAbortedError`). If it was
+        aborted by the live check of one of the test's components (see e.g.
+        :attr:`credo.systest.singleRunWithinTolTC.BaseWithinTolTC.liveCheckFactor`),
+        the test fails, with the evidence the component found so far.
+        Otherwise this is an error, as for :meth:`.setErrorStatus`."""
+        failedTCs = []
+        for runI, testCompsForRun in enumerate(self.testComps):
+            for tcName, testComp in list(testCompsForRun.items()):
+                if getattr(testComp, 'abortedLive', False):
+                    failedTCs.append("%s (run %d)" % (tcName, runI))
+        if len(failedTCs) == 0:
+            return self.setErrorStatus(str(abortedError))
+        testStatus = CREDO_FAIL("Run '%s' aborted early, as live check of"\
+            " test component(s) %s failed: %s" % (abortedError.modelName,
+            ", ".join(failedTCs), abortedError.reason))
+        self.testStatus = testStatus
+        return testStatus
+
     def setTimeout(self, seconds=0, minutes=0, hours=0, days=0):
         """Sets the :attr:`~.timeout` parameter, used to determine how long
         the test is allowed to run for."""
@@ -583,10 +857,8 @@ class SysTest(object):
         if not os.path.exists(outputPath):
             os.makedirs(outputPath)
         outFilePath = os.path.join(outputPath, filename)
-        outFile = open(outFilePath, 'wb')
-        credo.io.stgxml.writeXMLDoc(xmlDoc, outFile, prettyPrint)
-        outFile.close()
-        return outFilePath
+        return credo.io.stgxml.writeXMLDocAtomic(xmlDoc, outFilePath,
+            prettyPrint)
 
     def _getXMLBaseNodeFromFile(self, outputPath="", filename=""):
         """Open the XML file in outputPath and given by filename (if these
@@ -837,6 +1109,19 @@ class TestComponent(object):
         self.tcStatus = None
         self.tcType = tcType
 
+    def getReferenceFilenames(self):
+        """Returns a list of the files of reference data (e.g. expected
+        results) the test component compares the results of runs with
+        (absolute, or relative to the :attr:`~.SysTest.basePath` of the
+        test, which they are resolved against), so the test is re-run in
+        incremental mode if they change (see
+        :meth:`.SysTest.getInputFingerprint`). Returns None if they are not
+        known, in which case the test is always re-run.
+
+        Default is an empty list, for test components without reference
+        data."""
+        return []
+
     def _setStatus(self, result, statusMsg):
         """Utility function for setting the :attr:`.tcStatus` correctly.
         Useful to use at the end of the check() function by child classes."""
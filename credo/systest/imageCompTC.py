@@ -50,12 +50,14 @@ class ImageCompTC(SingleRunTestComponent):
 
     .. attribute:: refPath
 
-       Path to look for reference images.
+       Path to look for reference images (if relative, relative to the
+       ModelRun's base path).
 
     .. attribute:: genPath
 
        Path to look for generated images (if left as `None`, will default to
-       ModelRun's specified output path.)
+       ModelRun's specified output path. If relative, relative to the
+       ModelRun's base path.)
 
     .. attribute:: imageResults
 
@@ -90,12 +92,29 @@ class ImageCompTC(SingleRunTestComponent):
             self.genPath = None
         self.imageResults = None
         self.imageErrors = None
+        self._basePath = None
 
     def attachOps(self, modelRun):
         """Implements base class
-        :meth:`credo.systest.api.SingleRunTestComponent.attachOps`."""
-        # Nothing to do here - requires that the user has defined their
-        # model XMLs correctly to generate the images.
+        :meth:`credo.systest.api.SingleRunTestComponent.attachOps`. Nothing
+        needs attaching - requires that the user has defined their model
+        XMLs correctly to generate the images - but the run's base path is
+        saved to find the images relative to."""
+        self._basePath = modelRun.basePath
+
+    def _resolvePath(self, path):
+        """Returns path, relative to the base path of the run the test
+        component is attached to (if any)."""
+        if self._basePath is None:
+            return path
+        return os.path.join(self._basePath, path)
+
+    def getReferenceFilenames(self):
+        """Implements base class
+        :meth:`credo.systest.api.TestComponent.getReferenceFilenames`: the
+        reference image."""
+        return [os.path.join(self._resolvePath(self.refPath),
+            self.imageFilename)]
 
     def check(self, mResult):
         """Implements base class
@@ -104,7 +123,8 @@ class ImageCompTC(SingleRunTestComponent):
         self.imageErrors = []
         statusMsg = ""
         overallResult = True
-        refImageFname = os.path.join(self.refPath, self.imageFilename)
+        refImageFname = os.path.join(self._resolvePath(self.refPath),
+            self.imageFilename)
         if not os.path.exists(refImageFname):
             statusMsg += "Reference image '%s' not found!\n" % refImageFname
             print(statusMsg)
@@ -112,7 +132,7 @@ class ImageCompTC(SingleRunTestComponent):
             return False
 
         if self.genPath is not None:
-            genPath = self.genPath
+            genPath = self._resolvePath(self.genPath)
         else:
             genPath = mResult.outputPath
         genImageFname = os.path.join(genPath, self.imageFilename)
@@ -106,8 +106,8 @@ class ImageReferenceTest(api.SingleModelSysTest):
         result = jobRunner.runModel(mRun)
         # Now check the required images were actually created
         for imageComp in list(self.imageComps.values()):
-            refImageFilename = os.path.join(self.expectedSolnPath,
-                imageComp.imageFilename)
+            refImageFilename = os.path.join(self.basePath,
+                self.expectedSolnPath, imageComp.imageFilename)
             if not os.path.exists(refImageFilename):
                 raise api.SysTestSetupError("After running model to generate"\
                     " reference image for image '%s', image file doesn't"\
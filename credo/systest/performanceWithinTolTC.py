@@ -0,0 +1,296 @@
+from __future__ import print_function
+##  Copyright (C), 2010, Monash University
+##  Copyright (C), 2010, Victorian Partnership for Advanced Computing (VPAC)
+##
+##  This file is part of the CREDO library.
+##  Developed as part of the Simulation, Analysis, Modelling program of
+##  AuScope Limited, and funded by the Australian Federal Government's
+##  National Collaborative Research Infrastructure Strategy (NCRIS) program.
+##
+##  This library is free software; you can redistribute it and/or
+##  modify it under the terms of the GNU Lesser General Public
+##  License as published by the Free Software Foundation; either
+##  version 2.1 of the License, or (at your option) any later version.
+##
+##  This library is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+##  Lesser General Public License for more details.
+##
+##  You should have received a copy of the GNU Lesser General Public
+##  License along with this library; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+##  MA  02110-1301  USA
+
+import os
+import copy
+import json
+from xml.etree import ElementTree as etree
+
+import numpy
+
+from .api import MultiRunTestComponent, CREDO_PASS, CREDO_FAIL
+from credo.jobrunner.runhistory import SUMMARY_STATS, getRunPerformance
+
+#: Performance statistics that can be checked, and the (profType, name) of
+#: the performance info of a run they are taken from, in order of
+#: preference (see :mod:`credo.jobrunner`). walltime, cpuTime and peakRSS
+#: are as recorded in a :class:`~credo.jobrunner.runhistory.RunHistory`.
+PERFORMANCE_STATS = dict(SUMMARY_STATS)
+PERFORMANCE_STATS.update({
+    'linearIterations': [('WaiweraSolver', 'total_linear_iterations')],
+    'nonlinearIterations': [('WaiweraSolver', 'total_nonlinear_iterations')],
+    })
+
+def getPerformanceStat(performance, statName):
+    """Returns the value of statName (one of :data:`PERFORMANCE_STATS`) in
+    the performance info of a run, or None if it wasn't recorded."""
+    for profType, name in PERFORMANCE_STATS[statName]:
+        value = performance.get(profType, {}).get(name)
+        if isinstance(value, (int, float)):
+            return float(value)
+    return None
+
+def addRepeatedRuns(mSuite, modelRun, numRepeats, runDescrip=None):
+    """Add modelRun, and numRepeats-1 copies of it (named with a
+    '_repeatN' suffix, and with their own output paths), to the
+    :class:`~credo.modelsuite.ModelSuite` mSuite, e.g. so a
+    :class:`PerformanceWithinTolTC` can use the median of their performance.
+
+    :returns: the indices of the runs in the suite."""
+    runIndices = [mSuite.addRun(modelRun, runDescrip)]
+    for repeatI in range(1, numRepeats):
+        repeat = copy.deepcopy(modelRun)
+        repeat.name = "%s_repeat%d" % (modelRun.name, repeatI)
+        repeat.outputPath = os.path.join(mSuite.outputPathBase, repeat.name)
+        repeat.logPath = repeat.outputPath
+        runIndices.append(mSuite.addRun(repeat, runDescrip))
+    return runIndices
+
+class PerformanceWithinTolTC(MultiRunTestComponent):
+    '''Test component to check the performance of a model (e.g. its
+    walltime, peak memory use, or number of solver iterations) hasn't got
+    worse than a baseline, by more than a given ratio - so performance
+    regressions of a simulator are caught by the same tests as accuracy
+    regressions.
+
+    To allow for noise in measurements (e.g. of walltime), the median of
+    several repeated runs of the model can be used (see
+    :func:`addRepeatedRuns`). The repeats should be run one at a time (e.g.
+    by a :class:`~credo.jobrunner.simplejobrunner.SimpleJobRunner`), so they
+    don't compete with each other for processors, and not restored from a
+    run cache.
+
+    The statistics are read from the performance info the job runner's
+    profilers attach to the results (see :data:`PERFORMANCE_STATS`) - e.g.
+    CPU time and peak RSS need the
+    :class:`~credo.jobrunner.rusageProfiler.RusageProfiler` (used by default
+    on Unix) or the
+    :class:`~credo.jobrunner.procSamplingProfiler.ProcSamplingProfiler`.
+    Solver iterations are also read from results that have solver
+    statistics (e.g. :class:`~credo.waiwera.WaiweraModelResult`). A
+    statistic that wasn't recorded fails the check.
+
+    .. attribute:: tolerances
+
+       Dictionary of the maximum allowed ratio of each statistic to check
+       (a key of :data:`PERFORMANCE_STATS`) to its baseline value. E.g.
+       {'walltime': 1.2, 'linearIterations': 1.0} allows the walltime to
+       be 20% over the baseline, but no more linear iterations.
+
+    .. attribute:: baseline
+
+       Dictionary of the baseline value of each statistic, if given
+       directly. Otherwise it's read from :attr:`.baselineFilename`.
+
+    .. attribute:: baselineFilename
+
+       JSON file of the baseline values of each statistic (relative to the
+       runs' base path). If it doesn't exist when checked, the performance
+       of the runs is saved to it as the baseline, and the check passes.
+       Delete it to reset the baseline (e.g. after a deliberate change in
+       performance).
+
+    .. attribute:: runIndices
+
+       Indices of the runs in the suite that are repeats of the model to
+       check the performance of. If None, all runs are used.
+
+    .. attribute:: measured
+
+       After the check, a dictionary of the list of values of each
+       statistic over the runs (None where not recorded).
+
+    .. attribute:: medians
+
+       After the check, a dictionary of the median value of each
+       statistic over the runs.
+
+    .. attribute:: ratios
+
+       After the check, a dictionary of the ratio of each statistic's
+       median to its baseline value.
+
+    .. attribute:: statPassed
+
+       After the check, a dictionary of whether each statistic was within
+       its tolerance.
+    '''
+
+    def __init__(self, tolerances, baseline=None, baselineFilename=None,
+            runIndices=None):
+        MultiRunTestComponent.__init__(self, "performanceWithinTol")
+        for statName in tolerances:
+            if statName not in PERFORMANCE_STATS:
+                raise ValueError("Performance statistic '%s' not known,"\
+                    " must be one of %s" % (statName,
+                        sorted(PERFORMANCE_STATS.keys())))
+        if baseline is None and baselineFilename is None:
+            raise ValueError("Either a baseline, or a baselineFilename to"\
+                " read it from, must be given.")
+        self.tolerances = dict(tolerances)
+        self.baseline = None if baseline is None else dict(baseline)
+        self.baselineFilename = baselineFilename
+        self.runIndices = None if runIndices is None else list(runIndices)
+        self.measured = {}
+        self.medians = {}
+        self.ratios = {}
+        self.statPassed = {}
+        self._basePath = None
+
+    def _writeXMLCustomSpec(self, specNode):
+        for statName, tol in sorted(self.tolerances.items()):
+            etree.SubElement(specNode, 'tolerance', stat=statName,
+                ratio=str(tol))
+        if self.baseline is not None:
+            for statName, value in sorted(self.baseline.items()):
+                etree.SubElement(specNode, 'baseline', stat=statName,
+                    value=str(value))
+        if self.baselineFilename is not None:
+            etree.SubElement(specNode, 'baselineFilename',
+                value=self.baselineFilename)
+        if self.runIndices is not None:
+            etree.SubElement(specNode, 'runIndices',
+                value=" ".join([str(runI) for runI in self.runIndices]))
+
+    def attachOps(self, modelRuns):
+        """Implements base class
+        :meth:`credo.systest.api.MultiRunTestComponent.attachOps`. Nothing
+        needs attaching, but the runs' base path is saved to find the
+        baseline file relative to."""
+        if len(modelRuns) > 0:
+            self._basePath = modelRuns[0].basePath
+
+    def getBaselinePath(self):
+        """Returns the path of the :attr:`.baselineFilename`."""
+        if self._basePath is None:
+            return self.baselineFilename
+        return os.path.join(self._basePath, self.baselineFilename)
+
+    def getReferenceFilenames(self):
+        """Implements base class
+        :meth:`credo.systest.api.TestComponent.getReferenceFilenames`: the
+        baseline file, if the baseline is read from one."""
+        if self.baseline is not None:
+            return []
+        return [self.getBaselinePath()]
+
+    def readBaseline(self):
+        """Returns the baseline saved in :attr:`.baselineFilename`, or None
+        if it doesn't exist."""
+        baselinePath = self.getBaselinePath()
+        if not os.path.exists(baselinePath):
+            return None
+        with open(baselinePath) as f:
+            return json.load(f)
+
+    def writeBaseline(self, baseline):
+        """Save the baseline dictionary to :attr:`.baselineFilename`."""
+        baselinePath = self.getBaselinePath()
+        dirName = os.path.dirname(os.path.abspath(baselinePath))
+        if not os.path.exists(dirName):
+            os.makedirs(dirName)
+        with open(baselinePath, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+
+    def getMeasured(self, mResults):
+        """Returns a dictionary of the list of values of each statistic in
+        :attr:`.tolerances` over the given results."""
+        measured = dict([(statName, []) for statName in self.tolerances])
+        for mResult in mResults:
+            jobMetaInfo = getattr(mResult, 'jobMetaInfo', None)
+            performance = {} if jobMetaInfo is None else \
+                getRunPerformance(jobMetaInfo, mResult)
+            for statName in self.tolerances:
+                measured[statName].append(
+                    getPerformanceStat(performance, statName))
+        return measured
+
+    def check(self, mResults):
+        """Implements base class
+        :meth:`credo.systest.api.MultiRunTestComponent.check`."""
+        if self.runIndices is not None:
+            mResults = [mResults[runI] for runI in self.runIndices]
+        self.measured = self.getMeasured(mResults)
+        self.medians = {}
+        for statName, values in self.measured.items():
+            values = [v for v in values if v is not None]
+            self.medians[statName] = float(numpy.median(values)) \
+                if len(values) > 0 else None
+        self.ratios = {}
+        self.statPassed = {}
+        baseline = self.baseline
+        if baseline is None:
+            baseline = self.readBaseline()
+        if baseline is None and None not in list(self.medians.values()):
+            self.writeBaseline(self.medians)
+            statusMsg = "No performance baseline found, so saved the"\
+                " performance of the %d run(s) as the baseline, in %s." \
+                % (len(mResults), self.getBaselinePath())
+            print(statusMsg)
+            self._setStatus(True, statusMsg)
+            return True
+        if baseline is None:
+            baseline = {}
+
+        statusMsg = "Performance (median of %d run(s)) vs baseline:\n" \
+            % len(mResults)
+        for statName in sorted(self.tolerances):
+            tol = self.tolerances[statName]
+            median = self.medians[statName]
+            base = baseline.get(statName)
+            if median is None:
+                self.statPassed[statName] = False
+                statusMsg += "\t'%s' not recorded for the runs (check the"\
+                    " job runner's profilers).\n" % statName
+                continue
+            if base is None:
+                self.statPassed[statName] = False
+                statusMsg += "\t'%s' has no baseline value.\n" % statName
+                continue
+            if base > 0:
+                ratio = median / base
+            else:
+                ratio = 1.0 if median <= 0 else float('inf')
+            self.ratios[statName] = ratio
+            self.statPassed[statName] = ratio <= tol
+            statusMsg += "\t'%s' %g is %.3g times baseline %g (%s allowed"\
+                " ratio %g).\n" % (statName, median, ratio, base,
+                    "within" if self.statPassed[statName] else "over", tol)
+        overallResult = all(self.statPassed.values())
+        print(statusMsg)
+        self._setStatus(overallResult, statusMsg)
+        return overallResult
+
+    def _writeXMLCustomResult(self, resNode, mResults):
+        for statName in sorted(self.tolerances):
+            statNode = etree.SubElement(resNode, 'stat', name=statName)
+            statNode.attrib['passed'] = str(self.statPassed.get(statName))
+            median = self.medians.get(statName)
+            if median is not None:
+                statNode.attrib['median'] = "%6e" % median
+            if statName in self.ratios:
+                statNode.attrib['ratio'] = "%6g" % self.ratios[statName]
+            valuesNode = etree.SubElement(statNode, 'values')
+            valuesNode.text = " ".join([str(v) for v in
+                self.measured.get(statName, [])])
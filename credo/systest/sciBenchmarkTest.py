@@ -25,7 +25,8 @@ import os
 from xml.etree import ElementTree as etree
 
 from credo.modelsuite import ModelSuite
-from .api import SysTest, TestComponent, CREDO_PASS, CREDO_FAIL
+from .api import SysTest, TestComponent, MultiRunTestComponent
+from .api import CREDO_PASS, CREDO_FAIL
 import credo.utils
 
 class SciBenchmarkTest(SysTest):
@@ -95,6 +96,18 @@ class SciBenchmarkTest(SysTest):
                 " of runs in this system test's ModelSuite, currently %d"\
                 % (len(self.testComps)))
 
+    def addMultiRunTestComp(self, testCompName, testComp):
+        """Add a multi-run testComponent
+        (:class:`~.api.MultiRunTestComponent`), applied to the results of
+        all the runs in the suite, with name testCompName, to the test
+        components to be applied as part of determining if the benchmark
+        has passed."""
+        if not isinstance(testComp, MultiRunTestComponent):
+            raise TypeError("Test component passed in to be added to"\
+                " benchmark, '%s', not an instance of a"\
+                " MultiRunTestComponent." % (testComp))
+        self.multiRunTestComps[testCompName] = testComp
+
     def configureSuite(self):
         raise NotImplementedError("Should not be called on SciBenchmark"\
             " class, user should configure suite manually by operating on"\
@@ -2,9 +2,13 @@ from __future__ import division
 from __future__ import print_function
 from builtins import zip
 from past.utils import old_div
+from builtins import object
 from xml.etree import ElementTree as etree
 from .api import SingleRunTestComponent, CREDO_PASS, CREDO_FAIL
+from credo.jobrunner.runmonitor import isStale
 
+import os
+import time
 import numpy
 
 # TODO: do a literature research how to compare two set of values scientificly
@@ -32,24 +36,29 @@ def non_dimensionalise(x1, x2, abs_err_tol=1.0, logscale=False):
     between 0.0 and 1.0.  If the range of values is smaller than abs_err_tol,
     typically 1.0, the data sets will be shifted down to 0.0, but scale remains.
     """
-    xmin = min(min(x1), min(x2))
-    xmax = max(max(x1), max(x2))
+    xx1, xx2 = _non_dimensionalise_arrays(x1, x2, abs_err_tol, logscale)
+    return xx1.tolist(), xx2.tolist()
+
+def _non_dimensionalise_arrays(x1, x2, abs_err_tol=1.0, logscale=False):
+    """ As for non_dimensionalise(), but returns numpy arrays. """
+    x1 = numpy.asarray(x1, dtype=float)
+    x2 = numpy.asarray(x2, dtype=float)
+    xmin = min(x1.min(), x2.min())
+    xmax = max(x1.max(), x2.max())
     if logscale:
-        from math import log10
         xmin0 = xmin
-        def log_transform(x): return log10(x - xmin0 + 1.)
-        x1 = [log_transform(x) for x in x1]
-        x2 = [log_transform(x) for x in x2]
-        xmin = log_transform(xmin)
-        xmax = log_transform(xmax)
+        def log_transform(x): return numpy.log10(x - xmin0 + 1.)
+        x1, x2 = log_transform(x1), log_transform(x2)
+        xmin, xmax = log_transform(xmin), log_transform(xmax)
     xd = xmax - xmin
     if xd < abs_err_tol:
-        x1 = [x - xmin for x in x1]
-        x2 = [x - xmin for x in x2]
+        x1, x2 = x1 - xmin, x2 - xmin
         xmin, xmax, xd = 0.0, 1.0, 1.0
-    xx1 = [old_div((x - xmin),xd) for x in x1]
-    xx2 = [old_div((x - xmin),xd) for x in x2]
-    return xx1, xx2
+    return (x1 - xmin) / xd, (x2 - xmin) / xd
+
+#: Maximum number of point-segment distances calc_dist_errors() works out at
+#: once (limiting the size of its temporary arrays).
+DIST_ERRORS_BLOCK_SIZE = 2**20
 
 def calc_dist_errors(ptx, pty, linex, liney, abs_err_tol=1.0,
                      logx=False, logy=False):
@@ -60,13 +69,71 @@ def calc_dist_errors(ptx, pty, linex, liney, abs_err_tol=1.0,
     are normalised errors.  The second set of x/y is the polyline.  Errors are
     calculated from each of the points in the first x/y set.  Generally the
     polyline (second set) should have more points.
+
+    The distances from all of the points to all of the polyline's segments
+    are worked out together with numpy (in blocks of points, see
+    DIST_ERRORS_BLOCK_SIZE), taking the nearest for each point.
     """
-    from shapely.geometry import Point, LineString
     # non-dimensionalise both data sets
-    ptxx, linexx = non_dimensionalise(ptx, linex, abs_err_tol, logx)
-    ptyy, lineyy = non_dimensionalise(pty, liney, abs_err_tol, logy)
-    line = LineString([(x,y) for x,y in zip(linexx, lineyy)])
-    return [Point(x,y).distance(line) for x,y in zip(ptxx, ptyy)]
+    ptxx, linexx = _non_dimensionalise_arrays(ptx, linex, abs_err_tol, logx)
+    ptyy, lineyy = _non_dimensionalise_arrays(pty, liney, abs_err_tol, logy)
+    pts = numpy.column_stack((ptxx, ptyy))
+    line = numpy.column_stack((linexx, lineyy))
+    if len(line) == 1:
+        starts, vecs = line, numpy.zeros((1, 2))
+    else:
+        starts, vecs = line[:-1], numpy.diff(line, axis=0)
+    lengths2 = numpy.sum(vecs**2, axis=1)
+    lengths2[lengths2 == 0.] = 1. # (zero length segments are just points)
+    errors = numpy.empty(len(pts))
+    block = max(1, DIST_ERRORS_BLOCK_SIZE // len(starts))
+    for i in range(0, len(pts), block):
+        # nearest point on each segment to each point
+        d = pts[i:i+block, numpy.newaxis, :] - starts
+        s = numpy.clip(numpy.sum(d * vecs, axis=2) / lengths2, 0., 1.)
+        d -= s[:, :, numpy.newaxis] * vecs
+        errors[i:i+block] = numpy.sqrt(numpy.sum(d**2, axis=2).min(axis=1))
+    return errors.tolist()
+
+def _analytic_values(evaluate_all, evaluate, n, vectorised=False):
+    """ Returns an array of the n values evaluate(i) of an analytic solution.
+    If vectorised, they are all got at once by calling evaluate_all(), which
+    must return an array of the n values (e.g. if the solution is written
+    with numpy operations on coordinates pos[0] etc., or t).  Otherwise the
+    values are worked out one at a time.
+    """
+    if not vectorised or n == 0:
+        return numpy.array([evaluate(i) for i in range(n)], dtype=float)
+    values = numpy.asarray(evaluate_all(), dtype=float)
+    if values.shape != (n,):
+        raise ValueError("Vectorised analytic solution returned values of"\
+            " shape %s, rather than %d values." % (values.shape, n))
+    return values
+
+def _analytic_at_positions(func, positions, vectorised=False):
+    """ Returns the values of an analytic solution func(pos) at each of the
+    positions (rows of an array, see ModelResult.getPositionsArray()).  If
+    vectorised, func is called once with the transposed array, so it gets
+    arrays of each coordinate (see _analytic_values()).
+    """
+    positions = numpy.asarray(positions)
+    return _analytic_values(lambda: func(positions.T),
+                            lambda i: func(positions[i]), len(positions),
+                            vectorised)
+
+def _analytic_at_times(func, pos, times, vectorised=False):
+    """ Returns the values of an analytic solution func(pos, t) at a position,
+    for each of the times.  If vectorised, func is called once with the array
+    of times (see _analytic_values()).
+    """
+    times = numpy.asarray(times)
+    return _analytic_values(lambda: func(pos, times),
+                            lambda i: func(pos, times[i]), len(times),
+                            vectorised)
+
+def _within_tol(errors, tol):
+    """ Returns whether all the errors are within tol. """
+    return bool(numpy.all(numpy.asarray(errors) <= tol))
 
 class BaseWithinTolTC(SingleRunTestComponent):
     """Checks whether, for a particular set of fields and a specified cell
@@ -82,6 +149,14 @@ class BaseWithinTolTC(SingleRunTestComponent):
       (ReferenceResult, HighResReferenceResult) or a function (analytic
       solution).
 
+    .. attribute:: vectorised
+
+       Whether an analytic solution can be evaluated for arrays of values
+       at once, e.g. because it is written with numpy operations - so it can
+       be called with arrays of each coordinate of all the positions, or with
+       an array of times, returning an array of the values.  Default is
+       False, in which case it is called for each value in turn.
+
     .. attribute:: fieldsToTest
 
        A list of strings containing the names of fields that should be tested-
@@ -119,18 +194,37 @@ class BaseWithinTolTC(SingleRunTestComponent):
        Otherwise, absolute difference (|t1-t2|) will be used.  The default
        value of this tolerance is 1.0.
 
+    .. attribute:: liveCheckFactor
+
+       If not None, the outputs of the run are also checked while it runs
+       (see :class:`LiveWithinTolCheck`), and the run is aborted as soon as
+       the error of any field exceeds liveCheckFactor times its tolerance.
+       The test component then fails, with the errors found so far.
+       Default is None (no live checks).
+
+    .. attribute:: abortedLive
+
+       After the run, whether it was aborted by a live check of this test
+       component.
+
     """
     def __init__(self, fieldsToTest=None,
             defFieldTol=0.01,
             fieldTols=None,
             expected=None,
-            absoluteErrorTol=1.0
+            absoluteErrorTol=1.0,
+            liveCheckFactor=None,
+            vectorised=False
             ):
         SingleRunTestComponent.__init__(self, self.__class__.__name__)
         self.fieldsToTest = fieldsToTest
         self.defFieldTol = defFieldTol
         self.fieldTols = fieldTols
         self.absoluteErrorTol = absoluteErrorTol
+        self.liveCheckFactor = liveCheckFactor
+        self.vectorised = vectorised
+        self.abortedLive = False
+        self.liveEvidence = []
         self.expected = expected
         if expected is None:
             raise ValueError("expected solution must be ModelResult or func.")
@@ -142,9 +236,22 @@ class BaseWithinTolTC(SingleRunTestComponent):
         self.fieldResults = {}
         self.fieldErrors = {}
 
+    def getReferenceFilenames(self):
+        """Implements base class
+        :meth:`credo.systest.api.TestComponent.getReferenceFilenames`: the
+        data files of the expected result (none for analytic solutions)."""
+        if callable(self.expected):
+            return []
+        return self.expected.getDataFilenames()
+
     def preRunOps(self, modelRun):
         """ Implement pre-processing required for ModelRun object """
-        pass
+        self.abortedLive = False
+        # (replacing any live check already added by this test component)
+        modelRun.liveChecks = [c for c in modelRun.liveChecks
+            if getattr(c, 'testComp', None) is not self]
+        if self.liveCheckFactor is not None:
+            modelRun.liveChecks.append(LiveWithinTolCheck(self, modelRun))
 
     def postRunOps(self, modelRun):
         """ Implement post-processing required for ModelRun object, before
@@ -175,12 +282,12 @@ class BaseWithinTolTC(SingleRunTestComponent):
             self.fieldErrors[field] = errors
             fieldTol = self._getTolForField(field)
             if not fieldResult:
-                failed = [(i,e) for i,e in enumerate(errors) if e > fieldTol]
-                failed_indices, failed_errors = list(zip(*failed))
-                max_error = max(failed_errors)
+                errors = numpy.asarray(errors)
+                failed_indices = numpy.nonzero(~(errors <= fieldTol))[0]
+                failed_errors = errors[failed_indices]
                 statusMsg += "Field comp '%s' has failed error(s) of %s at"\
                     " indices %s not within tol %g of %s solution\n"\
-                    % (field, list(failed_errors), list(failed_indices), fieldTol, self.compareSource)
+                    % (field, failed_errors.tolist(), failed_indices.tolist(), fieldTol, self.compareSource)
                 # statusMsg += "Field comp '%s' error(s) of %s not within"\
                 #     " tol %g of %s solution\n"\
                 #     % (field, errors, fieldTol, self.compareSource)
@@ -202,9 +309,59 @@ class BaseWithinTolTC(SingleRunTestComponent):
         msg = "._checkFieldWithinTol() not implemented in %s" % self.__class__.__name__
         raise NotImplementedError(msg)
 
+    def checkLive(self, mResult):
+        """ Checks the outputs written so far by a run that is still running,
+        given a partial ModelResult of it.  If the error of any field exceeds
+        .liveCheckFactor times its tolerance, the TC fails (with the errors
+        found so far), and the reason the run should be aborted is returned.
+        Otherwise returns None.
+
+        .liveEvidence is set to a list of descriptions of the errors found.
+        """
+        self.liveEvidence = []
+        failedFields = []
+        for field in self.fieldsToTest:
+            live = self._checkFieldLive(field, mResult)
+            if live is None:
+                continue
+            errors, where = live
+            fieldTol = self._getTolForField(field)
+            maxError = numpy.max(errors)
+            self.liveEvidence.append("Field comp '%s' max error %g (tol %g)"\
+                " %s" % (field, maxError, fieldTol, where))
+            if maxError > self.liveCheckFactor * fieldTol:
+                failedFields.append(field)
+                self.fieldResults[field] = False
+                self.fieldErrors[field] = errors
+        if len(failedFields) == 0:
+            return None
+        self.abortedLive = True
+        statusMsg = "Field comp(s) %s error(s) exceeded %g times tol of %s"\
+            " solution while running:\n%s" % (failedFields,
+            self.liveCheckFactor, self.compareSource,
+            "\n".join(self.liveEvidence))
+        print(statusMsg)
+        self._setStatus(False, statusMsg)
+        return statusMsg
+
+    def _checkFieldLive(self, field, mResult):
+        """ Checks a field from a partial ModelResult (of a run still
+        running) against the expected, as far as possible.  Returns None if
+        nothing (new) can be checked yet, otherwise a tuple of errors (a list
+        of float) and a description of where they're from.
+
+        The last output of the partial result is never checked, as it may
+        not have been completely written yet.  Default is to do no live
+        checks.
+        """
+        return None
+
     def _writeXMLCustomSpec(self, specNode):
         etree.SubElement(specNode, 'compareSource',
             value=str(self.compareSource))
+        if self.liveCheckFactor is not None:
+            etree.SubElement(specNode, 'liveCheckFactor',
+                value=str(self.liveCheckFactor))
         fListNode = etree.SubElement(specNode, 'fields')
         for fName in self.fieldsToTest:
             fNode = etree.SubElement(fListNode, 'field', name=fName,
@@ -268,13 +425,17 @@ class HistoryWithinTolTC(BaseWithinTolTC):
                  times=None,
                  orthogonalError=False,
                  logx=False, logy=False,
-                 enforceLogic=True ):
+                 enforceLogic=True,
+                 liveCheckFactor=None,
+                 vectorised=False ):
         BaseWithinTolTC.__init__(self,
                                  fieldsToTest=fieldsToTest,
                                  defFieldTol=defFieldTol,
                                  fieldTols=fieldTols,
                                  expected=expected,
-                                 absoluteErrorTol=absoluteErrorTol )
+                                 absoluteErrorTol=absoluteErrorTol,
+                                 liveCheckFactor=liveCheckFactor,
+                                 vectorised=vectorised )
         self.testSourceIndex = testSourceIndex
         if testSourceIndex is None:
             self.testCellIndex = testCellIndex
@@ -307,11 +468,12 @@ class HistoryWithinTolTC(BaseWithinTolTC):
         ModelResult, .getFieldHistoryAtCell() is used here.
 
         If expected is an analytic function (callable), it will call
-        ModelResult.getPositions() to find where the cell index is, and
+        ModelResult.getPositionsArray() to find where the cell index is, and
         ModelResult.getTImes() for a series of times and get expected values
-        from func using the positions and time (a position tuple and a time
+        from func using the positions and time (a position array and a time
         float).  It is user's responsibility to ensure the analytic function
-        accepts the positions returned by (ModelResult.getPositions()[I], time).
+        accepts the positions returned by
+        (ModelResult.getPositionsArray()[I], time).
         """
         fieldTol = self._getTolForField(field)
         if self.testSourceIndex is None:
@@ -324,9 +486,10 @@ class HistoryWithinTolTC(BaseWithinTolTC):
             if self.times is None:
                 self.times = result_times
             if self.testSourceIndex is None:
-                pos = mResult.getPositions()[self.testCellIndex]
+                pos = mResult.getPositionsArray()[self.testCellIndex]
             else: pos = None
-            expected = numpy.array([self.expected(pos, t) for t in self.times])
+            expected = _analytic_at_times(self.expected, pos, self.times,
+                                          self.vectorised)
             expected_times = self.times
         else:
             if self.testSourceIndex is None:
@@ -352,9 +515,62 @@ class HistoryWithinTolTC(BaseWithinTolTC):
             # TODO: check if interp is actually skipped if times matched
             errors = calc_errors(expected, result, self.absoluteErrorTol)
 
-        fieldResult = all(e <= fieldTol for e in errors)
+        fieldResult = _within_tol(errors, fieldTol)
         return fieldResult, errors
 
+    def _checkFieldLive(self, field, mResult):
+        """ Checks the history of a field written so far against the
+        expected, at the expected times up to the last completely written
+        output time.  (With orthogonalError, the data is non-dimensionalised
+        using only the range of the history so far.)
+        """
+        if self.testSourceIndex is None:
+            result_times, result = mResult.getFieldHistoryAtCell(field, self.testCellIndex)
+        else:
+            result_times, result = mResult.getFieldHistoryAtSource(field, self.testSourceIndex)
+        n = min(len(result_times), len(result)) - 1
+        if n < 2:
+            return None
+        result_times = numpy.array(result_times[:n])
+        result = numpy.array(result[:n])
+        t_max = result_times[-1]
+        if callable(self.expected):
+            if self.testSourceIndex is None:
+                pos = mResult.getPositionsArray()[self.testCellIndex]
+            else: pos = None
+            times = result_times
+            expected = _analytic_at_times(self.expected, pos, times,
+                                          self.vectorised)
+            expected_times = times
+        else:
+            if self.testSourceIndex is None:
+                expected_times, expected = self.expected.\
+                                           getFieldHistoryAtCell(field, self.testCellIndex)
+            else:
+                expected_times, expected = self.expected.\
+                                           getFieldHistoryAtSource(field, self.testSourceIndex)
+            times = self.times if self.times is not None else expected_times
+            times = numpy.array(times)
+            times = times[(times >= result_times[0]) & (times <= t_max)]
+            if len(times) == 0:
+                return None
+            expected_times = numpy.array(expected_times)
+            expected = numpy.array(expected)
+        if self.orthogonalError:
+            within = expected_times <= t_max
+            if not any(within):
+                return None
+            errors = calc_dist_errors(expected_times[within],
+                                      expected[within],
+                                      result_times, result,
+                                      self.absoluteErrorTol,
+                                      self.logx, self.logy)
+        else:
+            expected = numpy.interp(times, expected_times, expected)
+            result = numpy.interp(times, result_times, result)
+            errors = calc_errors(expected, result, self.absoluteErrorTol)
+        return list(errors), "up to time %g" % t_max
+
     def _writeXMLCustomSpec(self, specNode):
         etree.SubElement(specNode, 'testCellIndex',
             value=str(self.testCellIndex))
@@ -392,7 +608,7 @@ class OneDSolutionWithinTolTC(BaseWithinTolTC):
 
     def _checkFieldWithinTol(self, field, mResult):
         fieldTol = self._getTolForField(field)
-        coord_result = numpy.array([pos[self.coordinateIndex] for pos in mResult.getPositions()])
+        coord_result = mResult.getPositionsArray()[:, self.coordinateIndex]
         result = mResult.getFieldAtOutputIndex(field, self.testOutputIndex)
         if self.maxCoordinate:
             ic = numpy.where(coord_result <= self.maxCoordinate)
@@ -403,7 +619,7 @@ class OneDSolutionWithinTolTC(BaseWithinTolTC):
         errors = calc_dist_errors(coord_result, result,
                                   coord_expected, expected,
                                   self.absoluteErrorTol, logx = self.logCoordinate)
-        fieldResult = all(e <= fieldTol for e in errors)
+        fieldResult = _within_tol(errors, fieldTol)
         return fieldResult, errors
 
     def _writeXMLCustomSpec(self, specNode):
@@ -424,14 +640,19 @@ class FieldWithinTolTC(BaseWithinTolTC):
                  fieldTols=None,
                  expected=None,
                  absoluteErrorTol=1.0,
-                 testOutputIndex=-1 ):
+                 testOutputIndex=-1,
+                 liveCheckFactor=None,
+                 vectorised=False ):
         BaseWithinTolTC.__init__(self,
                                  fieldsToTest=fieldsToTest,
                                  defFieldTol=defFieldTol,
                                  fieldTols=fieldTols,
                                  expected=expected,
-                                 absoluteErrorTol=absoluteErrorTol )
+                                 absoluteErrorTol=absoluteErrorTol,
+                                 liveCheckFactor=liveCheckFactor,
+                                 vectorised=vectorised )
         self.testOutputIndex = testOutputIndex
+        self._liveCheckedIndices = set()
 
     def _checkFieldWithinTol(self, field, mResult):
         """ This is the core of the TC, checks a field from ModelResult against
@@ -443,27 +664,161 @@ class FieldWithinTolTC(BaseWithinTolTC):
         ModelResult, .getFieldAtOutputIndex() is used here.
 
         If expected is an analytic function (callable), it will call
-        ModelResult.getPositions() and get expected values from func using the
-        positions (a list of tuples).  It is user's responsibility to ensure the
-        analytic function accepts the positions returned by
-        ModelResult.getPositions().
+        ModelResult.getPositionsArray() and get expected values from func using
+        the positions (rows of the array).  It is user's responsibility to
+        ensure the analytic function accepts the positions returned by
+        ModelResult.getPositionsArray().
         """
         fieldTol = self._getTolForField(field)
         result = mResult.getFieldAtOutputIndex(field, self.testOutputIndex)
 
         if callable(self.expected):
-            # analytic, calls func with position
-            expected = numpy.array([self.expected(pos) for pos in mResult.getPositions()])
+            # analytic, calls func with positions
+            expected = _analytic_at_positions(self.expected,
+                                              mResult.getPositionsArray(),
+                                              self.vectorised)
         else:
             # TODO: [Refactor] add support for HighResReferenceResult
             expected = self.expected.getFieldAtOutputIndex(field, self.testOutputIndex)
         errors = calc_errors(expected, result, self.absoluteErrorTol)
 
-        fieldResult = all(e <= fieldTol for e in errors)
+        fieldResult = _within_tol(errors, fieldTol)
         return fieldResult, errors
 
+    def preRunOps(self, modelRun):
+        BaseWithinTolTC.preRunOps(self, modelRun)
+        self._liveCheckedIndices = set()
+
+    def _checkFieldLive(self, field, mResult):
+        """ Checks the outputs of a field written so far (except the last)
+        that haven't been checked yet.  If .testOutputIndex is -1 (the final
+        output) and the expected is a reference result, each output is
+        compared with the reference output with the same index, if they're
+        at the same time.  (This is a heuristic - the field at other output
+        times isn't part of the test, which is why the error has to exceed
+        the tolerance by .liveCheckFactor to abort the run.)  Otherwise only
+        .testOutputIndex is checked, once available.
+        """
+        times = mResult.getTimes()
+        n = len(times) - 1
+        if self.testOutputIndex >= 0:
+            indices = [self.testOutputIndex] if self.testOutputIndex < n else []
+        elif callable(self.expected):
+            return None
+        else:
+            expected_times = self.expected.getTimes()
+            indices = [i for i in range(min(n, len(expected_times)))
+                       if numpy.isclose(times[i], expected_times[i],
+                                        rtol=1.0e-6, atol=0.0)]
+        indices = [i for i in indices
+                   if (field, i) not in self._liveCheckedIndices]
+        if len(indices) == 0:
+            return None
+        worst = None
+        if callable(self.expected):
+            analytic = _analytic_at_positions(self.expected,
+                                              mResult.getPositionsArray(),
+                                              self.vectorised)
+        for i in indices:
+            self._liveCheckedIndices.add((field, i))
+            result = mResult.getFieldAtOutputIndex(field, i)
+            if callable(self.expected):
+                expected = analytic
+            else:
+                expected = self.expected.getFieldAtOutputIndex(field, i)
+            errors = calc_errors(expected, result, self.absoluteErrorTol)
+            if worst is None or numpy.max(errors) > max(worst[0]):
+                worst = (list(errors), i)
+        errors, i = worst
+        return errors, "at output index %d (time %g)" % (i, times[i])
+
     def _writeXMLCustomSpec(self, specNode):
         etree.SubElement(specNode, 'testOutputIndex',
             value=str(self.testOutputIndex))
         BaseWithinTolTC._writeXMLCustomSpec(self, specNode)
 
+class LiveWithinTolCheck(object):
+    """A check of the outputs of a run while it runs, against the expected
+    solution of a :class:`BaseWithinTolTC` with a liveCheckFactor set, for
+    :attr:`credo.modelrun.ModelRun.liveChecks` (see
+    :mod:`credo.jobrunner.runmonitor`).
+
+    Whenever the run's output files (see
+    :meth:`~credo.modelrun.ModelRun.getOutputFilenames`) change, they're
+    re-opened (see
+    :meth:`~credo.modelrun.ModelRun.createPartialModelResult`) and the new
+    outputs are checked (see :meth:`BaseWithinTolTC.checkLive`).
+
+    .. attribute:: evidence
+
+       Descriptions of the errors found at the last check.
+
+    .. attribute:: startTime
+
+       Output files last modified before this time (as from time.time())
+       are left over from a previous run, and aren't checked. Defaults to
+       the time the check is created, i.e. before the run is launched (see
+       :meth:`BaseWithinTolTC.preRunOps`).
+    """
+    def __init__(self, testComp, modelRun):
+        self.testComp = testComp
+        self.modelRun = modelRun
+        self.evidence = []
+        self.startTime = time.time()
+        self._outputState = None
+        # Set if checking failed unexpectedly (see check())
+        self._failed = False
+
+    def _getOutputState(self):
+        """Returns the sizes and modification times of the run's output
+        files, or None if they don't all exist yet (or are left over from
+        before the run started)."""
+        filenames = self.modelRun.getOutputFilenames()
+        if len(filenames) == 0:
+            # No way of knowing if they've changed, so always check
+            return time.time()
+        state = []
+        for filename in filenames:
+            try:
+                st = os.stat(os.path.join(self.modelRun.basePath, filename))
+            except OSError:
+                return None
+            if isStale(st.st_mtime, self.startTime):
+                return None
+            state.append((st.st_size, st.st_mtime))
+        return state
+
+    def check(self):
+        """Returns the reason the run should be aborted, or None."""
+        if self._failed:
+            return None
+        state = self._getOutputState()
+        if state is None or state == self._outputState:
+            return None
+        self._outputState = state
+        try:
+            mResult = self.modelRun.createPartialModelResult()
+        except Exception:
+            # Outputs can fail to be read in all sorts of ways while being
+            #  written - just try again once they've changed.
+            return None
+        try:
+            reason = self.testComp.checkLive(mResult)
+        except (IOError, OSError, KeyError):
+            # E.g. (from h5py) datasets not yet fully written
+            return None
+        except Exception as e:
+            # Anything else is a bug, so say so rather than hiding it - and
+            #  don't keep trying.
+            print("Warning: live check of run '%s' failed (%s: %s), not"\
+                " checking it any more while it runs." % (self.modelRun.name,
+                e.__class__.__name__, e))
+            self._failed = True
+            return None
+        finally:
+            close = getattr(mResult, 'close', None)
+            if close is not None:
+                close()
+        self.evidence = list(self.testComp.liveEvidence)
+        return reason
+
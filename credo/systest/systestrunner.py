@@ -54,6 +54,7 @@ XML_TESTCASE_ATTR_NAME = 'name'
 XML_TESTCASE_ATTR_TYPE = 'type'
 XML_TESTCASE_ATTR_STATUS = 'status'
 XML_TESTCASE_ATTR_RECORDFILE = 'recordfile'
+XML_TESTCASE_ATTR_CACHED = 'cached'
 
 class SysTestRunner(object):
     """Class that runs a set of :class:`~credo.systest.api.SysTest`, usually
@@ -203,10 +204,8 @@ class SysTestRunner(object):
         if not os.path.exists(outputPath):
             os.makedirs(outputPath)
         outFilePath = os.path.join(outputPath, filename)
-        outFile = open(outFilePath, 'wb')
-        credo.io.stgxml.writeXMLDoc(xmlDoc, outFile, prettyPrint)
-        outFile.close()
-        return outFilePath
+        return credo.io.stgxml.writeXMLDocAtomic(xmlDoc, outFilePath,
+            prettyPrint)
 
     def _createSuiteNode(self, suite):
         suiteNode = etree.Element(XML_RESULT_TAG_SUITE)
@@ -234,6 +233,8 @@ class SysTestRunner(object):
         sysTestNode.attrib[XML_TESTCASE_ATTR_TYPE] = sysTest.testType
         sysTestNode.attrib[XML_TESTCASE_ATTR_STATUS] = sysTestResult.statusStr
         sysTestNode.attrib[XML_TESTCASE_ATTR_RECORDFILE] = sysTestResult.getRecordFile()
+        if sysTestResult.cached:
+            sysTestNode.attrib[XML_TESTCASE_ATTR_CACHED] = str(True)
 
     def printSuiteResultsByProject(self, testSuites, resultsLists):
         """Utility function to print a set of suite results out,
@@ -327,6 +328,10 @@ class SysTestRunner(object):
         """Prints details of which tests failed in a sub-suite."""
         sumsDict, failIndices, errorIndices = self.getResultsTotals(results)
         self._printResultsLine(sumsDict)
+        nCached = len([result for result in results if result.cached])
+        if nCached > 0:
+            print("(%d of these results were cached, from previous runs of"\
+                " tests whose inputs haven't changed.)" % nCached)
 
         if len(failIndices) > 0:
             print("Failures were:")
@@ -26,6 +26,7 @@ import shutil
 import unittest
 
 from credo.systest.imageCompTC import *
+from credo.modelrun import ModelRun
 from credo.modelresult import ModelResult
 
 class ImageCompTCTestCase(unittest.TestCase):
@@ -44,8 +45,15 @@ class ImageCompTCTestCase(unittest.TestCase):
 
     def test_attachOps(self):
         # test the model can have appropriate ops attached.
-        # In the case of this testComp, nothing to be done.
-        pass
+        # In the case of this testComp, nothing to be done, but the reference
+        # path is then relative to the run's base path.
+        mRun = ModelRun('testModel1', basePath=os.path.abspath('input'))
+        imageCompTest = ImageCompTC("window.00001.png",
+            refPath='testImages')
+        imageCompTest.attachOps(mRun)
+        self.assertEqual(imageCompTest.getReferenceFilenames(),
+            [os.path.abspath(os.path.join(self.imageRefPath,
+                "window.00001.png"))])
 
     def test_check(self):
         checkRes = self.imageCompTest.check(self.resultsSet1)
@@ -188,6 +188,14 @@ class TestCurveFitting(unittest.TestCase):
         xa, ya = [2.0], [1.5]
         xb, yb = [0, 1, 1], [0, 0, 2]
         self.assertEqual([0.5], calc_dist_errors(xa, ya, xb, yb))
+        # several points, nearest to segment ends, inner points or a
+        #  repeated (zero length) segment
+        xa, ya = [2.0, -1.0, 1.0, 0.0], [1.5, -2.0, 0.0, 2.0]
+        xb, yb = [0, 1, 1, 1], [0, 0, 2, 2]
+        errors = calc_dist_errors(xa, ya, xb, yb, 10.0)
+        self.assertTrue(isinstance(errors, list))
+        self.assertTrue(numpy.allclose(errors,
+            [1.0, numpy.hypot(1.0, 2.0), 0.0, 1.0]))
 
 
 if __name__ == '__main__':
@@ -93,6 +93,27 @@ class T2ModelRun(ModelRun):
         # AUT2 does not care these
         return self._runCommand
 
+    def getInputFilenames(self):
+        """ Returns the data, initial conditions and (optional) geometry
+        files.  The names of the save and listing files are part of the run's
+        stdin file.
+        """
+        import os
+        datbase, savebase, inconbase = self._aut2FileNameBases()
+        if self._incon_filename == '':
+            incon_filename = inconbase + '.incon'
+            if not os.path.isfile(os.path.join(self.basePath, incon_filename)):
+                incon_filename = inconbase + '.INCON'
+        else:
+            incon_filename = self._incon_filename
+        files = [self._dat_filename, incon_filename]
+        if self._geo_filename:
+            files.append(self._geo_filename)
+        return files
+
+    def getSimulatorExecutable(self):
+        return self._simulator
+
     def _aut2FileNameBases(self):
         """ Returns the basenames of the three model files (datbase, savebase,
         inconbase)
@@ -134,13 +155,15 @@ class T2ModelRun(ModelRun):
         import os
         import shutil
         absOutputPath = os.path.join(self.basePath, self.outputPath)
-        if self.basePath != self.outputPath:
+        if os.path.normpath(self.basePath) != os.path.normpath(absOutputPath):
             for f in files_to_keep():
-                if os.path.isfile(f):
-                    shutil.copy2(f, os.path.join(absOutputPath, f))
+                src = os.path.join(self.basePath, f)
+                if os.path.isfile(src):
+                    shutil.copy2(src, os.path.join(absOutputPath, f))
         for f in files_to_clean():
-            if os.path.isfile(f):
-                os.remove(f)
+            src = os.path.join(self.basePath, f)
+            if os.path.isfile(src):
+                os.remove(src)
 
     def createModelResult(self):
         """ Note: this is called AFTER .postRunCleanup() """
@@ -149,12 +172,13 @@ class T2ModelRun(ModelRun):
             lst_ext = '.LISTING'
         else:
             lst_ext = '.listing'
-        lst_filename = join(self.outputPath, self._lstbase+lst_ext)
+        absOutputPath = join(self.basePath, self.outputPath)
+        lst_filename = join(absOutputPath, self._lstbase+lst_ext)
         if self._geo_filename:
-            geo_filename = join(self.outputPath, self._geo_filename)
+            geo_filename = join(absOutputPath, self._geo_filename)
         else:
             geo_filename = self._geo_filename
-        dat_filename = join(self.outputPath, self._dat_filename)
+        dat_filename = join(absOutputPath, self._dat_filename)
         mres = T2ModelResult(self.name, lst_filename,
                              dat_filename,
                              geo_filename,
@@ -172,6 +196,9 @@ class T2ModelResult(ModelResult):
                                             ordering_map=ordering_map,
                                             fieldname_map=fieldname_map)
         self.name = name
+        self._lst_filename = lst_filename
+        self._dat_filename = dat_filename
+        self._geo_filename = geo_filename
         self._lst = t2listing(lst_filename)
         if geo_filename:
             self._geo = mulgrid(geo_filename)
@@ -181,6 +208,13 @@ class T2ModelResult(ModelResult):
     def destroy(self):
         self._lst.close()
 
+    def getDataFilenames(self):
+        """ Returns the listing file, plus the data and geometry files (if
+        given).
+        """
+        return [f for f in [self._lst_filename, self._dat_filename,
+                            self._geo_filename] if f]
+
     def _getOtherValues(self, field):
         if field is 'rock_porosity':
             return [b.rocktype.porosity for b in self._dat.grid.blocklist]
@@ -219,7 +253,40 @@ class T2ModelResult(ModelResult):
         return t, hist
 
     def _getPositions(self):
-        return [self._geo.block_centre(self._geo.layer_name(b), self._geo.column_name(b)) for b in self._geo.block_name_list]
+        """ Returns an array of the block centres (as given by
+        mulgrid.block_centre(), worked out for all blocks at once), with NaN
+        rows for blocks without a centre (e.g. the atmosphere, unless the
+        geometry has one atmosphere block per column).
+        """
+        import numpy as np
+        geo = self._geo
+        blocks = geo.block_name_list
+        layers = dict((lay.name, i) for i, lay in enumerate(geo.layerlist))
+        columns = dict((col.name, i) for i, col in enumerate(geo.columnlist))
+        li = np.array([layers[geo.layer_name(b)] for b in blocks], dtype=int)
+        # (-1 for a single atmosphere block, not in any column)
+        ci = np.array([columns.get(geo.column_name(b), -1) for b in blocks],
+                      dtype=int)
+        bottom = np.array([lay.bottom for lay in geo.layerlist])[li]
+        top = np.array([lay.top for lay in geo.layerlist])[li]
+        centre = np.array([lay.centre for lay in geo.layerlist])[li]
+        surface = np.array([col.surface for col in geo.columnlist] + [np.nan],
+                           dtype=float)[ci]
+        xy = np.array([col.centre[:2] for col in geo.columnlist] +
+                      [[np.nan, np.nan]], dtype=float)[ci]
+        # surface blocks with the column surface below the layer top are
+        # centred between the layer bottom and the surface
+        z = np.where((bottom < surface) & (surface <= top),
+                     0.5 * (bottom + surface), centre)
+        z[surface <= bottom] = np.nan # outside grid
+        atmosphere = li == 0
+        if geo.atmosphere_type == 1:
+            z[atmosphere] = centre[atmosphere]
+        else:
+            z[atmosphere] = np.nan
+        positions = np.column_stack((xy, z))
+        positions[np.isnan(z)] = np.nan
+        return positions
 
     def _getTimes(self):
         return self._lst.fulltimes
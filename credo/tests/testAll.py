@@ -34,7 +34,10 @@ def suite():
         'jobparamssuite',
         'test_autough2',
         'test_waiwera',
-        'test_runtest']
+        'test_runtest',
+        'test_jobrunner',
+        'test_pbsjobrunner',
+        'test_slurmjobrunner']
     alltests = unittest.TestSuite()
     for module in map(__import__, testMods):
         alltests.addTest(unittest.findTestCases(module))
@@ -6,12 +6,15 @@ from past.utils import old_div
 
 import unittest
 import os, sys
+import shutil
+import tempfile
 
 import numpy as np
 
 from credo.t2model import T2ModelResult
 from t2data import t2data
 from t2listing import t2listing
+from mulgrids import mulgrid
 
 THIS_DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -84,6 +87,39 @@ class TestAUT2Model(unittest.TestCase):
         for t,te in zip(times, expected_times):
             self.assertEqual(t, te)
 
+    def test_getpositions(self):
+        # block centres, including surface blocks and blocks above the
+        # surface, for each type of atmosphere
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for atmos_type in [0, 1, 2]:
+                geo = mulgrid().rectangular([100.] * 4, [50.] * 3,
+                                            [10., 20., 30.],
+                                            atmos_type=atmos_type)
+                for i, col in enumerate(geo.columnlist):
+                    col.surface = [-5., -15., 0., -30., 2.][i % 5]
+                geo_filename = os.path.join(tmp_dir, 'g%d.dat' % atmos_type)
+                geo.write(geo_filename)
+                mres = T2ModelResult('test_aut2_geo',
+                                     lst_filename='mres_aut2_cc6.listing',
+                                     geo_filename=geo_filename)
+                geo = mres._geo
+                p = mres.getPositions()
+                self.assertEqual(p.shape, (geo.num_blocks, 3))
+                for b, pb in zip(geo.block_name_list, p):
+                    lay, col = geo.layer_name(b), geo.column_name(b)
+                    if col in geo.column:
+                        centre = geo.block_centre(lay, col)
+                    else: # single atmosphere block
+                        centre = None
+                    if centre is None:
+                        self.assertTrue(np.all(np.isnan(pb)))
+                    else:
+                        self.assertTrue(np.allclose(pb, centre))
+                mres.destroy()
+        finally:
+            shutil.rmtree(tmp_dir)
+
 class TestCustomField(unittest.TestCase):
     def setUp(self):
         self.lstname = 'mres_aut2_fivespot.listing'
@@ -0,0 +1,1125 @@
+"""Test job runners with dummy model runs, which just sleep for a while and
+print out the times they started and finished.
+"""
+
+import os
+import sys
+import csv
+import gc
+import json
+import platform
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import warnings
+from xml.etree import ElementTree as etree
+
+from credo.modelrun import ModelRun
+from credo.modelresult import ModelResult
+from credo.modelsuite import ModelSuite
+from credo.jobrunner import SimpleJobRunner, PooledJobRunner, RunCache
+from credo.jobrunner.simplejobrunner import SimpleJobMetaInfo
+from credo.jobrunner import WalltimeHistory, readJobMetaInfoFromXMLNode
+from credo.jobrunner import RunHistory
+from credo.jobrunner.runcache import suiteRunFingerprint
+from credo.jobrunner.walltimehistory import runKey
+from credo.jobrunner import RunMonitor, ProgressReporter
+from credo.jobrunner.progress import RunProgress, formatDuration
+from credo.jobrunner.api import ModelRunRegularError, ModelRunTimeoutError
+from credo.jobrunner.api import ModelRunAbortedError, RunFutureTimeoutError
+from credo.jobrunner.api import ModelRunLaunchError
+from credo.io.waiweralog import WaiweraLogParser
+from credo.utils import findExecutable
+from credo.jobrunner.petscLogProfiler import PETScLogProfiler, \
+    xmlSafeName
+from credo.jobrunner.procSamplingProfiler import ProcSamplingProfiler, \
+    TIMELINE_FILENAME, TIMELINE_COLUMNS
+
+class SleepModelRun(ModelRun):
+    """Dummy model run that sleeps, then prints its start and end times."""
+    def __init__(self, name, basePath=None, outputPath=None, logPath=None,
+                 sleepTime=0.5, exitCode=0):
+        super(SleepModelRun, self).__init__(name, basePath, outputPath, logPath)
+        self.sleepTime = sleepTime
+        self.exitCode = exitCode
+
+    def getModelRunCommand(self, extraCmdLineOpts=None):
+        script = "from __future__ import print_function; " \
+            "import sys, time; s = time.time(); time.sleep(%g); " \
+            "print(s, time.time()); sys.exit(%d)" \
+            % (self.sleepTime, self.exitCode)
+        return '%s -c "%s"' % (sys.executable, script)
+
+    def createModelResult(self):
+        return SleepModelResult(self.name, self.outputPath,
+            os.path.join(self.basePath, self.getStdOutFilename()))
+
+class CachedSleepModelRun(SleepModelRun):
+    """Dummy model run with an input file, so its results can be cached.
+    Counts the times it's tidied up after running."""
+    cleanups = 0
+
+    def getInputFilenames(self):
+        return ['input.txt']
+
+    def postRunCleanup(self):
+        CachedSleepModelRun.cleanups += 1
+
+class NamedInputSleepModelRun(SleepModelRun):
+    """Dummy model run with its own input file, named after the run."""
+    def getInputFilenames(self):
+        return ['%s.in' % self.name]
+
+class SpawningModelRun(SleepModelRun):
+    """Dummy model run that starts a child process (which ignores SIGTERM)
+    that sleeps for a long time, prints its pid, then sleeps itself."""
+    def getModelRunCommand(self, extraCmdLineOpts=None):
+        child = "import signal, time; " \
+            "signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(60)"
+        script = "import subprocess, sys, time; " \
+            "p = subprocess.Popen([sys.executable, '-c', '%s']); " \
+            "print(p.pid); sys.stdout.flush(); time.sleep(%g)" \
+            % (child, self.sleepTime)
+        return '%s -c "%s"' % (sys.executable, script)
+
+    def createModelResult(self):
+        return ModelResult(self.name, self.outputPath)
+
+class StubbornModelRun(SleepModelRun):
+    """Dummy model run that ignores SIGTERM while it sleeps."""
+    def getModelRunCommand(self, extraCmdLineOpts=None):
+        script = "import signal, time; " \
+            "signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(%g)" \
+            % self.sleepTime
+        return '%s -c "%s"' % (sys.executable, script)
+
+class BrokenModelRun(SleepModelRun):
+    """Dummy model run whose preparation fails with an IOError."""
+    def preRunPreparation(self):
+        raise IOError("can't write input files")
+
+class MissingModelRun(SleepModelRun):
+    """Dummy model run whose simulator doesn't exist."""
+    def getModelRunCommand(self, extraCmdLineOpts=None):
+        return os.path.join(self.basePath, 'no-such-simulator')
+
+class BusyModelRun(SleepModelRun):
+    """Dummy model run that uses some memory and CPU time."""
+    def getModelRunCommand(self, extraCmdLineOpts=None):
+        script = "x = bytearray(64 * 2**20); " \
+            "[sum(range(10**6)) for i in range(10)]"
+        return '%s -c "%s"' % (sys.executable, script)
+
+    def createModelResult(self):
+        return ModelResult(self.name, self.outputPath)
+
+# Part of a PETSc -log_view log in ascii_info_detail format, for 2 ranks.
+PETSC_LOG_VIEW = """
+size = 2
+LocalTimes = {}
+LocalMessages = {}
+LocalMessageLens = {}
+LocalReductions = {}
+LocalFlop = {}
+Stages = {}
+Stages["Main Stage"] = {}
+Stages["Main Stage"]["summary"] = {}
+Stages["Solve"] = {}
+Stages["Solve"]["summary"] = {}
+LocalTimes[0] = 2.0
+LocalTimes[1] = 1.6
+LocalMessages[0] = 10
+LocalMessages[1] = 12
+LocalMessageLens[0] = 800
+LocalMessageLens[1] = 960
+LocalReductions[0] = 5
+LocalReductions[1] = 5
+LocalFlop[0] = 3e+06
+LocalFlop[1] = 1e+06
+Stages["Main Stage"]["summary"][0] = {"time" : 0.5, "numMessages" : 2, "messageLength" : 160, "numReductions" : 1, "flop" : 1e+06}
+Stages["Main Stage"]["summary"][1] = {"time" : 0.4, "numMessages" : 2, "messageLength" : 160, "numReductions" : 1, "flop" : 0}
+Stages["Main Stage"]["MatAssemblyEnd"] = {}
+Stages["Main Stage"]["MatAssemblyEnd"][0] = {"count" : 2, "time" : 0.1, "syncTime" : 0, "numMessages" : 2, "messageLength" : 160, "numReductions" : 1, "flop" : 0}
+Stages["Main Stage"]["MatAssemblyEnd"][1] = {"count" : 2, "time" : 0.05, "syncTime" : 0, "numMessages" : 2, "messageLength" : 160, "numReductions" : 1, "flop" : 0}
+Stages["Main Stage"]["KSPSolve"] = {}
+Stages["Main Stage"]["KSPSolve"][0] = {"count" : 1, "time" : 0.2, "syncTime" : 0, "numMessages" : 0, "messageLength" : 0, "numReductions" : 0, "flop" : 1e+06}
+Stages["Main Stage"]["KSPSolve"][1] = {"count" : 1, "time" : 0.2, "syncTime" : 0, "numMessages" : 0, "messageLength" : 0, "numReductions" : 0, "flop" : 0}
+Stages["Main Stage"]["VecView"] = {}
+Stages["Main Stage"]["VecView"][0] = {"count" : 0, "time" : 0, "syncTime" : 0, "numMessages" : 0, "messageLength" : 0, "numReductions" : 0, "flop" : 0}
+Stages["Main Stage"]["VecView"][1] = {"count" : 0, "time" : 0, "syncTime" : 0, "numMessages" : 0, "messageLength" : 0, "numReductions" : 0, "flop" : 0}
+Stages["Solve"]["summary"][0] = {"time" : 1.5, "numMessages" : 8, "messageLength" : 640, "numReductions" : 4, "flop" : 2e+06}
+Stages["Solve"]["summary"][1] = {"time" : 1.2, "numMessages" : 10, "messageLength" : 800, "numReductions" : 4, "flop" : 1e+06}
+Stages["Solve"]["KSPSolve"] = {}
+Stages["Solve"]["KSPSolve"][0] = {"count" : 3, "time" : 1.0, "syncTime" : 0, "numMessages" : 8, "messageLength" : 640, "numReductions" : 4, "flop" : 2e+06}
+Stages["Solve"]["KSPSolve"][1] = {"count" : 3, "time" : 0.8, "syncTime" : 0, "numMessages" : 10, "messageLength" : 800, "numReductions" : 4, "flop" : 1e+06}
+"""
+
+class PETScLogModelRun(SleepModelRun):
+    """Dummy model run that writes a PETSc log, where told to by the
+    -log_view option."""
+    def getModelRunCommand(self, extraCmdLineOpts=None):
+        script = "import shutil, sys; " \
+            "shutil.copy('petscLog.txt', sys.argv[-1].split(':')[1])"
+        return '%s -c "%s"' % (sys.executable, script)
+
+    def createModelResult(self):
+        return ModelResult(self.name, self.outputPath)
+
+# Script writing a Waiwera-like log, of time steps of the given size and
+#  sim time increment, then (if told to) failing to converge repeatedly.
+FAKE_LOG_SCRIPT = """
+import sys, time
+logFilename, steps, size, dt, failures = sys.argv[1:]
+with open(logFilename, 'w') as log:
+    t = 0.
+    for i in range(int(steps)):
+        t += float(dt)
+        log.write('- [info, timestep, start, {"count": %d, "size": %s}]\\n'
+            % (i + 1, size))
+        log.write('- [info, nonlinear_solver, end, {"iterations": 1, '
+            '"converged": T, "reason": "function_relative"}]\\n')
+        log.write('- [info, timestep, end, {"tries": 1, "size": %s, '
+            '"time": %g, "status": "OK"}]\\n\\n' % (size, t))
+        log.flush()
+        print('step %d' % (i + 1))
+        sys.stdout.flush()
+        time.sleep(0.02)
+    for i in range(int(failures)):
+        log.write('- [warn, nonlinear_solver, end, {"iterations": 0, '
+            '"converged": F, "reason": "line_search"}]\\n')
+        log.write('- [warn, timestep, reduction, {"new_size": %g}]\\n'
+            % (float(size) / 2**(i + 1)))
+        log.flush()
+        time.sleep(0.02)
+"""
+
+class FakeLogModelRun(SleepModelRun):
+    """Dummy model run that writes a Waiwera-like log as it runs (see
+    FAKE_LOG_SCRIPT)."""
+    def __init__(self, name, basePath, steps=10, size=1.0, dt=1.0,
+            failures=0):
+        super(FakeLogModelRun, self).__init__(name, basePath)
+        self.args = (steps, size, dt, failures)
+
+    def getModelRunCommand(self, extraCmdLineOpts=None):
+        return '%s fakelog.py %s %d %g %g %d' % ((sys.executable,
+            self.getProgressLogFilename()) + self.args)
+
+    def getInputFilenames(self):
+        return ['fakelog.py']
+
+    def getProgressLogFilename(self):
+        return '%s.yaml' % self.name
+
+    def createProgressParser(self):
+        return WaiweraLogParser()
+
+    def getSimTimeLimits(self):
+        steps, size, dt, failures = self.args
+        return (0., steps * dt)
+
+    def createModelResult(self):
+        return ModelResult(self.name, self.outputPath)
+
+def processRunning(pid):
+    """Returns whether process pid exists, and isn't a zombie."""
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except IOError:
+        return False
+
+class SleepModelResult(ModelResult):
+    """Dummy model result, holding start and end times of the run."""
+    def __init__(self, name, outputPath, stdOutFilename):
+        super(SleepModelResult, self).__init__(name, outputPath)
+        with open(stdOutFilename) as f:
+            self.startTime, self.endTime = [float(v) for v in f.read().split()]
+
+def maxOverlap(results):
+    """Returns maximum number of the results' runs that were running at the
+    same time."""
+    events = []
+    for r in results:
+        events += [(r.startTime, 1), (r.endTime, -1)]
+    count, maxCount = 0, 0
+    for t, change in sorted(events):
+        count += change
+        maxCount = max(count, maxCount)
+    return maxCount
+
+class TestPooledJobRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def makeSuite(self, nprocs, sleepTime=0.5):
+        suite = ModelSuite(os.path.join(self.base_path, 'output'))
+        for i, nproc in enumerate(nprocs):
+            name = "sleep_%d" % i
+            run = SleepModelRun(name, basePath=self.base_path,
+                outputPath=os.path.join(self.base_path, 'output', name),
+                sleepTime=sleepTime)
+            run.jobParams['nproc'] = nproc
+            suite.addRun(run, "sleep run %d" % i)
+        return suite
+
+    def test_concurrent(self):
+        suite = self.makeSuite([1, 1, 1, 1])
+        jrunner = PooledJobRunner(maxProcs=2)
+        results = jrunner.runSuite(suite, writeRecords=False)
+        self.assertEqual(len(results), 4)
+        for run, result in zip(suite.runs, results):
+            self.assertEqual(run.name, result.modelName)
+        self.assertEqual(maxOverlap(results), 2)
+
+    def test_nproc_budget(self):
+        suite = self.makeSuite([2, 1, 1, 2])
+        jrunner = PooledJobRunner(maxProcs=3)
+        results = jrunner.runSuite(suite, writeRecords=False)
+        used = []
+        for r in results:
+            nproc = [run.jobParams['nproc'] for run in suite.runs
+                if run.name == r.modelName][0]
+            running = [run.jobParams['nproc'] for run, other in
+                zip(suite.runs, results) if other.startTime <= r.startTime
+                and other.endTime > r.startTime]
+            used.append(sum(running))
+        self.assertTrue(max(used) <= 3)
+        self.assertTrue(maxOverlap(results) >= 2)
+
+    def test_oversized_run(self):
+        suite = self.makeSuite([4, 1], sleepTime=0.2)
+        jrunner = PooledJobRunner(maxProcs=2)
+        results = jrunner.runSuite(suite, writeRecords=False)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(maxOverlap(results), 1)
+
+    def test_failed_run(self):
+        suite = self.makeSuite([1, 1, 1], sleepTime=0.2)
+        suite.runs[1].exitCode = 1
+        jrunner = PooledJobRunner(maxProcs=1)
+        self.assertRaises(ModelRunRegularError, jrunner.runSuite, suite,
+            writeRecords=False)
+
+    def test_slow_completion(self):
+        # completing a run (here a slow result callback) doesn't hold up
+        # launching the next
+        suite = self.makeSuite([1, 1], sleepTime=0.2)
+        callbackEnds = {}
+        def resultCallback(runI, result):
+            if runI == 0:
+                time.sleep(1.5)
+            callbackEnds[runI] = time.time()
+        jrunner = PooledJobRunner(maxProcs=1)
+        results = jrunner.runSuite(suite, writeRecords=False,
+            resultCallback=resultCallback)
+        self.assertTrue(results[1].startTime < callbackEnds[0])
+        self.assertEqual(sorted(callbackEnds), [0, 1])
+        # the walltime of run 1 doesn't include waiting to be completed
+        walltime = results[1].jobMetaInfo.performance['Walltime']['walltime']
+        self.assertTrue(walltime < 1.0)
+
+    def test_sequential(self):
+        suite = self.makeSuite([1, 1], sleepTime=0.2)
+        jrunner = PooledJobRunner(maxProcs=2)
+        results = jrunner.runSuite(suite, runSuiteNonBlocking=False,
+            writeRecords=False)
+        self.assertEqual(maxOverlap(results), 1)
+
+    def test_interrupt(self):
+        suite = self.makeSuite([1, 1], sleepTime=30)
+        jrunner = PooledJobRunner(maxProcs=2)
+        # Simulate Ctrl-C while waiting for the runs
+        submitted = []
+        submitRun = jrunner.submitRun
+        def recordingSubmitRun(*args, **kwargs):
+            jobMI = submitRun(*args, **kwargs)
+            submitted.append(jobMI)
+            return jobMI
+        def interrupt(*args):
+            raise KeyboardInterrupt()
+        jrunner.submitRun = recordingSubmitRun
+        jrunner._waitForFinished = interrupt
+        start = time.time()
+        self.assertRaises(KeyboardInterrupt, jrunner.runSuite, suite,
+            writeRecords=False)
+        self.assertTrue(time.time() - start < 10)
+        self.assertEqual(len(submitted), 2)
+        for jobMI in submitted:
+            self.assertTrue(jobMI.finished.is_set())
+        self.assertFalse(any(t.name == "credo-completion"
+            for t in threading.enumerate()))
+
+    def test_launch_error(self):
+        # runs already launched are stopped if launching another fails with
+        #  an unexpected error
+        suite = self.makeSuite([1], sleepTime=30)
+        suite.addRun(BrokenModelRun("broken", basePath=self.base_path),
+            "broken run")
+        jrunner = PooledJobRunner(maxProcs=2)
+        submitted = []
+        submitRun = jrunner.submitRun
+        def recordingSubmitRun(*args, **kwargs):
+            jobMI = submitRun(*args, **kwargs)
+            submitted.append(jobMI)
+            return jobMI
+        jrunner.submitRun = recordingSubmitRun
+        start = time.time()
+        self.assertRaises(IOError, jrunner.runSuite, suite,
+            writeRecords=False)
+        self.assertTrue(time.time() - start < 10)
+        self.assertEqual(len(submitted), 1)
+        self.assertTrue(submitted[0].finished.is_set())
+        self.assertFalse(any(t.name == "credo-completion"
+            for t in threading.enumerate()))
+
+    def test_slow_kill(self):
+        # killing a run that timed out doesn't hold up launching others
+        suite = ModelSuite(os.path.join(self.base_path, 'output'))
+        stubborn = StubbornModelRun("stubborn", basePath=self.base_path,
+            sleepTime=30)
+        stubborn.jobParams['maxRunTime'] = 0.5
+        suite.addRun(stubborn, "stubborn run")
+        for name, sleepTime in [("first", 1.0), ("second", 0.1)]:
+            suite.addRun(SleepModelRun(name, basePath=self.base_path,
+                sleepTime=sleepTime), name)
+        jrunner = PooledJobRunner(maxProcs=2)
+        jrunner.killGracePeriod = 3.0
+        results = {}
+        def resultCallback(runI, result):
+            results[result.modelName] = result
+        start = time.time()
+        self.assertRaises(ModelRunTimeoutError, jrunner.runSuite, suite,
+            writeRecords=False, resultCallback=resultCallback)
+        self.assertTrue(time.time() - start >= 3.0)
+        self.assertTrue(results["second"].startTime - start < 2.5)
+
+class TestRunCompletion(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def makeRun(self, name, sleepTime, maxRunTime=None):
+        run = SleepModelRun(name, basePath=self.base_path,
+            sleepTime=sleepTime)
+        run.jobParams['maxRunTime'] = maxRunTime
+        run.jobParams['pollInterval'] = 10
+        return run
+
+    def test_no_poll_delay(self):
+        # Short runs shouldn't have to wait for a poll interval
+        run = self.makeRun("quick", 0.1, maxRunTime=20)
+        start = time.time()
+        SimpleJobRunner().runModel(run)
+        self.assertTrue(time.time() - start < 5)
+
+    def test_timeout(self):
+        run = self.makeRun("slow", 30, maxRunTime=0.5)
+        start = time.time()
+        self.assertRaises(ModelRunTimeoutError, SimpleJobRunner().runModel,
+            run)
+        self.assertTrue(time.time() - start < 5)
+
+    def test_finish_callbacks(self):
+        # called before the finished event is set, so waiters see their
+        # effects
+        jobMI = SimpleJobMetaInfo()
+        seen = []
+        jobMI.addFinishCallback(
+            lambda jobMI: seen.append((jobMI.retCode, jobMI.finished.is_set())))
+        jobMI.setFinished(3)
+        self.assertEqual(seen, [(3, False)])
+        self.assertTrue(jobMI.finished.is_set())
+        jobMI.addFinishCallback(lambda jobMI: seen.append('late'))
+        self.assertEqual(seen[-1], 'late')
+
+    def test_stdin_closed(self):
+        # the std in file is closed once the run is launched, not left to
+        # be garbage collected
+        run = self.makeRun("stdin", 0.1)
+        with open(run.getStdInFilename(), 'w') as f:
+            f.write("input\n")
+        jrunner = SimpleJobRunner()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            jobMI = jrunner.submitRun(run)
+            gc.collect()
+        self.assertEqual([w for w in caught
+            if run.getStdInFilename() in str(w.message)], [])
+        jrunner.blockResult(run, jobMI)
+
+    def test_pool_timeout(self):
+        suite = ModelSuite('output')
+        suite.addRun(self.makeRun("quick", 0.1), "quick run")
+        suite.addRun(self.makeRun("slow", 30, maxRunTime=0.5), "slow run")
+        start = time.time()
+        self.assertRaises(ModelRunTimeoutError,
+            PooledJobRunner(maxProcs=2).runSuite, suite, writeRecords=False)
+        self.assertTrue(time.time() - start < 5)
+
+@unittest.skipUnless(os.path.isdir('/proc'), "needs /proc")
+class TestKillProcessTree(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def childPid(self, run):
+        with open(os.path.join(self.base_path, run.getStdOutFilename())) as f:
+            return int(f.read().split()[0])
+
+    def runModel(self, sleepTime, maxRunTime=None):
+        run = SpawningModelRun("spawning", basePath=self.base_path,
+            sleepTime=sleepTime)
+        run.jobParams['maxRunTime'] = maxRunTime
+        jrunner = SimpleJobRunner()
+        jrunner.killGracePeriod = 0.5
+        return run, jrunner
+
+    def test_timeout(self):
+        run, jrunner = self.runModel(30, maxRunTime=1)
+        start = time.time()
+        self.assertRaises(ModelRunTimeoutError, jrunner.runModel, run)
+        self.assertTrue(time.time() - start < 10)
+        self.assertFalse(processRunning(self.childPid(run)))
+
+    def test_left_behind(self):
+        # Processes still going when the job itself exits are killed too
+        run, jrunner = self.runModel(0.5)
+        jrunner.runModel(run)
+        self.assertFalse(processRunning(self.childPid(run)))
+
+    def test_interrupt(self):
+        run, jrunner = self.runModel(30)
+        jobMI = jrunner.submitRun(run)
+        # Wait until the child has started
+        deadline = time.time() + 10
+        while time.time() < deadline and os.path.getsize(
+                os.path.join(self.base_path, run.getStdOutFilename())) == 0:
+            time.sleep(0.05)
+        # Simulate Ctrl-C while waiting for the job
+        waitFinished = jobMI.finished.wait
+        def interrupt(timeout=None):
+            jobMI.finished.wait = waitFinished
+            raise KeyboardInterrupt()
+        jobMI.finished.wait = interrupt
+        self.assertRaises(KeyboardInterrupt, jrunner.blockResult, run, jobMI)
+        self.assertTrue(jobMI.finished.is_set())
+        self.assertFalse(processRunning(self.childPid(run)))
+
+@unittest.skipUnless(hasattr(os, 'wait4'), "needs os.wait4")
+class TestRusageProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def runModel(self, mpi=False, nproc=1):
+        run = BusyModelRun("busy", basePath=self.base_path)
+        run.jobParams['nproc'] = nproc
+        result = SimpleJobRunner(mpi=mpi).runModel(run)
+        return result.jobMetaInfo.performance['Rusage']
+
+    def test_serial(self):
+        usage = self.runModel()
+        self.assertTrue(usage['userTime'] > 0.05)
+        self.assertAlmostEqual(usage['cpuTime'],
+            usage['userTime'] + usage['sysTime'])
+        self.assertTrue(usage['maxRSS'] > 64 * 2**20)
+        self.assertTrue(usage['minorPageFaults'] > 0)
+        for key in ['majorPageFaults', 'voluntaryContextSwitches',
+                'involuntaryContextSwitches']:
+            self.assertTrue(key in usage)
+
+    @unittest.skipUnless(findExecutable('mpiexec'), "needs mpiexec")
+    def test_mpi(self):
+        # Includes the usage of all ranks
+        serial = self.runModel()
+        parallel = self.runModel(mpi=True, nproc=2)
+        self.assertTrue(parallel['userTime'] > 1.5 * serial['userTime'])
+        self.assertTrue(parallel['maxRSS'] > 64 * 2**20)
+
+@unittest.skipUnless(os.path.exists('/proc/self/stat'), "needs /proc")
+class TestProcSamplingProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def runModel(self, mpi=False, nproc=1):
+        run = BusyModelRun("busy", basePath=self.base_path)
+        run.jobParams['nproc'] = nproc
+        jobRunner = SimpleJobRunner(mpi=mpi)
+        jobRunner.profilers.append(ProcSamplingProfiler(interval=0.02))
+        result = jobRunner.runModel(run)
+        fname = os.path.join(self.base_path, run.outputPath,
+            TIMELINE_FILENAME)
+        with open(fname) as f:
+            rows = list(csv.DictReader(f))
+        return result.jobMetaInfo.performance['ProcSampling'], rows
+
+    def test_serial(self):
+        perf, rows = self.runModel()
+        self.assertTrue(perf['nSamples'] > 1)
+        self.assertTrue(perf['rank0_peakRSS'] > 64 * 2**20)
+        self.assertTrue(0. < perf['rank0_cpuUtilisation'] <= 1.1)
+        self.assertTrue(perf['peakRSS'] >= perf['rank0_peakRSS'])
+        self.assertFalse('rank1_peakRSS' in perf)
+        self.assertEqual(sorted(rows[0].keys()), sorted(TIMELINE_COLUMNS))
+        self.assertTrue(max(int(r['rss']) for r in rows) > 64 * 2**20)
+
+    def test_launch_error(self):
+        # The sampling thread is stopped if the job can't be launched
+        run = MissingModelRun("missing", basePath=self.base_path)
+        jobRunner = SimpleJobRunner()
+        jobRunner.profilers.append(ProcSamplingProfiler(interval=0.02))
+        self.assertRaises(ModelRunLaunchError, jobRunner.submitRun, run)
+        self.assertFalse([t for t in threading.enumerate()
+            if t.name == "credo-proc-sampler"])
+
+    @unittest.skipUnless(findExecutable('mpiexec'), "needs mpiexec")
+    def test_mpi(self):
+        perf, rows = self.runModel(mpi=True, nproc=2)
+        for rank in [0, 1]:
+            self.assertTrue(perf['rank%d_peakRSS' % rank] > 64 * 2**20)
+        # mpiexec itself is sampled too, but isn't a rank.
+        self.assertTrue(perf['nProcs'] > 2)
+        self.assertEqual(set(r['rank'] for r in rows), set(['-1', '0', '1']))
+
+class TestPETScLogProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        with open(os.path.join(self.base_path, 'petscLog.txt'), 'w') as f:
+            f.write(PETSC_LOG_VIEW)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def test_profile(self):
+        run = PETScLogModelRun("petsc", basePath=self.base_path)
+        jobRunner = SimpleJobRunner()
+        jobRunner.profilers.append(PETScLogProfiler())
+        result = jobRunner.runModel(run)
+        perf = result.jobMetaInfo.performance
+        totals = perf['PETSc']
+        self.assertAlmostEqual(totals['time'], 2.0)
+        self.assertAlmostEqual(totals['timeRatio'], 1.25)
+        self.assertAlmostEqual(totals['flop'], 4e6)
+        self.assertAlmostEqual(totals['flopRatio'], 3.)
+        self.assertAlmostEqual(totals['numMessages'], 22)
+        # Events summed over stages
+        self.assertAlmostEqual(totals['KSPSolve_time'], 1.2)
+        self.assertAlmostEqual(totals['KSPSolve_count'], 4)
+        self.assertAlmostEqual(totals['KSPSolve_flop'], 4e6)
+        self.assertAlmostEqual(totals['MatAssemblyEnd_timeRatio'], 2.)
+        # Events that weren't called are left out.
+        self.assertFalse('VecView_time' in totals)
+        main = perf['PETSc stage Main Stage']
+        self.assertAlmostEqual(main['time'], 0.5)
+        self.assertAlmostEqual(main['flopRatio'], 0.)
+        self.assertAlmostEqual(main['KSPSolve_time'], 0.2)
+        solve = perf['PETSc stage Solve']
+        self.assertAlmostEqual(solve['KSPSolve_numMessages'], 18)
+        self.assertAlmostEqual(solve['KSPSolve_messageLength'], 1440)
+        # The performance info is saved in, and read back from, the records.
+        result.writeRecordXML()
+        xmlDoc = etree.parse(os.path.join(result.outputPath,
+            'ModelResult-petsc.xml'))
+        readJobMI = readJobMetaInfoFromXMLNode(
+            xmlDoc.getroot().find('jobMetaInfo'))
+        self.assertEqual(readJobMI.performance['PETSc'], totals)
+        self.assertEqual(readJobMI.performance['PETSc stage Solve'], solve)
+
+    def test_xml_safe_name(self):
+        self.assertEqual(xmlSafeName("Main Stage"), "Main_Stage")
+        self.assertEqual(xmlSafeName("MatMult GPU"), "MatMult_GPU")
+        self.assertEqual(xmlSafeName("3DStage"), "_3DStage")
+
+class TestRunMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        with open(os.path.join(self.base_path, 'fakelog.py'), 'w') as f:
+            f.write(FAKE_LOG_SCRIPT)
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def runMonitored(self, monitor, **kwargs):
+        monitor.pollInterval = 0.05
+        run = FakeLogModelRun("fake", self.base_path, **kwargs)
+        jobRunner = SimpleJobRunner(runMonitor=monitor)
+        start = time.time()
+        try:
+            return jobRunner.runModel(run)
+        finally:
+            self.elapsed = time.time() - start
+
+    def test_not_aborted(self):
+        monitor = RunMonitor(minStepSize=0.5, maxConsecutiveFailures=2,
+            abortPatterns=['Error'])
+        result = self.runMonitored(monitor, steps=5)
+        self.assertEqual(result.jobMetaInfo.abortReason, None)
+
+    def test_consecutive_failures(self):
+        monitor = RunMonitor(maxConsecutiveFailures=3)
+        with self.assertRaises(ModelRunAbortedError) as cm:
+            self.runMonitored(monitor, steps=2, failures=1000)
+        e = cm.exception
+        self.assertTrue("3 consecutive failed" in e.reason)
+        self.assertTrue(len(e.evidence) > 0)
+        self.assertTrue('"converged": F' in e.evidence[-1])
+        self.assertTrue(e.reason in str(e))
+        self.assertTrue(self.elapsed < 10.)
+
+    def test_min_step_size(self):
+        monitor = RunMonitor(minStepSize=0.1)
+        with self.assertRaises(ModelRunAbortedError) as cm:
+            self.runMonitored(monitor, steps=2, failures=1000)
+        self.assertTrue("below the minimum of 0.1" in cm.exception.reason)
+        self.assertTrue('"new_size": 0.0625' in cm.exception.evidence[-1])
+
+    def test_progress_rate(self):
+        monitor = RunMonitor(minProgressRate=100., progressWindow=0.3)
+        with self.assertRaises(ModelRunAbortedError) as cm:
+            self.runMonitored(monitor, steps=1000, dt=1.0)
+        self.assertTrue("below the minimum rate" in cm.exception.reason)
+        self.assertTrue(self.elapsed < 10.)
+
+    def test_stdout_pattern(self):
+        monitor = RunMonitor(abortPatterns=[r'^step 3$'])
+        with self.assertRaises(ModelRunAbortedError) as cm:
+            self.runMonitored(monitor, steps=1000)
+        self.assertTrue("step 3" in cm.exception.reason)
+        self.assertEqual(cm.exception.evidence[-1], 'step 3')
+
+    def test_stale_log(self):
+        # The log of a previous run that was aborted shouldn't be read
+        logFilename = os.path.join(self.base_path, 'fake.yaml')
+        with open(logFilename, 'w') as f:
+            f.write('Error\n' * 10)
+        old = time.time() - 3600.
+        os.utime(logFilename, (old, old))
+        monitor = RunMonitor(abortPatterns=['Error'])
+        monitor.pollInterval = 0.001
+        run = FakeLogModelRun("fake", self.base_path, steps=5)
+        result = SimpleJobRunner(runMonitor=monitor).runModel(run)
+        self.assertEqual(result.jobMetaInfo.abortReason, None)
+
+    def test_abort_finished(self):
+        # A run that finishes by itself just as it's aborted isn't recorded
+        #  as aborted
+        run = FakeLogModelRun("fake", self.base_path, steps=1)
+        jobRunner = SimpleJobRunner()
+        jobMI = jobRunner.submitRun(run)
+        jobMI.finished.wait()
+        jobRunner._abortJob(jobMI, "too late", [])
+        self.assertEqual(jobMI.abortReason, None)
+        self.assertFalse(jobMI.killed)
+        result = jobRunner.blockResult(run, jobMI)
+        self.assertEqual(result.jobMetaInfo.abortReason, None)
+
+class RecordingProgressReporter(ProgressReporter):
+    """Progress reporter that keeps each status it reports."""
+    def __init__(self, *args, **kwargs):
+        ProgressReporter.__init__(self, *args, **kwargs)
+        self.statuses = []
+
+    def report(self):
+        ProgressReporter.report(self)
+        self.statuses.append(self.statusDict())
+
+class TestProgressReporter(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        with open(os.path.join(self.base_path, 'fakelog.py'), 'w') as f:
+            f.write(FAKE_LOG_SCRIPT)
+        self.status_filename = os.path.join(self.base_path, 'status.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def makeSuite(self, steps=20):
+        suite = ModelSuite('output')
+        for i in range(2):
+            suite.addRun(FakeLogModelRun("fake_%d" % i, self.base_path,
+                steps=steps, dt=2.0), "fake run %d" % i)
+        return suite
+
+    def readStatus(self):
+        with open(self.status_filename) as f:
+            return json.load(f)
+
+    def test_suite(self):
+        reporter = RecordingProgressReporter(self.status_filename,
+            interval=0.05, console=False)
+        jobRunner = SimpleJobRunner(progressReporter=reporter)
+        afterFirst = []
+        def resultCallback(runI, result):
+            if runI == 0:
+                afterFirst.append(self.readStatus())
+        jobRunner.runSuite(self.makeSuite(), writeRecords=False,
+            resultCallback=resultCallback)
+        status = afterFirst[0]
+        self.assertEqual([r['state'] for r in status['runs']],
+            ['complete', 'pending'])
+        self.assertEqual(status['suite']['numComplete'], 1)
+        # No history, so the walltime of the pending run isn't known
+        self.assertEqual(status['suite']['eta'], None)
+        running = [r for st in reporter.statuses for r in st['runs']
+            if r['state'] == 'running' and r['simTime'] is not None]
+        self.assertTrue(len(running) > 0)
+        for run in running:
+            self.assertEqual(run['stopTime'], 40.)
+            self.assertTrue(0. < run['fraction'] <= 1.)
+            self.assertTrue(run['eta'] is not None)
+        status = self.readStatus()
+        self.assertEqual(status['suite']['numComplete'], 2)
+        self.assertEqual(status['suite']['eta'], 0.)
+        self.assertEqual([r['fraction'] for r in status['runs']], [1., 1.])
+        self.assertEqual([f for f in os.listdir(self.base_path)
+            if f.endswith('.tmp')], [])
+
+    def test_estimates(self):
+        run = FakeLogModelRun("fake", self.base_path, steps=10, dt=2.0)
+        rp = RunProgress(0, run, predictedWalltime=10.)
+        self.assertEqual(rp.remainingWalltime(0.), 10.)
+        rp.state, rp.startClock = 'running', 100.
+        rp.simTimeLimits, rp.simTime = run.getSimTimeLimits(), 5.
+        self.assertEqual(rp.fraction(), 0.25)
+        # 12 s left from progress so far, 6 s from history
+        self.assertAlmostEqual(rp.remainingWalltime(104.), 7.5)
+        rp.predictedWalltime = None
+        self.assertAlmostEqual(rp.remainingWalltime(104.), 12.)
+        other = RunProgress(1, run, predictedWalltime=4.)
+        reporter = ProgressReporter(console=False)
+        reporter.runs = [rp, other]
+        self.assertAlmostEqual(reporter.suiteRemainingWalltime(104.), 16.)
+        reporter.maxProcs = 2
+        self.assertAlmostEqual(reporter.suiteRemainingWalltime(104.), 12.)
+        self.assertEqual(formatDuration(3725.2), "1h02m05s")
+        self.assertEqual(formatDuration(None), "unknown")
+
+    def test_pooled_history(self):
+        history_filename = os.path.join(self.base_path, 'walltimes.json')
+        for i in range(2):
+            reporter = ProgressReporter(self.status_filename, interval=0.05,
+                console=False)
+            jobRunner = PooledJobRunner(maxProcs=2,
+                walltimeHistory=WalltimeHistory(history_filename),
+                progressReporter=reporter)
+            jobRunner.runSuite(self.makeSuite(steps=5), writeRecords=False)
+        # Walltimes of the first suite are used to predict the second
+        for rp in reporter.runs:
+            self.assertTrue(rp.predictedWalltime > 0.)
+        self.assertEqual(self.readStatus()['suite']['numComplete'], 2)
+
+class TestAsyncRuns(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def makeRun(self, name, sleepTime, exitCode=0):
+        return SleepModelRun(name, basePath=self.base_path,
+            sleepTime=sleepTime, exitCode=exitCode)
+
+    def test_future(self):
+        jrunner = SimpleJobRunner()
+        run = self.makeRun("async", 0.1)
+        future = jrunner.submitRunAsync(run)
+        self.assertTrue(future.modelRun is run)
+        result = future.result(timeout=10)
+        self.assertEqual(result.modelName, "async")
+        failed = jrunner.submitRunAsync(self.makeRun("failed", 0.1, 1))
+        self.assertTrue(isinstance(failed.exception(timeout=10),
+            ModelRunRegularError))
+
+    def test_as_completed(self):
+        jrunner = SimpleJobRunner()
+        futures = [jrunner.submitRunAsync(self.makeRun(name, sleepTime))
+            for name, sleepTime in [("slow", 1.5), ("quick", 0.1)]]
+        names = [f.result().modelName for f in jrunner.as_completed(futures,
+            timeout=20)]
+        self.assertEqual(names, ["quick", "slow"])
+        # not all completed in time
+        futures = [jrunner.submitRunAsync(self.makeRun(name, sleepTime))
+            for name, sleepTime in [("slow", 1.5), ("quick", 0.1)]]
+        completed = jrunner.as_completed(futures, timeout=0.8)
+        self.assertEqual(next(completed).modelRun.name, "quick")
+        self.assertRaises(RunFutureTimeoutError, next, completed)
+        self.assertRaises(RunFutureTimeoutError, futures[0].result, 0.01)
+        self.assertEqual(futures[0].result(timeout=10).modelName, "slow")
+
+    def test_block_suite(self):
+        suite = ModelSuite('output')
+        suite.addRun(self.makeRun("slow", 1.0), "slow run")
+        suite.addRun(self.makeRun("quick", 0.1), "quick run")
+        results = SimpleJobRunner().runSuite(suite, runSuiteNonBlocking=True,
+            writeRecords=False)
+        self.assertEqual([r.modelName for r in results], ["slow", "quick"])
+        self.assertTrue(results[1].endTime < results[0].endTime)
+
+    def test_single_waiter(self):
+        # all runs are blocked on by the same thread, timing out as usual
+        jrunner = SimpleJobRunner()
+        before = threading.active_count()
+        futures = [jrunner.submitRunAsync(self.makeRun("run_%d" % i, 0.5))
+            for i in range(5)]
+        slowRun = self.makeRun("timeout", 30)
+        slowRun.jobParams['maxRunTime'] = 1
+        timedOut = jrunner.submitRunAsync(slowRun)
+        # (a thread reaping the process of each run, plus the waiter)
+        self.assertTrue(threading.active_count() <= before + 6 + 1)
+        start = time.time()
+        for future in futures:
+            self.assertEqual(future.exception(timeout=10), None)
+        self.assertTrue(isinstance(timedOut.exception(timeout=10),
+            ModelRunTimeoutError))
+        self.assertTrue(time.time() - start < 10)
+        # the waiter stops once there's nothing left to wait on
+        def waiters():
+            return [t for t in threading.enumerate()
+                if t.name == "credo-async-waiter"]
+        deadline = time.time() + 10
+        while time.time() < deadline and len(waiters()) > 0:
+            time.sleep(0.05)
+        self.assertEqual(waiters(), [])
+
+class TestRunCache(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.cache = RunCache(os.path.join(self.base_path, 'cache'))
+        self.writeInput('a')
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def writeInput(self, text):
+        with open(os.path.join(self.base_path, 'input.txt'), 'w') as f:
+            f.write(text)
+
+    def runModel(self, name='cached'):
+        jrunner = SimpleJobRunner(runCache=self.cache)
+        run = CachedSleepModelRun(name, basePath=self.base_path,
+            sleepTime=0.1)
+        return jrunner.runModel(run)
+
+    def test_hit(self):
+        CachedSleepModelRun.cleanups = 0
+        first = self.runModel()
+        self.assertFalse(first.jobMetaInfo.cacheHit)
+        second = self.runModel()
+        self.assertTrue(second.jobMetaInfo.cacheHit)
+        # runs restored from the cache are still tidied up
+        self.assertEqual(CachedSleepModelRun.cleanups, 2)
+        self.assertEqual(second.startTime, first.startTime)
+        self.assertEqual(second.jobMetaInfo.performance,
+            first.jobMetaInfo.performance)
+        self.writeInput('b')
+        third = self.runModel()
+        self.assertFalse(third.jobMetaInfo.cacheHit)
+        self.assertNotEqual(third.startTime, first.startTime)
+
+    def test_uncacheable(self):
+        jrunner = SimpleJobRunner(runCache=self.cache)
+        for i in range(2):
+            run = SleepModelRun('uncached', basePath=self.base_path,
+                sleepTime=0.1)
+            self.assertFalse(jrunner.runModel(run).jobMetaInfo.cacheHit)
+        self.assertEqual(self.cache.entries(), [])
+
+    def test_eviction(self):
+        self.runModel('first')
+        size = self.cache.totalBytes()
+        self.cache.maxBytes = int(size * 1.5)
+        # Make sure modification times of entries differ
+        time.sleep(0.05)
+        self.writeInput('b')
+        self.runModel('second')
+        entries = self.cache.entries()
+        self.assertEqual(len(entries), 1)
+        self.writeInput('b')
+        self.assertTrue(self.runModel('second').jobMetaInfo.cacheHit)
+
+class TestWalltimeHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.history_filename = os.path.join(self.base_path, 'walltimes.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def runSuite(self, inputSuffix=''):
+        suite = ModelSuite('output')
+        for name, sleepTime in [("short", 0.1), ("long", 0.8)]:
+            with open(os.path.join(self.base_path, '%s.in' % name), 'w') as f:
+                f.write(name + inputSuffix)
+            suite.addRun(NamedInputSleepModelRun(name, basePath=self.base_path,
+                sleepTime=sleepTime), "%s run" % name)
+        jrunner = PooledJobRunner(maxProcs=1,
+            walltimeHistory=WalltimeHistory(self.history_filename))
+        return jrunner.runSuite(suite, writeRecords=False)
+
+    def test_longest_first(self):
+        results = self.runSuite()
+        self.assertTrue(results[0].startTime < results[1].startTime)
+        history = WalltimeHistory(self.history_filename)
+        walltimes = [history.predictWalltime(fp) for fp in history._entries
+            if not fp.startswith('run:')]
+        self.assertEqual(len(walltimes), 2)
+        self.assertTrue(max(walltimes) > 0.8)
+        # Now the long run is known to be longer, it should be started first
+        results = self.runSuite()
+        self.assertEqual([r.modelName for r in results], ["short", "long"])
+        self.assertTrue(results[1].startTime < results[0].startTime)
+
+    def test_changed_fingerprint(self):
+        self.runSuite()
+        # Changed inputs (or a rebuilt simulator) change the runs'
+        #  fingerprints, but their past walltimes are still used
+        results = self.runSuite(inputSuffix='-changed')
+        self.assertTrue(results[1].startTime < results[0].startTime)
+        history = WalltimeHistory(self.history_filename)
+        run = NamedInputSleepModelRun("long", basePath=self.base_path,
+            sleepTime=0.8)
+        self.assertEqual(history.predictWalltime('unknown'), None)
+        self.assertTrue(history.predictWalltime('unknown', run) > 0.8)
+        self.assertEqual(len(history._entries[runKey(run)]['walltimes']), 2)
+
+class TestRunHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.db_filename = os.path.join(self.base_path, 'history.sqlite')
+        with open(os.path.join(self.base_path, 'input.txt'), 'w') as f:
+            f.write('a')
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def runModel(self, history, name='sleep'):
+        jrunner = SimpleJobRunner(runHistory=history)
+        run = CachedSleepModelRun(name, basePath=self.base_path,
+            sleepTime=0.05)
+        return jrunner.runModel(run)
+
+    def test_record(self):
+        history = RunHistory(self.db_filename)
+        for i in range(3):
+            self.runModel(history)
+        self.runModel(history, name='other')
+        # Reopened, as another tool would
+        history = RunHistory(self.db_filename)
+        runs = history.getRuns('sleep')
+        self.assertEqual(len(runs), 3)
+        self.assertEqual(len(history.getRuns()), 4)
+        for run in runs:
+            self.assertEqual(run['nproc'], 1)
+            self.assertEqual(run['host'], platform.node())
+            self.assertEqual(run['fingerprint'], runs[0]['fingerprint'])
+            self.assertTrue(run['walltime'] >= 0.05)
+            if hasattr(os, 'wait4'):
+                self.assertTrue(run['cpuTime'] > 0.)
+                self.assertTrue(run['peakRSS'] > 0.)
+        perf = history.getPerformance(runs[-1]['id'])
+        self.assertEqual(perf['Walltime']['walltime'], runs[-1]['walltime'])
+        trend = history.walltimeTrend('sleep', lastN=2)
+        self.assertEqual([w for t, w in trend],
+            [run['walltime'] for run in runs[1:]])
+        self.assertTrue(trend[0][0] <= trend[1][0])
+        if hasattr(os, 'wait4'):
+            self.assertEqual(len(history.getTrend('sleep', 'Rusage.cpuTime')),
+                3)
+        # The other run has the same command and inputs, so fingerprint
+        same = history.getRuns(fingerprint=runs[0]['fingerprint'])
+        self.assertEqual(len(same), 4)
+
+    def test_suite_fingerprint(self):
+        # Runs of a suite are recorded by the fingerprint the job runner
+        #  identifies them by in the suite, e.g. for walltime predictions
+        for jrunner in [SimpleJobRunner(), PooledJobRunner(maxProcs=2)]:
+            history = RunHistory(self.db_filename)
+            jrunner.runHistory = history
+            suite = ModelSuite('output')
+            for name in ["first", "second"]:
+                suite.addRun(CachedSleepModelRun(name,
+                    basePath=self.base_path, sleepTime=0.05), name)
+            jrunner.runSuite(suite, writeRecords=False)
+            for runI, name in enumerate(["first", "second"]):
+                runs = history.getRuns(name)
+                self.assertEqual(runs[-1]['fingerprint'],
+                    suiteRunFingerprint(suite, runI))
+            self.assertEqual(jrunner._suiteFingerprints, {})
+
+    def test_import_xml(self):
+        result = self.runModel(None)
+        result.writeRecordXML()
+        xmlFilename = os.path.join(result.outputPath, 'ModelResult-sleep.xml')
+        readJobMI = readJobMetaInfoFromXMLNode(
+            etree.parse(xmlFilename).getroot().find('jobMetaInfo'))
+        self.assertEqual(readJobMI.submitTime, result.jobMetaInfo.submitTime)
+        self.assertEqual(readJobMI.platform['node'], platform.node())
+        history = RunHistory(self.db_filename)
+        runId = history.importModelResultXML(xmlFilename)
+        run = history.getRuns('sleep')[0]
+        self.assertEqual(run['id'], runId)
+        self.assertEqual(run['submitTime'],
+            result.jobMetaInfo.submitTime.isoformat())
+        self.assertEqual(run['host'], platform.node())
+        self.assertAlmostEqual(run['walltime'],
+            result.jobMetaInfo.performance['Walltime']['walltime'])
+
+class TestRunPaths(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def test_relative_output_path(self):
+        # Output paths are relative to the base path, not the current path
+        suite = ModelSuite('output')
+        for i in range(2):
+            run = SleepModelRun("sleep_%d" % i, basePath=self.base_path,
+                sleepTime=0.1)
+            suite.addRun(run, "sleep run %d" % i)
+        startDir = os.getcwd()
+        jrunner = PooledJobRunner(maxProcs=2)
+        results = jrunner.runSuite(suite, writeRecords=True)
+        self.assertEqual(os.getcwd(), startDir)
+        for run, result in zip(suite.runs, results):
+            outputPath = os.path.join(self.base_path, 'output', run.name)
+            self.assertEqual(result.outputPath, outputPath)
+            for fname in ['ModelRun-%s.xml' % run.name,
+                    'ModelResult-%s.xml' % run.name,
+                    '%s.stdout' % run.name]:
+                self.assertTrue(os.path.isfile(os.path.join(outputPath,
+                    fname)))
+        self.assertEqual([f for f in os.listdir(results[0].outputPath)
+            if f.endswith('.tmp')], [])
+
+if __name__ == '__main__':
+    unittest.main()
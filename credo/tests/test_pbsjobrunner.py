@@ -0,0 +1,231 @@
+"""Test the PBS job runner, using fake qsub and qstat scripts that run jobs
+in the background on the local machine. The fake qstat reports finished jobs
+as PBS Professional does with `-x` (job history), or otherwise as Torque does
+(completed jobs are kept in the queue).
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+from credo.modelsuite import ModelSuite
+from credo.jobrunner.pbsjobrunner import PBSJobRunner, PBSJobPoller, \
+    PBSProJobPoller, parseQStatFull
+from credo.jobrunner.api import ModelRunRegularError, ModelRunLaunchError
+from test_jobrunner import SleepModelRun
+
+FAKE_QSUB = """#!%(python)s
+import os, re, sys, subprocess
+stateDir = os.environ['FAKE_PBS_DIR']
+args = sys.argv[1:]
+script = args[-1]
+arrayRange = args[args.index('-J') + 1] if '-J' in args else None
+if arrayRange is None:
+    with open(script) as f:
+        match = re.search(r'-J (\\S+)', f.read())
+        if match: arrayRange = match.group(1)
+counterFile = os.path.join(stateDir, 'counter')
+jobNum = int(open(counterFile).read()) + 1 if os.path.exists(counterFile) else 1
+open(counterFile, 'w').write(str(jobNum))
+if arrayRange is None:
+    jobs = [('%%d.fake' %% jobNum, None)]
+    print('%%d.fake' %% jobNum)
+else:
+    first, last = [int(i) for i in arrayRange.split('-')]
+    jobs = [('%%d[%%d].fake' %% (jobNum, i), i) for i in range(first, last+1)]
+    print('%%d[].fake' %% jobNum)
+for jobId, index in jobs:
+    env = dict(os.environ)
+    if index is not None:
+        env['PBS_ARRAY_INDEX'] = str(index)
+    done = os.path.join(stateDir, jobId + '.done')
+    open(os.path.join(stateDir, jobId + '.queued'), 'w').close()
+    subprocess.Popen(['sh', '-c', 'bash "$0"; touch "$1"', script, done],
+        env=env, preexec_fn=os.setsid)
+"""
+
+FAKE_QSTAT = """#!%(python)s
+import os, sys, json
+stateDir = os.environ['FAKE_PBS_DIR']
+with open(os.path.join(stateDir, 'qstat.log'), 'a') as f:
+    f.write(json.dumps(sys.argv[1:]) + '\\n')
+jobIds = [a for a in sys.argv[1:] if not a.startswith('-')]
+finishedState = 'F' if '-x' in sys.argv else 'C'
+for jobId in jobIds:
+    if os.path.exists(os.path.join(stateDir, jobId + '.done')):
+        print('Job Id: %%s\\n    job_state = %%s\\n    Exit_status = 0'
+            %% (jobId, finishedState))
+    elif os.path.exists(os.path.join(stateDir, jobId + '.queued')):
+        print('Job Id: %%s\\n    job_state = R' %% jobId)
+    else:
+        sys.stderr.write('qstat: Unknown Job Id %%s\\n' %% jobId)
+"""
+
+class TestPBSJobRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.state_dir = os.path.join(self.base_path, 'pbs')
+        bin_dir = os.path.join(self.base_path, 'bin')
+        for d in [self.state_dir, bin_dir]:
+            os.mkdir(d)
+        for name, script in [('qsub', FAKE_QSUB), ('qstat', FAKE_QSTAT)]:
+            fname = os.path.join(bin_dir, name)
+            with open(fname, 'w') as f:
+                f.write(script % {'python': sys.executable})
+            os.chmod(fname, 0o755)
+        self.old_environ = dict(os.environ)
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+        os.environ['FAKE_PBS_DIR'] = self.state_dir
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.old_environ)
+        shutil.rmtree(self.base_path)
+
+    def makeSuite(self, nRuns, sleepTime=0.5):
+        suite = ModelSuite('output')
+        for i in range(nRuns):
+            run = SleepModelRun("sleep_%d" % i, basePath=self.base_path,
+                sleepTime=sleepTime)
+            run.jobParams['pollInterval'] = 0.2
+            suite.addRun(run, "sleep run %d" % i)
+        return suite
+
+    def makeRunner(self):
+        jrunner = PBSJobRunner()
+        jrunner.mpiRunCommand = ""
+        return jrunner
+
+    def qsubCalls(self):
+        with open(os.path.join(self.state_dir, 'counter')) as f:
+            return int(f.read())
+
+    def qstatCalls(self, withOptions=False):
+        with open(os.path.join(self.state_dir, 'qstat.log')) as f:
+            calls = [json.loads(line) for line in f]
+        if withOptions:
+            return calls
+        return [[a for a in args if not a.startswith('-')] for args in calls]
+
+    def test_job_array(self):
+        suite = self.makeSuite(3)
+        results = self.makeRunner().runSuite(suite, writeRecords=False)
+        self.assertEqual([r.modelName for r in results],
+            [run.name for run in suite.runs])
+        self.assertEqual(self.qsubCalls(), 1)
+        self.assertEqual(results[2].jobMetaInfo.jobId, "1[2].fake")
+        self.assertEqual(results[2].jobMetaInfo.arrayJobId, "1[].fake")
+        # All jobs are checked on together
+        self.assertEqual(sorted(self.qstatCalls()[0]),
+            ["1[0].fake", "1[1].fake", "1[2].fake"])
+
+    def test_array_directives(self):
+        # qsub ignores directives after the first command, so the array
+        #  flag has to come before the environment set up
+        suite = self.makeSuite(3)
+        for run in suite.runs:
+            run.jobParams['PBS'] = {'sourcefiles': ['~/.bashrc'],
+                'modules': ['petsc']}
+        self.makeRunner().submitSuite(suite, dryRun=True,
+            writeRecords=False)
+        with open(os.path.join(self.base_path, 'output_array_3.pbs')) as f:
+            lines = f.read().splitlines()
+        self.assertTrue("#PBS -J 0-2" in lines)
+        self.assertTrue("module load petsc" in lines)
+        firstCommand = [i for i, line in enumerate(lines)
+            if line.strip() and not line.startswith('#')][0]
+        self.assertEqual([line for line in lines[firstCommand:]
+            if line.startswith('#PBS')], [])
+
+    def test_separate_jobs(self):
+        suite = self.makeSuite(3)
+        jrunner = self.makeRunner()
+        jrunner.useJobArrays = False
+        results = jrunner.runSuite(suite, writeRecords=False)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(self.qsubCalls(), 3)
+        qstatCalls = self.qstatCalls()
+        self.assertEqual(sorted(qstatCalls[0]),
+            ["1.fake", "2.fake", "3.fake"])
+        # One qstat call per poll, not per job
+        self.assertTrue(len(qstatCalls) < 3 * 0.5 / 0.2 + 3)
+
+    def test_failed_run(self):
+        suite = self.makeSuite(2, sleepTime=0.1)
+        suite.runs[1].exitCode = 2
+        self.assertRaises(ModelRunRegularError, self.makeRunner().runSuite,
+            suite, writeRecords=False)
+
+    def test_qstat_options(self):
+        # -x is only used for PBS Professional servers with job history
+        suite = self.makeSuite(2, sleepTime=0.1)
+        jrunner = self.makeRunner()
+        jrunner.runSuite(suite, writeRecords=False)
+        self.assertEqual(self.qstatCalls(True)[0][:1], ['-f'])
+        os.remove(os.path.join(self.state_dir, 'qstat.log'))
+        jrunner.poller = PBSProJobPoller()
+        jrunner.runSuite(suite, writeRecords=False)
+        self.assertEqual(self.qstatCalls(True)[0][:2], ['-x', '-f'])
+
+    def test_unknown_jobs(self):
+        # scripted qstat reports, for a job that isn't known about at first
+        #  (not yet visible), then runs and is removed from the queue
+        class ScriptedPoller(PBSJobPoller):
+            def __init__(self, reports):
+                PBSJobPoller.__init__(self)
+                self.reports = reports
+                self.queries = 0
+            def queryJobs(self, jobIds):
+                self.queries += 1
+                return self.reports.pop(0) if self.reports else {}
+        poller = ScriptedPoller([{}, {}, {'1.fake': ('R', None)}, {}])
+        self.assertEqual(poller.waitForJob('1.fake', 0.01), None)
+        self.assertEqual(poller.queries, 4)
+        # with job history, unknown jobs have finished (the history has
+        #  been removed)
+        class ScriptedProPoller(ScriptedPoller, PBSProJobPoller):
+            pass
+        poller = ScriptedProPoller([{}])
+        self.assertEqual(poller.waitForJob('1.fake', 0.01), None)
+        self.assertEqual(poller.queries, 1)
+        # jobs never reported on aren't taken to have finished
+        poller = ScriptedPoller([])
+        thread = threading.Thread(target=poller.waitForJob,
+            args=('2.fake', 0.01))
+        thread.daemon = True
+        thread.start()
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+        self.assertTrue(poller.queries > 2)
+        with poller._lock:
+            poller._waiting.pop('2.fake')[1].set()
+        # unless they've left their exit status file
+        exitStatusFilename = os.path.join(self.base_path, '3.exitstatus')
+        open(exitStatusFilename, 'w').close()
+        poller = ScriptedPoller([])
+        self.assertEqual(poller.waitForJob('3.fake', 0.01,
+            exitStatusFilename), None)
+        # and they're given up on eventually if they haven't
+        poller = ScriptedPoller([])
+        poller.unreportedTimeout = 0.1
+        self.assertRaises(ModelRunLaunchError, poller.waitForJob, '4.fake',
+            0.01, os.path.join(self.base_path, '4.exitstatus'))
+
+    def test_parse_qstat(self):
+        jobs = parseQStatFull("Job Id: 12[3].server\n"
+            "    Job_Name = test\n    job_state = F\n    Exit_status = 1\n"
+            "\nJob Id: 13.server\n    job_state = Q\n")
+        self.assertEqual(jobs, {"12[3].server": ("F", 1),
+            "13.server": ("Q", None)})
+        # Torque
+        jobs = parseQStatFull("Job Id: 14.torque\n    job_state = C\n"
+            "    exit_status = 0\n")
+        self.assertEqual(jobs, {"14.torque": ("C", 0)})
+
+if __name__ == '__main__':
+    unittest.main()
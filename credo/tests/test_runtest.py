@@ -4,17 +4,27 @@ analytical function foo(x, t).
 """
 
 import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import threading
 import unittest
 import numpy as np
 from functools import partial
 
 from credo.modelrun import ModelRun
-from credo.modelresult import ModelResult
+from credo.modelresult import ModelResult, FieldCache
 from credo.systest import SciBenchmarkTest
-from credo.systest import CREDO_PASS
+from credo.systest import CREDO_PASS, CREDO_FAIL
 from credo.systest import FieldWithinTolTC
 from credo.systest import HistoryWithinTolTC
-from credo.jobrunner import SimpleJobRunner
+from credo.systest import PerformanceWithinTolTC, addRepeatedRuns
+from credo.jobrunner.api import JobMetaInfo
+from credo.jobrunner import SimpleJobRunner, PooledJobRunner, RunMonitor
+from credo.reporting import getGenerators
+from credo.reporting.standardReports import makeSciBenchReport
 
 THIS_DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -37,6 +47,11 @@ class FooModelRun(ModelRun):
         return FooModelResult(self.name, self.outputPath,
                               perturbation = self.perturbation)
 
+class FooInputModelRun(FooModelRun):
+    """Dummy model run with an input file, so it can be fingerprinted."""
+    def getInputFilenames(self):
+        return ['foo.in']
+
 class FooModelResult(ModelResult):
     """Dummy model result with analytical function."""
     def __init__(self, name, outputPath, perturbation = 0):
@@ -44,6 +59,9 @@ class FooModelResult(ModelResult):
         self.name = name
         self.perturbation = perturbation
 
+    def getDataFilenames(self):
+        return []
+
     def _getFieldAtOutputIndex(self, field, outputIndex):
         if field == 'foo':
             t = output_times[outputIndex]
@@ -67,6 +85,64 @@ class FooModelResult(ModelResult):
     def _getTimes(self):
         return output_times
 
+# Script writing outputs of a linear function of time gradually, with a big
+#  error from the output index given.
+GROWING_SCRIPT = """
+import sys, time
+filename, badFrom = sys.argv[1], int(sys.argv[2])
+with open(filename, 'w') as f:
+    for i in range(20):
+        error = 0.5 if i >= badFrom else 0.001
+        f.write('%g %r\\n' % (i, -0.5 * (1. + i) * (1. + error)))
+        f.flush()
+        time.sleep(0.1)
+"""
+
+def linear(x, t): return x * (1. + t)
+
+class GrowingModelRun(ModelRun):
+    """Dummy model run that writes its outputs gradually (see
+    GROWING_SCRIPT)."""
+    def __init__(self, name, basePath, badFrom=100):
+        super(GrowingModelRun, self).__init__(name, basePath)
+        self.badFrom = badFrom
+
+    def getModelRunCommand(self, extraCmdLineOpts=None):
+        return "%s growing.py %s %d" % (sys.executable,
+                                        self.getOutputFilenames()[0],
+                                        self.badFrom)
+
+    def getOutputFilenames(self):
+        return [os.path.join(self.outputPath, 'growing.out')]
+
+    def createModelResult(self):
+        return GrowingModelResult(self.name, self.outputPath,
+                                  os.path.join(self.basePath,
+                                               self.getOutputFilenames()[0]))
+
+class GrowingModelResult(ModelResult):
+    """Model result of a GrowingModelRun, at a single position."""
+    def __init__(self, name, outputPath, filename):
+        super(GrowingModelResult, self).__init__(name, outputPath)
+        self.filename = filename
+        data = np.loadtxt(filename, ndmin=2)
+        self.times, self.values = data[:,0], data[:,1]
+
+    def getDataFilenames(self):
+        return [self.filename]
+
+    def _getFieldAtOutputIndex(self, field, outputIndex):
+        return np.full(1, self.values[outputIndex])
+
+    def _getFieldHistoryAtCell(self, field, cellIndex):
+        return self.times, self.values
+
+    def _getPositions(self):
+        return output_positions
+
+    def _getTimes(self):
+        return self.times
+
 class TestFooModelResult(unittest.TestCase):
 
     def setUp(self):
@@ -84,6 +160,11 @@ class TestFooModelResult(unittest.TestCase):
         x = self.result.getPositions()
         self.assertTrue(np.allclose(x, output_positions))
 
+    def test_getpositionsarray(self):
+        x = self.result.getPositionsArray()
+        self.assertTrue(np.allclose(x, output_positions))
+        self.assertTrue(x is self.result.getPositionsArray())
+
     def test_gettimes(self):
         t = self.result.getTimes()
         self.assertTrue(np.allclose(t, output_times))
@@ -94,6 +175,113 @@ class TestFooModelResult(unittest.TestCase):
         expected_foo = np.array([foo(output_positions[0], t) for t in output_times])
         self.assertTrue(np.allclose(y, expected_foo))
 
+    def test_gethistories(self):
+        # default implementation, from the history at each cell
+        t, y = self.result.getFieldHistoryAtCells('foo', [0, 0])
+        self.assertTrue(np.allclose(t, output_times))
+        self.assertEqual(y.shape, (len(output_times), 2))
+        expected_foo = np.array([foo(output_positions[0], t) for t in output_times])
+        self.assertTrue(np.allclose(y[:,1], expected_foo))
+        t, y = self.result.getFieldHistoryAtCells('foo', [])
+        self.assertEqual(y.shape, (len(output_times), 0))
+
+    def test_fieldcache(self):
+        # off by default, values returned as read
+        y = self.result.getFieldAtOutputIndex('foo', 1)
+        self.assertFalse(y is self.result.getFieldAtOutputIndex('foo', 1))
+        self.assertTrue(y.flags.writeable)
+
+        cache = self.result.fieldCache = FieldCache()
+        y = self.result.getFieldAtOutputIndex('foo', 1)
+        self.assertTrue(y is self.result.getFieldAtOutputIndex('foo', 1))
+        t, h = self.result.getFieldHistoryAtCell('foo', 0)
+        self.result.getFieldHistoryAtCell('foo', 0)
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (2, 2, 0))
+        self.assertEqual(cache.totalBytes, y.nbytes + t.nbytes + h.nbytes)
+
+        # least recently used evicted first
+        cache.clear()
+        cache.resize(y.nbytes * 2)
+        for i in [1, 2, 1, 0, 2]:
+            self.result.getFieldAtOutputIndex('foo', i)
+        self.assertEqual(cache.stats(), {'hits': 3, 'misses': 6,
+            'evictions': 2, 'entries': 2, 'totalBytes': y.nbytes * 2,
+            'maxBytes': y.nbytes * 2})
+        self.result.getFieldAtOutputIndex('foo', 0)
+        self.assertEqual(cache.hits, 4)
+
+        # cached arrays are shared read-only, leaving the result's own
+        # arrays (here output_times) as they were
+        t, h = self.result.getFieldHistoryAtCell('foo', 0)
+        self.assertFalse(t.flags.writeable or h.flags.writeable)
+        self.assertRaises(ValueError, h.__setitem__, 0, 1.)
+        self.assertTrue(output_times.flags.writeable)
+
+        # values read by several threads at once are cached once
+        cache.clear()
+        misses = cache.misses
+        values = []
+        def getField():
+            time.sleep(0.05)
+            return np.zeros(1)
+        threads = [threading.Thread(target=lambda: values.append(
+            cache.get(('field', 'bar', 0), getField))) for i in range(4)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(cache.misses - misses, 4)
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(all(v is values[0] for v in values[1:]))
+
+        # a cache shared by several results keeps their values apart
+        cache.clear()
+        other = FooModelResult('other', outputPath = THIS_DIR,
+                               perturbation = 1.0)
+        other.fieldCache = cache
+        y1 = self.result.getFieldAtOutputIndex('foo', 1)
+        y2 = other.getFieldAtOutputIndex('foo', 1)
+        self.assertTrue(np.allclose(y2, y1 + 1.0))
+        self.assertEqual(len(cache), 2)
+
+        self.result.fieldCache = None
+        y1 = self.result.getFieldAtOutputIndex('foo', 1)
+        self.assertFalse(y1 is self.result.getFieldAtOutputIndex('foo', 1))
+        self.assertTrue(np.allclose(y, y1))
+
+    def test_analytic_values(self):
+        from credo.systest.singleRunWithinTolTC import \
+            _analytic_at_positions, _analytic_at_times
+        positions = np.array([[0., 1., -10.], [5., 2., -20.], [3., 4., -30.]])
+        calls = []
+        def hydrostatic(pos):
+            calls.append(np.shape(pos))
+            return 1.0e5 - 9810. * pos[2]
+        p = _analytic_at_positions(hydrostatic, positions, vectorised=True)
+        self.assertTrue(np.allclose(p, 1.0e5 - 9810. * positions[:,2]))
+        # evaluated for all positions at once
+        self.assertEqual(calls, [(3, 3)])
+        # or one position at a time, by default
+        del calls[:]
+        p = _analytic_at_positions(hydrostatic, positions)
+        self.assertTrue(np.allclose(p, 1.0e5 - 9810. * positions[:,2]))
+        self.assertEqual(calls, [(3,), (3,), (3,)])
+        # which solutions that only work one position at a time need
+        import math
+        def radial(pos):
+            return math.hypot(pos[0], pos[1]) if pos[2] < -15. else 0.
+        self.assertTrue(np.allclose(_analytic_at_positions(radial, positions),
+                                    [0., math.hypot(5., 2.), 5.]))
+        def norm(pos): return np.linalg.norm(pos)
+        self.assertTrue(np.allclose(_analytic_at_positions(norm, positions),
+                                    [np.linalg.norm(x) for x in positions]))
+        self.assertRaises(ValueError, _analytic_at_positions, norm,
+                          positions, vectorised=True)
+        t = _analytic_at_times(foo, output_positions[0], output_times,
+                               vectorised=True)
+        self.assertTrue(np.allclose(t, foo(output_positions[0], output_times)))
+        self.assertTrue(np.allclose(t, _analytic_at_times(
+            foo, output_positions[0], output_times)))
+        self.assertEqual(len(_analytic_at_times(foo, 1., [])), 0)
+
     def test_test(self):
 
         model_dir = './run'
@@ -151,5 +339,392 @@ class TestFooModelResult(unittest.TestCase):
 
                 self.assertEqual(isinstance(test.testStatus, CREDO_PASS), expected_pass)
 
+    def test_pipelined(self):
+        model_dir = './run'
+        if not os.path.exists(model_dir): os.mkdir(model_dir)
+        base_path = os.path.realpath(model_dir)
+        tol = 0.01
+        test = SciBenchmarkTest("foo_test_pipelined")
+        perturbations = [0.5 * tol, 0.2 * tol]
+        for i, perturbation in enumerate(perturbations):
+            run_name = "foo_run_%d" % i
+            test.mSuite.addRun(FooModelRun(run_name, basePath = base_path,
+                                           perturbation = perturbation),
+                               run_name)
+        test.setupEmptyTestCompsList()
+        for i in range(len(perturbations)):
+            test.addTestComp(i, "history",
+                             HistoryWithinTolTC(fieldsToTest = ['foo'],
+                                                defFieldTol = tol,
+                                                expected = FooModelResult("expected", ""),
+                                                testCellIndex = 0))
+        jrunner = PooledJobRunner(maxProcs = 2)
+        test_result, model_results = test.runTest(jrunner,
+                                                  createReports = False,
+                                                  pipelineChecks = True)
+        self.assertTrue(isinstance(test.testStatus, CREDO_PASS))
+        self.assertEqual([list(r.keys()) for r in test.tcResults],
+                         [["history"], ["history"]])
+
+    def test_field_cache(self):
+        # The results of a test share one field cache while being checked,
+        #  so fields checked by several TCs are only read once
+        model_dir = './run'
+        if not os.path.exists(model_dir): os.mkdir(model_dir)
+        base_path = os.path.realpath(model_dir)
+        for cacheBytes in [1024**2, None]:
+            test = SciBenchmarkTest("foo_test_field_cache")
+            test.fieldCacheBytes = cacheBytes
+            test.mSuite.addRun(FooModelRun("foo_run", basePath = base_path),
+                               "foo_run")
+            test.setupEmptyTestCompsList()
+            for name in ["history", "history again"]:
+                test.addTestComp(0, name,
+                                 HistoryWithinTolTC(fieldsToTest = ['foo'],
+                                                    defFieldTol = 0.01,
+                                                    expected = FooModelResult("expected", ""),
+                                                    testCellIndex = 0))
+            test_result, model_results = test.runTest(SimpleJobRunner(),
+                                                      createReports = False)
+            self.assertTrue(isinstance(test_result, CREDO_PASS))
+            self.assertEqual(test.fieldCache, None)
+            cache = model_results[0].fieldCache
+            if cacheBytes:
+                self.assertEqual(cache.maxBytes, cacheBytes)
+                self.assertEqual((cache.misses, cache.hits), (1, 1))
+                # (not kept once the test is done)
+                self.assertEqual(len(cache), 0)
+            else:
+                self.assertEqual(cache, None)
+
+    def test_incremental(self):
+        model_dir = './run'
+        if not os.path.exists(model_dir): os.mkdir(model_dir)
+        base_path = os.path.realpath(model_dir)
+        input_filename = os.path.join(base_path, 'foo.in')
+        def write_input(text):
+            with open(input_filename, 'w') as f: f.write(text)
+        def run_test(tol):
+            test = SciBenchmarkTest("foo_test_incremental")
+            run_name = "foo_run_incremental"
+            test.mSuite.addRun(FooInputModelRun(run_name, basePath = base_path,
+                                                perturbation = 0.005),
+                               run_name)
+            test.setupEmptyTestCompsList()
+            test.addTestComp(0, "history",
+                             HistoryWithinTolTC(fieldsToTest = ['foo'],
+                                                defFieldTol = tol,
+                                                expected = FooModelResult("expected", ""),
+                                                testCellIndex = 0))
+            test_result, model_results = test.runTest(SimpleJobRunner(),
+                                                      createReports = False,
+                                                      incremental = True)
+            self.assertTrue(os.path.isfile(test_result.getRecordFile()))
+            return test_result
+        write_input('a')
+        manifest = os.path.join('output', 'SysTest-foo_test_incremental.manifest.json')
+        if os.path.exists(manifest): os.remove(manifest)
+        first = run_test(0.01)
+        self.assertTrue(isinstance(first, CREDO_PASS))
+        self.assertFalse(first.cached)
+        second = run_test(0.01)
+        self.assertTrue(isinstance(second, CREDO_PASS))
+        self.assertTrue(second.cached)
+        self.assertEqual(second.getRecordFile(), first.getRecordFile())
+        # Changing the test components or the inputs means a re-run
+        third = run_test(0.001)
+        self.assertTrue(isinstance(third, CREDO_FAIL))
+        self.assertFalse(third.cached)
+        self.assertTrue(run_test(0.001).cached)
+        write_input('b')
+        self.assertFalse(run_test(0.001).cached)
+
+    def test_incremental_reference(self):
+        # changes to the reference data files of test components also mean
+        #  a re-run
+        model_dir = './run'
+        if not os.path.exists(model_dir): os.mkdir(model_dir)
+        base_path = os.path.realpath(model_dir)
+        with open(os.path.join(base_path, 'foo.in'), 'w') as f: f.write('a')
+        ref_filename = os.path.join(base_path, 'foo_reference.out')
+        def write_reference(error):
+            with open(ref_filename, 'w') as f:
+                for t in output_times:
+                    y = foo(output_positions[0], t) + error
+                    f.write('%g %r\n' % (t, float(y)))
+        def run_test(expected):
+            test = SciBenchmarkTest("foo_test_incremental_reference")
+            run_name = "foo_run_incremental_reference"
+            test.mSuite.addRun(FooInputModelRun(run_name, basePath = base_path),
+                               run_name)
+            test.setupEmptyTestCompsList()
+            test.addTestComp(0, "history",
+                             HistoryWithinTolTC(fieldsToTest = ['foo'],
+                                                defFieldTol = 0.01,
+                                                expected = expected,
+                                                testCellIndex = 0))
+            test_result, model_results = test.runTest(SimpleJobRunner(),
+                                                      createReports = False,
+                                                      incremental = True)
+            return test, test_result
+        manifest = os.path.join('output',
+            'SysTest-foo_test_incremental_reference.manifest.json')
+        if os.path.exists(manifest): os.remove(manifest)
+        write_reference(0.)
+        def reference():
+            return GrowingModelResult("reference", "", ref_filename)
+        test, first = run_test(reference())
+        self.assertFalse(first.cached)
+        self.assertEqual(list(test.getInputFingerprint()['references']),
+                         [ref_filename])
+        self.assertTrue(run_test(reference())[1].cached)
+        write_reference(1.)
+        test, changed = run_test(reference())
+        self.assertFalse(changed.cached)
+        self.assertTrue(isinstance(changed, CREDO_FAIL))
+        # tests with references whose files aren't known are always re-run
+        class UnknownReference(GrowingModelResult):
+            def getDataFilenames(self):
+                return None
+        unknown = UnknownReference("reference", "", ref_filename)
+        test, result = run_test(unknown)
+        self.assertEqual(test.getInputFingerprint(), None)
+        self.assertFalse(run_test(unknown)[1].cached)
+
+    def test_other_cwd(self):
+        # relative paths used by the test are relative to its base path,
+        #  whatever the working directory it's run from
+        model_dir = './run'
+        if not os.path.exists(model_dir): os.mkdir(model_dir)
+        base_path = os.path.realpath(model_dir)
+        test = SciBenchmarkTest("foo_test_other_cwd", basePath = base_path)
+        run_name = "foo_run_other_cwd"
+        test.mSuite.addRun(FooModelRun(run_name, basePath = base_path),
+                           run_name)
+        test.setupEmptyTestCompsList()
+        test.addTestComp(0, "history",
+                         HistoryWithinTolTC(fieldsToTest = ['foo'],
+                                            defFieldTol = 0.01,
+                                            expected = FooModelResult("expected", ""),
+                                            testCellIndex = 0))
+        with open(os.path.join(base_path, 'foo_report.in'), 'w') as f:
+            f.write('report')
+        reported = []
+        def report(sysTest, mResults):
+            with open(os.path.join(sysTest.basePath, 'foo_report.in')) as f:
+                reported.append((os.getcwd(), f.read()))
+            for rGen in getGenerators(["RST"], sysTest.outputPathBase):
+                makeSciBenchReport(sysTest, mResults, rGen,
+                    os.path.join(sysTest.outputPathBase, "foo-report.rst"))
+        test.setCustomReporting(report)
+        start_dir = os.getcwd()
+        other_dir = tempfile.mkdtemp()
+        os.chdir(other_dir)
+        try:
+            test_result, model_results = test.runTest(SimpleJobRunner(),
+                                                      createReports = True)
+            self.assertEqual(os.getcwd(), other_dir)
+        finally:
+            os.chdir(start_dir)
+            shutil.rmtree(other_dir)
+        self.assertTrue(isinstance(test_result, CREDO_PASS))
+        # (the working directory isn't changed while the test runs)
+        self.assertEqual(reported, [(other_dir, 'report')])
+        self.assertTrue(test_result.getRecordFile().startswith(base_path))
+        self.assertEqual(test.generatedReports, [os.path.join(base_path,
+            test.outputPathBase, "foo-report.rst")])
+        self.assertTrue(os.path.exists(test.generatedReports[0]))
+
+class TestLiveChecks(unittest.TestCase):
+
+    def setUp(self):
+        model_dir = './run'
+        if not os.path.exists(model_dir): os.mkdir(model_dir)
+        self.base_path = os.path.realpath(model_dir)
+        with open(os.path.join(self.base_path, 'growing.py'), 'w') as f:
+            f.write(GROWING_SCRIPT)
+        ref_filename = os.path.join(self.base_path, 'reference.out')
+        with open(ref_filename, 'w') as f:
+            for t in range(20):
+                f.write('%g %r\n' % (t, linear(-0.5, t)))
+        self.reference = GrowingModelResult("reference", "", ref_filename)
+
+    def run_test(self, badFrom):
+        test = SciBenchmarkTest("growing_test_%d" % badFrom)
+        run_name = "growing_run"
+        test.mSuite.addRun(GrowingModelRun(run_name, self.base_path, badFrom),
+                           run_name)
+        test.setupEmptyTestCompsList()
+        self.history = HistoryWithinTolTC(fieldsToTest = ['foo'],
+                                          defFieldTol = 0.01,
+                                          expected = linear,
+                                          testCellIndex = 0,
+                                          liveCheckFactor = 10.)
+        self.field = FieldWithinTolTC(fieldsToTest = ['foo'],
+                                      defFieldTol = 0.01,
+                                      expected = self.reference,
+                                      liveCheckFactor = 10.)
+        test.addTestComp(0, "history", self.history)
+        test.addTestComp(0, "field", self.field)
+        jrunner = SimpleJobRunner(runMonitor = RunMonitor(pollInterval = 0.05))
+        start = time.time()
+        test_result, model_results = test.runTest(jrunner,
+                                                  createReports = False)
+        self.elapsed = time.time() - start
+        return test_result
+
+    def test_pass(self):
+        test_result = self.run_test(100)
+        self.assertTrue(isinstance(test_result, CREDO_PASS))
+        self.assertFalse(self.history.abortedLive)
+        self.assertFalse(self.field.abortedLive)
+        self.assertEqual(len(self.history.fieldErrors['foo']), 20)
+
+    def test_abort(self):
+        test_result = self.run_test(3)
+        self.assertTrue(isinstance(test_result, CREDO_FAIL))
+        self.assertTrue("aborted early" in test_result.detailMsg)
+        # Killed well before the 2 seconds the run takes
+        self.assertTrue(self.elapsed < 1.5)
+        failed = [tc for tc in [self.history, self.field] if tc.abortedLive]
+        self.assertTrue(len(failed) > 0)
+        for tc in failed:
+            self.assertTrue(isinstance(tc.tcStatus, CREDO_FAIL))
+            self.assertTrue(max(tc.fieldErrors['foo']) > 0.1)
+            self.assertTrue(len(tc.liveEvidence) > 0)
+        with open(test_result.getRecordFile()) as f:
+            self.assertTrue("aborted early" in f.read())
+
+    def test_stale_outputs(self):
+        # Outputs left over from a previous bad run aren't checked
+        run = GrowingModelRun("growing_run", self.base_path)
+        filename = os.path.join(self.base_path, run.getOutputFilenames()[0])
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        def write_outputs():
+            with open(filename, 'w') as f:
+                for t in range(20):
+                    f.write('%g %r\n' % (t, 2. * linear(-0.5, t)))
+        write_outputs()
+        old = time.time() - 3600.
+        os.utime(filename, (old, old))
+        field = FieldWithinTolTC(fieldsToTest = ['foo'],
+                                 defFieldTol = 0.01,
+                                 expected = self.reference,
+                                 liveCheckFactor = 10.)
+        field.preRunOps(run)
+        live_check = run.liveChecks[0]
+        self.assertEqual(live_check.check(), None)
+        write_outputs()
+        self.assertNotEqual(live_check.check(), None)
+
+    def test_check_errors(self):
+        # Outputs being written can fail to be read, so are checked again
+        #  once they change, but other errors aren't hidden
+        run = GrowingModelRun("growing_run", self.base_path)
+        filename = os.path.join(self.base_path, run.getOutputFilenames()[0])
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        def write_outputs(n):
+            with open(filename, 'w') as f:
+                for t in range(n):
+                    f.write('%g %r\n' % (t, 2. * linear(-0.5, t)))
+        field = FieldWithinTolTC(fieldsToTest = ['foo'],
+                                 defFieldTol = 0.01,
+                                 expected = self.reference,
+                                 liveCheckFactor = 10.)
+        field.preRunOps(run)
+        live_check = run.liveChecks[0]
+        errors = [IOError("partly written"), ZeroDivisionError("bug")]
+        def check_live(mResult):
+            raise errors.pop(0)
+        field.checkLive = check_live
+        write_outputs(5)
+        self.assertEqual(live_check.check(), None)
+        write_outputs(10)
+        self.assertEqual(live_check.check(), None)
+        self.assertEqual(errors, [])
+        # Not checked any more
+        del field.checkLive
+        write_outputs(20)
+        self.assertEqual(live_check.check(), None)
+
+class TestPerformanceWithinTol(unittest.TestCase):
+
+    def setUp(self):
+        model_dir = './run'
+        if not os.path.exists(model_dir): os.mkdir(model_dir)
+        self.base_path = os.path.realpath(model_dir)
+        self.baseline_filename = os.path.join(self.base_path,
+                                              'foo_baseline.json')
+        if os.path.exists(self.baseline_filename):
+            os.remove(self.baseline_filename)
+
+    def make_result(self, walltime, iterations=None):
+        result = ModelResult("perf", "")
+        result.jobMetaInfo = JobMetaInfo(None)
+        result.jobMetaInfo.performance['Walltime'] = {'walltime': walltime}
+        if iterations is not None:
+            result.jobMetaInfo.performance['WaiweraSolver'] = {
+                'total_linear_iterations': iterations}
+        return result
+
+    def test_median(self):
+        # a single noisy run doesn't fail the check
+        results = [self.make_result(w, 100) for w in [1.0, 10.0, 1.2]]
+        tc = PerformanceWithinTolTC({'walltime': 1.5, 'linearIterations': 1.},
+                                    baseline = {'walltime': 1.0,
+                                                'linearIterations': 100})
+        self.assertTrue(tc.check(results))
+        self.assertEqual(tc.medians['walltime'], 1.2)
+        self.assertAlmostEqual(tc.ratios['walltime'], 1.2)
+        results = [self.make_result(w, 101) for w in [1.8, 10.0, 1.2]]
+        self.assertFalse(tc.check(results))
+        self.assertEqual(tc.statPassed, {'walltime': False,
+                                         'linearIterations': False})
+        self.assertTrue(isinstance(tc.tcStatus, CREDO_FAIL))
+        # only some of the runs, and a statistic not recorded
+        tc = PerformanceWithinTolTC({'walltime': 1.5, 'cpuTime': 1.5},
+                                    baseline = {'walltime': 1.0,
+                                                'cpuTime': 1.0},
+                                    runIndices = [0, 2])
+        self.assertFalse(tc.check(results))
+        self.assertEqual(tc.measured['walltime'], [1.8, 1.2])
+        self.assertTrue(tc.statPassed['walltime'])
+        self.assertTrue("not recorded" in tc.tcStatus.detailMsg)
+        with self.assertRaises(ValueError):
+            PerformanceWithinTolTC({'speed': 1.0}, baseline = {})
+
+    def run_test(self, name, tol):
+        test = SciBenchmarkTest(name)
+        run_indices = addRepeatedRuns(test.mSuite,
+                                      FooModelRun("foo_perf",
+                                                  basePath = self.base_path),
+                                      3, "foo perf run")
+        test.setupEmptyTestCompsList()
+        self.tc = PerformanceWithinTolTC({'walltime': tol},
+                                         baselineFilename = 'foo_baseline.json',
+                                         runIndices = run_indices)
+        test.addMultiRunTestComp("performance", self.tc)
+        test_result, model_results = test.runTest(SimpleJobRunner(),
+                                                  createReports = False)
+        return test_result
+
+    def test_baseline(self):
+        # first run saves the baseline, later runs are checked against it
+        self.assertTrue(isinstance(self.run_test("foo_perf_1", 1.5),
+                                   CREDO_PASS))
+        self.assertTrue(os.path.exists(self.baseline_filename))
+        self.assertEqual(len(self.tc.measured['walltime']), 3)
+        self.assertTrue(isinstance(self.run_test("foo_perf_2", 100.),
+                                   CREDO_PASS))
+        self.assertTrue(self.tc.ratios['walltime'] > 0.)
+        with open(self.baseline_filename, 'w') as f:
+            json.dump({'walltime': 1e-6}, f)
+        test_result = self.run_test("foo_perf_3", 100.)
+        self.assertTrue(isinstance(test_result, CREDO_FAIL))
+        with open(test_result.getRecordFile()) as f:
+            self.assertTrue('name="walltime"' in f.read())
+
 if __name__ == '__main__':
     unittest.main()
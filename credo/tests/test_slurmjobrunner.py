@@ -0,0 +1,209 @@
+"""Test the Slurm job runner, using fake sbatch and sacct scripts that run
+jobs in the background on the local machine.
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+from credo.modelsuite import ModelSuite
+from credo.jobrunner.slurmjobrunner import SlurmJobRunner, parseSAcct, \
+    parseSlurmTime, formatSlurmTime
+from credo.jobrunner.api import ModelRunRegularError, ModelRunLaunchError
+from test_jobrunner import SleepModelRun
+
+FAKE_SBATCH = """#!%(python)s
+import os, re, sys, subprocess
+stateDir = os.environ['FAKE_SLURM_DIR']
+script = sys.argv[-1]
+with open(script) as f:
+    scriptText = f.read()
+match = re.search(r'--array=(\\d+)-(\\d+)', scriptText)
+counterFile = os.path.join(stateDir, 'counter')
+jobNum = int(open(counterFile).read()) + 1 if os.path.exists(counterFile) else 1
+open(counterFile, 'w').write(str(jobNum))
+with open(os.path.join(stateDir, '%%d.script' %% jobNum), 'w') as f:
+    f.write(scriptText)
+if match is None:
+    jobs = [('%%d' %% jobNum, None)]
+else:
+    first, last = [int(i) for i in match.groups()]
+    jobs = [('%%d_%%d' %% (jobNum, i), i) for i in range(first, last+1)]
+print('%%d;cluster' %% jobNum)
+for jobId, index in jobs:
+    env = dict(os.environ)
+    if index is not None:
+        env['SLURM_ARRAY_TASK_ID'] = str(index)
+    done = os.path.join(stateDir, jobId + '.done')
+    open(os.path.join(stateDir, jobId + '.queued'), 'w').close()
+    # (not holding on to sbatch's output, so sbatch returns straight away)
+    devNull = open(os.devnull, 'w')
+    subprocess.Popen(['sh', '-c', 'bash "$0"; touch "$1"', script, done],
+        env=env, stdout=devNull, stderr=devNull, close_fds=True,
+        preexec_fn=os.setsid)
+"""
+
+FAKE_SACCT = """#!%(python)s
+import os, sys, json
+stateDir = os.environ['FAKE_SLURM_DIR']
+jobIds = [a.split('=', 1)[1] for a in sys.argv[1:]
+    if a.startswith('--jobs=')][0].split(',')
+with open(os.path.join(stateDir, 'sacct.log'), 'a') as f:
+    f.write(json.dumps(jobIds) + '\\n')
+forget = os.path.exists(os.path.join(stateDir, 'forget'))
+if os.path.exists(os.path.join(stateDir, 'unlisted')):
+    jobIds = []
+for jobId in jobIds:
+    if os.path.exists(os.path.join(stateDir, jobId + '.done')):
+        if forget:
+            continue
+        print('%%s|COMPLETED|0:0|00:00:01||00:00.500' %% jobId)
+        print('%%s.batch|COMPLETED|0:0|00:00:01|2048K|00:00.500' %% jobId)
+    elif os.path.exists(os.path.join(stateDir, jobId + '.queued')):
+        print('%%s|RUNNING|0:0|00:00:00||00:00:00' %% jobId)
+"""
+
+class TestSlurmJobRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.state_dir = os.path.join(self.base_path, 'slurm')
+        bin_dir = os.path.join(self.base_path, 'bin')
+        for d in [self.state_dir, bin_dir]:
+            os.mkdir(d)
+        for name, script in [('sbatch', FAKE_SBATCH), ('sacct', FAKE_SACCT)]:
+            fname = os.path.join(bin_dir, name)
+            with open(fname, 'w') as f:
+                f.write(script % {'python': sys.executable})
+            os.chmod(fname, 0o755)
+        self.old_environ = dict(os.environ)
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+        os.environ['FAKE_SLURM_DIR'] = self.state_dir
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.old_environ)
+        shutil.rmtree(self.base_path)
+
+    def makeSuite(self, nprocs, sleepTime=0.3):
+        suite = ModelSuite('output')
+        for i, nproc in enumerate(nprocs):
+            run = SleepModelRun("sleep_%d" % i, basePath=self.base_path,
+                sleepTime=sleepTime)
+            run.jobParams['nproc'] = nproc
+            run.jobParams['maxRunTime'] = 90000
+            run.jobParams['pollInterval'] = 0.2
+            suite.addRun(run, "sleep run %d" % i)
+        return suite
+
+    def makeRunner(self):
+        jrunner = SlurmJobRunner()
+        jrunner.mpiRunCommand = ""
+        return jrunner
+
+    def sbatchScripts(self):
+        with open(os.path.join(self.state_dir, 'counter')) as f:
+            nJobs = int(f.read())
+        scripts = []
+        for jobNum in range(1, nJobs+1):
+            with open(os.path.join(self.state_dir, '%d.script' % jobNum)) as f:
+                scripts.append(f.read())
+        return scripts
+
+    def sacctCalls(self):
+        with open(os.path.join(self.state_dir, 'sacct.log')) as f:
+            return [json.loads(line) for line in f]
+
+    def test_array_jobs(self):
+        suite = self.makeSuite([1, 2, 1])
+        results = self.makeRunner().runSuite(suite, writeRecords=False)
+        self.assertEqual([r.modelName for r in results],
+            [run.name for run in suite.runs])
+        # Runs are grouped into an array job for each number of processors
+        scripts = self.sbatchScripts()
+        self.assertEqual(len(scripts), 2)
+        self.assertTrue("--array=0-1" in scripts[0])
+        self.assertTrue("--ntasks=1" in scripts[0])
+        self.assertTrue("--ntasks=2" in scripts[1])
+        self.assertTrue("--time=1-1:00:00" in scripts[1])
+        self.assertEqual([r.jobMetaInfo.jobId for r in results],
+            ["1_0", "2_0", "1_1"])
+        self.assertEqual(sorted(self.sacctCalls()[0]), ["1_0", "1_1", "2_0"])
+        self.assertEqual(results[0].jobMetaInfo.performance['Slurm'],
+            {'walltime': 1.0, 'cpuTime': 0.5, 'maxRSS': 2048 * 1024.0})
+
+    def test_array_directives(self):
+        # sbatch ignores options after the first command, so the array
+        #  option has to come before the environment set up
+        suite = self.makeSuite([1, 1])
+        for run in suite.runs:
+            run.jobParams['Slurm'] = {'sourcefiles': ['~/.bashrc'],
+                'modules': ['petsc']}
+        self.makeRunner().submitSuite(suite, dryRun=True,
+            writeRecords=False)
+        with open(os.path.join(self.base_path,
+                'output-0_array_2.slurm')) as f:
+            lines = f.read().splitlines()
+        self.assertTrue("#SBATCH --array=0-1" in lines)
+        self.assertTrue("module load petsc" in lines)
+        firstCommand = [i for i, line in enumerate(lines)
+            if line.strip() and not line.startswith('#')][0]
+        self.assertEqual([line for line in lines[firstCommand:]
+            if line.startswith('#SBATCH')], [])
+
+    def test_failed_run(self):
+        suite = self.makeSuite([1, 1], sleepTime=0.1)
+        suite.runs[0].exitCode = 3
+        self.assertRaises(ModelRunRegularError, self.makeRunner().runSuite,
+            suite, writeRecords=False)
+
+    def test_unreported_job(self):
+        # jobs sacct stops reporting on (e.g. purged) are taken as finished,
+        #  with no accounting info
+        open(os.path.join(self.state_dir, 'forget'), 'w').close()
+        suite = self.makeSuite([1], sleepTime=1.0)
+        results = self.makeRunner().runSuite(suite, writeRecords=False)
+        self.assertEqual(results[0].jobMetaInfo.performance['Slurm'], {})
+        self.assertTrue(len(self.sacctCalls()) > 1)
+        # and fail if the job script didn't record the run's exit code
+        suite = self.makeSuite([1])
+        suite.runs[0].getModelRunCommand = \
+            lambda extraCmdLineOpts=None: "sleep 1; kill -9 $$"
+        self.assertRaises(ModelRunRegularError, self.makeRunner().runSuite,
+            suite, writeRecords=False)
+
+    def test_never_reported_job(self):
+        # jobs sacct never reports on have finished once they've left their
+        #  exit status file
+        open(os.path.join(self.state_dir, 'unlisted'), 'w').close()
+        suite = self.makeSuite([1])
+        results = self.makeRunner().runSuite(suite, writeRecords=False)
+        self.assertEqual(results[0].jobMetaInfo.performance['Slurm'], {})
+        # and are given up on if they don't
+        suite.runs[0].getModelRunCommand = \
+            lambda extraCmdLineOpts=None: "kill -9 $$"
+        jrunner = self.makeRunner()
+        jrunner.poller.unreportedTimeout = 1.0
+        self.assertRaises(ModelRunLaunchError, jrunner.runSuite, suite,
+            writeRecords=False)
+
+    def test_parse_sacct(self):
+        jobs = parseSAcct("12_3|CANCELLED by 100|0:15|1-02:00:00||01:02:03\n"
+            "12_3.batch|CANCELLED|0:15|1-02:00:00|1.5G|01:02:03\n"
+            "12_3.0|CANCELLED|0:15|1-01:59:00|2G|01:00:00\n"
+            "13|PENDING|0:0|00:00:00||00:00:00\n")
+        self.assertEqual(jobs["12_3"][0], "CANCELLED")
+        self.assertEqual(jobs["12_3"][1], {'exitCode': 0,
+            'walltime': 26 * 3600.0, 'cpuTime': 3723.0,
+            'maxRSS': 2.0 * 1024**3})
+        self.assertEqual(jobs["13"][0], "PENDING")
+
+    def test_times(self):
+        self.assertEqual(parseSlurmTime("05:01.5"), 301.5)
+        self.assertEqual(formatSlurmTime(90061), "1-1:01:01")
+
+if __name__ == '__main__':
+    unittest.main()
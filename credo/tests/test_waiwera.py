@@ -2,10 +2,15 @@
 
 import unittest
 import os, sys
+import shutil
+import tempfile
 
 import numpy as np
 
-from credo.waiwera import WaiweraModelResult
+from credo.waiwera import WaiweraModelResult, WaiweraModelRun
+from credo.jobrunner.api import JobMetaInfo
+from credo.jobrunner.runhistory import RunHistory
+from credo.jobrunner.waiweraLogProfiler import WaiweraLogProfiler
 
 THIS_DIR = os.path.dirname(os.path.realpath(__file__))
 
@@ -34,6 +39,18 @@ class TestWaiweraModelResult(unittest.TestCase):
         expected = np.array([4500., 3600., -1500.])
         self.assertTrue(np.allclose(p[-1][:], expected))
 
+    def test_getpositionsarray(self):
+        p = self.mres.getPositionsArray()
+        self.assertEqual(p.shape, (125, 3))
+        self.assertTrue(p.flags.c_contiguous)
+        self.assertTrue(np.allclose(p, self.mres.getPositions()))
+        self.assertTrue(p is self.mres.getPositionsArray())
+        # remade when the ordering map is changed
+        self.mres.ordering_map = list(range(124, -1, -1))
+        q = self.mres.getPositionsArray()
+        self.assertTrue(np.allclose(q, p[::-1]))
+        self.assertTrue(np.allclose(q, self.mres.getPositions()))
+
     def test_gethistory(self):
         expected_t = np.array([0., 3.1540000e+07, 6.3080000e+07,
                                9.4620000e+07, 1.2616000e+08, 1.5770000e+08,
@@ -49,6 +66,118 @@ class TestWaiweraModelResult(unittest.TestCase):
         self.assertTrue(np.allclose(t[::20], expected_t))
         self.assertTrue(np.allclose(p[::20], expected_p))
 
+    def test_gethistories(self):
+        cells = [75, 3, 124, 75, 0, 60]
+        t, p = self.mres.getFieldHistoryAtCells('fluid_pressure', cells)
+        self.assertEqual(p.shape, (142, len(cells)))
+        for j, c in enumerate(cells):
+            tc, pc = self.mres.getFieldHistoryAtCell('fluid_pressure', c)
+            self.assertTrue(np.allclose(t, tc))
+            self.assertTrue(np.allclose(p[:,j], pc))
+        t, p = self.mres.getFieldHistoryAtCells('fluid_pressure', [])
+        self.assertEqual(p.shape, (142, 0))
+
+        t, q = self.mres.getFieldHistoryAtSources('source_rate', [0, 0])
+        ts, qs = self.mres.getFieldHistoryAtSource('source_rate', 0)
+        self.assertEqual(q.shape, (142, 2))
+        self.assertTrue(np.allclose(q[:,1], qs))
+
+        # ordering and field name maps are applied as for single cells
+        self.mres.ordering_map = list(range(124, -1, -1))
+        self.mres.fieldname_map = {'pressure': 'fluid_pressure'}
+        t, p = self.mres.getFieldHistoryAtCells('pressure', [0, 49])
+        for j, c in enumerate([0, 49]):
+            tc, pc = self.mres.getFieldHistoryAtCell('pressure', c)
+            self.assertTrue(np.allclose(p[:,j], pc))
+        self.mres.ordering_map = None
+        tc, pc = self.mres.getFieldHistoryAtCell('fluid_pressure', 124)
+        self.assertTrue(np.allclose(p[:,0], pc))
+
+    def test_readcolumns(self):
+        # reads spanning several chunks, with gaps, in blocks of rows
+        import h5py
+        from credo import waiwera
+        tmp_dir = tempfile.mkdtemp()
+        block_size = waiwera.READ_BLOCK_SIZE
+        try:
+            f = h5py.File(os.path.join(tmp_dir, 'cols.h5'), 'w')
+            data = np.arange(30 * 100, dtype=float).reshape(30, 100)
+            dset = f.create_dataset('field', data=data, chunks=(4, 10))
+            cols = [95, 2, 3, 41, 2, 19, 99]
+            waiwera.READ_BLOCK_SIZE = 1000
+            self.assertTrue(np.array_equal(waiwera._readColumns(dset, cols),
+                                           data[:, cols]))
+            f.close()
+        finally:
+            waiwera.READ_BLOCK_SIZE = block_size
+            shutil.rmtree(tmp_dir)
+
+    def test_historycache(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            h5_filename = os.path.join(tmp_dir, 'problem6.h5')
+            shutil.copy(os.path.join(THIS_DIR, 'problem6.h5'), h5_filename)
+            cache_filename = os.path.join(tmp_dir, 'problem6_history.h5')
+            def cachedResult():
+                return WaiweraModelResult('test_waiwera_MIS6_cached',
+                                          outputPath=tmp_dir,
+                                          h5_filename=h5_filename,
+                                          history_cache=True)
+            mres = cachedResult()
+            cells = [75, 3, 124, 0]
+            t, p = mres.getFieldHistoryAtCells('fluid_pressure', cells)
+            tc, pc = mres.getFieldHistoryAtCell('fluid_pressure', 3)
+            t0, p0 = self.mres.getFieldHistoryAtCells('fluid_pressure', cells)
+            self.assertTrue(np.allclose(t, t0))
+            self.assertTrue(np.array_equal(p, p0))
+            self.assertTrue(np.array_equal(pc, p0[:,1]))
+            cache = mres._history_cache._cache
+            self.assertEqual(cache.filename, cache_filename)
+            dset = cache['cell_fields/fluid_pressure']
+            self.assertEqual(dset.chunks, (142, 125))
+            self.assertEqual(list(cache['cell_fields']), ['fluid_pressure'])
+            mres.close()
+
+            # still valid after the output is touched, but not once it's
+            # changed
+            os.utime(h5_filename, (0, 0))
+            mres = cachedResult()
+            mres.getFieldHistoryAtCell('fluid_pressure', 3)
+            cache = mres._history_cache._cache
+            self.assertEqual(cache.attrs['source_mtime'], 0)
+            self.assertTrue('cell_fields/fluid_pressure' in cache)
+            cache.attrs['source_size'] = 0 # as if it was changed
+            mres.close()
+            mres = cachedResult()
+            mres.getFieldHistoryAtCell('fluid_temperature', 3)
+            self.assertEqual(list(mres._history_cache._cache['cell_fields']),
+                             ['fluid_temperature'])
+            mres.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_historycache_empty(self):
+        # outputs with no output times, or no cells
+        import h5py
+        from credo.io.historycache import HistoryCache
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            h5_filename = os.path.join(tmp_dir, 'empty.h5')
+            with h5py.File(h5_filename, 'w') as f:
+                f.create_dataset('cell_fields/fluid_pressure', shape=(0, 125))
+                f.create_dataset('cell_fields/fluid_temperature',
+                                 shape=(10, 0))
+            with h5py.File(h5_filename, 'r') as f:
+                cache = HistoryCache(f)
+                p = cache.getField('fluid_pressure')
+                self.assertEqual(p.shape, (0, 125))
+                self.assertEqual(p[:, 3].shape, (0,))
+                t = cache.getField('fluid_temperature')
+                self.assertEqual(t.shape, (10, 0))
+                cache.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_getothers(self):
         # other non h5 data, these can be easily checked in 'problem6.dat'
         v = self.mres.getFieldAtOutputIndex('geom_volume', 1234)
@@ -65,6 +194,90 @@ class TestWaiweraModelResult(unittest.TestCase):
         self.assertListEqual(list(v[25:100]), [2.0e-13]*75) # rck 2
         self.assertListEqual(list(v[100:]), [1.0e-13]*25) # rck 1
 
+    def test_staticfields(self):
+        # computed once, and copies returned, which can be changed
+        for field in ['rock_porosity', 'rock_permeability3', 'geom_volume']:
+            v = self.mres.getFieldAtOutputIndex(field, 0)
+            stored = self.mres._static_fields[field]
+            v0 = v[0]
+            v[0] = -1.
+            v = self.mres.getFieldAtOutputIndex(field, -1)
+            self.assertEqual(v[0], v0)
+            self.assertTrue(stored is self.mres._static_fields[field])
+        # rock fields are all assembled together
+        self.assertTrue('rock_permeability1' in self.mres._static_fields)
+        p = self.mres.getPositions()
+        self.assertTrue(np.array_equal(p, self.mres.getPositions()))
+        self.assertTrue('geom_centroid' in self.mres._static_fields)
+
+        # cells in several rock types get the last one, and cells in none
+        # the defaults
+        self.mres._input = {'rock': {'types': [
+            {'porosity': 0.3, 'permeability': [1e-14, 2e-14, 3e-14],
+             'cells': [0, 1, 2]},
+            {'porosity': 0.05, 'permeability': [4e-15, 5e-15],
+             'cells': [2, 3]}]}}
+        self.mres._static_fields = {}
+        v = self.mres.getFieldAtOutputIndex('rock_porosity', 0)
+        self.assertListEqual(list(v[:5]), [0.3, 0.3, 0.05, 0.05, 0.1])
+        v = self.mres.getFieldAtOutputIndex('rock_permeability3', 0)
+        self.assertListEqual(list(v[:5]), [3e-14, 3e-14, 1e-13, 1e-13, 1e-13])
+
+    def test_live(self):
+        # opened as if still being written by Waiwera (HDF5 won't open a
+        # file twice with different flags)
+        self.mres.close()
+        mres = WaiweraModelResult('test_waiwera_MIS6_live',
+                                  outputPath=THIS_DIR,
+                                  h5_filename='problem6.h5',
+                                  input_filename='problem6.json',
+                                  live=True)
+        p = mres.getFieldAtOutputIndex('fluid_pressure', 0)
+        self.assertTrue(np.allclose(p[0], 3.98022e+06))
+        self.assertEqual(len(mres.getTimes()), 142)
+        mres.close()
+
+    def test_solverstats(self):
+        stats = self.mres.getSolverStats()
+        self.assertEqual(len(stats['time']), 141)
+        self.assertTrue(np.allclose(stats['time'][:2], [1.577e6, 3.154e6]))
+        self.assertTrue(np.allclose(stats['time'][-1], 2.16e8))
+        self.assertEqual(list(stats['nonlinear_iterations'][:3]), [2, 2, 1])
+        self.assertEqual(list(stats['linear_iterations'][:3]), [10, 10, 5])
+        # step 136 failed once and was reduced, before completing
+        i = list(stats['count']).index(136)
+        self.assertEqual(stats['tries'][i], 2)
+        self.assertEqual(stats['failed_tries'][i], 1)
+        self.assertEqual(stats['reductions'][i], 1)
+        self.assertTrue(np.allclose(stats['size'][i], 3.154e5))
+        self.assertEqual(sum(stats['reductions']), 2)
+
+        jobMI = JobMetaInfo(None)
+        WaiweraLogProfiler().attachPerformanceInfo(jobMI, self.mres)
+        perf = jobMI.performance['WaiweraSolver']
+        self.assertEqual(perf['num_steps'], 141)
+        self.assertEqual(perf['total_nonlinear_iterations'], 236)
+        self.assertEqual(perf['total_linear_iterations'], 1149)
+        self.assertEqual(perf['total_failed_tries'], 2)
+        self.assertTrue(np.allclose(perf['min_step_size'], 2.5232e5))
+
+    def test_runhistory(self):
+        # solver stats of the result are recorded with the run
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            history = RunHistory(os.path.join(tmp_dir, 'history.sqlite'))
+            mrun = WaiweraModelRun('test_waiwera_MIS6', 'problem6.json',
+                                   basePath=THIS_DIR)
+            runId = history.recordRun(mrun, JobMetaInfo(None), self.mres,
+                                      fingerprint='problem6')
+            perf = history.getPerformance(runId)['WaiweraSolver']
+            self.assertEqual(perf['total_linear_iterations'], 1149)
+            trend = history.getTrend('test_waiwera_MIS6',
+                                     'WaiweraSolver.num_steps')
+            self.assertEqual([v for t, v in trend], [141])
+        finally:
+            shutil.rmtree(tmp_dir)
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -26,6 +26,8 @@ into other modules."""
 from builtins import map
 
 import os
+import time
+import shutil
 import inspect
 
 def getCallingPath(stackNum):
@@ -64,3 +66,38 @@ def dictAsPrettyStr(inDict):
     for kw, val in inDict.items():
         strings.append("'%s': %s" % (str(kw), str(val)))
     return "{%s}" % (", ".join(strings))
+
+def monotonicTime():
+    """Returns the current value, in seconds, of a clock that can't go
+    backwards, for timing intervals. Uses :func:`time.monotonic` where
+    available (Python 3.3+), otherwise falls back to :func:`time.time`."""
+    return _monotonicClock()
+
+_monotonicClock = getattr(time, 'monotonic', time.time)
+
+def replaceFile(src, dst):
+    """Rename the file src to dst, replacing dst if it already exists. On
+    POSIX systems this is atomic, so readers of dst see either the old or
+    the new file, never a partly-written one. Uses :func:`os.replace` where
+    available (Python 3.3+), otherwise :func:`os.rename` (which on Windows
+    fails if dst exists)."""
+    _replaceFile(src, dst)
+
+_replaceFile = getattr(os, 'replace', os.rename)
+
+def findExecutable(command):
+    """Returns the path of the executable that running command (a program
+    name, or a path) would use, searching the PATH as the shell does, or
+    None if there isn't one. Uses :func:`shutil.which` where available
+    (Python 3.3+)."""
+    if hasattr(shutil, 'which'):
+        return shutil.which(command)
+    def isExecutable(path):
+        return os.path.isfile(path) and os.access(path, os.X_OK)
+    if os.path.dirname(command):
+        return command if isExecutable(command) else None
+    for dirName in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        path = os.path.join(dirName, command)
+        if isExecutable(path):
+            return path
+    return None
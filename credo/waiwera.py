@@ -35,6 +35,7 @@ configure and run a Model, and save records of this as an XML. This process will
 produce a :class:`credo.modelresult.ModelResult` class.
 """
 from __future__ import print_function
+from past.builtins import basestring
 
 from credo.modelrun import ModelRun
 from credo.modelresult import ModelResult
@@ -46,11 +47,15 @@ class WaiweraModelRun(ModelRun):
 
     TODO: should I add suport of .ordering_map? Waiwera does not use dummy
     blocks.
+
+    history_cache is passed to the :class:`WaiweraModelResult` created after
+    the run.
     """
     def __init__(self, name, input_filename,
                  fieldname_map={},
                  simulator=DEFAULT_COMMAND,
                  basePath=None, outputPath=None, logPath=None,
+                 history_cache=False,
                  ):
         super(WaiweraModelRun, self).__init__(name, basePath, outputPath, logPath)
 
@@ -58,6 +63,7 @@ class WaiweraModelRun(ModelRun):
         self._simulator = simulator
 
         self._fieldname_map = fieldname_map
+        self._history_cache = history_cache
 
     def getModelRunCommand(self, extraCmdLineOpts=None):
         """ Note: this is called AFTER .preRunPreparation() """
@@ -69,46 +75,214 @@ class WaiweraModelRun(ModelRun):
             cmd += " " + extraCmdLineOpts
         return cmd
 
-    def createModelResult(self):
+    def getInputFilenames(self):
+        """ Returns the input (json) file, plus the mesh and initial
+        conditions files it refers to, if any.
+        """
+        files = [self._input_filename]
+        jdata = self._readInput()
+        for section in ['mesh', 'initial']:
+            if section in jdata:
+                spec = jdata[section]
+                if isinstance(spec, dict):
+                    spec = spec.get('filename')
+                # (json gives unicode filenames on Python 2)
+                if isinstance(spec, basestring):
+                    files.append(spec)
+        return files
+
+    def getOutputFilenames(self):
+        """ Waiwera's h5 output and YAML log files are written to .basePath
+        (unless specified otherwise in the input file).
+        """
+        return [self._getH5Filename(), self._getLogFilename()]
+
+    def getSimulatorExecutable(self):
+        return self._simulator.split()[0]
+
+    def getProgressLogFilename(self):
+        return self._getLogFilename()
+
+    def createProgressParser(self):
+        from credo.io.waiweralog import WaiweraLogParser
+        return WaiweraLogParser()
+
+    def getSimTimeLimits(self):
+        """ Returns the start and stop times in the input (json) file, or None
+        if there is no stop time (e.g. the run is limited by number of time
+        steps instead).
+        """
+        try:
+            time_input = self._readInput()['time']
+            return (float(time_input.get('start', 0.0)),
+                    float(time_input['stop']))
+        except (KeyError, TypeError, ValueError, IOError):
+            return None
+
+    def readSimTime(self):
+        """ Returns the last output time in the h5 output, or None if there
+        isn't one yet.
+        """
+        import os
+        h5_fn = self._getH5Filename()
+        if not os.path.isfile(h5_fn):
+            return None
+        try:
+            with _openH5(h5_fn, live=True) as data:
+                times = data['time']
+                if len(times) == 0:
+                    return None
+                return float(times[-1, 0])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def createModelResult(self, live=False):
         """ Note: this is called AFTER .postRunCleanup() """
-        mres = WaiweraModelResult(self.name, self.outputPath,
+        from os.path import join
+        mres = WaiweraModelResult(self.name,
+                                join(self.basePath, self.outputPath),
                                 self._getH5Filename(),
-                                input_filename=self._input_filename,
-                                fieldname_map=self._fieldname_map)
+                                input_filename=join(self.basePath,
+                                                    self._input_filename),
+                                fieldname_map=self._fieldname_map,
+                                log_filename=self._getLogFilename(),
+                                live=live,
+                                history_cache=self._history_cache)
         return mres
 
+    def createPartialModelResult(self):
+        """ Returns a result reading the h5 output while Waiwera is still
+        writing it.
+        """
+        return self.createModelResult(live=True)
+
     def _getH5Filename(self):
         """ Returns the hdf5 output filename of a model run.
 
         Waiwera's output filename is default to have the same name as the
         input filename, with extension .h5.  It can also be specified by user in
-        the input (json) file.
+        the input (json) file, relative to the path Waiwera runs in (the
+        .basePath).  The returned filename is always an absolute path.
         """
-        import json
         import os
         input_fn = os.path.join(self.basePath, self._input_filename)
         try:
-            with open(input_fn, 'r') as jf:
-                jdata = json.load(jf)
-            h5_fn = jdata['output']['filename']
-        except KeyError:
+            h5_fn = os.path.join(self.basePath,
+                                 self._readInput()['output']['filename'])
+        except (KeyError, TypeError):
             base, ext = os.path.splitext(input_fn)
             h5_fn =  base + '.h5'
         return h5_fn
 
+    def _getLogFilename(self):
+        """ Returns the (YAML) log filename of a model run, as an absolute
+        path.  Like the hdf5 output, it defaults to the input filename with
+        extension .yaml, unless specified in the input file.
+        """
+        import os
+        input_fn = os.path.join(self.basePath, self._input_filename)
+        try:
+            log_fn = os.path.join(self.basePath,
+                                  self._readInput()['logfile']['filename'])
+        except (KeyError, TypeError):
+            base, ext = os.path.splitext(input_fn)
+            log_fn =  base + '.yaml'
+        return log_fn
+
+    def _readInput(self):
+        """ Returns the contents of the input (json) file. """
+        import json
+        import os
+        input_fn = os.path.join(self.basePath, self._input_filename)
+        with open(input_fn, 'r') as jf:
+            return json.load(jf)
+
+def _openH5(h5_filename, live=False):
+    """ Opens a Waiwera h5 output file for reading.  If live, the file may
+    still be being written by Waiwera: HDF5 file locking (which would stop it
+    being opened) is turned off, and SWMR (single writer multiple reader)
+    mode is used if Waiwera is writing in that mode.  Otherwise only the
+    output times that had been flushed to the file when it was opened can be
+    relied on.
+    """
+    import h5py
+    if not live:
+        return h5py.File(h5_filename, 'r')
+    try:
+        return h5py.File(h5_filename, 'r', swmr=True, locking=False)
+    except (OSError, TypeError):
+        # not SWMR (or h5py too old to turn off locking)
+        try:
+            return h5py.File(h5_filename, 'r', locking=False)
+        except TypeError:
+            return h5py.File(h5_filename, 'r')
+
+#: Approximate maximum size (in bytes) of each block read by _readColumns().
+READ_BLOCK_SIZE = 64 * 1024 * 1024
+
+def _readColumns(dataset, columns):
+    """ Reads the values of the given columns of a 2-D h5 dataset (e.g. a
+    field of cell_fields, with a row per output time), at all rows.  Returns
+    an array of shape (nrows, len(columns)), with the columns in the order
+    given (they may be repeated).
+
+    Rather than reading each column separately (which reads every chunk it
+    crosses again for each column), the distinct columns are read in
+    ascending order, as contiguous blocks aligned to the dataset's chunks,
+    so each chunk holding any of the columns is only read once.  Runs of
+    chunks with none of the columns are skipped.
+    """
+    import numpy as np
+    columns = np.asarray(columns, dtype=int)
+    nrows, ncols = dataset.shape
+    if len(columns) == 0:
+        return np.empty((nrows, 0), dtype=dataset.dtype)
+    unique, inverse = np.unique(columns, return_inverse=True)
+    if dataset.chunks is None:
+        chunk_rows, chunk_cols = 1, ncols
+    else:
+        chunk_rows, chunk_cols = dataset.chunks
+    values = np.empty((nrows, len(unique)), dtype=dataset.dtype)
+    blocks = unique // chunk_cols
+    gaps = np.nonzero(np.diff(blocks) > 1)[0] + 1
+    for sel in np.split(np.arange(len(unique)), gaps):
+        if dataset.chunks is None:
+            lo, hi = unique[sel[0]], unique[sel[-1]] + 1
+        else:
+            lo = blocks[sel[0]] * chunk_cols
+            hi = min((blocks[sel[-1]] + 1) * chunk_cols, ncols)
+        offsets = unique[sel] - lo
+        # whole chunks of rows at a time, limiting the memory used
+        row_size = (hi - lo) * dataset.dtype.itemsize
+        step = max(1, READ_BLOCK_SIZE // (row_size * chunk_rows)) * chunk_rows
+        for r in range(0, nrows, step):
+            block = dataset[r:r + step, lo:hi]
+            values[r:r + step, sel] = block[:, offsets]
+    return values[:, inverse]
+
 class WaiweraModelResult(ModelResult):
     """ for Waiwera
+
+    If history_cache is True (or the filename of the cache), histories at
+    cells are read from a :class:`credo.io.historycache.HistoryCache` of the
+    h5 output, which is much faster for large models with many output times
+    (after each field has been copied into the cache once).  The cache isn't
+    used for live results.  Nor should a field cache (see
+    :class:`credo.modelresult.ModelResult`) be set for live results, since
+    the values read change as the output is written.
     """
     def __init__(self, name, outputPath, h5_filename, input_filename=None,
-                 fieldname_map={}):
-        from os.path import dirname
+                 fieldname_map={}, log_filename=None, live=False,
+                 history_cache=False):
+        from os.path import dirname, splitext
         super(WaiweraModelResult, self).__init__(name, outputPath,
                                                fieldname_map=fieldname_map)
         self.name = name
 
-        import h5py
         # have to keep it open, unless copy all data, which is not ideal.
-        self._data = h5py.File(h5_filename, 'r')
+        self._data = _openH5(h5_filename, live)
+        self._h5_filename = h5_filename
+        self._input_filename = input_filename
         # obtain slicing arrays for converting values back to natural ordering
         self.cell_idx = self._data['cell_index'][:,0] # cell_fields/*
         if 'source_index' in self._data:
@@ -121,53 +295,130 @@ class WaiweraModelResult(ModelResult):
         if input_filename is not None:
             with open(input_filename, 'r') as fin:
                 self._input = json.load(fin)
+        # the YAML log, by default named after the input file (or else the
+        # h5 output)
+        if log_filename is None:
+            base = input_filename if input_filename else h5_filename
+            log_filename = splitext(base)[0] + '.yaml'
+        self.log_filename = log_filename
+        self._solver_stats = None
+        self._static_fields = {}
+        self._history_cache = None
+        if history_cache and not live:
+            from credo.io.historycache import HistoryCache
+            cache_filename = None if history_cache is True else history_cache
+            self._history_cache = HistoryCache(self._data, cache_filename)
+
+    def close(self):
+        """ Closes the h5 output file (and history cache).  The result
+        can't be used after this.
+        """
+        if self._history_cache is not None:
+            self._history_cache.close()
+        self._data.close()
+
+    def getDataFilenames(self):
+        """ Returns the h5 output, and the input file (if given), which rock
+        and other static fields are read from.
+        """
+        files = [self._h5_filename]
+        if self._input_filename is not None:
+            files.append(self._input_filename)
+        return files
+
+    def getSolverStats(self):
+        """ Returns a dictionary of numpy arrays of solver statistics for
+        each time step (time, step size, nonlinear and linear iterations,
+        failed tries and step size reductions etc.), read from the Waiwera
+        YAML log.  See :func:`credo.io.waiweralog.readSolverStats`.
+        """
+        if self._solver_stats is None:
+            from credo.io.waiweralog import readSolverStats
+            self._solver_stats = readSolverStats(self.log_filename)
+        return self._solver_stats
+
+    # TODO: sync with Waiwera's internal defaults
+    DEFAULT_POROSITY = 0.1
+    DEFAULT_PERMEABILITY = [1.0e-13, 1.0e-13, 1.0e-13]
+
+    OTHER_FIELD_NAMES = [
+        'rock_porosity',
+        'rock_permeability1',
+        'rock_permeability2',
+        'rock_permeability3',
+        'geom_volume']
+
+    def _getStaticField(self, name, compute):
+        """ Returns the value of a field that doesn't change over time (e.g.
+        rock properties or cell geometry), computed by compute() the first
+        time it's needed.  compute() can instead return a dictionary of the
+        values of several fields computed together, which are all kept.  The
+        (read-only) arrays are kept, and a copy returned, so callers can
+        change the values they get.
+        """
+        if name not in self._static_fields:
+            v = compute()
+            values = v if isinstance(v, dict) else {name: v}
+            for n, v in values.items():
+                v.flags.writeable = False
+                self._static_fields[n] = v
+        return self._static_fields[name].copy()
+
+    def _assembleRockFields(self):
+        """ Returns a dictionary of the rock property fields, from the rock
+        types in the input, scattered to their cells all at once.
+        """
+        import numpy as np
+        types = self._input.get('rock', {}).get('types', [])
+        cells = [np.asarray(rock.get('cells', []), dtype=int) for rock in types]
+        idx = np.concatenate([np.empty(0, dtype=int)] + cells)
+        type_of_cell = np.repeat(np.arange(len(types), dtype=int),
+                                 [len(c) for c in cells])
+        porosity = np.array([rock.get('porosity', self.DEFAULT_POROSITY)
+                             for rock in types], dtype=float)
+        perm = np.array([(list(rock.get('permeability', [])) +
+                          self.DEFAULT_PERMEABILITY)[:3] for rock in types],
+                        dtype=float).reshape(len(types), 3)
+        v = np.full(self.num_cells, self.DEFAULT_POROSITY)
+        v[idx] = porosity[type_of_cell]
+        fields = {'rock_porosity': v}
+        for i in range(3):
+            v = np.full(self.num_cells, self.DEFAULT_PERMEABILITY[i])
+            v[idx] = perm[type_of_cell, i]
+            fields['rock_permeability%d' % (i + 1)] = v
+        return fields
 
     def _getOtherValues(self, field):
-        import numpy
-        # TODO: sync with Waiwera's internal default
-        if field is 'rock_porosity':
-            v = numpy.full(self.num_cells, 0.1)
-            for rock in self._input['rock']['types']:
-                for i in rock['cells']:
-                    v[i] = rock['porosity']
-            return v
-        if field is 'rock_permeability1':
-            v = numpy.full(self.num_cells, 1.0e-13)
-            for rock in self._input['rock']['types']:
-                for i in rock['cells']:
-                    v[i] = rock['permeability'][0]
-            return v
-        if field is 'rock_permeability2':
-            v = numpy.full(self.num_cells, 1.0e-13)
-            for rock in self._input['rock']['types']:
-                for i in rock['cells']:
-                    v[i] = rock['permeability'][1]
-            return v
-        if field is 'rock_permeability3':
-            v = numpy.full(self.num_cells, 1.0e-13)
-            for rock in self._input['rock']['types']:
-                for i in rock['cells']:
-                    v[i] = rock['permeability'][2]
-            return v
-        elif field is 'geom_volume':
-            return self._data['cell_fields']['cell_geometry_volume'][:][self.cell_idx]
+        if field == 'geom_volume':
+            return self._getStaticField(field, lambda:
+                self._data['cell_fields']['cell_geometry_volume'][:][self.cell_idx])
+        elif field in self.OTHER_FIELD_NAMES:
+            return self._getStaticField(field, self._assembleRockFields)
         else:
-            raise Exception
+            raise Exception('Unknown field %s' % field)
 
     def _getFieldAtOutputIndex(self, field, outputIndex):
-        other_field_names = [
-            'rock_porosity',
-            'rock_permeability1',
-            'rock_permeability2',
-            'rock_permeability3',
-            'geom_volume']
-        if field in other_field_names:
+        if field in self.OTHER_FIELD_NAMES:
             return self._getOtherValues(field)
         return self._data['cell_fields'][field][outputIndex][self.cell_idx]
 
+    def _cellFieldHistory(self, field):
+        """ Returns the h5 dataset to read histories of field at cells from,
+        from the history cache if it's used.
+        """
+        if self._history_cache is not None:
+            try:
+                return self._history_cache.getField(field)
+            except (IOError, OSError) as e:
+                print("Warning: couldn't use history cache '%s' of model %s"\
+                    " (%s), reading the output instead." \
+                    % (self._history_cache.filename, self.name, e))
+                self._history_cache = None
+        return self._data['cell_fields'][field]
+
     def _getFieldHistoryAtCell(self, field, cellIndex):
         t = self._data['time'][:,0]
-        val = self._data['cell_fields'][field][:,self.cell_idx[cellIndex]]
+        val = self._cellFieldHistory(field)[:,self.cell_idx[cellIndex]]
         return t, val
 
     def _getFieldHistoryAtSource(self, field, sourceIndex):
@@ -178,8 +429,24 @@ class WaiweraModelResult(ModelResult):
         else:
             raise Exception('No sources in model %s' % (self.name))
 
+    def _getFieldHistoryAtCells(self, field, cellIndices):
+        import numpy as np
+        t = self._data['time'][:,0]
+        columns = self.cell_idx[np.asarray(cellIndices, dtype=int)]
+        return t, _readColumns(self._cellFieldHistory(field), columns)
+
+    def _getFieldHistoryAtSources(self, field, sourceIndices):
+        import numpy as np
+        if self.source_idx is not None:
+            t = self._data['time'][:,0]
+            columns = self.source_idx[np.asarray(sourceIndices, dtype=int)]
+            return t, _readColumns(self._data['source_fields'][field], columns)
+        else:
+            raise Exception('No sources in model %s' % (self.name))
+
     def _getPositions(self):
-        return self._data['cell_fields']['cell_geometry_centroid'][:][self.cell_idx]
+        return self._getStaticField('geom_centroid', lambda:
+            self._data['cell_fields']['cell_geometry_centroid'][:][self.cell_idx])
 
     def _getTimes(self):
         return self._data['time'][:,0]
@@ -196,19 +463,16 @@ def t2_to_waiwera(geofilename, datfilename, incfilename =  None, basepath = None
     from mulgrids import mulgrid
     from t2incons import t2incon
     from t2data import t2data
-    from os import getcwd, chdir
-    from os.path import splitext, basename
+    from os import getcwd
+    from os.path import splitext, basename, join
     import json
 
     if basepath is None:
         basepath = getcwd()
-    startpath = getcwd()
-    if basepath != startpath:
-        print("Changing to specified base path '%s'" % (basepath))
-        os.chdir(basepath)
 
-    geo = mulgrid(geofilename)
-    dat = t2data(datfilename)
+    # all filenames are relative to basepath, where Waiwera will be run
+    geo = mulgrid(join(basepath, geofilename))
+    dat = t2data(join(basepath, datfilename))
 
     geobase, ext = splitext(basename(geofilename))
     datbase, ext = splitext(basename(datfilename))
@@ -216,25 +480,21 @@ def t2_to_waiwera(geofilename, datfilename, incfilename =  None, basepath = None
     input_filename = datbase + '.json'
 
     if incfilename:
-        inc = t2incon(incfilename)
+        inc = t2incon(join(basepath, incfilename))
         incbase, ext = splitext(basename(incfilename))
         initial_filename = incbase  + '_ss.h5'
     else:
         inc = None
         initial_filename = None
 
-    geo.write_exodusii(mesh_filename)
+    geo.write_exodusii(join(basepath, mesh_filename))
     print('  Mesh file %s created.' % mesh_filename)
     jsondata = dat.json(geo, mesh_filename,
                         incons = initial_filename,
                         bdy_incons = inc)
-    with open(input_filename, 'w') as jf:
+    with open(join(basepath, input_filename), 'w') as jf:
         json.dump(jsondata, jf, indent=2)
         print('  Input file %s created.' % input_filename)
 
-    if basepath != startpath:
-        print("Restoring initial path '%s'" % (startpath))
-        os.chdir(startpath)
-
     return input_filename
 